@@ -2,4 +2,6 @@ from django.urls import path, include
 
 urlpatterns = [
     path('accounts/', include('apps.accounts.urls')),
+    path('ussd/', include('apps.ussd.urls')),
+    path('notifications/', include('apps.notifications.urls')),
 ]
@@ -2,13 +2,17 @@ from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin as BaseUserAdmin
 from django.contrib.auth import get_user_model
 from django.utils.html import format_html
-from .models import UserProfile, LoginAttempt
+
+from smartfunds.routers import ReplicaChangeListMixin
+
+from .models import BulkUserJob, CitizenImportJob, UserProfile, LoginAttempt
+from .search import search_users
 
 User = get_user_model()
 
 
 @admin.register(User)
-class UserAdmin(BaseUserAdmin):
+class UserAdmin(ReplicaChangeListMixin, BaseUserAdmin):
     """
     Custom User admin with role-based functionality
     """
@@ -63,9 +67,16 @@ class UserAdmin(BaseUserAdmin):
     def get_queryset(self, request):
         return super().get_queryset(request).select_related('profile')
 
+    def get_search_results(self, request, queryset, search_term):
+        # search_fields only drives the search box; matching goes through
+        # the indexed search backend instead of ORed icontains lookups
+        if not search_term:
+            return queryset, False
+        return search_users(queryset, search_term), False
+
 
 @admin.register(UserProfile)
-class UserProfileAdmin(admin.ModelAdmin):
+class UserProfileAdmin(ReplicaChangeListMixin, admin.ModelAdmin):
     """
     User profile admin
     """
@@ -91,7 +102,7 @@ class UserProfileAdmin(admin.ModelAdmin):
 
 
 @admin.register(LoginAttempt)
-class LoginAttemptAdmin(admin.ModelAdmin):
+class LoginAttemptAdmin(ReplicaChangeListMixin, admin.ModelAdmin):
     """
     Login attempt admin for security monitoring
     """
@@ -117,3 +128,45 @@ class LoginAttemptAdmin(admin.ModelAdmin):
 
     def has_change_permission(self, request, obj=None):
         return False  # Prevent editing
+
+
+@admin.register(BulkUserJob)
+class BulkUserJobAdmin(admin.ModelAdmin):
+    """
+    Bulk user action job admin for monitoring progress
+    """
+    list_display = [
+        'id', 'action', 'status', 'total', 'processed', 'affected',
+        'created_by', 'created_at', 'finished_at'
+    ]
+    list_filter = ['action', 'status', 'created_at']
+    ordering = ['-created_at']
+    exclude = ['user_ids']
+    readonly_fields = ['errors', 'created_at', 'started_at', 'finished_at']
+
+    def has_add_permission(self, request):
+        return False  # Created through the bulk action endpoint
+
+    def has_change_permission(self, request, obj=None):
+        return False  # Prevent editing
+
+
+@admin.register(CitizenImportJob)
+class CitizenImportJobAdmin(admin.ModelAdmin):
+    """
+    Citizen import job admin for monitoring progress
+    """
+    list_display = [
+        'id', 'format', 'status', 'rows', 'created', 'error_count',
+        'created_by', 'created_at', 'finished_at'
+    ]
+    list_filter = ['format', 'status', 'created_at']
+    ordering = ['-created_at']
+    exclude = ['file']
+    readonly_fields = ['errors', 'created_at', 'started_at', 'finished_at']
+
+    def has_add_permission(self, request):
+        return False  # Created through the import endpoint
+
+    def has_change_permission(self, request, obj=None):
+        return False  # Prevent editing
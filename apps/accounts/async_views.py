@@ -0,0 +1,321 @@
+"""
+Native async variants of the hot accounts endpoints.
+
+Under ASGI (``smartfunds.asgi`` sets ``ASYNC_VIEWS``), login,
+``users/me/``, the profile and user stats are served by these views
+instead of their DRF counterparts. A request waiting on Postgres or Redis
+then no longer holds a whole worker:
+
+- JWT authentication, throttling and the login lockout talk to Redis
+  through ``redis.asyncio``, and the response cache and cached users are
+  read with the cache's native ``aget_many``/``aget``;
+- queries use the async ORM, and password hashing runs in a thread (see
+  ``backends.ModelBackend``).
+
+DRF has no async views, so ``AsyncAPIView`` runs DRF's authentication,
+permission and throttle classes itself (they only look at ``request.user``
+and ``request.META``) and renders ``Response`` data with DRF's
+``JSONRenderer``. Responses and errors match the DRF views, and cached
+responses are shared with them. Writes and other methods are handed to
+the DRF view in a thread.
+"""
+
+from asgiref.sync import sync_to_async
+from django.contrib.auth import aauthenticate, get_user_model
+from django.contrib.auth.models import AnonymousUser
+from django.http import HttpResponse
+from django.views import View
+from django.views.decorators.csrf import csrf_exempt
+from rest_framework import exceptions
+from rest_framework.parsers import JSONParser
+from rest_framework.permissions import IsAuthenticated
+from rest_framework.renderers import JSONRenderer
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework_simplejwt.serializers import TokenObtainPairSerializer
+from rest_framework_simplejwt.settings import (
+    api_settings as jwt_settings
+)
+
+from smartfunds.routers import areplica_reads
+
+from .audit import get_login_audit_sink
+from .conditional import aprofile_validators, auser_validators, conditional
+from .lockout import login_lockout
+from .models import LoginAttempt, UserProfile
+from .permissions import IsAdminUser
+from .response_cache import cache_response
+from .serializers import (
+    UserProfileSerializer, UserSerializer, UserStatsSerializer
+)
+from .signals import aupdate_last_login
+from .stats import acompute_user_stats, aget_user_stats
+from .throttling import LoginRateThrottle
+from .views import (
+    CurrentUserView, CustomTokenObtainPairView, UserProfileView,
+    UserStatsView
+)
+
+User = get_user_model()
+
+
+def render_sync_view(view, request, *args, **kwargs):
+    response = view(request, *args, **kwargs)
+    if hasattr(response, 'render'):
+        response.render()
+    return response
+
+
+class AsyncAPIView(View):
+    """
+    Async counterpart of a DRF APIView: authenticates, checks permissions
+    and throttles before the handler, and renders DRF exceptions and
+    ``Response`` objects the way DRF does.
+
+    Authentication classes need an ``aauthenticate`` and throttles an
+    ``aallow_request`` to stay off threads; others are run with
+    ``sync_to_async``. Methods without an async handler go to
+    ``sync_view``.
+    """
+    authentication_classes = api_settings.DEFAULT_AUTHENTICATION_CLASSES
+    permission_classes = api_settings.DEFAULT_PERMISSION_CLASSES
+    throttle_classes = api_settings.DEFAULT_THROTTLE_CLASSES
+    renderer = JSONRenderer()
+    sync_view = None
+
+    @classmethod
+    def as_view(cls, **initkwargs):
+        # Token authenticated, like every APIView
+        return csrf_exempt(super().as_view(**initkwargs))
+
+    async def dispatch(self, request, *args, **kwargs):
+        method = request.method.lower()
+        handler = (getattr(self, method, None)
+                   if method in self.http_method_names else None)
+        if handler is None or method == 'options':
+            if self.sync_view is not None:
+                return await sync_to_async(render_sync_view)(
+                    self.sync_view.as_view(), request, *args, **kwargs)
+            return await super().dispatch(request, *args, **kwargs)
+
+        try:
+            await self.initial(request)
+            response = await handler(request, *args, **kwargs)
+        except Exception as exc:
+            response = self.handle_exception(request, exc)
+        return self.finalize_response(response)
+
+    async def initial(self, request):
+        await self.perform_authentication(request)
+        self.check_permissions(request)
+        await self.check_throttles(request)
+
+    async def perform_authentication(self, request):
+        self.authenticated = False
+        request.user = AnonymousUser()
+        request.auth = None
+        for authenticator in self.get_authenticators():
+            if hasattr(authenticator, 'aauthenticate'):
+                result = await authenticator.aauthenticate(request)
+            else:
+                result = await sync_to_async(authenticator.authenticate)(
+                    request)
+            if result is not None:
+                request.user, request.auth = result
+                self.authenticated = True
+                return
+
+    def check_permissions(self, request):
+        for permission in [cls() for cls in self.permission_classes]:
+            if not permission.has_permission(request, self):
+                if self.get_authenticators() and not self.authenticated:
+                    raise exceptions.NotAuthenticated()
+                raise exceptions.PermissionDenied(
+                    detail=getattr(permission, 'message', None),
+                    code=getattr(permission, 'code', None))
+
+    async def check_throttles(self, request):
+        waits = []
+        for throttle in [cls() for cls in self.throttle_classes]:
+            if hasattr(throttle, 'aallow_request'):
+                allowed = await throttle.aallow_request(request, self)
+            else:
+                allowed = await sync_to_async(throttle.allow_request)(
+                    request, self)
+            if not allowed:
+                waits.append(throttle.wait())
+        if waits:
+            waits = [wait for wait in waits if wait is not None]
+            raise exceptions.Throttled(max(waits, default=None))
+
+    def get_authenticators(self):
+        return [cls() for cls in self.authentication_classes]
+
+    def get_authenticate_header(self, request):
+        authenticators = self.get_authenticators()
+        if authenticators:
+            return authenticators[0].authenticate_header(request)
+        return None
+
+    def handle_exception(self, request, exc):
+        if isinstance(exc, (exceptions.NotAuthenticated,
+                            exceptions.AuthenticationFailed)):
+            auth_header = self.get_authenticate_header(request)
+            if auth_header:
+                exc.auth_header = auth_header
+            else:
+                exc.status_code = 403
+        response = api_settings.EXCEPTION_HANDLER(
+            exc, {'view': self, 'args': self.args, 'kwargs': self.kwargs,
+                  'request': request})
+        if response is None:
+            raise exc
+        return response
+
+    def finalize_response(self, response):
+        if not isinstance(response, Response) or response.is_rendered:
+            return response
+        rendered = HttpResponse(
+            self.renderer.render(response.data),
+            status=response.status_code,
+            content_type=self.renderer.media_type)
+        for header, value in response.items():
+            if header != 'Content-Type':
+                rendered[header] = value
+        return rendered
+
+
+class CredentialsSerializer(TokenObtainPairSerializer):
+    """
+    Validates the login fields only; the view checks the credentials
+    """
+
+    def validate(self, attrs):
+        return attrs
+
+
+class AsyncTokenObtainPairView(AsyncAPIView):
+    """
+    Async ``CustomTokenObtainPairView``
+    """
+    authentication_classes = []
+    permission_classes = []
+    throttle_classes = [LoginRateThrottle]
+    sync_view = CustomTokenObtainPairView
+
+    www_authenticate_realm = CustomTokenObtainPairView.www_authenticate_realm
+    get_authenticate_header = (
+        CustomTokenObtainPairView.get_authenticate_header)
+    get_client_ip = CustomTokenObtainPairView.get_client_ip
+
+    async def post(self, request):
+        data = self.parse(request)
+        ip_address = self.get_client_ip(request)
+        email = data.get('email', '')
+        principals = login_lockout.principals(
+            email=email, ip_address=ip_address)
+        user = None
+
+        try:
+            await login_lockout.acheck(principals)
+            serializer = CredentialsSerializer(data=data)
+            serializer.is_valid(raise_exception=True)
+            try:
+                user = await self.authenticate(request, serializer)
+            except exceptions.AuthenticationFailed:
+                await login_lockout.aregister_failure(principals)
+                raise
+            refresh = serializer.get_token(user)
+        finally:
+            await sync_to_async(get_login_audit_sink().record)(
+                user=user,
+                email=email,
+                ip_address=ip_address,
+                method=LoginAttempt.LoginMethod.WEB,
+                successful=user is not None,
+                user_agent=request.META.get('HTTP_USER_AGENT', '')
+            )
+
+        await aupdate_last_login(user)
+        await login_lockout.aregister_success(principals)
+        return Response({
+            'refresh': str(refresh),
+            'access': str(refresh.access_token),
+        })
+
+    def parse(self, request):
+        if request.content_type == 'application/json':
+            return JSONParser().parse(request) or {}
+        return request.POST
+
+    async def authenticate(self, request, serializer):
+        """
+        The user behind valid credentials, as ``TokenObtainSerializer``
+        checks them
+        """
+        credentials = serializer.validated_data
+        user = await aauthenticate(request, **{
+            serializer.username_field:
+                credentials[serializer.username_field],
+            'password': credentials['password'],
+        })
+        if not jwt_settings.USER_AUTHENTICATION_RULE(user):
+            raise exceptions.AuthenticationFailed(
+                serializer.error_messages['no_active_account'],
+                'no_active_account')
+        return user
+
+
+class AsyncCurrentUserView(AsyncAPIView):
+    """
+    Async ``CurrentUserView`` (GET)
+    """
+    permission_classes = [IsAuthenticated]
+    sync_view = CurrentUserView
+
+    @conditional(auser_validators)
+    @cache_response(
+        timeout=300, tags=lambda request, *args, **kwargs: [
+            f'user:{request.user.pk}'],
+        view_name='CurrentUserView.get')
+    async def get(self, request):
+        user = await User.objects.select_related('profile').aget(
+            pk=request.user.pk)
+        return Response(
+            UserSerializer(user, context={'request': request}).data)
+
+
+class AsyncUserProfileView(AsyncAPIView):
+    """
+    Async ``UserProfileView`` (GET)
+    """
+    permission_classes = [IsAuthenticated]
+    sync_view = UserProfileView
+
+    @conditional(aprofile_validators)
+    async def get(self, request):
+        profile, created = await UserProfile.objects.aget_or_create(
+            user_id=request.user.pk)
+        return Response(
+            UserProfileSerializer(profile, context={'request': request}).data)
+
+
+class AsyncUserStatsView(AsyncAPIView):
+    """
+    Async ``UserStatsView``
+    """
+    permission_classes = [IsAdminUser]
+    sync_view = UserStatsView
+
+    @cache_response(timeout=60, tags=['user-stats'], vary='role',
+                    view_name='UserStatsView.get')
+    async def get(self, request):
+        async with areplica_reads(request):
+            # ?exact=1 bypasses the maintained counters
+            if request.GET.get('exact') in ('1', 'true'):
+                stats = await acompute_user_stats()
+            else:
+                stats = await aget_user_stats()
+
+        serializer = UserStatsSerializer(stats)
+        return Response(serializer.data)
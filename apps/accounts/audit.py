@@ -0,0 +1,329 @@
+"""
+Login audit sinks.
+
+Every login attempt is recorded as a ``LoginAttempt`` row. Writing that row
+inline costs an INSERT on the login hot path, so the sink used by the login
+views is selected through ``settings.LOGIN_AUDIT['MODE']``:
+
+* ``sync`` - INSERT inside the request (strongest durability, slowest).
+* ``buffered`` - RPUSH onto a Redis list; a Celery task drains the list with
+  ``bulk_create`` when it reaches ``BATCH_SIZE`` or every ``FLUSH_INTERVAL``
+  seconds (beat). Attempts survive a web worker crash. A flush moves each
+  batch onto a processing list and deletes it only once the INSERT has
+  committed, so a failed or crashed flush leaves the batch to the next one.
+  A crash between the commit and the delete writes that batch twice. A batch
+  the database rejects is written row by row; an attempt whose user has
+  since been deleted is kept without the user, and records that still fail
+  go to a dead-letter list (``<REDIS_KEY>:dead``) so the queue keeps
+  draining. Past ``MAX_QUEUE`` queued attempts, new ones are dropped.
+* ``fire_and_forget`` - append to an in-process buffer drained by a daemon
+  thread. Nothing leaves the process until the flush, so attempts can be lost
+  on a crash and are dropped once ``MAX_BUFFER`` is exceeded.
+"""
+
+import atexit
+import json
+import logging
+import os
+import threading
+from collections import deque
+from datetime import datetime
+
+from django.conf import settings
+from django.db import (
+    DataError, IntegrityError, close_old_connections, transaction
+)
+from django.utils import timezone
+from redis.exceptions import LockError
+
+from .models import LoginAttempt
+
+logger = logging.getLogger('smartfunds')
+
+DEFAULTS = {
+    'MODE': 'sync',
+    'BATCH_SIZE': 500,
+    'FLUSH_INTERVAL': 5,
+    'FLUSH_LOCK_TIMEOUT': 60,
+    'MAX_BUFFER': 10000,
+    'MAX_QUEUE': 100000,
+    'REDIS_KEY': 'accounts:login_attempts',
+    'CACHE_ALIAS': 'default',
+}
+
+
+# KEYS: queue, processing list. ARGV: batch size.
+# Returns the processing list if a flush left it behind, else moves the
+# next batch off the queue onto it.
+CLAIM_SCRIPT = """
+local records = redis.call('LRANGE', KEYS[2], 0, -1)
+if #records > 0 then
+    return records
+end
+records = redis.call('LRANGE', KEYS[1], 0, tonumber(ARGV[1]) - 1)
+if #records > 0 then
+    redis.call('LTRIM', KEYS[1], #records, -1)
+    redis.call('RPUSH', KEYS[2], unpack(records))
+end
+return records
+"""
+
+
+def get_audit_setting(name):
+    return getattr(settings, 'LOGIN_AUDIT', {}).get(name, DEFAULTS[name])
+
+
+def attempt_to_record(attempt):
+    """
+    Serialize an attempt dict to a JSON string
+    """
+    record = dict(attempt)
+    record['timestamp'] = record['timestamp'].isoformat()
+    return json.dumps(record)
+
+
+def record_to_attempt(record):
+    """
+    Build an unsaved LoginAttempt from a serialized record
+    """
+    data = json.loads(record)
+    data['timestamp'] = datetime.fromisoformat(data['timestamp'])
+    return LoginAttempt(**data)
+
+
+class LoginAuditSink:
+    """
+    Base class for login audit sinks
+    """
+
+    def record(self, *, user=None, email='', ip_address=None,
+               method=LoginAttempt.LoginMethod.WEB, successful=False,
+               user_agent=''):
+        """Record a single login attempt"""
+        self.write({
+            'user_id': user.pk if user is not None else None,
+            # As posted; a list or number would fail the later INSERT
+            'email': email if isinstance(email, str) else '',
+            'ip_address': ip_address,
+            'method': method,
+            'successful': successful,
+            'user_agent': user_agent,
+            'timestamp': timezone.now(),
+        })
+
+    def write(self, attempt):
+        raise NotImplementedError
+
+    def flush(self):
+        """Persist any buffered attempts, returning the number written"""
+        return 0
+
+
+class SyncLoginAuditSink(LoginAuditSink):
+    """
+    Write each attempt with its own INSERT
+    """
+
+    def write(self, attempt):
+        LoginAttempt.objects.create(**attempt)
+
+
+class BufferedLoginAuditSink(LoginAuditSink):
+    """
+    Queue attempts in Redis and bulk insert them from a Celery task
+    """
+
+    def __init__(self):
+        self.claim_script = None
+
+    def get_connection(self):
+        from django_redis import get_redis_connection
+        return get_redis_connection(get_audit_setting('CACHE_ALIAS'))
+
+    def write(self, attempt):
+        key = get_audit_setting('REDIS_KEY')
+        max_queue = get_audit_setting('MAX_QUEUE')
+        try:
+            # Bounded while flushes can't keep up: the trim drops the
+            # attempt just pushed
+            pipe = self.get_connection().pipeline()
+            pipe.rpush(key, attempt_to_record(attempt))
+            pipe.ltrim(key, 0, max_queue - 1)
+            length, _ = pipe.execute()
+        except Exception:
+            # Never lose an attempt because Redis is unavailable
+            logger.warning(
+                'Login audit buffer unavailable, writing synchronously',
+                exc_info=True)
+            LoginAttempt.objects.create(**attempt)
+            return
+
+        if length > max_queue:
+            logger.warning('Login audit queue full, dropping attempt')
+            return
+        if length % get_audit_setting('BATCH_SIZE') == 0:
+            from .tasks import flush_login_attempts
+            flush_login_attempts.delay()
+
+    def claim_batch(self, size):
+        """
+        Move up to size records onto the processing list and return them,
+        or return the records a failed or crashed flush left there
+        """
+        if self.claim_script is None:
+            self.claim_script = self.get_connection().register_script(
+                CLAIM_SCRIPT)
+        key = get_audit_setting('REDIS_KEY')
+        return self.claim_script(keys=[key, f'{key}:processing'], args=[size])
+
+    def write_batch(self, records):
+        """
+        Insert the records, returning those that could not be written
+        """
+        try:
+            LoginAttempt.objects.bulk_create(
+                [record_to_attempt(record) for record in records])
+            return []
+        except (IntegrityError, DataError, ValueError, TypeError, KeyError):
+            logger.warning('Login audit batch rejected, writing row by row',
+                           exc_info=True)
+        return [record for record in records
+                if not self.write_record(record)]
+
+    def write_record(self, record):
+        """
+        Insert one record, without its user if that fails, returning
+        whether it was written
+        """
+        try:
+            attempt = record_to_attempt(record)
+        except (ValueError, TypeError, KeyError):
+            return False
+        # A user deleted since the attempt fails the foreign key at commit
+        for user_id in dict.fromkeys([attempt.user_id, None]):
+            attempt.pk = None
+            attempt.user_id = user_id
+            try:
+                with transaction.atomic():
+                    attempt.save(force_insert=True)
+                return True
+            except (IntegrityError, DataError):
+                pass
+        return False
+
+    def flush(self):
+        key = get_audit_setting('REDIS_KEY')
+        batch_size = get_audit_setting('BATCH_SIZE')
+        connection = self.get_connection()
+        # The processing list belongs to one flush at a time
+        lock = connection.lock(
+            f'{key}:flush_lock', timeout=get_audit_setting('FLUSH_LOCK_TIMEOUT'))
+        if not lock.acquire(blocking=False):
+            return 0
+        written = 0
+        try:
+            while True:
+                records = self.claim_batch(batch_size)
+                if not records:
+                    break
+                # If the database is unavailable the batch stays on the
+                # processing list and is the first one the next flush writes
+                failed = self.write_batch(records)
+                pipe = connection.pipeline()
+                if failed:
+                    logger.error('Moved %d unwritable login attempts to %s',
+                                 len(failed), f'{key}:dead')
+                    pipe.rpush(f'{key}:dead', *failed)
+                    pipe.ltrim(f'{key}:dead', -get_audit_setting('MAX_QUEUE'),
+                               -1)
+                pipe.delete(f'{key}:processing')
+                pipe.execute()
+                written += len(records) - len(failed)
+                if len(records) < batch_size:
+                    break
+                lock.reacquire()
+        finally:
+            try:
+                lock.release()
+            except LockError:
+                logger.warning('Login audit flush outlived its lock')
+        return written
+
+
+class FireAndForgetLoginAuditSink(LoginAuditSink):
+    """
+    Buffer attempts in process memory and bulk insert them from a
+    background thread
+    """
+
+    def __init__(self):
+        self.buffer = deque()
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.pid = None
+        self.thread = None
+        atexit.register(self.flush)
+
+    def ensure_flusher(self):
+        # Threads do not survive fork (gunicorn --preload), so restart the
+        # flusher in each worker process
+        if self.pid == os.getpid() and self.thread.is_alive():
+            return
+        with self.lock:
+            if self.pid != os.getpid() or not self.thread.is_alive():
+                self.pid = os.getpid()
+                self.thread = threading.Thread(
+                    target=self.run, name='login-audit-flusher', daemon=True)
+                self.thread.start()
+
+    def write(self, attempt):
+        self.ensure_flusher()
+        if len(self.buffer) >= get_audit_setting('MAX_BUFFER'):
+            logger.warning('Login audit buffer full, dropping attempt')
+            return
+        self.buffer.append(attempt)
+        if len(self.buffer) >= get_audit_setting('BATCH_SIZE'):
+            self.wakeup.set()
+
+    def run(self):
+        while True:
+            self.wakeup.wait(get_audit_setting('FLUSH_INTERVAL'))
+            self.wakeup.clear()
+            try:
+                self.flush()
+            except Exception:
+                logger.exception('Failed to flush login audit buffer')
+            finally:
+                close_old_connections()
+
+    def flush(self):
+        batch_size = get_audit_setting('BATCH_SIZE')
+        written = 0
+        while self.buffer:
+            batch = []
+            while self.buffer and len(batch) < batch_size:
+                batch.append(LoginAttempt(**self.buffer.popleft()))
+            LoginAttempt.objects.bulk_create(batch)
+            written += len(batch)
+        return written
+
+
+SINKS = {
+    'sync': SyncLoginAuditSink,
+    'buffered': BufferedLoginAuditSink,
+    'fire_and_forget': FireAndForgetLoginAuditSink,
+}
+
+_sinks = {}
+
+
+def get_login_audit_sink(mode=None):
+    """
+    Return the shared sink instance for the given (or configured) mode
+    """
+    mode = mode or get_audit_setting('MODE')
+    if mode not in SINKS:
+        raise ValueError(f'Unknown login audit mode: {mode}')
+    if mode not in _sinks:
+        _sinks[mode] = SINKS[mode]()
+    return _sinks[mode]
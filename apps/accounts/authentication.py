@@ -0,0 +1,191 @@
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import caches
+from django.utils.functional import cached_property
+from django.utils.translation import gettext_lazy as _
+from drf_spectacular.contrib.rest_framework_simplejwt import SimpleJWTScheme
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+from rest_framework_simplejwt.settings import api_settings
+
+User = get_user_model()
+
+DEFAULTS = {
+    'CACHE_ALIAS': 'default',
+    'TIMEOUT': 300,
+}
+
+# Columns copied into the cache; everything else is loaded on demand
+CACHED_USER_FIELDS = (
+    'id', 'email', 'role', 'is_active', 'is_verified', 'is_staff',
+    'is_superuser',
+)
+
+
+def get_auth_cache_setting(name):
+    return getattr(settings, 'AUTH_USER_CACHE', {}).get(name, DEFAULTS[name])
+
+
+def user_cache_key(user_id):
+    # Kept in the cache backend's local tier (see smartfunds.cache), which
+    # every process drops on invalidation
+    return f'accounts:auth_user:{user_id}'
+
+
+class CachedUser:
+    """
+    Lightweight authenticated user built from cached columns.
+
+    Carries what permission checks need (role, is_active, is_verified, ...)
+    and loads the full ``User`` row only when another attribute is accessed.
+    """
+    is_authenticated = True
+    is_anonymous = False
+
+    def __init__(self, data):
+        for field in CACHED_USER_FIELDS:
+            setattr(self, field, data[field])
+
+    @property
+    def pk(self):
+        return self.id
+
+    @cached_property
+    def instance(self):
+        """The full User model instance (one query, on first access)"""
+        return User.objects.get(pk=self.id)
+
+    def __getattr__(self, name):
+        # Only called for attributes not set in __init__
+        if name.startswith('__') or name == 'instance':
+            raise AttributeError(name)
+        return getattr(self.instance, name)
+
+    def __eq__(self, other):
+        if isinstance(other, (CachedUser, User)):
+            return self.pk == other.pk
+        return NotImplemented
+
+    def __hash__(self):
+        return hash(self.pk)
+
+    def __str__(self):
+        return self.email
+
+    def get_username(self):
+        return self.email
+
+    is_admin_user = User.is_admin_user
+    can_review_applications = User.can_review_applications
+    can_deploy_contracts = User.can_deploy_contracts
+    UserRole = User.UserRole
+
+
+def resolve_user(user):
+    """
+    Return the full User model instance behind request.user
+    """
+    if isinstance(user, CachedUser):
+        return user.instance
+    return user
+
+
+def get_cached_user(user_id):
+    """
+    Resolve a user id through the cache, then the database. Returns None
+    when the user does not exist.
+    """
+    key = user_cache_key(user_id)
+    cache = caches[get_auth_cache_setting('CACHE_ALIAS')]
+    data = cache.get(key)
+    if data is None:
+        data = User.objects.filter(pk=user_id).values(
+            *CACHED_USER_FIELDS).first()
+        if data is None:
+            return None
+        cache.set(key, data, get_auth_cache_setting('TIMEOUT'))
+    return CachedUser(data)
+
+
+async def aget_cached_user(user_id):
+    """
+    ``get_cached_user`` for async code
+    """
+    key = user_cache_key(user_id)
+    cache = caches[get_auth_cache_setting('CACHE_ALIAS')]
+    data = await cache.aget(key)
+    if data is None:
+        data = await User.objects.filter(pk=user_id).values(
+            *CACHED_USER_FIELDS).afirst()
+        if data is None:
+            return None
+        await cache.aset(key, data, get_auth_cache_setting('TIMEOUT'))
+    return CachedUser(data)
+
+
+def invalidate_cached_users(user_ids):
+    """
+    Drop cached auth entries for the given user ids, in every process.
+
+    Call this after any write that bypasses ``User.save()`` (queryset
+    ``update()``/``delete()``).
+    """
+    caches[get_auth_cache_setting('CACHE_ALIAS')].delete_many(
+        [user_cache_key(user_id) for user_id in user_ids])
+
+
+class CachedJWTAuthentication(JWTAuthentication):
+    """
+    JWT authentication that resolves the user from a two-tier cache
+    instead of selecting the user row on every request
+    """
+
+    def get_user(self, validated_token):
+        if api_settings.CHECK_REVOKE_TOKEN:
+            # Revocation compares against the password hash, which is
+            # deliberately never cached
+            return super().get_user(validated_token)
+        return self.check_user(
+            get_cached_user(self.get_user_id(validated_token)))
+
+    async def aauthenticate(self, request):
+        """
+        ``authenticate`` for async views, taking a Django request
+        """
+        header = self.get_header(request)
+        if header is None:
+            return None
+        raw_token = self.get_raw_token(header)
+        if raw_token is None:
+            return None
+        validated_token = self.get_validated_token(raw_token)
+        return await self.aget_user(validated_token), validated_token
+
+    async def aget_user(self, validated_token):
+        if api_settings.CHECK_REVOKE_TOKEN:
+            return await sync_to_async(super().get_user)(validated_token)
+        return self.check_user(
+            await aget_cached_user(self.get_user_id(validated_token)))
+
+    def get_user_id(self, validated_token):
+        try:
+            return validated_token[api_settings.USER_ID_CLAIM]
+        except KeyError:
+            raise InvalidToken(
+                _('Token contained no recognizable user identification'))
+
+    def check_user(self, user):
+        if user is None:
+            raise AuthenticationFailed(
+                _('User not found'), code='user_not_found')
+
+        if api_settings.CHECK_USER_IS_ACTIVE and not user.is_active:
+            raise AuthenticationFailed(
+                _('User is inactive'), code='user_inactive')
+
+        return user
+
+
+class CachedJWTScheme(SimpleJWTScheme):
+    target_class = 'apps.accounts.authentication.CachedJWTAuthentication'
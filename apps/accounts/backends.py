@@ -0,0 +1,88 @@
+"""
+Authentication backends.
+
+Django's ``ModelBackend.aauthenticate`` looks the user up with the async
+ORM but verifies the password on the event loop, where a PBKDF2 check
+would stall every other request of the worker. ``ModelBackend`` here
+awaits the password hashing pool instead (see ``hashing``), or a thread
+for hashers outside it. The sync path reaches the pool through the
+hasher.
+"""
+
+from asgiref.sync import sync_to_async
+from django.contrib.auth import backends, get_user_model
+from django.contrib.auth.hashers import (
+    get_hasher, identify_hasher, is_password_usable, make_password,
+    verify_password
+)
+from django.utils.crypto import constant_time_compare
+
+User = get_user_model()
+
+
+async def averify_password(password, encoded):
+    """
+    ``verify_password`` with the hashing done off the event loop
+    """
+    hasher = None
+    if password is not None and is_password_usable(encoded):
+        try:
+            hasher = identify_hasher(encoded)
+        except ValueError:
+            pass
+    if not hasattr(hasher, 'aencode'):
+        return await sync_to_async(
+            verify_password, thread_sensitive=False)(password, encoded)
+
+    decoded = hasher.decode(encoded)
+    correct = constant_time_compare(encoded, await hasher.aencode(
+        password, decoded['salt'], decoded['iterations']))
+    preferred = get_hasher('default')
+    must_update = correct and (
+        hasher.algorithm != preferred.algorithm or
+        preferred.must_update(encoded))
+    return correct, must_update
+
+
+async def amake_password(password):
+    hasher = get_hasher('default')
+    if hasattr(hasher, 'aencode'):
+        return await hasher.aencode(password, hasher.salt())
+    return await sync_to_async(make_password, thread_sensitive=False)(
+        password)
+
+
+async def acheck_password(user, password):
+    """
+    ``user.acheck_password`` with the hashing done off the event loop
+    """
+    correct, must_update = await averify_password(password, user.password)
+    if correct and must_update:
+        # Rehash with the current hasher settings
+        user.password = await amake_password(password)
+        user._password = password
+        await user.asave(update_fields=['password'])
+    return correct
+
+
+class ModelBackend(backends.ModelBackend):
+    """
+    ModelBackend whose async path hashes passwords off the event loop
+    """
+
+    async def aauthenticate(self, request, username=None, password=None,
+                            **kwargs):
+        if username is None:
+            username = kwargs.get(User.USERNAME_FIELD)
+        if username is None or password is None:
+            return None
+        try:
+            user = await User._default_manager.aget_by_natural_key(username)
+        except User.DoesNotExist:
+            # Hash anyway, so unknown emails take as long as wrong passwords
+            await amake_password(password)
+            return None
+        if (await acheck_password(user, password) and
+                self.user_can_authenticate(user)):
+            return user
+        return None
@@ -0,0 +1,62 @@
+"""
+Helpers shared by the ``bench_*`` management commands
+"""
+
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.db import close_old_connections
+
+
+def percentile(samples, pct):
+    """
+    Return the pct-th percentile (nearest rank) of a list of samples
+    """
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    rank = max(0, min(len(ordered) - 1,
+                      int(round(pct / 100.0 * len(ordered))) - 1))
+    return ordered[rank]
+
+
+def timed(func, *args, **kwargs):
+    """
+    Call func and return (elapsed milliseconds, result)
+    """
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    return (time.perf_counter() - start) * 1000, result
+
+
+def run_concurrently(func, count, concurrency):
+    """
+    Call func(i) count times over a thread pool, returning
+    (per-call latencies in ms, results, wall clock seconds)
+    """
+    def call(i):
+        try:
+            return timed(func, i)
+        finally:
+            close_old_connections()
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        outcomes = list(pool.map(call, range(count)))
+    wall = time.perf_counter() - start
+    return [o[0] for o in outcomes], [o[1] for o in outcomes], wall
+
+
+def summarize(label, latencies, wall=None):
+    """
+    Format a one-line latency summary
+    """
+    line = (
+        f'{label:<28} n={len(latencies):<6} '
+        f'p50={percentile(latencies, 50):8.2f}ms '
+        f'p95={percentile(latencies, 95):8.2f}ms '
+        f'p99={percentile(latencies, 99):8.2f}ms'
+    )
+    if wall:
+        line += f' rps={len(latencies) / wall:9.1f}'
+    return line
@@ -0,0 +1,135 @@
+"""
+Conditional requests for user and profile resources.
+
+``conditional`` wraps a DRF view method and compares the request's
+``If-None-Match``/``If-Modified-Since`` (GET/HEAD) and
+``If-Match``/``If-Unmodified-Since`` (PUT/PATCH) headers against
+validators derived from the resource's ``updated_at`` columns. The
+validators come from a single ``values_list`` query, so a 304 or 412 is
+answered without loading or serializing the object.
+
+Successful responses carry ``ETag`` and ``Last-Modified``; after an update
+they describe the new state, so a client can chain ``If-Match`` writes.
+Timestamps changed by queryset ``update()`` calls must set ``updated_at``
+explicitly, or clients keep validating against the old state.
+
+Async view methods are wrapped the same way, with the ``a``-prefixed
+validators.
+"""
+
+import hashlib
+from functools import wraps
+
+from asgiref.sync import iscoroutinefunction
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
+
+from .models import User, UserProfile
+
+
+def make_validators(timestamps):
+    """
+    Return (etag, last_modified) for a row's timestamps; None values are
+    skipped
+    """
+    timestamps = [ts for ts in timestamps if ts is not None]
+    if not timestamps:
+        return None, None
+    digest = hashlib.md5(
+        '|'.join(ts.isoformat() for ts in timestamps).encode()).hexdigest()
+    return quote_etag(digest), int(max(timestamps).timestamp())
+
+
+def user_validator_row(request, pk=None):
+    """
+    Queryset of the validator columns of a user's representation, which
+    embeds the profile and ``last_login`` (saved without touching
+    ``updated_at``); None when the user may not see it
+    """
+    user = request.user
+    if pk is None:
+        pk = user.pk
+    elif int(pk) != user.pk and not user.is_admin_user():
+        # Leave it to the view to refuse access
+        return None
+    return User.objects.filter(pk=pk).values_list(
+        'updated_at', 'last_login', 'profile__updated_at')
+
+
+def user_validators(request, pk=None, **kwargs):
+    row = user_validator_row(request, pk)
+    return make_validators((row.first() if row is not None else None) or ())
+
+
+async def auser_validators(request, pk=None, **kwargs):
+    row = user_validator_row(request, pk)
+    return make_validators(
+        (await row.afirst() if row is not None else None) or ())
+
+
+def profile_validator_row(request):
+    return UserProfile.objects.filter(user_id=request.user.pk).values_list(
+        'updated_at')
+
+
+def profile_validators(request, **kwargs):
+    return make_validators(profile_validator_row(request).first() or ())
+
+
+async def aprofile_validators(request, **kwargs):
+    return make_validators(
+        await profile_validator_row(request).afirst() or ())
+
+
+def add_validators(response, etag, last_modified):
+    if etag and not response.has_header('ETag'):
+        response['ETag'] = etag
+    if last_modified and not response.has_header('Last-Modified'):
+        response['Last-Modified'] = http_date(last_modified)
+
+
+def conditional(validators):
+    """
+    Answer conditional GET/HEAD/PUT/PATCH requests to an APIView method
+    from ``validators(request, *args, **kwargs)``, which returns
+    (etag, last_modified timestamp). Async methods take async validators.
+    """
+    def decorator(handler):
+        if iscoroutinefunction(handler):
+            @wraps(handler)
+            async def async_wrapper(self, request, *args, **kwargs):
+                etag, last_modified = await validators(
+                    request, *args, **kwargs)
+                response = get_conditional_response(
+                    request, etag=etag, last_modified=last_modified)
+                if response is not None:
+                    return response
+
+                response = await handler(self, request, *args, **kwargs)
+                if response.status_code == 200:
+                    if request.method not in ('GET', 'HEAD'):
+                        etag, last_modified = await validators(
+                            request, *args, **kwargs)
+                    add_validators(response, etag, last_modified)
+                return response
+
+            return async_wrapper
+
+        @wraps(handler)
+        def wrapper(self, request, *args, **kwargs):
+            etag, last_modified = validators(request, *args, **kwargs)
+            response = get_conditional_response(
+                request, etag=etag, last_modified=last_modified)
+            if response is not None:
+                return response
+
+            response = handler(self, request, *args, **kwargs)
+            if response.status_code == 200:
+                if request.method not in ('GET', 'HEAD'):
+                    etag, last_modified = validators(
+                        request, *args, **kwargs)
+                add_validators(response, etag, last_modified)
+            return response
+
+        return wrapper
+    return decorator
@@ -0,0 +1,340 @@
+"""
+Bounded password hashing pool.
+
+PBKDF2 is deliberately slow, and a login burst hashing inside the web
+workers leaves none of them free for other requests. ``PooledPBKDF2
+PasswordHasher`` (first in ``PASSWORD_HASHERS``) therefore runs every
+hash, whether from a login, a password change or a new user, in a small
+process pool next to the web process (optionally at a lower CPU
+priority, see ``NICENESS``). Only web processes use the pool:
+``smartfunds.wsgi`` and ``smartfunds.asgi`` turn ``ENABLED`` on, so
+tests, management commands and Celery hash inline.
+
+Hashes are admitted against ``MAX_CONCURRENT`` slots shared by every web
+process through a Redis sorted set. When they are all taken the request
+fails at once with ``PasswordHashingSaturated`` (503 with Retry-After,
+from DRF's exception handler or, for the admin login and other Django
+views, ``PasswordHashingSaturatedMiddleware``) instead of queueing behind
+the others, so at most ``MAX_CONCURRENT``
+workers are ever busy hashing. Slots left behind by a crashed process
+expire after ``SLOT_TTL`` seconds. If Redis is unavailable, hashes are
+admitted and a warning is logged.
+
+Admissions, rejections and the number of hashes in flight at each
+admission are counted per process and summed in Redis (see
+``get_password_hashing_stats``, served at ``hashing/stats/``).
+"""
+
+import asyncio
+import logging
+import multiprocessing
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import django
+from django.conf import settings
+from django.contrib.auth.hashers import PBKDF2PasswordHasher
+from django.http import JsonResponse
+from django.utils.deprecation import MiddlewareMixin
+from rest_framework import status
+from rest_framework.exceptions import APIException
+
+from smartfunds.metrics import RedisCounters
+
+logger = logging.getLogger('smartfunds')
+
+DEFAULTS = {
+    'ENABLED': False,
+    'MAX_CONCURRENT': 2,  # hashes at once, across all web processes
+    'WORKERS': 1,  # hashing processes per web process
+    'NICENESS': 0,  # added to the hashing processes' nice value
+    'SLOT_TTL': 30,  # seconds
+    'RETRY_AFTER': 1,  # seconds
+    'KEY_PREFIX': 'accounts:hashing',
+    'STATS_FLUSH_INTERVAL': 10,  # seconds
+    'CACHE_ALIAS': 'default',
+}
+
+# KEYS: in-flight sorted set. ARGV: now (ms), slot ttl (ms), limit, member.
+# Returns the hashes in flight including this one, or -1 when saturated.
+ACQUIRE_SCRIPT = """
+local now = tonumber(ARGV[1])
+local ttl = tonumber(ARGV[2])
+redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', now - ttl)
+local depth = redis.call('ZCARD', KEYS[1])
+if depth >= tonumber(ARGV[3]) then
+    return -1
+end
+redis.call('ZADD', KEYS[1], now, ARGV[4])
+redis.call('PEXPIRE', KEYS[1], ttl)
+return depth + 1
+"""
+
+# Set in the pool's processes, which hash inline
+in_hashing_worker = False
+
+
+def get_hashing_setting(name):
+    return getattr(settings, 'PASSWORD_HASHING', {}).get(
+        name, DEFAULTS[name])
+
+
+def init_worker(niceness=0):
+    """
+    Process pool initializer for processes that hash passwords
+    """
+    global in_hashing_worker
+    in_hashing_worker = True
+    django.setup()
+    if niceness:
+        os.nice(niceness)
+
+
+def pbkdf2_encode(password, salt, iterations):
+    return PBKDF2PasswordHasher().encode(password, salt, iterations)
+
+
+class PasswordHashingSaturated(APIException):
+    status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    default_detail = 'Too many sign-ins in progress. Please retry shortly.'
+    default_code = 'password_hashing_saturated'
+
+    def __init__(self, detail=None, code=None, wait=None):
+        super().__init__(detail, code)
+        self.wait = wait
+
+
+class PasswordHashingSaturatedMiddleware(MiddlewareMixin):
+    """
+    Answer PasswordHashingSaturated raised outside DRF's exception
+    handling (the admin login, plain Django views) as DRF would, rather
+    than with a 500
+    """
+
+    def process_exception(self, request, exception):
+        if not isinstance(exception, PasswordHashingSaturated):
+            return None
+        response = JsonResponse(
+            {'detail': exception.detail}, status=exception.status_code)
+        if exception.wait:
+            response['Retry-After'] = '%d' % exception.wait
+        return response
+
+
+class PasswordHashingPool:
+    """
+    Runs hashing functions in this process's pool once a slot is free
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.executor = None
+        self.pid = None
+        self.pending = 0
+        self.script = None
+        self.counters = RedisCounters(
+            f"{get_hashing_setting('KEY_PREFIX')}:stats",
+            get_hashing_setting('STATS_FLUSH_INTERVAL'),
+            get_hashing_setting('CACHE_ALIAS'))
+
+    def get_connection(self):
+        from django_redis import get_redis_connection
+        return get_redis_connection(get_hashing_setting('CACHE_ALIAS'))
+
+    def get_async_connection(self):
+        from smartfunds.cache import get_async_redis_connection
+        return get_async_redis_connection(get_hashing_setting('CACHE_ALIAS'))
+
+    def get_script(self):
+        if self.script is None:
+            self.script = self.get_connection().register_script(
+                ACQUIRE_SCRIPT)
+        return self.script
+
+    def slots_key(self):
+        return f"{get_hashing_setting('KEY_PREFIX')}:in_flight"
+
+    def enabled(self):
+        return get_hashing_setting('ENABLED') and not in_hashing_worker
+
+    def get_executor(self):
+        with self.lock:
+            # An executor inherited through fork belongs to the parent
+            if self.executor is None or self.pid != os.getpid():
+                self.executor = ProcessPoolExecutor(
+                    max_workers=get_hashing_setting('WORKERS'),
+                    mp_context=multiprocessing.get_context('forkserver'),
+                    initializer=init_worker,
+                    initargs=(get_hashing_setting('NICENESS'),))
+                self.pid = os.getpid()
+                self.pending = 0
+            return self.executor
+
+    def submit(self, func, *args):
+        executor = self.get_executor()
+        with self.lock:
+            self.pending += 1
+        future = executor.submit(func, *args)
+        future.add_done_callback(self.done)
+        return executor, future
+
+    def done(self, future):
+        with self.lock:
+            self.pending -= 1
+
+    def broken(self, executor):
+        logger.warning('Password hashing pool broke, hashing inline',
+                       exc_info=True)
+        with self.lock:
+            if self.executor is executor:
+                self.executor = None
+        executor.shutdown(wait=False)
+
+    def acquire_call(self):
+        return {'keys': [self.slots_key()], 'args': [
+            int(time.time() * 1000),
+            get_hashing_setting('SLOT_TTL') * 1000,
+            get_hashing_setting('MAX_CONCURRENT'),
+            uuid.uuid4().hex,
+        ]}
+
+    def admitted(self, call, depth):
+        """
+        Count an admission attempt, returning its slot or raising
+        PasswordHashingSaturated
+        """
+        if depth < 0:
+            self.counters.increment('rejected')
+            raise PasswordHashingSaturated(
+                wait=get_hashing_setting('RETRY_AFTER'))
+        self.counters.increment('admitted')
+        self.counters.increment(f'depth:{depth}')
+        return call['args'][-1]
+
+    def acquire(self):
+        call = self.acquire_call()
+        try:
+            depth = self.get_script()(**call)
+        except Exception:
+            logger.warning('Password hashing admission failed',
+                           exc_info=True)
+            self.counters.increment('failed_open')
+            return None
+        return self.admitted(call, depth)
+
+    async def aacquire(self):
+        call = self.acquire_call()
+        try:
+            script = self.get_async_connection().register_script(
+                ACQUIRE_SCRIPT)
+            depth = await script(**call)
+        except Exception:
+            logger.warning('Password hashing admission failed',
+                           exc_info=True)
+            self.counters.increment('failed_open')
+            return None
+        return self.admitted(call, depth)
+
+    def release(self, slot):
+        if slot is None:
+            return
+        try:
+            self.get_connection().zrem(self.slots_key(), slot)
+        except Exception:
+            logger.warning('Password hashing slot release failed',
+                           exc_info=True)
+
+    async def arelease(self, slot):
+        if slot is None:
+            return
+        try:
+            await self.get_async_connection().zrem(self.slots_key(), slot)
+        except Exception:
+            logger.warning('Password hashing slot release failed',
+                           exc_info=True)
+
+    def run(self, func, *args):
+        """
+        Return func(*args), computed in the pool
+        """
+        if not self.enabled():
+            return func(*args)
+        slot = self.acquire()
+        try:
+            executor, future = self.submit(func, *args)
+            try:
+                return future.result()
+            except BrokenProcessPool:
+                self.broken(executor)
+                return func(*args)
+        finally:
+            self.release(slot)
+
+    async def arun(self, func, *args):
+        if not self.enabled():
+            return await asyncio.to_thread(func, *args)
+        slot = await self.aacquire()
+        try:
+            executor, future = self.submit(func, *args)
+            try:
+                return await asyncio.wrap_future(future)
+            except BrokenProcessPool:
+                self.broken(executor)
+                return await asyncio.to_thread(func, *args)
+        finally:
+            await self.arelease(slot)
+
+
+password_pool = PasswordHashingPool()
+
+
+class PooledPBKDF2PasswordHasher(PBKDF2PasswordHasher):
+    """
+    PBKDF2PasswordHasher computing its hashes in ``password_pool``.
+    Encoded passwords are unchanged, so it can be swapped in and out.
+    """
+
+    def encode(self, password, salt, iterations=None):
+        return password_pool.run(
+            pbkdf2_encode, password, salt, iterations or self.iterations)
+
+    async def aencode(self, password, salt, iterations=None):
+        return await password_pool.arun(
+            pbkdf2_encode, password, salt, iterations or self.iterations)
+
+
+def get_password_hashing_stats():
+    """
+    Return the hashes in flight now, this process's queued hashes and
+    the admission counts of every process, with the in-flight depth seen
+    at admission as {depth: count}
+    """
+    stats = {
+        'max_concurrent': get_hashing_setting('MAX_CONCURRENT'),
+        'in_flight': None,
+        'pending': password_pool.pending,
+        'admitted': 0,
+        'rejected': 0,
+        'failed_open': 0,
+        'depth': {},
+    }
+    for field, count in password_pool.counters.read().items():
+        if field.startswith('depth:'):
+            stats['depth'][int(field.split(':', 1)[1])] = count
+        else:
+            stats[field] = count
+    try:
+        connection = password_pool.get_connection()
+        key = password_pool.slots_key()
+        connection.zremrangebyscore(
+            key, '-inf',
+            time.time() * 1000 - get_hashing_setting('SLOT_TTL') * 1000)
+        stats['in_flight'] = connection.zcard(key)
+    except Exception:
+        logger.warning('Failed to read password hashing slots',
+                       exc_info=True)
+    return stats
@@ -0,0 +1,378 @@
+"""
+Bulk citizen import.
+
+Rows are read from CSV or NDJSON one at a time and validated as they
+stream in. Valid rows are grouped into chunks of ``CHUNK_SIZE``. For each
+chunk, passwords are hashed across a process pool, or inline with a
+single worker (rows without a password get an unusable one). Users and
+their profiles are then inserted with two ``bulk_create`` statements in
+one transaction.
+
+The ``import_citizens`` command imports in-process with a pool of
+``WORKERS``. Uploads to the API are stored on a ``CitizenImportJob`` and
+imported by the ``process_citizen_import_job`` Celery task with one
+worker, recording progress after every chunk for the job status
+endpoint; the file is deleted afterwards.
+
+``bulk_create`` does not send ``post_save``, so the per-row profile
+signals are skipped. The maintained user statistics are adjusted here
+instead.
+"""
+
+import csv
+import io
+import json
+import logging
+import os
+import secrets
+from concurrent.futures import ProcessPoolExecutor
+
+from django.conf import settings
+from django.contrib.auth.hashers import (
+    UNUSABLE_PASSWORD_PREFIX, make_password
+)
+from django.contrib.auth.password_validation import validate_password
+from django.core.exceptions import ValidationError
+from django.db import IntegrityError, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .hashing import init_worker
+from .models import CitizenImportJob, User, UserProfile
+from .phones import to_e164
+from .response_cache import invalidate_tags_on_commit
+from .stats import apply_stat_deltas, user_counters
+
+logger = logging.getLogger('smartfunds')
+
+DEFAULTS = {
+    'CHUNK_SIZE': 1000,
+    'WORKERS': None,  # os.cpu_count()
+    'MAX_ERRORS': 1000,
+}
+
+FORMATS = ('csv', 'ndjson')
+
+USER_FIELDS = ('email', 'phone_number', 'first_name', 'last_name')
+PROFILE_FIELDS = ('preferred_language', 'location', 'sms_notifications')
+TRUE_VALUES = ('1', 't', 'true', 'y', 'yes')
+# NDJSON values that are read as text; lists and objects are rejected
+SCALAR_TYPES = (str, int, float, bool)
+
+
+def get_import_setting(name):
+    return getattr(settings, 'USER_IMPORT', {}).get(name, DEFAULTS[name])
+
+
+def detect_format(filename):
+    """
+    Guess the import format from a file name, defaulting to CSV
+    """
+    if filename.lower().endswith(('.ndjson', '.jsonl', '.json')):
+        return 'ndjson'
+    return 'csv'
+
+
+def read_rows(lines, format):
+    """
+    Yield (row number, dict) from an iterable of text lines
+    """
+    if format == 'csv':
+        for number, row in enumerate(csv.DictReader(lines), start=1):
+            yield number, row
+    elif format == 'ndjson':
+        for number, line in enumerate(lines, start=1):
+            if line.strip():
+                try:
+                    row = json.loads(line)
+                except ValueError as exc:
+                    row = exc
+                yield number, row
+    else:
+        raise ValueError(f'Unknown import format: {format}')
+
+
+def clean_row(row):
+    """
+    Validate a row, returning (user, profile fields, password) or raising
+    ValidationError with a message dict
+    """
+    if isinstance(row, ValueError):
+        raise ValidationError({'row': [f'Invalid JSON: {row}']})
+    if not isinstance(row, dict):
+        raise ValidationError({'row': ['Not a JSON object.']})
+
+    errors = {}
+    values = {}
+    for name in USER_FIELDS:
+        field = User._meta.get_field(name)
+        value = row.get(name)
+        if value is not None and not isinstance(value, SCALAR_TYPES):
+            errors[name] = ['Must be a string or number.']
+            continue
+        value = '' if value is None else str(value).strip()
+        try:
+            values[name] = field.clean(value, None)
+        except ValidationError as exc:
+            errors[name] = exc.messages
+    if 'email' in values:
+        values['email'] = User.objects.normalize_email(values['email'])
+    if 'phone_number' in values:
+        # bulk_create skips User.save, which sets phone_e164
+        values['phone_e164'] = to_e164(values['phone_number'])
+        if values['phone_e164'] is None:
+            errors['phone_number'] = ['Enter a valid phone number.']
+
+    profile = {}
+    for name in PROFILE_FIELDS:
+        value = row.get(name)
+        if value in (None, ''):
+            continue
+        if not isinstance(value, SCALAR_TYPES):
+            errors[name] = ['Must be a string or number.']
+            continue
+        if name == 'sms_notifications' and isinstance(value, str):
+            value = value.strip().lower() in TRUE_VALUES
+        try:
+            profile[name] = UserProfile._meta.get_field(name).clean(
+                value, None)
+        except ValidationError as exc:
+            errors[name] = exc.messages
+
+    password = row.get('password') or None
+    if password is not None and not isinstance(password, str):
+        errors['password'] = ['Must be a string.']
+    if errors:
+        raise ValidationError(errors)
+
+    user = User(
+        username=values['email'], role=User.UserRole.CITIZEN, **values)
+    if password is not None:
+        try:
+            validate_password(password, user)
+        except ValidationError as exc:
+            raise ValidationError({'password': exc.messages})
+    return user, profile, password
+
+
+class CitizenImporter:
+    """
+    Import citizens from an iterable of text lines. Use as a context
+    manager so the hashing pool is shut down.
+    """
+
+    def __init__(self, chunk_size=None, workers=None, progress=None):
+        self.chunk_size = chunk_size or get_import_setting('CHUNK_SIZE')
+        self.workers = (workers or get_import_setting('WORKERS') or
+                        os.cpu_count())
+        self.max_errors = get_import_setting('MAX_ERRORS')
+        # Called with the summary so far after every chunk
+        self.progress = progress
+        self.pool = None
+        self.rows = 0
+        self.created = 0
+        self.error_count = 0
+        self.errors = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        if self.pool is not None:
+            self.pool.shutdown()
+
+    def add_error(self, number, errors):
+        self.error_count += 1
+        if len(self.errors) < self.max_errors:
+            self.errors.append({'row': number, 'errors': errors})
+
+    def run(self, lines, format):
+        """
+        Import every row, returning a summary with per-row errors
+        """
+        emails, phones = set(), set()
+        chunk = []
+        for number, row in read_rows(lines, format):
+            self.rows += 1
+            try:
+                user, profile, password = clean_row(row)
+            except ValidationError as exc:
+                self.add_error(number, exc.message_dict)
+                continue
+            if user.email in emails:
+                self.add_error(number, {'email': ['Duplicate in import.']})
+                continue
+            if user.phone_e164 in phones:
+                self.add_error(
+                    number, {'phone_number': ['Duplicate in import.']})
+                continue
+            emails.add(user.email)
+            phones.add(user.phone_e164)
+
+            chunk.append((number, user, profile, password))
+            if len(chunk) >= self.chunk_size:
+                self.import_chunk(chunk)
+                chunk = []
+        if chunk:
+            self.import_chunk(chunk)
+        return self.summary()
+
+    def summary(self):
+        return {
+            'rows': self.rows,
+            'created': self.created,
+            'error_count': self.error_count,
+            'errors': self.errors,
+        }
+
+    def hash_passwords(self, passwords):
+        # Only real passwords go to the pool. Unusable ones are any value
+        # starting with "!"; token_hex is much cheaper than the
+        # get_random_string() make_password(None) uses
+        hashed = [
+            UNUSABLE_PASSWORD_PREFIX + secrets.token_hex(20)
+            for _ in passwords
+        ]
+        pending = [i for i, password in enumerate(passwords) if password]
+        if pending and self.workers == 1:
+            # A pool of one would only add pickling
+            for i in pending:
+                hashed[i] = make_password(passwords[i])
+        elif pending:
+            if self.pool is None:
+                # The pool's processes hash inline rather than through
+                # the web hashing pool
+                self.pool = ProcessPoolExecutor(
+                    max_workers=self.workers, initializer=init_worker)
+            results = self.pool.map(
+                make_password, [passwords[i] for i in pending],
+                chunksize=max(1, len(pending) // (self.workers * 4)))
+            for i, encoded in zip(pending, results):
+                hashed[i] = encoded
+        return hashed
+
+    def drop_existing(self, chunk):
+        """
+        Report and remove rows whose email or phone number is taken
+        """
+        # phone_number too, for rows not yet backfilled with phone_e164
+        existing = User.objects.filter(
+            Q(email__in=[user.email for _, user, _, _ in chunk]) |
+            Q(phone_e164__in=[user.phone_e164 for _, user, _, _ in chunk]) |
+            Q(phone_number__in=[user.phone_number for _, user, _, _ in chunk])
+        ).values_list('email', 'phone_number')
+        taken_emails = {email for email, _ in existing}
+        taken_phones = {to_e164(phone) for _, phone in existing}
+
+        remaining = []
+        for entry in chunk:
+            number, user = entry[0], entry[1]
+            if user.email in taken_emails:
+                self.add_error(number, {'email': ['Already registered.']})
+            elif user.phone_e164 in taken_phones:
+                self.add_error(
+                    number, {'phone_number': ['Already registered.']})
+            else:
+                remaining.append(entry)
+        return remaining
+
+    def import_chunk(self, chunk):
+        self.insert_chunk(chunk)
+        if self.progress is not None:
+            self.progress(self.summary())
+
+    def insert_chunk(self, chunk):
+        chunk = self.drop_existing(chunk)
+        if not chunk:
+            return
+        hashed = self.hash_passwords([entry[3] for entry in chunk])
+        for (_, user, _, _), password in zip(chunk, hashed):
+            user.password = password
+
+        try:
+            self.insert(chunk)
+        except IntegrityError:
+            # Lost a race with another writer; drop the new conflicts
+            # and retry once
+            chunk = self.drop_existing(chunk)
+            try:
+                self.insert(chunk)
+            except IntegrityError as exc:
+                for number, *_ in chunk:
+                    self.add_error(number, {'row': [str(exc)]})
+                return
+        self.created += len(chunk)
+
+    def insert(self, chunk):
+        if not chunk:
+            return
+        with transaction.atomic():
+            users = User.objects.bulk_create(
+                [user for _, user, _, _ in chunk])
+            UserProfile.objects.bulk_create([
+                UserProfile(user=user, **profile)
+                for user, (_, _, profile, _) in zip(users, chunk)
+            ])
+            deltas = {}
+            for user in users:
+                for counter, delta in user_counters({
+                        'role': user.role, 'is_active': user.is_active,
+                        'is_verified': user.is_verified}).items():
+                    deltas[counter] = deltas.get(counter, 0) + delta
+            apply_stat_deltas(deltas)
+            invalidate_tags_on_commit([f'role:{User.UserRole.CITIZEN}'])
+
+
+def import_citizens(lines, format, chunk_size=None, workers=None,
+                    progress=None):
+    """
+    Import citizens from text lines in the given format
+    """
+    with CitizenImporter(chunk_size=chunk_size, workers=workers,
+                         progress=progress) as importer:
+        summary = importer.run(lines, format)
+    logger.info(
+        'Imported %s of %s citizen rows (%s errors)',
+        summary['created'], summary['rows'], summary['error_count'])
+    return summary
+
+
+def run_citizen_import_job(job_id):
+    """
+    Import a pending job's file, saving progress after every chunk
+    """
+    started = CitizenImportJob.objects.filter(
+        id=job_id, status=CitizenImportJob.Status.PENDING).update(
+        status=CitizenImportJob.Status.RUNNING, started_at=timezone.now())
+    if not started:
+        logger.warning('Citizen import job %s is not pending, skipping',
+                       job_id)
+        return
+
+    job = CitizenImportJob.objects.get(id=job_id)
+    jobs = CitizenImportJob.objects.filter(id=job_id)
+    progress = {}
+
+    def save_progress(summary):
+        progress.update(summary)
+        jobs.update(**summary)
+
+    try:
+        with job.file.open('rb') as file:
+            lines = io.TextIOWrapper(file, encoding='utf-8-sig', newline='')
+            # Celery's worker processes can't start a pool; hash inline
+            summary = import_citizens(
+                lines, job.format, workers=1, progress=save_progress)
+    except Exception as exc:
+        # Rows imported before the failure stay, as with the command
+        logger.exception('Citizen import job %s failed', job_id)
+        jobs.update(
+            status=CitizenImportJob.Status.FAILED, finished_at=timezone.now(),
+            errors=progress.get('errors', []) + [
+                {'row': None, 'errors': {'file': [str(exc)]}}])
+    else:
+        jobs.update(status=CitizenImportJob.Status.COMPLETED,
+                    finished_at=timezone.now(), **summary)
+    finally:
+        job.file.delete(save=False)
+        jobs.update(file='')
@@ -0,0 +1,140 @@
+"""
+Background bulk user actions.
+
+``bulk_user_action`` records a ``BulkUserJob`` and hands it to the
+``process_bulk_user_job`` Celery task, which works through the user IDs in
+chunks of ``CHUNK_SIZE``. Every chunk runs in its own short transaction and
+progress is saved after each one, so the job status endpoint can report it.
+Chunks that hit a deadlock are retried (see ``smartfunds.transactions``);
+a chunk that still fails is recorded in ``errors`` and the job moves on.
+
+Deleting users first removes their login attempts in batches of
+``DELETE_BATCH_SIZE`` rows, each in its own transaction, so the cascade
+never holds locks on large parts of the login audit table.
+"""
+
+import logging
+from functools import partial
+
+from django.conf import settings
+from django.db.models import F
+from django.utils import timezone
+
+from smartfunds.transactions import READ_COMMITTED, run_in_transaction
+
+from .authentication import invalidate_cached_users
+from .models import BulkUserJob, LoginAttempt, User
+from .response_cache import invalidate_tags
+from .stats import apply_stat_deltas
+
+logger = logging.getLogger('smartfunds')
+
+DEFAULTS = {
+    'CHUNK_SIZE': 500,
+    'DELETE_BATCH_SIZE': 5000,
+    'MAX_USER_IDS': 100000,
+}
+
+
+def get_bulk_action_setting(name):
+    return getattr(settings, 'BULK_USER_ACTIONS', {}).get(name, DEFAULTS[name])
+
+
+def set_flag(user_ids, field, value, counter):
+    """
+    Set a boolean field on the users that don't have it yet and adjust
+    the matching statistics counter
+    """
+    # update() skips auto_now; bump updated_at so ETags change
+    changed = User.objects.filter(
+        id__in=user_ids, **{field: not value}).update(
+        **{field: value}, updated_at=timezone.now())
+    apply_stat_deltas({counter: changed if value else -changed})
+    return changed
+
+
+def delete_login_attempts(user_ids):
+    """
+    Delete the users' login attempts in bounded batches
+    """
+    batch_size = get_bulk_action_setting('DELETE_BATCH_SIZE')
+    attempts = LoginAttempt.objects.filter(user_id__in=user_ids)
+    while True:
+        ids = list(attempts.values_list('id', flat=True)[:batch_size])
+        if not ids:
+            break
+        # LoginAttempt has no dependents or signals, so this is one
+        # DELETE statement
+        run_in_transaction(
+            attempts.filter(id__in=ids).delete, READ_COMMITTED,
+            operation='bulk_user_action:delete_login_attempts')
+
+
+def delete_users(user_ids):
+    delete_login_attempts(user_ids)
+    # The remaining cascade (profiles) is small; deleting through the ORM
+    # keeps the signal handlers for statistics and caches working
+    _, deleted = run_in_transaction(
+        User.objects.filter(id__in=user_ids).delete, READ_COMMITTED,
+        operation='bulk_user_action:delete')
+    return deleted.get(User._meta.label, 0)
+
+
+ACTIONS = {
+    BulkUserJob.Action.ACTIVATE: (
+        lambda ids: set_flag(ids, 'is_active', True, 'active_users')),
+    BulkUserJob.Action.DEACTIVATE: (
+        lambda ids: set_flag(ids, 'is_active', False, 'active_users')),
+    BulkUserJob.Action.VERIFY: (
+        lambda ids: set_flag(ids, 'is_verified', True, 'verified_users')),
+    BulkUserJob.Action.DELETE: delete_users,
+}
+
+
+def run_bulk_user_job(job_id):
+    """
+    Process a pending job chunk by chunk
+    """
+    started = BulkUserJob.objects.filter(
+        id=job_id, status=BulkUserJob.Status.PENDING).update(
+        status=BulkUserJob.Status.RUNNING, started_at=timezone.now())
+    if not started:
+        logger.warning('Bulk user job %s is not pending, skipping', job_id)
+        return
+
+    job = BulkUserJob.objects.get(id=job_id)
+    action = ACTIONS[job.action]
+    chunk_size = get_bulk_action_setting('CHUNK_SIZE')
+    failed = False
+
+    for index, start in enumerate(range(0, len(job.user_ids), chunk_size)):
+        chunk = job.user_ids[start:start + chunk_size]
+        affected = 0
+        try:
+            if job.action == BulkUserJob.Action.DELETE:
+                affected = action(chunk)
+            else:
+                affected = run_in_transaction(
+                    partial(action, chunk), READ_COMMITTED,
+                    operation=f'bulk_user_action:{job.action}')
+        except Exception as exc:
+            logger.exception(
+                'Bulk user job %s failed on chunk %s', job_id, index)
+            job.errors.append({
+                'chunk': index, 'user_ids': chunk, 'error': str(exc)})
+            failed = True
+            BulkUserJob.objects.filter(id=job_id).update(errors=job.errors)
+
+        # Queryset update() bypasses the post_save invalidation
+        invalidate_cached_users(chunk)
+        invalidate_tags(
+            [f'user:{user_id}' for user_id in chunk] +
+            [f'role:{role}' for role in User.UserRole.values])
+        BulkUserJob.objects.filter(id=job_id).update(
+            processed=F('processed') + len(chunk),
+            affected=F('affected') + affected)
+
+    BulkUserJob.objects.filter(id=job_id).update(
+        status=(BulkUserJob.Status.FAILED if failed
+                else BulkUserJob.Status.COMPLETED),
+        finished_at=timezone.now())
@@ -0,0 +1,267 @@
+"""
+Brute-force lockout for logins.
+
+Failed logins are counted per principal (email, IP address, phone number)
+in Redis sorted sets holding the failure times of the last ``WINDOW``
+seconds. When a principal reaches its threshold it is locked for
+``BACKOFF`` seconds, multiplied by ``BACKOFF_FACTOR`` for every further
+lockout within ``STRIKE_TTL`` (capped at ``MAX_BACKOFF``).
+
+Checking and recording are single Lua script calls, so each costs one
+round trip. The check runs before the password is verified, so a locked
+principal costs no PBKDF2 work. The engine only deals in principals, so
+USSD and SMS logins can use it with whichever principals they have,
+for example the phone number alone.
+
+If Redis is unavailable, logins are allowed and a warning is logged.
+The ``a``-prefixed methods do the same from async views.
+"""
+
+import logging
+import re
+import time
+import uuid
+
+from django.conf import settings
+from rest_framework.exceptions import Throttled
+
+logger = logging.getLogger('smartfunds')
+
+DEFAULTS = {
+    'ENABLED': True,
+    'WINDOW': 900,  # seconds
+    'THRESHOLDS': {'email': 5, 'phone': 5, 'ip': 50},
+    'BACKOFF': 60,  # seconds
+    'BACKOFF_FACTOR': 2,
+    'MAX_BACKOFF': 3600,  # seconds
+    'STRIKE_TTL': 86400,  # seconds a lockout counts towards escalation
+    'KEY_PREFIX': 'accounts:lockout',
+    'CACHE_ALIAS': 'default',
+}
+
+# KEYS: lock key per principal. Returns the longest remaining lock in ms.
+CHECK_SCRIPT = """
+local locked = 0
+for i = 1, #KEYS do
+    local ttl = redis.call('PTTL', KEYS[i])
+    if ttl > locked then locked = ttl end
+end
+return locked
+"""
+
+# KEYS: failures, strikes and lock key per principal.
+# ARGV: now (ms), window (ms), backoff (ms), factor, max backoff (ms),
+# strike ttl (ms), unique member, then one threshold per principal.
+# Returns the longest remaining lock in ms.
+FAILURE_SCRIPT = """
+local now = tonumber(ARGV[1])
+local window = tonumber(ARGV[2])
+local backoff = tonumber(ARGV[3])
+local factor = tonumber(ARGV[4])
+local max_backoff = tonumber(ARGV[5])
+local strike_ttl = tonumber(ARGV[6])
+local locked = 0
+for i = 1, #KEYS, 3 do
+    local failures, strikes, lock = KEYS[i], KEYS[i + 1], KEYS[i + 2]
+    local threshold = tonumber(ARGV[7 + (i + 2) / 3])
+    redis.call('ZREMRANGEBYSCORE', failures, '-inf', now - window)
+    redis.call('ZADD', failures, now, ARGV[7])
+    redis.call('PEXPIRE', failures, window)
+    if redis.call('ZCARD', failures) >= threshold then
+        local level = redis.call('INCR', strikes)
+        redis.call('PEXPIRE', strikes, strike_ttl)
+        local duration = math.min(
+            backoff * math.pow(factor, level - 1), max_backoff)
+        redis.call('SET', lock, level, 'PX', math.floor(duration))
+        redis.call('DEL', failures)
+    end
+    local ttl = redis.call('PTTL', lock)
+    if ttl > locked then locked = ttl end
+end
+return locked
+"""
+
+
+def get_lockout_setting(name):
+    return getattr(settings, 'LOGIN_LOCKOUT', {}).get(name, DEFAULTS[name])
+
+
+class LoginLocked(Throttled):
+    default_detail = 'Too many failed login attempts.'
+    default_code = 'login_locked'
+
+
+class LoginLockout:
+    """
+    Sliding-window failure counters and escalating lockouts per principal
+    """
+
+    def __init__(self):
+        self.scripts = None
+
+    def get_connection(self):
+        from django_redis import get_redis_connection
+        return get_redis_connection(get_lockout_setting('CACHE_ALIAS'))
+
+    def get_scripts(self):
+        # Script objects run EVALSHA, loading the script once if needed
+        if self.scripts is None:
+            connection = self.get_connection()
+            self.scripts = (
+                connection.register_script(CHECK_SCRIPT),
+                connection.register_script(FAILURE_SCRIPT),
+            )
+        return self.scripts
+
+    def get_async_connection(self):
+        from smartfunds.cache import get_async_redis_connection
+        return get_async_redis_connection(get_lockout_setting('CACHE_ALIAS'))
+
+    def principals(self, email=None, ip_address=None, phone_number=None):
+        """
+        Return the (kind, value) principals for a login attempt. Values
+        from the request body that are not strings count as missing.
+        """
+        principals = []
+        if email and isinstance(email, str):
+            principals.append(('email', email.strip().lower()))
+        if phone_number and isinstance(phone_number, str):
+            digits = re.sub(r'\D', '', phone_number)
+            if digits:
+                principals.append(('phone', digits))
+        if ip_address:
+            principals.append(('ip', ip_address))
+        return principals
+
+    def key(self, suffix, principal):
+        kind, value = principal
+        return f"{get_lockout_setting('KEY_PREFIX')}:{suffix}:{kind}:{value}"
+
+    def locked_for(self, principals):
+        """
+        Seconds until every principal is unlocked, 0 if none is locked
+        """
+        if not principals or not get_lockout_setting('ENABLED'):
+            return 0
+        try:
+            check, _ = self.get_scripts()
+            remaining = check(keys=self.lock_keys(principals))
+        except Exception:
+            logger.warning('Login lockout check failed', exc_info=True)
+            return 0
+        return remaining / 1000
+
+    async def alocked_for(self, principals):
+        if not principals or not get_lockout_setting('ENABLED'):
+            return 0
+        try:
+            check = self.get_async_connection().register_script(CHECK_SCRIPT)
+            remaining = await check(keys=self.lock_keys(principals))
+        except Exception:
+            logger.warning('Login lockout check failed', exc_info=True)
+            return 0
+        return remaining / 1000
+
+    def check(self, principals):
+        """
+        Raise LoginLocked if any principal is locked
+        """
+        wait = self.locked_for(principals)
+        if wait:
+            raise LoginLocked(wait=wait)
+
+    async def acheck(self, principals):
+        wait = await self.alocked_for(principals)
+        if wait:
+            raise LoginLocked(wait=wait)
+
+    def register_failure(self, principals):
+        """
+        Count a failed login, returning the seconds the attempt's
+        principals are now locked for (0 if none is)
+        """
+        if not principals or not get_lockout_setting('ENABLED'):
+            return 0
+        try:
+            _, failure = self.get_scripts()
+            remaining = failure(**self.failure_call(principals))
+        except Exception:
+            logger.warning('Login lockout update failed', exc_info=True)
+            return 0
+        return self.failure_recorded(principals, remaining)
+
+    async def aregister_failure(self, principals):
+        if not principals or not get_lockout_setting('ENABLED'):
+            return 0
+        try:
+            failure = self.get_async_connection().register_script(
+                FAILURE_SCRIPT)
+            remaining = await failure(**self.failure_call(principals))
+        except Exception:
+            logger.warning('Login lockout update failed', exc_info=True)
+            return 0
+        return self.failure_recorded(principals, remaining)
+
+    def register_success(self, principals):
+        """
+        Clear the failure history of the account principals. IP
+        addresses are shared, so their counters are left alone.
+        """
+        keys = self.history_keys(principals)
+        if not keys or not get_lockout_setting('ENABLED'):
+            return
+        try:
+            self.get_connection().delete(*keys)
+        except Exception:
+            logger.warning('Login lockout reset failed', exc_info=True)
+
+    async def aregister_success(self, principals):
+        keys = self.history_keys(principals)
+        if not keys or not get_lockout_setting('ENABLED'):
+            return
+        try:
+            await self.get_async_connection().delete(*keys)
+        except Exception:
+            logger.warning('Login lockout reset failed', exc_info=True)
+
+    def lock_keys(self, principals):
+        return [self.key('lock', p) for p in principals]
+
+    def history_keys(self, principals):
+        return [self.key(suffix, principal)
+                for principal in principals if principal[0] != 'ip'
+                for suffix in ('failures', 'strikes')]
+
+    def failure_call(self, principals):
+        """
+        Keys and arguments of FAILURE_SCRIPT for the principals
+        """
+        thresholds = {
+            **DEFAULTS['THRESHOLDS'], **get_lockout_setting('THRESHOLDS')}
+        keys = []
+        for principal in principals:
+            keys.extend([
+                self.key('failures', principal),
+                self.key('strikes', principal),
+                self.key('lock', principal),
+            ])
+        return {'keys': keys, 'args': [
+            int(time.time() * 1000),
+            get_lockout_setting('WINDOW') * 1000,
+            get_lockout_setting('BACKOFF') * 1000,
+            get_lockout_setting('BACKOFF_FACTOR'),
+            get_lockout_setting('MAX_BACKOFF') * 1000,
+            get_lockout_setting('STRIKE_TTL') * 1000,
+            uuid.uuid4().hex,
+            *[thresholds[kind] for kind, _ in principals],
+        ]}
+
+    def failure_recorded(self, principals, remaining):
+        if remaining:
+            logger.warning(
+                'Login locked for %.0fs after repeated failures: %s',
+                remaining / 1000, principals)
+        return remaining / 1000
+
+
+login_lockout = LoginLockout()
@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand
+
+from apps.accounts.phones import backfill_phone_e164
+
+
+class Command(BaseCommand):
+    help = (
+        'Fill in the canonical E.164 phone number of users saved before '
+        'the column existed, in chunks'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int,
+                            help='Users per transaction')
+
+    def handle(self, *args, **options):
+        updated = skipped = 0
+        for last_id, chunk_updated, chunk_skipped in backfill_phone_e164(
+                chunk_size=options['chunk_size']):
+            updated += chunk_updated
+            skipped += len(chunk_skipped)
+            for user_id, phone_number, reason in chunk_skipped:
+                self.stderr.write(
+                    f'Skipped user {user_id} ({phone_number}): {reason}')
+            self.stdout.write(
+                f'Up to user {last_id}: {updated} updated, {skipped} skipped')
+        self.stdout.write(f'Done: {updated} updated, {skipped} skipped')
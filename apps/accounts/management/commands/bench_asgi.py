@@ -0,0 +1,317 @@
+import asyncio
+import http.client
+import multiprocessing
+import os
+import signal
+import socket
+import subprocess
+import sys
+import threading
+import time
+from urllib.parse import urlsplit, urlunsplit
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django_redis import get_redis_connection
+from rest_framework_simplejwt.tokens import AccessToken
+
+from apps.accounts.benchmark import run_concurrently, summarize
+
+User = get_user_model()
+
+BENCH_EMAIL = 'bench-asgi-{}@smartfunds.local'
+BENCH_PASSWORD = 'bench-asgi-password'
+PREFIX = '/api/v1/accounts/'
+
+SERVERS = {
+    # The current production command, and the ASGI variant at the same
+    # worker count
+    'wsgi': ['smartfunds.wsgi:application'],
+    'asgi': ['smartfunds.asgi:application',
+             '-k', 'uvicorn.workers.UvicornWorker'],
+}
+
+ENDPOINTS = ('me', 'profile', 'stats', 'login')
+
+
+def delayed_proxy(listeners, delay):
+    """
+    Forward each listening socket to its (host, port), sleeping delay
+    seconds before passing on every chunk a client sends
+    """
+    async def pipe(reader, writer, wait):
+        try:
+            while data := await reader.read(65536):
+                if wait:
+                    await asyncio.sleep(wait)
+                writer.write(data)
+                await writer.drain()
+        except (ConnectionError, OSError):
+            pass
+        finally:
+            writer.close()
+
+    async def serve(sock, target):
+        async def handle(client_reader, client_writer):
+            try:
+                reader, writer = await asyncio.open_connection(*target)
+            except OSError:
+                client_writer.close()
+                return
+            await asyncio.gather(pipe(client_reader, writer, delay),
+                                 pipe(reader, client_writer, 0))
+
+        server = await asyncio.start_server(handle, sock=sock)
+        await server.serve_forever()
+
+    async def main():
+        await asyncio.gather(*(serve(sock, target)
+                               for sock, target in listeners))
+
+    asyncio.run(main())
+
+
+def process_tree_memory(pid):
+    """
+    Proportional set size (RSS where unavailable) of pid and its
+    children, in MB
+    """
+    total = 0
+    pids = [pid]
+    while pids:
+        current = pids.pop()
+        try:
+            with open(f'/proc/{current}/smaps_rollup') as f:
+                fields = dict(line.split(':', 1) for line in f if ':' in line)
+            total += int((fields.get('Pss') or fields['Rss']).split()[0])
+            with open(f'/proc/{current}/task/{current}/children') as f:
+                pids.extend(int(child) for child in f.read().split())
+        except (FileNotFoundError, ProcessLookupError):
+            continue
+    return total / 1024
+
+
+def client(port, endpoint, tokens, count, concurrency, results):
+    local = threading.local()
+
+    def request(i):
+        connection = getattr(local, 'connection', None)
+        if connection is None:
+            connection = local.connection = http.client.HTTPConnection(
+                '127.0.0.1', port, timeout=60)
+        token = tokens[i % len(tokens)]
+        if endpoint == 'login':
+            # A distinct client address per attempt, so the login rate
+            # limit doesn't turn the run into 429s (the server trusts
+            # X-Real-IP from 127.0.0.1, as from nginx)
+            body = (f'{{"email": "{token[0]}", '
+                    f'"password": "{BENCH_PASSWORD}"}}')
+            headers = {'Content-Type': 'application/json',
+                       'X-Real-IP': f'10.{i >> 16 & 255}.'
+                                    f'{i >> 8 & 255}.{i & 255}'}
+            connection.request('POST', f'{PREFIX}auth/login/', body, headers)
+        else:
+            path = {'me': 'users/me/', 'profile': 'profile/',
+                    'stats': 'users/stats/'}[endpoint]
+            connection.request('GET', f'{PREFIX}{path}', headers={
+                'Authorization': f'Bearer {token[1]}'})
+        try:
+            response = connection.getresponse()
+            response.read()
+        except (http.client.HTTPException, OSError):
+            connection.close()
+            return 0
+        if response.will_close:
+            connection.close()
+        return response.status
+
+    latencies, statuses, wall = run_concurrently(request, count, concurrency)
+    results.put((latencies, statuses, wall))
+
+
+class Command(BaseCommand):
+    help = (
+        'Load test login, users/me/, profile and stats under gunicorn with '
+        'sync (WSGI) workers and with Uvicorn (ASGI) workers, reporting '
+        'requests/sec, p99 and memory'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=3,
+                            help='gunicorn --workers for both servers')
+        parser.add_argument('--asgi-workers', type=int,
+                            help='Override --workers for the ASGI server, '
+                                 'to compare at equal memory')
+        parser.add_argument('--requests', type=int, default=2000,
+                            help='Requests per endpoint')
+        parser.add_argument('--login-requests', type=int, default=60,
+                            help='Logins (each hashes a password)')
+        parser.add_argument('--concurrency', type=int, default=32)
+        parser.add_argument('--clients', type=int, default=2,
+                            help='Load generator processes')
+        parser.add_argument('--users', type=int, default=50)
+        parser.add_argument('--latency-ms', type=float, default=0.0,
+                            help='Delay added to every Postgres and Redis '
+                                 'request, to model a slow network or '
+                                 'server')
+        parser.add_argument('--servers', default='wsgi,asgi')
+        parser.add_argument('--endpoints', default=','.join(ENDPOINTS))
+        parser.add_argument('--port', type=int, default=8765)
+
+    def handle(self, *args, **options):
+        users = self.get_bench_users(options['users'])
+        tokens = [(user.email, str(AccessToken.for_user(user)))
+                  for user in users]
+        context = multiprocessing.get_context('fork')
+        env = {**os.environ, 'PROCESS_TYPE': 'web',
+               'TRUSTED_PROXIES': '127.0.0.1'}
+
+        proxy = None
+        if options['latency_ms']:
+            proxy, proxied = self.start_proxy(
+                context, options['latency_ms'] / 1000)
+            env.update(proxied)
+
+        try:
+            for mode in options['servers'].split(','):
+                workers = options['workers']
+                if mode == 'asgi' and options['asgi_workers']:
+                    workers = options['asgi_workers']
+                self.clear_throttles()
+                server = self.start_server(mode, workers, options['port'], {
+                    **env, 'ASYNC_VIEWS': str(mode == 'asgi')})
+                try:
+                    self.run_server(mode, server, workers, tokens, context,
+                                    options)
+                finally:
+                    server.send_signal(signal.SIGTERM)
+                    server.wait(timeout=30)
+        finally:
+            if proxy is not None:
+                proxy.terminate()
+            self.clear_throttles()
+            User.objects.filter(pk__in=[user.pk for user in users]).delete()
+
+    def run_server(self, mode, server, workers, tokens, context, options):
+        # Warm up every worker's connections and caches
+        for endpoint in options['endpoints'].split(','):
+            if endpoint != 'login':
+                self.load(options['port'], endpoint, tokens,
+                          len(tokens) * 2, options['concurrency'], context,
+                          options['clients'])
+        memory = process_tree_memory(server.pid)
+        self.stdout.write(
+            f'{mode}: {workers} workers, {memory:.0f} MB (PSS)')
+
+        for endpoint in options['endpoints'].split(','):
+            count = (options['login_requests'] if endpoint == 'login'
+                     else options['requests'])
+            latencies, statuses, wall = self.load(
+                options['port'], endpoint, tokens, count,
+                options['concurrency'], context, options['clients'])
+            errors = sum(1 for status in statuses if status != 200)
+            line = summarize(f'{mode} {endpoint}', latencies, wall)
+            if errors:
+                line += f' errors={errors}'
+            self.stdout.write(line)
+
+    def load(self, port, endpoint, tokens, count, concurrency, context,
+             clients):
+        results = context.Queue()
+        processes = [
+            context.Process(target=client, args=(
+                port, endpoint, tokens, count // clients,
+                max(1, concurrency // clients), results))
+            for _ in range(clients)
+        ]
+        for process in processes:
+            process.start()
+        outcomes = [results.get() for _ in processes]
+        for process in processes:
+            process.join()
+        latencies = [ms for outcome in outcomes for ms in outcome[0]]
+        statuses = [s for outcome in outcomes for s in outcome[1]]
+        return latencies, statuses, max(outcome[2] for outcome in outcomes)
+
+    def start_server(self, mode, workers, port, env):
+        server = subprocess.Popen([
+            sys.executable, '-m', 'gunicorn', *SERVERS[mode],
+            '--bind', f'127.0.0.1:{port}', '--workers', str(workers),
+            '--timeout', '120', '--preload', '--log-level', 'warning',
+        ], env=env, cwd=settings.BASE_DIR)
+        deadline = time.monotonic() + 60
+        while time.monotonic() < deadline:
+            if server.poll() is not None:
+                raise RuntimeError(f'{mode} server exited')
+            try:
+                socket.create_connection(('127.0.0.1', port), 1).close()
+                return server
+            except OSError:
+                time.sleep(0.2)
+        server.kill()
+        raise RuntimeError(f'{mode} server did not start')
+
+    def start_proxy(self, context, delay):
+        """
+        Start the delaying proxy, returning it and the environment that
+        points the servers at it
+        """
+        database = settings.DATABASES['default']
+        redis_url = urlsplit(settings.CACHES['default']['LOCATION'])
+        targets = [
+            (database['HOST'] or '127.0.0.1', int(database['PORT'] or 5432)),
+            (redis_url.hostname, redis_url.port or 6379),
+        ]
+        listeners = []
+        for target in targets:
+            sock = socket.socket()
+            sock.bind(('127.0.0.1', 0))
+            sock.listen(1024)
+            listeners.append((sock, target))
+        proxy = context.Process(
+            target=delayed_proxy, args=(listeners, delay), daemon=True)
+        proxy.start()
+
+        db_port = listeners[0][0].getsockname()[1]
+        redis_port = listeners[1][0].getsockname()[1]
+        for sock, _ in listeners:
+            sock.close()
+        credentials = database['USER']
+        if database['PASSWORD']:
+            credentials += f":{database['PASSWORD']}"
+        redis_netloc = f'127.0.0.1:{redis_port}'
+        if redis_url.password:
+            redis_netloc = f':{redis_url.password}@{redis_netloc}'
+        return proxy, {
+            'DATABASE_URL': (f'postgres://{credentials}@127.0.0.1:{db_port}/'
+                             f"{database['NAME']}"),
+            'REDIS_URL': urlunsplit(redis_url._replace(netloc=redis_netloc)),
+        }
+
+    def clear_throttles(self):
+        connection = get_redis_connection('default')
+        keys = list(connection.scan_iter('throttle:gcra:*', count=1000))
+        if keys:
+            connection.delete(*keys)
+
+    def get_bench_users(self, count):
+        """
+        Admins (so stats is allowed) sharing one password hash
+        """
+        hashed = User()
+        hashed.set_password(BENCH_PASSWORD)
+        users = []
+        for i in range(count):
+            user, _ = User.objects.get_or_create(
+                email=BENCH_EMAIL.format(i),
+                defaults={
+                    'username': BENCH_EMAIL.format(i),
+                    'phone_number': f'+2547009{i:05d}',
+                    'first_name': 'Bench',
+                    'last_name': f'ASGI {i}',
+                    'role': User.UserRole.FUND_ADMIN,
+                    'password': hashed.password,
+                })
+            users.append(user)
+        return users
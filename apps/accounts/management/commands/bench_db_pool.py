@@ -0,0 +1,131 @@
+import multiprocessing
+import threading
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection, connections
+
+from apps.accounts.benchmark import run_concurrently, summarize
+from apps.accounts.models import User, UserProfile
+from smartfunds.db import pool_snapshot
+
+ACTIVE_CONNECTIONS_SQL = """
+    SELECT count(*) FROM pg_stat_activity
+    WHERE datname = current_database() AND pid <> pg_backend_pid()
+"""
+
+
+def active_connections(cursor):
+    cursor.execute(ACTIVE_CONNECTIONS_SQL)
+    return cursor.fetchone()[0]
+
+
+def configure(mode, pool_max):
+    """
+    Switch this (forked) process between persistent connections and a
+    pool, before any connection is opened
+    """
+    db = connections.settings['default']
+    options = db.setdefault('OPTIONS', {})
+    if mode == 'pool':
+        db['CONN_MAX_AGE'] = 0
+        db['CONN_HEALTH_CHECKS'] = False
+        options['pool'] = {
+            'min_size': 1, 'max_size': pool_max, 'timeout': 30}
+    else:
+        db['CONN_MAX_AGE'] = 600
+        options.pop('pool', None)
+
+
+def worker(mode, pool_max, user_ids, requests, threads, work_ms, results):
+    configure(mode, pool_max)
+
+    def handle(i):
+        # A typical request: read the user, do non-database work while
+        # holding the connection, read the profile
+        user_id = user_ids[i % len(user_ids)]
+        User.objects.filter(pk=user_id).values_list('email').first()
+        time.sleep(work_ms / 1000)
+        UserProfile.objects.filter(user_id=user_id).values_list('bio').first()
+
+    latencies, _, wall = run_concurrently(handle, requests, threads)
+    results.put((latencies, wall, pool_snapshot()))
+
+
+class Command(BaseCommand):
+    help = (
+        'Load test persistent connections against the psycopg 3 pool at a '
+        'fixed worker count, reporting Postgres connections and latency'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=3,
+                            help='Processes, like gunicorn --workers')
+        parser.add_argument('--threads', type=int, default=4,
+                            help='Concurrent requests per worker')
+        parser.add_argument('--requests', type=int, default=400,
+                            help='Requests per worker')
+        parser.add_argument('--pool-max', type=int, default=2)
+        parser.add_argument('--work-ms', type=float, default=5.0)
+        parser.add_argument('--modes', default='persistent,pool')
+
+    def handle(self, *args, **options):
+        user_ids = list(User.objects.values_list('id', flat=True)[:1000])
+        if not user_ids:
+            self.stderr.write('No users to query; create some first')
+            return
+        # Children must not share the parent's connection
+        connection.close()
+        context = multiprocessing.get_context('fork')
+        # Counts connections from this thread and the sampler thread
+        monitor = connections.create_connection('default')
+        monitor.inc_thread_sharing()
+
+        for mode in options['modes'].split(','):
+            # Let backends of the previous run exit before counting
+            with monitor.cursor() as cursor:
+                deadline = time.monotonic() + 5
+                while (active_connections(cursor) and
+                       time.monotonic() < deadline):
+                    time.sleep(0.05)
+
+            results = context.Queue()
+            processes = [
+                context.Process(target=worker, args=(
+                    mode, options['pool_max'], user_ids, options['requests'],
+                    options['threads'], options['work_ms'], results))
+                for _ in range(options['workers'])
+            ]
+
+            peak = 0
+            done = threading.Event()
+
+            def sample():
+                nonlocal peak
+                with monitor.cursor() as cursor:
+                    while not done.is_set():
+                        peak = max(peak, active_connections(cursor))
+                        time.sleep(0.02)
+
+            sampler = threading.Thread(target=sample)
+            sampler.start()
+            for process in processes:
+                process.start()
+            outcomes = [results.get() for _ in processes]
+            for process in processes:
+                process.join()
+            done.set()
+            sampler.join()
+
+            latencies = [ms for outcome in outcomes for ms in outcome[0]]
+            wall = max(outcome[1] for outcome in outcomes)
+            self.stdout.write(summarize(mode, latencies, wall))
+            line = f'{"":<28} peak connections={peak}'
+            snapshots = [outcome[2] for outcome in outcomes if outcome[2]]
+            if snapshots:
+                queued = sum(s['requests_queued'] for s in snapshots)
+                wait_ms = sum(s['requests_wait_ms'] for s in snapshots)
+                line += (f' queued={queued}'
+                         f' avg_wait={wait_ms / queued if queued else 0:.2f}ms')
+            self.stdout.write(line)
+        monitor.close()
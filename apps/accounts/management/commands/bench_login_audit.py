@@ -0,0 +1,76 @@
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.test import override_settings
+from rest_framework.test import APIRequestFactory
+
+from apps.accounts.audit import SINKS, get_login_audit_sink
+from apps.accounts.benchmark import run_concurrently, summarize
+from apps.accounts.models import LoginAttempt
+from apps.accounts.views import CustomTokenObtainPairView
+
+User = get_user_model()
+
+BENCH_EMAIL = 'bench-login@smartfunds.local'
+BENCH_PASSWORD = 'bench-login-password'
+
+
+class Command(BaseCommand):
+    help = 'Measure login latency (p50/p95/p99) for each login audit mode'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=500)
+        parser.add_argument('--concurrency', type=int, default=8)
+        parser.add_argument(
+            '--modes', nargs='+', choices=list(SINKS), default=list(SINKS))
+        parser.add_argument(
+            '--fast-hasher', action='store_true',
+            help='Use the MD5 hasher so the audit write is not hidden '
+                 'behind PBKDF2')
+
+    def handle(self, *args, **options):
+        hashers = settings.PASSWORD_HASHERS
+        if options['fast_hasher']:
+            hashers = ['django.contrib.auth.hashers.MD5PasswordHasher']
+
+        with override_settings(PASSWORD_HASHERS=hashers):
+            user = self.get_bench_user()
+            view = CustomTokenObtainPairView.as_view(throttle_classes=())
+            factory = APIRequestFactory()
+
+            def login(i):
+                request = factory.post('/api/v1/accounts/auth/login/', {
+                    'email': BENCH_EMAIL,
+                    'password': BENCH_PASSWORD,
+                }, format='json', REMOTE_ADDR='10.0.0.1')
+                return view(request).status_code
+
+            for mode in options['modes']:
+                audit = {**settings.LOGIN_AUDIT, 'MODE': mode}
+                with override_settings(LOGIN_AUDIT=audit):
+                    LoginAttempt.objects.filter(email=BENCH_EMAIL).delete()
+                    latencies, _, wall = run_concurrently(
+                        login, options['requests'], options['concurrency'])
+                    flushed = get_login_audit_sink(mode).flush()
+                recorded = LoginAttempt.objects.filter(
+                    email=BENCH_EMAIL).count()
+                self.stdout.write(summarize(f'login [{mode}]', latencies, wall))
+                self.stdout.write(
+                    f'    rows recorded: {recorded} '
+                    f'({flushed} flushed after the run)')
+
+        LoginAttempt.objects.filter(email=BENCH_EMAIL).delete()
+        user.delete()
+
+    def get_bench_user(self):
+        user, _ = User.objects.get_or_create(
+            email=BENCH_EMAIL,
+            defaults={
+                'username': BENCH_EMAIL,
+                'phone_number': '+254700000000',
+                'first_name': 'Bench',
+                'last_name': 'Login',
+            })
+        user.set_password(BENCH_PASSWORD)
+        user.save()
+        return user
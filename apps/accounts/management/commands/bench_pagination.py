@@ -0,0 +1,93 @@
+from urllib.parse import parse_qs, urlparse
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import connection
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from apps.accounts.benchmark import summarize, timed
+from apps.accounts.models import LoginAttempt
+from apps.accounts.pagination import LoginAttemptPagination
+from apps.accounts.views import LoginAttemptsView
+
+User = get_user_model()
+
+BENCH_EMAIL = 'pagination-bench@smartfunds.local'
+
+INSERT_SQL = """
+INSERT INTO accounts_login_attempt (
+    email, ip_address, method, successful, timestamp, user_agent
+)
+SELECT %(email)s, '10.0.0.1', 'web', n %% 4 <> 0,
+       now() - (n || ' seconds')::interval, 'bench'
+FROM generate_series(%(start)s, %(stop)s) AS n
+"""
+
+
+class Command(BaseCommand):
+    help = (
+        'Compare page-number and keyset pagination of login attempts on '
+        'page 1 and a deep page'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=250_000)
+        parser.add_argument('--page', type=int, default=10_000)
+        parser.add_argument('--page-size', type=int, default=20)
+        parser.add_argument('--repeat', type=int, default=20)
+        parser.add_argument('--keep', action='store_true')
+
+    def handle(self, *args, **options):
+        self.populate(options['rows'])
+        admin = User(id=0, role=User.UserRole.SUPERADMIN, is_active=True)
+        view = LoginAttemptsView.as_view(throttle_classes=())
+        factory = APIRequestFactory()
+        page, page_size = options['page'], options['page_size']
+
+        def fetch(params):
+            request = factory.get('/api/v1/accounts/login-attempts/', params)
+            force_authenticate(request, user=admin)
+            response = view(request)
+            response.render()
+            return response
+
+        deep_cursor = self.cursor_before((page - 1) * page_size)
+        cases = [
+            ('page-number page 1', {'page': 1, 'page_size': page_size}),
+            (f'page-number page {page}',
+             {'page': page, 'page_size': page_size}),
+            ('keyset page 1', {'page_size': page_size}),
+            (f'keyset page {page}',
+             {'cursor': deep_cursor, 'page_size': page_size}),
+        ]
+        for label, params in cases:
+            status = fetch(params).status_code
+            latencies = [
+                timed(fetch, params)[0] for _ in range(options['repeat'])]
+            self.stdout.write(summarize(f'{label} [{status}]', latencies))
+
+        if not options['keep']:
+            LoginAttempt.objects.filter(email=BENCH_EMAIL).delete()
+
+    def populate(self, rows):
+        existing = LoginAttempt.objects.filter(email=BENCH_EMAIL).count()
+        if existing >= rows:
+            return
+        self.stdout.write(f'Generating {rows - existing} login attempts...')
+        with connection.cursor() as cursor:
+            cursor.execute(INSERT_SQL, {
+                'email': BENCH_EMAIL, 'start': existing + 1, 'stop': rows})
+            cursor.execute('ANALYZE accounts_login_attempt')
+
+    def cursor_before(self, offset):
+        """
+        Build the cursor a client would hold after walking to offset
+        """
+        if offset <= 0:
+            return ''
+        last = LoginAttempt.objects.order_by(
+            '-timestamp', '-id')[offset - 1]
+        paginator = LoginAttemptPagination()
+        paginator.base_url = '/'
+        link = paginator.encode_cursor(paginator.get_position(last), False)
+        return parse_qs(urlparse(link).query)['cursor'][0]
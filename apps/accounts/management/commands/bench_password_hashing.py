@@ -0,0 +1,152 @@
+import http.client
+import multiprocessing
+import os
+import signal
+import threading
+from collections import Counter
+
+from django_redis import get_redis_connection
+from rest_framework_simplejwt.tokens import AccessToken
+
+from apps.accounts.benchmark import summarize
+from apps.accounts.hashing import password_pool
+
+from . import bench_asgi
+
+MODES = ('inline', 'pool')
+
+
+def login_flood(port, emails, concurrency, stop, results):
+    """
+    Log in from concurrency threads until stop is set, honouring
+    Retry-After, and put the status counts on results
+    """
+    counts = [Counter() for _ in range(concurrency)]
+
+    def flood(n):
+        connection = None
+        attempt = n
+        while not stop.is_set():
+            if connection is None:
+                connection = http.client.HTTPConnection(
+                    '127.0.0.1', port, timeout=60)
+            email = emails[attempt % len(emails)]
+            body = (f'{{"email": "{email}", '
+                    f'"password": "{bench_asgi.BENCH_PASSWORD}"}}')
+            # A distinct client address per attempt, as in bench_asgi
+            headers = {'Content-Type': 'application/json',
+                       'X-Real-IP': f'10.{attempt >> 16 & 255}.'
+                                    f'{attempt >> 8 & 255}.'
+                                    f'{attempt & 255}'}
+            attempt += concurrency
+            try:
+                connection.request(
+                    'POST', f'{bench_asgi.PREFIX}auth/login/', body, headers)
+                response = connection.getresponse()
+                response.read()
+            except (http.client.HTTPException, OSError):
+                counts[n][0] += 1
+                connection.close()
+                connection = None
+                continue
+            counts[n][response.status] += 1
+            if response.status == 503:
+                stop.wait(float(response.getheader('Retry-After') or 0))
+            if response.will_close:
+                connection.close()
+                connection = None
+
+    threads = [threading.Thread(target=flood, args=(n,))
+               for n in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    results.put(dict(sum(counts, Counter())))
+
+
+class Command(bench_asgi.Command):
+    help = (
+        'Measure users/me/ latency under gunicorn sync workers while a '
+        'login flood runs, with passwords hashed inline and in the bounded '
+        'hashing pool'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=3,
+                            help='gunicorn --workers')
+        parser.add_argument('--requests', type=int, default=600,
+                            help='users/me/ requests per measurement')
+        parser.add_argument('--concurrency', type=int, default=4,
+                            help='Concurrent users/me/ clients')
+        parser.add_argument('--login-concurrency', type=int, default=12,
+                            help='Concurrent clients in the login flood')
+        parser.add_argument('--max-concurrent', type=int, default=1,
+                            help='PASSWORD_HASHING MAX_CONCURRENT')
+        parser.add_argument('--clients', type=int, default=1,
+                            help='users/me/ load generator processes')
+        parser.add_argument('--users', type=int, default=20)
+        parser.add_argument('--modes', default=','.join(MODES))
+        parser.add_argument('--port', type=int, default=8765)
+
+    def handle(self, *args, **options):
+        users = self.get_bench_users(options['users'])
+        tokens = [(user.email, str(AccessToken.for_user(user)))
+                  for user in users]
+        context = multiprocessing.get_context('fork')
+
+        try:
+            for mode in options['modes'].split(','):
+                self.clear_throttles()
+                get_redis_connection('default').delete(
+                    password_pool.slots_key())
+                server = self.start_server('wsgi', options['workers'],
+                                           options['port'], {
+                    **os.environ,
+                    'PROCESS_TYPE': 'web',
+                    'TRUSTED_PROXIES': '127.0.0.1',
+                    'PASSWORD_HASHING_POOL': str(mode == 'pool'),
+                    'PASSWORD_HASHING_MAX_CONCURRENT':
+                        str(options['max_concurrent']),
+                })
+                try:
+                    self.run_mode(mode, tokens, context, options)
+                finally:
+                    server.send_signal(signal.SIGTERM)
+                    server.wait(timeout=30)
+        finally:
+            self.clear_throttles()
+            bench_asgi.User.objects.filter(
+                pk__in=[user.pk for user in users]).delete()
+
+    def run_mode(self, mode, tokens, context, options):
+        def measure():
+            return self.load(options['port'], 'me', tokens,
+                             options['requests'], options['concurrency'],
+                             context, options['clients'])
+
+        # Warm up, then measure without and with the flood
+        measure()
+        self.report(f'{mode} me idle', *measure())
+
+        stop = context.Event()
+        results = context.Queue()
+        flood = context.Process(target=login_flood, args=(
+            options['port'], [email for email, _ in tokens],
+            options['login_concurrency'], stop, results))
+        flood.start()
+        try:
+            self.report(f'{mode} me flood', *measure())
+        finally:
+            stop.set()
+            statuses = results.get()
+            flood.join()
+        self.stdout.write(f'{mode} logins: ' + ', '.join(
+            f'{status}={count}' for status, count in sorted(statuses.items())))
+
+    def report(self, label, latencies, statuses, wall):
+        errors = sum(1 for status in statuses if status != 200)
+        line = summarize(label, latencies, wall)
+        if errors:
+            line += f' errors={errors}'
+        self.stdout.write(line)
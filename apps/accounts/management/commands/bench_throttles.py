@@ -0,0 +1,48 @@
+from django.core.cache import cache
+from django.core.management.base import BaseCommand
+from django.test import override_settings
+from rest_framework.settings import api_settings
+from rest_framework.test import APIRequestFactory
+from rest_framework.throttling import UserRateThrottle
+
+from apps.accounts.benchmark import summarize, timed
+from apps.accounts.throttling import GCRAUserRateThrottle
+
+
+class Command(BaseCommand):
+    help = (
+        'Compare per-request cost of the stock UserRateThrottle and the '
+        'GCRA throttle as the request history grows'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=2000)
+        parser.add_argument(
+            '--rate', default='1000000/hour',
+            help='High enough that requests are never denied, so only the '
+                 'bookkeeping is measured')
+
+    def handle(self, *args, **options):
+        rates = {**api_settings.DEFAULT_THROTTLE_RATES, 'user': options['rate']}
+        request = APIRequestFactory().get('/', REMOTE_ADDR='10.9.9.9')
+        request.user = None
+        count = options['requests']
+
+        with override_settings(REST_FRAMEWORK={
+                'DEFAULT_THROTTLE_RATES': rates}):
+            for label, throttle_class in (
+                    ('stock UserRateThrottle', UserRateThrottle),
+                    ('GCRAUserRateThrottle', GCRAUserRateThrottle)):
+                # Rates are read at class definition time
+                throttle_class.THROTTLE_RATES = rates
+                throttle = throttle_class()
+                cache.delete(throttle.get_cache_key(request, None))
+
+                latencies = []
+                for i in range(count):
+                    ms, allowed = timed(throttle.allow_request, request, None)
+                    latencies.append(ms)
+                first = latencies[:count // 10]
+                last = latencies[-(count // 10):]
+                self.stdout.write(summarize(f'{label} first 10%', first))
+                self.stdout.write(summarize(f'{label} last 10%', last))
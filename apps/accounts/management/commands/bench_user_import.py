@@ -0,0 +1,102 @@
+import csv
+import io
+import time
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+
+from apps.accounts.imports import import_citizens
+from apps.accounts.models import UserProfile
+from apps.accounts.serializers import UserCreateSerializer
+from apps.accounts.stats import reconcile_user_stats
+
+User = get_user_model()
+
+BENCH_DOMAIN = 'import-bench.invalid'
+BENCH_PASSWORD = 'Import-bench-pw-42'
+
+
+def bench_rows(start, count, password=''):
+    for n in range(start, start + count):
+        yield {
+            'email': f'citizen{n}@{BENCH_DOMAIN}',
+            'phone_number': f'+2549{n:08d}',
+            'first_name': 'Bench',
+            'last_name': f'Citizen{n}',
+            'password': password,
+            'preferred_language': 'sw',
+        }
+
+
+def as_csv(rows):
+    output = io.StringIO()
+    writer = csv.DictWriter(output, fieldnames=[
+        'email', 'phone_number', 'first_name', 'last_name', 'password',
+        'preferred_language'])
+    writer.writeheader()
+    writer.writerows(rows)
+    output.seek(0)
+    return output
+
+
+class Command(BaseCommand):
+    help = (
+        'Compare citizen creation throughput (rows/sec) through '
+        'UserCreateSerializer and the bulk import path'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=20_000,
+                            help='Rows for the unusable-password import')
+        parser.add_argument('--password-rows', type=int, default=500,
+                            help='Rows for the runs that hash passwords')
+        parser.add_argument('--chunk-size', type=int)
+        parser.add_argument('--workers', type=int)
+
+    def handle(self, *args, **options):
+        self.cleanup()
+        password_rows = options['password_rows']
+        try:
+            self.report('serializer (hashed)', password_rows, lambda: [
+                self.create_with_serializer(row)
+                for row in bench_rows(0, password_rows, BENCH_PASSWORD)
+            ])
+            self.cleanup()
+
+            self.report('bulk import (hashed)', password_rows, lambda: (
+                self.bulk_import(
+                    bench_rows(0, password_rows, BENCH_PASSWORD), options)))
+            self.cleanup()
+
+            self.report('bulk import (unusable)', options['rows'], lambda: (
+                self.bulk_import(bench_rows(0, options['rows']), options)))
+        finally:
+            self.cleanup()
+
+    def create_with_serializer(self, row):
+        serializer = UserCreateSerializer(
+            data={**row, 'password_confirm': row['password']})
+        serializer.is_valid(raise_exception=True)
+        serializer.save()
+
+    def bulk_import(self, rows, options):
+        summary = import_citizens(
+            as_csv(rows), 'csv', chunk_size=options['chunk_size'],
+            workers=options['workers'])
+        if summary['error_count']:
+            self.stderr.write(f"errors: {summary['errors'][:3]}")
+
+    def report(self, label, rows, func):
+        start = time.perf_counter()
+        func()
+        elapsed = time.perf_counter() - start
+        self.stdout.write(
+            f'{label:<28} rows={rows:<7} {elapsed:8.2f}s '
+            f'{rows / elapsed:10.1f} rows/sec')
+
+    def cleanup(self):
+        # Deleting through the ORM would send post_delete for every row
+        users = User.objects.filter(email__endswith=f'@{BENCH_DOMAIN}')
+        UserProfile.objects.filter(user__in=users)._raw_delete(users.db)
+        users._raw_delete(users.db)
+        reconcile_user_stats()
@@ -0,0 +1,118 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.db.models import Q
+
+from apps.accounts.benchmark import summarize, timed
+from apps.accounts.search import search_users
+from apps.accounts.stats import reconcile_user_stats
+
+User = get_user_model()
+
+BENCH_DOMAIN = 'search-bench.invalid'
+
+FIRST_NAMES = [
+    'Wanjiku', 'Otieno', 'Akinyi', 'Kamau', 'Njeri', 'Mwangi', 'Achieng',
+    'Kiprop', 'Chebet', 'Mutua', 'Wambui', 'Omondi', 'Nyambura', 'Kiptoo',
+    'Atieno', 'Karanja', 'Jeptoo', 'Ouma', 'Wairimu', 'Muthoni',
+]
+LAST_NAMES = [
+    'Odhiambo', 'Kariuki', 'Kimani', 'Onyango', 'Wekesa', 'Mohamed', 'Korir',
+    'Macharia', 'Ndungu', 'Ochieng', 'Rotich', 'Gitau', 'Barasa', 'Maina',
+    'Njoroge', 'Kiplagat', 'Ngugi', 'Omollo', 'Mutiso', 'Langat',
+]
+
+# Synthetic citizens generated in the database, no Python round trips.
+# Names are picked by hashing the row number so combinations vary.
+INSERT_SQL = """
+INSERT INTO accounts_user (
+    password, is_superuser, username, first_name, last_name, is_staff,
+    is_active, date_joined, email, phone_number, role, is_verified,
+    created_at, updated_at, last_login_method
+)
+SELECT
+    '!', false, 'sb' || n,
+    (%(first)s)[1 + abs(hashint4(n)) %% %(nfirst)s],
+    (%(last)s)[1 + abs(hashint4(n * 7)) %% %(nlast)s] || (n %% 97),
+    false, true, now() - (n || ' seconds')::interval,
+    'citizen' || n || '@' || %(domain)s,
+    CASE WHEN n %% 2 = 0 THEN '+2547' ELSE '07' END
+        || lpad((n %% 100000000)::text, 8, '0'),
+    'citizen', n %% 3 = 0, now(), now(), ''
+FROM generate_series(%(start)s, %(stop)s) AS n
+"""
+
+
+class Command(BaseCommand):
+    help = (
+        'Compare legacy icontains user search with the indexed search '
+        'backend on a synthetic citizen table'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=2_000_000)
+        parser.add_argument('--repeat', type=int, default=20)
+        parser.add_argument(
+            '--keep', action='store_true',
+            help='Keep the synthetic rows for later runs')
+        parser.add_argument(
+            '--terms', nargs='+',
+            default=['wanjiku', 'kariuki4', '0712', '+25470001',
+                     'akinyi odhiambo', 'citizen12345@'])
+
+    def handle(self, *args, **options):
+        self.populate(options['rows'])
+
+        base = User.objects.filter(email__endswith=BENCH_DOMAIN)
+        for term in options['terms']:
+            legacy = base.filter(
+                Q(email__icontains=term) |
+                Q(first_name__icontains=term) |
+                Q(last_name__icontains=term) |
+                Q(phone_number__icontains=term)
+            ).order_by('-date_joined')
+            indexed = search_users(base, term)
+
+            for label, queryset in (('legacy', legacy), ('indexed', indexed)):
+                page = queryset.values_list('id', flat=True)[:20]
+                latencies = [
+                    timed(list, page.all())[0]
+                    for _ in range(options['repeat'])]
+                self.stdout.write(
+                    summarize(f'{label} "{term}"', latencies))
+                self.stdout.write(f'    plan: {self.plan(page)}')
+
+        if not options['keep']:
+            self.stdout.write('Removing synthetic rows...')
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    'DELETE FROM accounts_user WHERE email LIKE %s',
+                    [f'%@{BENCH_DOMAIN}'])
+            reconcile_user_stats()
+
+    def populate(self, rows):
+        existing = User.objects.filter(email__endswith=BENCH_DOMAIN).count()
+        if existing >= rows:
+            return
+        self.stdout.write(f'Generating {rows - existing} synthetic users...')
+        chunk = 200_000
+        with connection.cursor() as cursor:
+            for start in range(existing + 1, rows + 1, chunk):
+                cursor.execute(INSERT_SQL, {
+                    'first': FIRST_NAMES, 'nfirst': len(FIRST_NAMES),
+                    'last': LAST_NAMES, 'nlast': len(LAST_NAMES),
+                    'domain': BENCH_DOMAIN,
+                    'start': start, 'stop': min(start + chunk - 1, rows),
+                })
+            cursor.execute('ANALYZE accounts_user')
+
+    def plan(self, queryset):
+        """
+        Return the scan nodes of the query plan
+        """
+        nodes = []
+        for line in queryset.explain().splitlines():
+            node = line.strip().removeprefix('->').strip()
+            if 'Scan' in node:
+                nodes.append(node.split('  (')[0])
+        return '; '.join(nodes)
@@ -0,0 +1,45 @@
+import json
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from apps.accounts.imports import FORMATS, detect_format, import_citizens
+
+
+class Command(BaseCommand):
+    help = 'Create citizens in bulk from a CSV or NDJSON file ("-" for stdin)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path')
+        parser.add_argument('--format', choices=FORMATS)
+        parser.add_argument('--chunk-size', type=int)
+        parser.add_argument('--workers', type=int)
+        parser.add_argument(
+            '--errors', help='Write per-row errors as NDJSON to this file')
+
+    def handle(self, *args, **options):
+        path = options['path']
+        format = options['format'] or detect_format(path)
+
+        try:
+            lines = (sys.stdin if path == '-' else
+                     open(path, encoding='utf-8-sig', newline=''))
+        except OSError as exc:
+            raise CommandError(exc)
+
+        with lines:
+            summary = import_citizens(
+                lines, format, chunk_size=options['chunk_size'],
+                workers=options['workers'])
+
+        if options['errors']:
+            with open(options['errors'], 'w') as output:
+                for error in summary['errors']:
+                    output.write(json.dumps(error) + '\n')
+        else:
+            for error in summary['errors']:
+                self.stderr.write(f"row {error['row']}: {error['errors']}")
+
+        self.stdout.write(
+            f"{summary['created']} of {summary['rows']} rows imported, "
+            f"{summary['error_count']} errors")
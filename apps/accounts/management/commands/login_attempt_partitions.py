@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand
+
+from apps.accounts.partitions import archive_partitions, ensure_partitions
+
+
+class Command(BaseCommand):
+    help = (
+        'Create upcoming monthly login attempt partitions and archive '
+        'partitions older than the retention period'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--months-ahead', type=int)
+        parser.add_argument('--retention-months', type=int)
+        parser.add_argument('--archive-dir')
+        parser.add_argument(
+            '--no-archive', action='store_true',
+            help='Only create partitions')
+
+    def handle(self, *args, **options):
+        for name in ensure_partitions(months_ahead=options['months_ahead']):
+            self.stdout.write(f'Created {name}')
+
+        if options['no_archive']:
+            return
+        archived = archive_partitions(
+            retention_months=options['retention_months'],
+            archive_dir=options['archive_dir'])
+        for path in archived:
+            self.stdout.write(f'Archived {path}')
@@ -21,6 +21,8 @@ class CustomUserManager(BaseUserManager):
             raise ValueError('Invalid email address')
 
         email = self.normalize_email(email)
+        # username is unique on AbstractUser but unused for login
+        extra_fields.setdefault('username', email)
         user = self.model(email=email, **extra_fields)
         user.set_password(password)
         user.save(using=self._db)
@@ -45,11 +47,24 @@ class CustomUserManager(BaseUserManager):
 
         return self._create_user(email, password, **extra_fields)
 
+    @classmethod
+    def normalize_email(cls, email):
+        """
+        Lowercase the whole address; emails are stored lowercased so that
+        case-insensitive lookups can use the unique index on email
+        """
+        return super().normalize_email(email).lower()
+
     def get_by_natural_key(self, username):
         """
-        Allow authentication with email
+        Allow authentication with email, in any case
         """
-        return self.get(**{f'{self.model.USERNAME_FIELD}__iexact': username})
+        return self.get(**{
+            self.model.USERNAME_FIELD: self.normalize_email(username)})
+
+    async def aget_by_natural_key(self, username):
+        return await self.aget(**{
+            self.model.USERNAME_FIELD: self.normalize_email(username)})
 
     def citizens(self):
         """Get all citizen users"""
@@ -0,0 +1,37 @@
+# Generated by Django 5.2.2 on 2026-10-17 02:58
+
+import django.contrib.postgres.search
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    # Adding stored generated columns rewrites all of accounts_user under
+    # ACCESS EXCLUSIVE, blocking reads and writes until it finishes. The
+    # lock is taken up front with a lock_timeout, so the migration fails
+    # fast rather than waiting behind long transactions with every other
+    # query queued behind it. Run it in a quiet period; the indexes follow
+    # in 0004_user_search.
+
+    dependencies = [
+        ('accounts', '0002_login_attempt_timestamp_default'),
+        ('auth', '0012_alter_user_first_name_max_length'),
+    ]
+
+    operations = [
+        migrations.RunSQL(
+            "SET LOCAL lock_timeout = '10s';"
+            'LOCK TABLE accounts_user IN ACCESS EXCLUSIVE MODE;',
+            migrations.RunSQL.noop,
+        ),
+        migrations.AddField(
+            model_name='user',
+            name='phone_digits',
+            field=models.GeneratedField(db_persist=True, expression=models.Func(models.F('phone_number'), models.Value('\\D'), models.Value(''), models.Value('g'), function='REGEXP_REPLACE'), output_field=models.CharField(max_length=17)),
+        ),
+        migrations.AddField(
+            model_name='user',
+            name='search_vector',
+            field=models.GeneratedField(db_persist=True, expression=django.contrib.postgres.search.SearchVector('first_name', 'last_name', 'email', config='simple'), output_field=django.contrib.postgres.search.SearchVectorField()),
+        ),
+    ]
@@ -0,0 +1,42 @@
+# Generated by Django 5.2.2 on 2026-10-17 02:58
+
+import django.contrib.postgres.indexes
+import django.db.models.functions.text
+from django.contrib.postgres.operations import AddIndexConcurrently, TrigramExtension
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    # Indexes are built concurrently so the user table stays writable.
+    # Adding the columns they index rewrites the table, which is done
+    # separately, under an explicit lock, in 0003_user_search_columns.
+    atomic = False
+
+    dependencies = [
+        ('accounts', '0003_user_search_columns'),
+    ]
+
+    operations = [
+        TrigramExtension(),
+        AddIndexConcurrently(
+            model_name='user',
+            index=django.contrib.postgres.indexes.GinIndex(django.contrib.postgres.indexes.OpClass(django.db.models.functions.text.Upper('email'), name='gin_trgm_ops'), name='accounts_user_email_trgm'),
+        ),
+        AddIndexConcurrently(
+            model_name='user',
+            index=django.contrib.postgres.indexes.GinIndex(django.contrib.postgres.indexes.OpClass(django.db.models.functions.text.Upper('first_name'), name='gin_trgm_ops'), name='accounts_user_first_name_trgm'),
+        ),
+        AddIndexConcurrently(
+            model_name='user',
+            index=django.contrib.postgres.indexes.GinIndex(django.contrib.postgres.indexes.OpClass(django.db.models.functions.text.Upper('last_name'), name='gin_trgm_ops'), name='accounts_user_last_name_trgm'),
+        ),
+        AddIndexConcurrently(
+            model_name='user',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['search_vector'], name='accounts_user_search_vector'),
+        ),
+        AddIndexConcurrently(
+            model_name='user',
+            index=models.Index(fields=['phone_digits'], name='accounts_user_phone_digits', opclasses=['varchar_pattern_ops']),
+        ),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 5.2.2 on 2026-10-17 03:02
+
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    atomic = False
+
+    dependencies = [
+        ('accounts', '0004_user_search'),
+        ('auth', '0012_alter_user_first_name_max_length'),
+    ]
+
+    operations = [
+        AddIndexConcurrently(
+            model_name='loginattempt',
+            index=models.Index(fields=['timestamp', 'id'], name='accounts_login_ts_id'),
+        ),
+        AddIndexConcurrently(
+            model_name='user',
+            index=models.Index(fields=['date_joined', 'id'], name='accounts_user_joined_id'),
+        ),
+    ]
@@ -0,0 +1,186 @@
+"""
+Convert accounts_login_attempt into a table range-partitioned by month on
+"timestamp", without copying rows.
+
+The existing table is attached as the first partition, covering everything
+before the first month boundary that is at least a day away and after its
+latest row. Its indexes and foreign key are matched to identically defined
+ones on the new parent, so Postgres adopts them instead of rebuilding. A
+partitioned table's primary key must include the partition key, so a unique
+(id, timestamp) index is built concurrently first and becomes the original
+table's primary key, which the new one adopts too. Monthly partitions for
+the coming months and a default partition are then created.
+
+ATTACH skips its validation scan when a valid CHECK constraint already
+proves every row is in range. The constraint is added NOT VALID (no scan)
+and validated in its own transaction, under SHARE UPDATE EXCLUSIVE, so
+logins keep writing while the table is scanned. Only the swap that follows
+(rename, create the parent, attach) holds ACCESS EXCLUSIVE, and it reads
+no rows.
+
+The reverse detaches the original table, moves the rows written to the
+newer partitions back into it, and restores its name, indexes, primary
+key and identity column. Building the primary key scans the whole table.
+"""
+
+from datetime import datetime, timedelta, timezone
+
+from django.db import migrations, transaction
+
+TABLE = 'accounts_login_attempt'
+LEGACY = 'accounts_login_attempt_legacy'
+SEQUENCE = 'accounts_login_attempt_id_seq'
+MONTHS_AHEAD = 3
+
+
+def add_months(value, months):
+    month = value.month - 1 + months
+    return datetime(value.year + month // 12, month % 12 + 1, 1,
+                    tzinfo=timezone.utc)
+
+
+def partition_login_attempt(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+
+    # The original table keeps every stored row and at least a day of new
+    # ones, so inserts made before the swap never break the bound
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute(f'SELECT MAX("timestamp") FROM "{TABLE}"')
+        latest = cursor.fetchone()[0]
+    start = datetime.now(timezone.utc) + timedelta(days=1)
+    bound = add_months(max(start, latest) if latest else start, 1)
+    execute = schema_editor.execute
+
+    # Each step before the swap is its own transaction, and may be rerun
+    # after a failure
+    execute(f'ALTER TABLE "{TABLE}" DROP CONSTRAINT IF EXISTS "{TABLE}_bound"')
+    execute(
+        f'ALTER TABLE "{TABLE}" ADD CONSTRAINT "{TABLE}_bound" '
+        f'CHECK ("timestamp" IS NOT NULL AND "timestamp" < %s) NOT VALID',
+        [bound])
+    execute(f'ALTER TABLE "{TABLE}" VALIDATE CONSTRAINT "{TABLE}_bound"')
+    # Becomes the original table's primary key (see above). A failed
+    # concurrent build leaves an invalid index, so start afresh.
+    execute(f'DROP INDEX CONCURRENTLY IF EXISTS "{TABLE}_id_ts"')
+    execute(
+        f'CREATE UNIQUE INDEX CONCURRENTLY "{TABLE}_id_ts" '
+        f'ON "{TABLE}" (id, "timestamp")')
+
+    with transaction.atomic(using=schema_editor.connection.alias):
+        with schema_editor.connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT indexname, indexdef FROM pg_indexes "
+                "WHERE tablename = %s AND indexname NOT IN (%s, %s)",
+                [TABLE, f'{TABLE}_pkey', f'{TABLE}_id_ts'])
+            indexes = cursor.fetchall()
+            cursor.execute(
+                "SELECT conname, pg_get_constraintdef(oid) FROM pg_constraint "
+                "WHERE conrelid = %s::regclass AND contype = 'f'", [TABLE])
+            foreign_keys = cursor.fetchall()
+
+        execute(f'ALTER TABLE "{TABLE}" RENAME TO "{LEGACY}"')
+        execute(f'ALTER TABLE "{LEGACY}" DROP CONSTRAINT "{TABLE}_pkey"')
+        execute(
+            f'ALTER TABLE "{LEGACY}" ADD CONSTRAINT "{LEGACY}_pkey" '
+            f'PRIMARY KEY USING INDEX "{TABLE}_id_ts"')
+        execute(
+            f'ALTER TABLE "{LEGACY}" ALTER COLUMN id DROP IDENTITY IF EXISTS')
+        for name, _ in indexes:
+            execute(f'ALTER INDEX "{name}" RENAME TO "{name[:56]}_legacy"')
+        for name, _ in foreign_keys:
+            execute(
+                f'ALTER TABLE "{LEGACY}" RENAME CONSTRAINT "{name}" '
+                f'TO "{name[:56]}_legacy"')
+
+        execute(
+            f'CREATE TABLE "{TABLE}" (LIKE "{LEGACY}" INCLUDING DEFAULTS '
+            f'INCLUDING CONSTRAINTS) PARTITION BY RANGE ("timestamp")')
+        execute(f'ALTER TABLE "{TABLE}" DROP CONSTRAINT "{TABLE}_bound"')
+        execute(f'CREATE SEQUENCE "{SEQUENCE}" OWNED BY "{TABLE}".id')
+        execute(
+            f'SELECT setval(%s, COALESCE(MAX(id), 0) + 1, false) '
+            f'FROM "{LEGACY}"', [SEQUENCE])
+        execute(
+            f'ALTER TABLE "{TABLE}" ALTER COLUMN id '
+            f"SET DEFAULT nextval('{SEQUENCE}')")
+
+        execute(
+            f'ALTER TABLE "{TABLE}" ATTACH PARTITION "{LEGACY}" '
+            f'FOR VALUES FROM (MINVALUE) TO (%s)', [bound])
+        execute(f'ALTER TABLE "{LEGACY}" DROP CONSTRAINT "{TABLE}_bound"')
+
+        execute(f'ALTER TABLE "{TABLE}" ADD PRIMARY KEY (id, "timestamp")')
+        # Captured before the rename, so these now target the new parent
+        for _, definition in indexes:
+            execute(definition)
+        for name, definition in foreign_keys:
+            execute(
+                f'ALTER TABLE "{TABLE}" ADD CONSTRAINT "{name}" {definition}')
+
+        for offset in range(MONTHS_AHEAD):
+            start = add_months(bound, offset)
+            execute(
+                f'CREATE TABLE "{TABLE}_p{start:%Y_%m}" PARTITION OF "{TABLE}" '
+                f'FOR VALUES FROM (%s) TO (%s)', [start, add_months(start, 1)])
+        execute(
+            f'CREATE TABLE "{TABLE}_default" PARTITION OF "{TABLE}" DEFAULT')
+
+
+def unpartition_login_attempt(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+
+    execute = schema_editor.execute
+    with transaction.atomic(using=schema_editor.connection.alias):
+        with schema_editor.connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT indexname FROM pg_indexes "
+                "WHERE tablename = %s AND indexname <> %s",
+                [TABLE, f'{TABLE}_pkey'])
+            indexes = [name for name, in cursor.fetchall()]
+            cursor.execute(
+                "SELECT conname FROM pg_constraint "
+                "WHERE conrelid = %s::regclass AND contype = 'f'", [TABLE])
+            foreign_keys = [name for name, in cursor.fetchall()]
+
+        execute(f'ALTER TABLE "{TABLE}" DETACH PARTITION "{LEGACY}"')
+        execute(f'INSERT INTO "{LEGACY}" SELECT * FROM "{TABLE}"')
+        # Check the deferred foreign key now; ALTER TABLE refuses to run
+        # with its trigger events pending
+        execute('SET CONSTRAINTS ALL IMMEDIATE')
+        # Drops the other partitions and the sequence with it
+        execute(f'DROP TABLE "{TABLE}"')
+
+        execute(f'ALTER TABLE "{LEGACY}" RENAME TO "{TABLE}"')
+        for name in indexes:
+            execute(f'ALTER INDEX "{name[:56]}_legacy" RENAME TO "{name}"')
+        for name in foreign_keys:
+            execute(
+                f'ALTER TABLE "{TABLE}" RENAME CONSTRAINT '
+                f'"{name[:56]}_legacy" TO "{name}"')
+        execute(f'ALTER TABLE "{TABLE}" DROP CONSTRAINT "{LEGACY}_pkey"')
+        execute(f'ALTER TABLE "{TABLE}" ADD PRIMARY KEY (id)')
+        execute(
+            f'ALTER TABLE "{TABLE}" ALTER COLUMN id '
+            f'ADD GENERATED BY DEFAULT AS IDENTITY')
+        execute(
+            f"SELECT setval(pg_get_serial_sequence(%s, 'id'), "
+            f'COALESCE(MAX(id), 0) + 1, false) FROM "{TABLE}"', [TABLE])
+
+
+class Migration(migrations.Migration):
+
+    # Validating the bound and swapping the tables are separate
+    # transactions (see the module docstring)
+    atomic = False
+
+    dependencies = [
+        ('accounts', '0005_keyset_pagination_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(
+            partition_login_attempt, unpartition_login_attempt,
+            elidable=False),
+    ]
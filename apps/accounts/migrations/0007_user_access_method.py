@@ -0,0 +1,18 @@
+# Generated by Django 5.2.2 on 2026-10-17 03:07
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0006_partition_login_attempt'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='user',
+            name='access_method',
+            field=models.CharField(choices=[('web', 'Web'), ('ussd', 'USSD'), ('sms', 'SMS')], default='web', max_length=10),
+        ),
+    ]
@@ -0,0 +1,44 @@
+"""
+Store emails lowercased, so that case-insensitive email lookups are
+equality lookups on the existing unique index instead of sequential
+scans of UPPER(email).
+
+Addresses differing only in case belong to separate accounts that would
+collide once lowercased; they have to be merged by hand first, so the
+migration stops and lists them.
+"""
+
+from django.db import migrations, models
+from django.db.models import Count
+from django.db.models.functions import Lower
+
+
+def lowercase_emails(apps, schema_editor):
+    User = apps.get_model('accounts', 'User')
+    clashes = list(
+        User.objects.values(address=Lower('email'))
+        .annotate(accounts=Count('id')).filter(accounts__gt=1)
+        .values_list('address', flat=True)[:20])
+    if clashes:
+        raise RuntimeError(
+            'Accounts whose emails differ only in case must be merged '
+            'before migrating: ' + ', '.join(clashes))
+    User.objects.exclude(email=Lower('email')).update(email=Lower('email'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0008_bulk_user_job'),
+    ]
+
+    operations = [
+        migrations.RunPython(
+            lowercase_emails, migrations.RunPython.noop, elidable=False),
+        migrations.AddConstraint(
+            model_name='user',
+            constraint=models.CheckConstraint(
+                condition=models.Q(email=Lower('email')),
+                name='accounts_user_email_lowercase'),
+        ),
+    ]
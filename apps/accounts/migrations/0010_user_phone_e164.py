@@ -0,0 +1,32 @@
+"""
+Add the canonical E.164 phone column with its unique index, and drop the
+plain phone_number index, which duplicated the unique constraint's.
+
+The column starts out NULL; existing rows are filled in by the
+backfill_phone_e164 command (see apps.accounts.phones).
+"""
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0009_user_email_lowercase'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='user',
+            name='accounts_us_phone_n_613c4a_idx',
+        ),
+        migrations.AddField(
+            model_name='user',
+            name='phone_e164',
+            field=models.CharField(blank=True, editable=False, max_length=16, null=True),
+        ),
+        migrations.AddConstraint(
+            model_name='user',
+            constraint=models.UniqueConstraint(fields=('phone_e164',), name='accounts_user_phone_e164_key'),
+        ),
+    ]
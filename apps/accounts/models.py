@@ -1,7 +1,14 @@
+import uuid
+
 from django.contrib.auth.models import AbstractUser
+from django.contrib.postgres.indexes import GinIndex, OpClass
+from django.contrib.postgres.search import SearchVector, SearchVectorField
 from django.db import models
+from django.db.models.functions import Lower, Upper
 from django.core.validators import RegexValidator
+from django.utils import timezone
 from .managers import CustomUserManager
+from .phones import to_e164
 
 
 class User(AbstractUser):
@@ -14,6 +21,11 @@ class User(AbstractUser):
         FUND_ADMIN = 'fund_admin', 'Fund Admin'
         SUPERADMIN = 'superadmin', 'Super Admin'
 
+    class AccessMethod(models.TextChoices):
+        WEB = 'web', 'Web'
+        USSD = 'ussd', 'USSD'
+        SMS = 'sms', 'SMS'
+
     # Override email to be unique and required
     email = models.EmailField(unique=True, blank=False, null=False)
 
@@ -28,6 +40,9 @@ class User(AbstractUser):
         unique=True,
         help_text="Required for USSD/SMS access"
     )
+    # phone_number in E.164, set on save (see apps.accounts.phones)
+    phone_e164 = models.CharField(
+        max_length=16, null=True, blank=True, editable=False)
 
     # Role and access method
     role = models.CharField(
@@ -36,6 +51,11 @@ class User(AbstractUser):
         default=UserRole.CITIZEN,
         db_index=True
     )
+    access_method = models.CharField(
+        max_length=10,
+        choices=AccessMethod.choices,
+        default=AccessMethod.WEB
+    )
 
     # Additional fields
     is_verified = models.BooleanField(default=False)
@@ -43,6 +63,21 @@ class User(AbstractUser):
     updated_at = models.DateTimeField(auto_now=True)
     last_login_method = models.CharField(max_length=20, blank=True)
 
+    # Search columns maintained by Postgres (see apps.accounts.search)
+    phone_digits = models.GeneratedField(
+        expression=models.Func(
+            models.F('phone_number'), models.Value(r'\D'), models.Value(''),
+            models.Value('g'), function='REGEXP_REPLACE'),
+        output_field=models.CharField(max_length=17),
+        db_persist=True,
+    )
+    search_vector = models.GeneratedField(
+        expression=SearchVector(
+            'first_name', 'last_name', 'email', config='simple'),
+        output_field=SearchVectorField(),
+        db_persist=True,
+    )
+
     # User manager
     objects = CustomUserManager()
 
@@ -56,12 +91,60 @@ class User(AbstractUser):
         verbose_name_plural = 'Users'
         indexes = [
             models.Index(fields=['role', 'is_active']),
-            models.Index(fields=['phone_number']),
+            # Keyset pagination of the user list
+            models.Index(fields=['date_joined', 'id'],
+                         name='accounts_user_joined_id'),
+            # Trigram indexes serve icontains (UPPER(col) LIKE '%term%')
+            GinIndex(OpClass(Upper('email'), name='gin_trgm_ops'),
+                     name='accounts_user_email_trgm'),
+            GinIndex(OpClass(Upper('first_name'), name='gin_trgm_ops'),
+                     name='accounts_user_first_name_trgm'),
+            GinIndex(OpClass(Upper('last_name'), name='gin_trgm_ops'),
+                     name='accounts_user_last_name_trgm'),
+            GinIndex(fields=['search_vector'],
+                     name='accounts_user_search_vector'),
+            models.Index(fields=['phone_digits'],
+                         opclasses=['varchar_pattern_ops'],
+                         name='accounts_user_phone_digits'),
+        ]
+        constraints = [
+            # Emails are stored lowercased (see
+            # CustomUserManager.normalize_email), so the unique index on
+            # email serves case-insensitive lookups
+            models.CheckConstraint(
+                condition=models.Q(email=Lower('email')),
+                name='accounts_user_email_lowercase'),
+            # A constraint rather than unique=True, which would add a
+            # second (LIKE) index that gateway lookups never use
+            models.UniqueConstraint(fields=['phone_e164'],
+                                    name='accounts_user_phone_e164_key'),
         ]
 
     def __str__(self):
         return f"{self.email} ({self.get_role_display()})"
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        """
+        Remember the values loaded from the database so that signal
+        handlers can tell what a save changed
+        """
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_values = dict(zip(field_names, values))
+        return instance
+
+    def save(self, *args, **kwargs):
+        """
+        Keep phone_e164 in step with phone_number
+        """
+        # A deferred phone_number is not being written
+        if 'phone_number' in self.__dict__:
+            self.phone_e164 = to_e164(self.phone_number)
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and 'phone_number' in update_fields:
+            kwargs['update_fields'] = {*update_fields, 'phone_e164'}
+        super().save(*args, **kwargs)
+
     @property
     def full_name(self):
         """
@@ -118,6 +201,58 @@ class UserProfile(models.Model):
     def __str__(self):
         return f"{self.user.email} Profile"
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        """
+        Remember the values loaded from the database so that save() can
+        write only what changed
+        """
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_values = dict(zip(field_names, values))
+        return instance
+
+    def changed_fields(self):
+        """
+        Return the names of the fields changed since the profile was
+        loaded or saved, or None if its stored values are not known
+        """
+        loaded = getattr(self, '_loaded_values', None)
+        if loaded is None:
+            return None
+        changed = []
+        for field in self._meta.concrete_fields:
+            if field.attname not in loaded:
+                # Deferred when loaded; changed if it has been set since
+                if field.attname in self.__dict__:
+                    changed.append(field.name)
+            elif (field.get_prep_value(getattr(self, field.attname)) !=
+                    field.get_prep_value(loaded[field.attname])):
+                changed.append(field.name)
+        return changed
+
+    def save(self, *args, **kwargs):
+        """
+        Write only the changed fields of a loaded profile, and nothing
+        when none changed
+        """
+        update_fields = kwargs.get('update_fields')
+        if update_fields is None and not self._state.adding:
+            changed = self.changed_fields()
+            if changed is not None:
+                if not changed:
+                    return
+                update_fields = kwargs['update_fields'] = [
+                    *changed, 'updated_at']
+        super().save(*args, **kwargs)
+
+        saved = [field for field in self._meta.concrete_fields
+                 if field.attname in self.__dict__ and (
+                     update_fields is None or field.name in update_fields)]
+        self._loaded_values = {
+            **getattr(self, '_loaded_values', {}),
+            **{field.attname: getattr(self, field.attname) for field in saved},
+        }
+
 
 class LoginAttempt(models.Model):
     """
@@ -134,13 +269,101 @@ class LoginAttempt(models.Model):
     ip_address = models.GenericIPAddressField()
     method = models.CharField(max_length=10, choices=LoginMethod.choices)
     successful = models.BooleanField()
-    timestamp = models.DateTimeField(auto_now_add=True)
+    # Set when the attempt happens, not when a buffered audit sink flushes it
+    timestamp = models.DateTimeField(default=timezone.now, editable=False)
     user_agent = models.TextField(blank=True)
 
     class Meta:
         db_table = 'accounts_login_attempt'
         ordering = ['-timestamp']
+        indexes = [
+            # Keyset pagination and time-range filters
+            models.Index(fields=['timestamp', 'id'],
+                         name='accounts_login_ts_id'),
+        ]
 
     def __str__(self):
         status = "Successful" if self.successful else "Failed"
         return f"{self.email} - {status} ({self.method})"
+
+
+class BulkUserJob(models.Model):
+    """
+    Background bulk action over a set of users (see apps.accounts.jobs)
+    """
+    class Action(models.TextChoices):
+        ACTIVATE = 'activate', 'Activate'
+        DEACTIVATE = 'deactivate', 'Deactivate'
+        VERIFY = 'verify', 'Verify'
+        DELETE = 'delete', 'Delete'
+
+    class Status(models.TextChoices):
+        PENDING = 'pending', 'Pending'
+        RUNNING = 'running', 'Running'
+        COMPLETED = 'completed', 'Completed'
+        FAILED = 'failed', 'Failed'
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    action = models.CharField(max_length=20, choices=Action.choices)
+    user_ids = models.JSONField(default=list)
+    status = models.CharField(
+        max_length=20, choices=Status.choices, default=Status.PENDING)
+    total = models.PositiveIntegerField(default=0)
+    processed = models.PositiveIntegerField(default=0)
+    affected = models.PositiveIntegerField(default=0)
+    # One entry per failed chunk: {'chunk', 'user_ids', 'error'}
+    errors = models.JSONField(default=list, blank=True)
+    created_by = models.ForeignKey(
+        User, on_delete=models.SET_NULL, null=True, blank=True,
+        related_name='+')
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        db_table = 'accounts_bulk_user_job'
+        ordering = ['-created_at']
+
+    def __str__(self):
+        return f"{self.get_action_display()} {self.total} users ({self.status})"
+
+
+class CitizenImportJob(models.Model):
+    """
+    Background citizen import of an uploaded file (see
+    apps.accounts.imports)
+    """
+    class Format(models.TextChoices):
+        CSV = 'csv', 'CSV'
+        NDJSON = 'ndjson', 'NDJSON'
+
+    class Status(models.TextChoices):
+        PENDING = 'pending', 'Pending'
+        RUNNING = 'running', 'Running'
+        COMPLETED = 'completed', 'Completed'
+        FAILED = 'failed', 'Failed'
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    # Deleted once the import has run
+    file = models.FileField(upload_to='imports/citizens/', blank=True)
+    format = models.CharField(max_length=10, choices=Format.choices)
+    status = models.CharField(
+        max_length=20, choices=Status.choices, default=Status.PENDING)
+    rows = models.PositiveIntegerField(default=0)
+    created = models.PositiveIntegerField(default=0)
+    error_count = models.PositiveIntegerField(default=0)
+    # The first MAX_ERRORS row errors: {'row', 'errors'}
+    errors = models.JSONField(default=list, blank=True)
+    created_by = models.ForeignKey(
+        User, on_delete=models.SET_NULL, null=True, blank=True,
+        related_name='+')
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        db_table = 'accounts_citizen_import_job'
+        ordering = ['-created_at']
+
+    def __str__(self):
+        return f"Import of {self.rows} rows ({self.status})"
@@ -0,0 +1,161 @@
+"""
+Keyset (cursor) pagination.
+
+Pages are addressed by an opaque cursor holding the ``(key, id)`` position of
+the last row served, so fetching any page is an index range scan of
+``page_size`` rows with no COUNT(*) and no OFFSET. Passing ``?page=N`` opts
+back into the legacy page-number format.
+"""
+
+import json
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from datetime import datetime
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import CursorPagination, PageNumberPagination
+from rest_framework.utils.urls import replace_query_param
+
+
+class LegacyPageNumberPagination(PageNumberPagination):
+    page_size_query_param = 'page_size'
+    max_page_size = getattr(settings, 'MAX_PAGE_SIZE', 100)
+
+
+class KeysetPagination(CursorPagination):
+    """
+    Cursor pagination over a two column ordering such as
+    ``('-timestamp', '-id')``; both columns must sort the same direction
+    and the second must be unique.
+    """
+    ordering = ('-id',)
+    page_size_query_param = 'page_size'
+    max_page_size = getattr(settings, 'MAX_PAGE_SIZE', 100)
+    legacy_query_param = 'page'
+    legacy_pagination_class = LegacyPageNumberPagination
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.base_url = request.build_absolute_uri()
+        self.model = queryset.model
+        self.legacy = None
+
+        # Ranked or otherwise custom-ordered querysets cannot be keyset
+        # paginated on this ordering, so they use page numbers as well
+        if (self.legacy_query_param in request.query_params or
+                tuple(queryset.query.order_by) != tuple(self.ordering)):
+            self.legacy = self.legacy_pagination_class()
+            return self.legacy.paginate_queryset(queryset, request, view)
+
+        self.page_size = self.get_page_size(request)
+        if not self.page_size:
+            return None
+
+        cursor = self.decode_cursor(request)
+        reverse = bool(cursor and cursor['reverse'])
+        if cursor:
+            queryset = queryset.filter(
+                self.position_filter(cursor['position'], reverse))
+        if reverse:
+            queryset = queryset.order_by(*self.flipped_ordering())
+
+        rows = list(queryset[:self.page_size + 1])
+        has_more = len(rows) > self.page_size
+        self.page = rows[:self.page_size]
+        if reverse:
+            self.page.reverse()
+
+        self.has_next = has_more if not reverse else True
+        self.has_previous = cursor is not None if not reverse else has_more
+        return self.page
+
+    def get_paginated_response(self, data):
+        if self.legacy is not None:
+            return self.legacy.get_paginated_response(data)
+        return super().get_paginated_response(data)
+
+    def get_next_link(self):
+        if not self.has_next or not self.page:
+            return None
+        return self.encode_cursor(self.get_position(self.page[-1]), False)
+
+    def get_previous_link(self):
+        if not self.has_previous or not self.page:
+            return None
+        return self.encode_cursor(self.get_position(self.page[0]), True)
+
+    def get_fields(self):
+        return [field.lstrip('-') for field in self.ordering]
+
+    def flipped_ordering(self):
+        return [
+            field[1:] if field.startswith('-') else f'-{field}'
+            for field in self.ordering
+        ]
+
+    def get_position(self, instance):
+        return [getattr(instance, field) for field in self.get_fields()]
+
+    def position_filter(self, position, reverse):
+        """
+        Rows strictly after position in the (possibly reversed) ordering.
+
+        The redundant ``key <= value`` bound gives Postgres an index
+        condition to start the scan at, instead of filtering from the top.
+        """
+        key, tiebreak = self.get_fields()
+        key_value, tiebreak_value = position
+        descending = self.ordering[0].startswith('-')
+        op = 'lt' if descending != reverse else 'gt'
+        return Q(**{f'{key}__{op}e': key_value}) & (
+            Q(**{f'{key}__{op}': key_value}) |
+            Q(**{f'{tiebreak}__{op}': tiebreak_value})
+        )
+
+    def encode_cursor(self, position, reverse):
+        payload = {
+            'p': [
+                value.isoformat() if isinstance(value, datetime) else value
+                for value in position
+            ],
+            'r': int(reverse),
+        }
+        encoded = urlsafe_b64encode(
+            json.dumps(payload, separators=(',', ':')).encode()).decode()
+        return replace_query_param(
+            self.base_url, self.cursor_query_param, encoded)
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if encoded is None:
+            return None
+        try:
+            payload = json.loads(urlsafe_b64decode(encoded.encode()).decode())
+            position = payload['p']
+            reverse = bool(payload['r'])
+            if len(position) != 2:
+                raise ValueError
+            # Cursors come from the client, so each value must convert to
+            # its column's type before it reaches a filter
+            position = [
+                self.clean_position_value(field, value)
+                for field, value in zip(self.get_fields(), position)
+            ]
+        except (TypeError, ValueError, KeyError, ValidationError):
+            raise NotFound(self.invalid_cursor_message)
+        return {'position': position, 'reverse': reverse}
+
+    def clean_position_value(self, field, value):
+        if not isinstance(value, (str, int)) or isinstance(value, bool):
+            raise ValueError(value)
+        return self.model._meta.get_field(field).to_python(value)
+
+
+class UserPagination(KeysetPagination):
+    ordering = ('-date_joined', '-id')
+
+
+class LoginAttemptPagination(KeysetPagination):
+    ordering = ('-timestamp', '-id')
@@ -0,0 +1,160 @@
+"""
+Monthly range partitions for ``accounts_login_attempt``.
+
+The table is partitioned by ``timestamp`` (see migration 0006). Celery beat
+runs ``maintain_login_attempt_partitions`` daily to create partitions ahead
+of time and to archive partitions older than the retention period: each one
+is copied to a gzipped CSV file and then detached and dropped, which
+replaces row-by-row DELETEs.
+"""
+
+import gzip
+import logging
+import os
+import re
+from datetime import datetime, timezone
+
+from django.conf import settings
+from django.db import connection, transaction
+
+logger = logging.getLogger('smartfunds')
+
+DEFAULTS = {
+    'PARTITIONS_AHEAD': 3,
+    'RETENTION_MONTHS': 12,
+    'ARCHIVE_DIR': 'archives/login_attempts',
+}
+
+TABLE = 'accounts_login_attempt'
+DEFAULT_PARTITION = f'{TABLE}_default'
+# The pre-partitioning table, attached FROM (MINVALUE) by migration 0006
+LEGACY_PARTITION = f'{TABLE}_legacy'
+
+UPPER_BOUND = re.compile(r"TO \('([^']+)'\)")
+
+
+def get_partition_setting(name):
+    return getattr(settings, 'LOGIN_ATTEMPT_PARTITIONS', {}).get(
+        name, DEFAULTS[name])
+
+
+def month_start(value):
+    return datetime(value.year, value.month, 1, tzinfo=timezone.utc)
+
+
+def add_months(value, months):
+    month = value.month - 1 + months
+    return datetime(value.year + month // 12, month % 12 + 1, 1,
+                    tzinfo=timezone.utc)
+
+
+def partition_name(start):
+    return f'{TABLE}_p{start:%Y_%m}'
+
+
+def create_partition(start, cursor):
+    """
+    Create the partition for the month beginning at start, if missing
+    """
+    name = partition_name(start)
+    cursor.execute(
+        f'CREATE TABLE IF NOT EXISTS "{name}" PARTITION OF "{TABLE}" '
+        f'FOR VALUES FROM (%s) TO (%s)',
+        [start, add_months(start, 1)])
+    return name
+
+
+def list_partitions(cursor):
+    """
+    Return (name, upper bound or None) for every attached partition
+    """
+    cursor.execute("""
+        SELECT c.relname, pg_get_expr(c.relpartbound, c.oid)
+        FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = %s::regclass
+        ORDER BY c.relname
+    """, [TABLE])
+    partitions = []
+    for name, bound in cursor.fetchall():
+        match = UPPER_BOUND.search(bound)
+        upper = datetime.fromisoformat(match.group(1)) if match else None
+        partitions.append((name, upper))
+    return partitions
+
+
+def ensure_partitions(now=None, months_ahead=None):
+    """
+    Create partitions from the current month up to months_ahead
+    """
+    if months_ahead is None:
+        months_ahead = get_partition_setting('PARTITIONS_AHEAD')
+    current = month_start(now or datetime.now(timezone.utc))
+    with connection.cursor() as cursor:
+        partitions = dict(list_partitions(cursor))
+        covered = set(partitions.values())
+        # The pre-partitioning table covers everything before its bound
+        legacy_bound = partitions.get(LEGACY_PARTITION)
+        created = []
+        for offset in range(months_ahead + 1):
+            start = add_months(current, offset)
+            if add_months(start, 1) in covered or (
+                    legacy_bound and start < legacy_bound):
+                continue
+            created.append(create_partition(start, cursor))
+
+        cursor.execute(f'SELECT count(*) FROM "{DEFAULT_PARTITION}"')
+        stray = cursor.fetchone()[0]
+    if stray:
+        logger.warning(
+            '%s login attempts fell into %s; create the missing monthly '
+            'partitions by hand', stray, DEFAULT_PARTITION)
+    return created
+
+
+def copy_to_file(cursor, table, path):
+    """
+    Stream a table to a gzipped CSV file with COPY
+    """
+    sql = f'COPY (SELECT * FROM "{table}" ORDER BY "timestamp", id) ' \
+          f'TO STDOUT WITH (FORMAT csv, HEADER)'
+    with gzip.open(path, 'wb') as archive:
+        if hasattr(cursor, 'copy_expert'):  # psycopg2
+            cursor.copy_expert(sql, archive)
+        else:  # psycopg 3
+            with cursor.copy(sql) as copy:
+                for chunk in copy:
+                    archive.write(chunk)
+        archive.flush()
+        os.fsync(archive.fileobj.fileno())
+
+
+def archive_partitions(now=None, retention_months=None, archive_dir=None):
+    """
+    Archive and drop partitions whose rows are all older than the
+    retention period. Returns the archive file paths written.
+    """
+    if retention_months is None:
+        retention_months = get_partition_setting('RETENTION_MONTHS')
+    archive_dir = archive_dir or get_partition_setting('ARCHIVE_DIR')
+    cutoff = add_months(
+        month_start(now or datetime.now(timezone.utc)), -retention_months)
+    os.makedirs(archive_dir, exist_ok=True)
+
+    with connection.cursor() as cursor:
+        expired = [
+            name for name, upper in list_partitions(cursor)
+            if upper is not None and upper <= cutoff
+        ]
+
+    archived = []
+    for name in expired:
+        path = os.path.join(archive_dir, f'{name}.csv.gz')
+        with connection.cursor() as cursor:
+            copy_to_file(cursor, name, path)
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute(f'ALTER TABLE "{TABLE}" DETACH PARTITION "{name}"')
+            cursor.execute(f'DROP TABLE "{name}"')
+        logger.info('Archived login attempt partition %s to %s', name, path)
+        archived.append(path)
+    return archived
@@ -0,0 +1,234 @@
+"""
+Canonical phone numbers.
+
+``User.phone_number`` keeps whatever the user typed (``+254712345678``,
+``254712345678``, ``0712345678``, ...). ``User.phone_e164`` holds the same
+number in E.164 form (``+254712345678``). It is set by ``User.save`` and
+is unique, so two spellings of one number cannot both be registered.
+Rows written before the column existed are filled in, a chunk per
+transaction, by the ``backfill_phone_e164`` command.
+
+USSD and SMS gateways identify callers by MSISDN. ``resolve_user_id`` maps
+one to a user id with a single indexed lookup, caching hits for
+``CACHE_TIMEOUT`` and misses for ``NEGATIVE_TIMEOUT`` seconds. Entries for
+a user's old and new numbers are dropped when the user is saved or
+deleted (see ``apps.accounts.signals``).
+"""
+
+import logging
+import re
+from functools import partial
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import IntegrityError, transaction
+
+from smartfunds.transactions import READ_COMMITTED, run_in_transaction
+
+logger = logging.getLogger('smartfunds')
+
+DEFAULTS = {
+    'DEFAULT_COUNTRY_CODE': '254',
+    'NATIONAL_NUMBER_LENGTH': 9,  # digits after the country code
+    'CACHE_ALIAS': 'default',
+    'CACHE_TIMEOUT': 3600,  # seconds
+    'NEGATIVE_TIMEOUT': 60,  # seconds
+    'KEY_PREFIX': 'accounts:phone',
+    'BACKFILL_CHUNK_SIZE': 1000,  # users per transaction
+}
+
+# Cached for numbers that belong to no user
+NO_USER = 0
+
+# E.164 allows at most 15 digits; shorter than 8 is no real number
+E164_RE = re.compile(r'^\+[1-9]\d{7,14}$')
+
+
+def get_phone_setting(name):
+    return getattr(settings, 'PHONE_NUMBERS', {}).get(name, DEFAULTS[name])
+
+
+def to_e164(value):
+    """
+    Return a phone number in E.164 form, or None if it cannot be one.
+    National numbers get the default country code.
+    """
+    if not value:
+        return None
+    value = value.strip()
+    digits = re.sub(r'\D', '', value)
+    country_code = get_phone_setting('DEFAULT_COUNTRY_CODE')
+    national_length = get_phone_setting('NATIONAL_NUMBER_LENGTH')
+
+    if value.startswith('+'):
+        number = digits
+    elif digits.startswith('00'):
+        number = digits[2:]
+    elif digits.startswith('0') and len(digits) == national_length + 1:
+        number = country_code + digits[1:]
+    elif len(digits) == national_length:
+        number = country_code + digits
+    else:
+        # Already carries a country code, e.g. 254712345678
+        number = digits
+
+    e164 = f'+{number}'
+    return e164 if E164_RE.match(e164) else None
+
+
+def phone_cache_key(e164):
+    return f"{get_phone_setting('KEY_PREFIX')}:{e164}"
+
+
+def get_phone_cache():
+    return caches[get_phone_setting('CACHE_ALIAS')]
+
+
+def lookup_user_id(e164):
+    from .models import User
+    return User.objects.filter(phone_e164=e164).values_list(
+        'id', flat=True).first()
+
+
+def cache_user_id(cache, key, user_id):
+    if user_id is None:
+        cache.set(key, NO_USER, get_phone_setting('NEGATIVE_TIMEOUT'))
+    else:
+        cache.set(key, user_id, get_phone_setting('CACHE_TIMEOUT'))
+
+
+def resolve_user_id(msisdn):
+    """
+    Return the id of the user with this phone number, in any accepted
+    format, or None
+    """
+    e164 = to_e164(msisdn)
+    if e164 is None:
+        return None
+    key = phone_cache_key(e164)
+    cache = get_phone_cache()
+    try:
+        cached = cache.get(key)
+    except Exception:
+        logger.warning('Phone cache read failed', exc_info=True)
+        return lookup_user_id(e164)
+    if cached is not None:
+        return cached or None
+
+    user_id = lookup_user_id(e164)
+    try:
+        cache_user_id(cache, key, user_id)
+    except Exception:
+        logger.warning('Phone cache write failed', exc_info=True)
+    return user_id
+
+
+async def aresolve_user_id(msisdn):
+    e164 = to_e164(msisdn)
+    if e164 is None:
+        return None
+    key = phone_cache_key(e164)
+    cache = get_phone_cache()
+    try:
+        cached = await cache.aget(key)
+    except Exception:
+        logger.warning('Phone cache read failed', exc_info=True)
+        cached = None
+    if cached is not None:
+        return cached or None
+
+    from .models import User
+    user_id = await User.objects.filter(phone_e164=e164).values_list(
+        'id', flat=True).afirst()
+    try:
+        if user_id is None:
+            await cache.aset(key, NO_USER,
+                             get_phone_setting('NEGATIVE_TIMEOUT'))
+        else:
+            await cache.aset(key, user_id,
+                             get_phone_setting('CACHE_TIMEOUT'))
+    except Exception:
+        logger.warning('Phone cache write failed', exc_info=True)
+    return user_id
+
+
+def invalidate_phone_numbers(numbers):
+    """
+    Drop the cached resolutions of these E.164 numbers
+    """
+    keys = [phone_cache_key(number) for number in numbers if number]
+    if not keys:
+        return
+    try:
+        get_phone_cache().delete_many(keys)
+    except Exception:
+        logger.warning('Phone cache invalidation failed', exc_info=True)
+
+
+def backfill_chunk(user_ids):
+    """
+    Set phone_e164 on the users among user_ids that lack it, returning
+    the number updated and the skipped (id, phone_number, reason) rows
+    """
+    from .models import User
+    rows = User.objects.select_for_update().filter(
+        id__in=user_ids, phone_e164__isnull=True,
+    ).order_by('id').values_list('id', 'phone_number')
+
+    numbers, skipped = {}, []
+    for user_id, phone_number in rows:
+        e164 = to_e164(phone_number)
+        if e164 is None:
+            skipped.append((user_id, phone_number, 'invalid'))
+        elif e164 in numbers:
+            # The lowest id keeps a number shared in several formats
+            skipped.append((user_id, phone_number, 'duplicate'))
+        else:
+            numbers[e164] = (user_id, phone_number)
+    for e164 in User.objects.filter(phone_e164__in=list(numbers)).values_list(
+            'phone_e164', flat=True):
+        skipped.append((*numbers.pop(e164), 'duplicate'))
+
+    users = [User(id=user_id, phone_e164=e164)
+             for e164, (user_id, _) in numbers.items()]
+    updated = len(users)
+    try:
+        with transaction.atomic():
+            User.objects.bulk_update(users, ['phone_e164'])
+    except IntegrityError:
+        # A number was registered since the check; find it row by row
+        updated = 0
+        for user in users:
+            try:
+                with transaction.atomic():
+                    User.objects.filter(id=user.id).update(
+                        phone_e164=user.phone_e164)
+                updated += 1
+            except IntegrityError:
+                skipped.append((user.id, numbers[user.phone_e164][1],
+                                'duplicate'))
+
+    # Numbers that resolved to nobody may have cached misses
+    transaction.on_commit(lambda: invalidate_phone_numbers(numbers))
+    return updated, skipped
+
+
+def backfill_phone_e164(chunk_size=None):
+    """
+    Fill in phone_e164 for users saved before it existed, one chunk per
+    transaction, yielding (last user id, updated, skipped rows) per chunk
+    """
+    from .models import User
+    chunk_size = chunk_size or get_phone_setting('BACKFILL_CHUNK_SIZE')
+    last_id = 0
+    while True:
+        user_ids = list(User.objects.filter(
+            id__gt=last_id, phone_e164__isnull=True,
+        ).order_by('id').values_list('id', flat=True)[:chunk_size])
+        if not user_ids:
+            return
+        last_id = user_ids[-1]
+        updated, skipped = run_in_transaction(
+            partial(backfill_chunk, user_ids), READ_COMMITTED,
+            operation='backfill_phone_e164')
+        yield last_id, updated, skipped
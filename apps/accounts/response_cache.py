@@ -0,0 +1,303 @@
+"""
+API response cache.
+
+``cache_response`` caches the data of successful GET responses from a DRF
+handler. Unlike the site-wide cache middleware, it runs after
+authentication and permission checks, and keys entries on the user (or
+their role) as well as the full path. A user is never served another
+user's response.
+
+Entries carry tags such as ``user:42`` or ``role:citizen``. Each tag has a
+version token in the cache, stored with every entry that carries it.
+``invalidate_tags`` replaces the tokens, which makes every entry with
+those tags stale at once without tracking keys. A lookup fetches the entry
+and its tag versions in a single ``get_many``. Tokens expire after
+``TAG_TIMEOUT`` seconds (at least the timeout of the entry that created
+them), so tags of users no longer viewed don't stay in Redis; an expired
+token only turns the entries carrying it into misses.
+
+Async handlers (see ``async_views``) are wrapped the same way, reading
+through the cache's native ``aget_many``. Passing the sync view's name as
+``view_name`` lets both variants of an endpoint share entries.
+
+Hits and misses are counted per view in process and added to a Redis hash
+at most every ``STATS_FLUSH_INTERVAL`` seconds (see
+``get_response_cache_stats``).
+"""
+
+import hashlib
+import logging
+import threading
+import time
+import uuid
+from collections import Counter
+from functools import wraps
+
+from asgiref.sync import iscoroutinefunction, sync_to_async
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.http import HttpRequest
+from rest_framework.request import Request
+from rest_framework.response import Response
+
+logger = logging.getLogger('smartfunds')
+
+DEFAULTS = {
+    'ENABLED': True,
+    'CACHE_ALIAS': 'default',
+    'KEY_PREFIX': 'api',
+    'TAG_TIMEOUT': 3600,  # seconds, longer than any cached view's
+    'STATS_KEY': 'accounts:response_cache:stats',
+    'STATS_FLUSH_INTERVAL': 10,  # seconds
+}
+
+
+def get_response_cache_setting(name):
+    return getattr(settings, 'RESPONSE_CACHE', {}).get(name, DEFAULTS[name])
+
+
+def get_cache():
+    return caches[get_response_cache_setting('CACHE_ALIAS')]
+
+
+def tag_key(tag):
+    return f"{get_response_cache_setting('KEY_PREFIX')}:tag:{tag}"
+
+
+def invalidate_tags(tags):
+    """
+    Make every cached response carrying any of the tags stale
+    """
+    tags = set(tags)
+    if not tags:
+        return
+    try:
+        get_cache().set_many(
+            {tag_key(tag): uuid.uuid4().hex for tag in tags},
+            timeout=get_response_cache_setting('TAG_TIMEOUT'))
+    except Exception:
+        logger.warning('Failed to invalidate response cache tags %s', tags,
+                       exc_info=True)
+
+
+def invalidate_tags_on_commit(tags):
+    tags = set(tags)
+    transaction.on_commit(lambda: invalidate_tags(tags))
+
+
+class CacheStats:
+    """
+    Per-view hit/miss counters, flushed to Redis periodically
+    """
+
+    def __init__(self):
+        self.counts = Counter()
+        self.lock = threading.Lock()
+        self.flushed_at = time.monotonic()
+
+    def get_connection(self):
+        from django_redis import get_redis_connection
+        return get_redis_connection(
+            get_response_cache_setting('CACHE_ALIAS'))
+
+    def count(self, view, outcome):
+        """
+        Count in memory, returning True when the counters are due a flush
+        """
+        with self.lock:
+            self.counts[f'{view}:{outcome}'] += 1
+            return (time.monotonic() - self.flushed_at >=
+                    get_response_cache_setting('STATS_FLUSH_INTERVAL'))
+
+    def record(self, view, outcome):
+        if self.count(view, outcome):
+            self.flush()
+
+    async def arecord(self, view, outcome):
+        if self.count(view, outcome):
+            await sync_to_async(self.flush)()
+
+    def flush(self):
+        with self.lock:
+            counts, self.counts = self.counts, Counter()
+            self.flushed_at = time.monotonic()
+        if not counts:
+            return
+        try:
+            pipe = self.get_connection().pipeline(transaction=False)
+            for field, count in counts.items():
+                pipe.hincrby(
+                    get_response_cache_setting('STATS_KEY'), field, count)
+            pipe.execute()
+        except Exception:
+            logger.warning('Failed to flush response cache stats',
+                           exc_info=True)
+            with self.lock:
+                self.counts.update(counts)
+
+    def read(self):
+        """
+        Return {view: {'hits', 'misses', 'hit_ratio'}} across processes
+        """
+        self.flush()
+        stored = self.get_connection().hgetall(
+            get_response_cache_setting('STATS_KEY'))
+        views = {}
+        for field, count in stored.items():
+            view, outcome = field.decode().rsplit(':', 1)
+            views.setdefault(view, {'hits': 0, 'misses': 0})[outcome] = (
+                int(count))
+        for counts in views.values():
+            total = counts['hits'] + counts['misses']
+            counts['hit_ratio'] = counts['hits'] / total if total else 0.0
+        return views
+
+
+cache_stats = CacheStats()
+
+
+def get_response_cache_stats():
+    return cache_stats.read()
+
+
+def cache_ident(request, vary):
+    user = request.user
+    if not user or not user.is_authenticated:
+        return 'anon'
+    if vary == 'role':
+        return f'role:{user.role}'
+    return f'user:{user.pk}'
+
+
+def entry_key(view_name, request, vary):
+    path = hashlib.md5(request.get_full_path().encode()).hexdigest()
+    return (f"{get_response_cache_setting('KEY_PREFIX')}:"
+            f"{view_name}:{cache_ident(request, vary)}:{path}")
+
+
+def new_versions(found, version_keys):
+    """
+    Tokens for the tags that have none yet, to be stored by the caller
+    """
+    return {k: uuid.uuid4().hex for k in version_keys if k not in found}
+
+
+def versions_timeout(timeout):
+    """
+    How long new tag tokens are kept, outliving the entry storing them
+    """
+    return max(get_response_cache_setting('TAG_TIMEOUT'), timeout)
+
+
+def cached_entry(found, key, versions):
+    entry = found.get(key)
+    if entry is not None and entry['versions'] == versions:
+        response = Response(entry['data'], status=entry['status'])
+        response['X-Cache'] = 'HIT'
+        return response
+    return None
+
+
+def new_entry(response, versions):
+    response['X-Cache'] = 'MISS'
+    return {
+        'versions': versions,
+        'data': response.data,
+        'status': response.status_code,
+    }
+
+
+def cache_response(timeout, tags=(), vary='user', view_name=None):
+    """
+    Cache successful GET responses of a DRF handler.
+
+    Works on APIView methods and on ``@api_view`` functions (place it
+    below ``@permission_classes``), and on async view methods returning
+    a ``Response``. ``tags`` is a list of tags or a callable taking the
+    handler's (request, *args, **kwargs). ``vary`` is ``'user'`` or, for
+    responses that are the same for everyone with a role, ``'role'``.
+    ``view_name`` defaults to the handler's qualified name.
+    """
+    def decorator(handler):
+        name = view_name or handler.__qualname__
+
+        def lookup(args, kwargs):
+            index = 0 if isinstance(args[0], (Request, HttpRequest)) else 1
+            request = args[index]
+            if (request.method != 'GET' or
+                    not get_response_cache_setting('ENABLED')):
+                return None, None
+            entry_tags = sorted(
+                tags(*args[index:], **kwargs) if callable(tags) else tags)
+            return (entry_key(name, request, vary),
+                    [tag_key(tag) for tag in entry_tags])
+
+        if iscoroutinefunction(handler):
+            @wraps(handler)
+            async def async_wrapper(*args, **kwargs):
+                key, version_keys = lookup(args, kwargs)
+                if key is None:
+                    return await handler(*args, **kwargs)
+
+                cache = get_cache()
+                try:
+                    found = await cache.aget_many([key, *version_keys])
+                except Exception:
+                    logger.warning('Response cache unavailable',
+                                   exc_info=True)
+                    return await handler(*args, **kwargs)
+
+                missing = new_versions(found, version_keys)
+                if missing:
+                    await cache.aset_many(
+                        missing, timeout=versions_timeout(timeout))
+                    found.update(missing)
+                versions = [found[k] for k in version_keys]
+
+                response = cached_entry(found, key, versions)
+                if response is not None:
+                    await cache_stats.arecord(name, 'hits')
+                    return response
+
+                await cache_stats.arecord(name, 'misses')
+                response = await handler(*args, **kwargs)
+                if response.status_code == 200:
+                    await cache.aset(
+                        key, new_entry(response, versions), timeout)
+                return response
+
+            return async_wrapper
+
+        @wraps(handler)
+        def wrapper(*args, **kwargs):
+            key, version_keys = lookup(args, kwargs)
+            if key is None:
+                return handler(*args, **kwargs)
+
+            cache = get_cache()
+            try:
+                found = cache.get_many([key, *version_keys])
+            except Exception:
+                logger.warning('Response cache unavailable', exc_info=True)
+                return handler(*args, **kwargs)
+
+            missing = new_versions(found, version_keys)
+            if missing:
+                cache.set_many(missing, timeout=versions_timeout(timeout))
+                found.update(missing)
+            versions = [found[k] for k in version_keys]
+
+            response = cached_entry(found, key, versions)
+            if response is not None:
+                cache_stats.record(name, 'hits')
+                return response
+
+            cache_stats.record(name, 'misses')
+            response = handler(*args, **kwargs)
+            if response.status_code == 200:
+                cache.set(key, new_entry(response, versions), timeout)
+            return response
+
+        return wrapper
+    return decorator
@@ -0,0 +1,86 @@
+"""
+Indexed user search.
+
+* Phone-like terms match by prefix on ``phone_digits`` (digits only, btree
+  with ``varchar_pattern_ops``), accepting both ``07..`` and ``2547..``
+  forms of Kenyan numbers.
+* Multi-word terms ("jane wanjiku") use the ``search_vector`` column with
+  prefix matching on every word (GIN).
+* Single words keep the substring semantics of the old ``icontains``
+  filters, which the ``UPPER(col) gin_trgm_ops`` indexes serve.
+
+Results are annotated with ``search_rank`` and ordered by it.
+"""
+
+import re
+
+from django.contrib.postgres.search import (
+    SearchQuery, SearchRank, TrigramWordSimilarity,
+)
+from django.db.models import F, Q, Value
+from django.db.models.functions import Greatest
+
+PHONE_TERM = re.compile(r'^\+?[\d\s\-()]{3,}$')
+WORD = re.compile(r'[\w@.+\-]+')
+
+KENYA_COUNTRY_CODE = '254'
+
+
+def phone_prefixes(term):
+    """
+    Return the digit prefixes a phone search term can match
+    """
+    digits = re.sub(r'\D', '', term)
+    prefixes = {digits}
+    if digits.startswith('0'):
+        prefixes.add(KENYA_COUNTRY_CODE + digits[1:])
+    elif digits.startswith(KENYA_COUNTRY_CODE):
+        prefixes.add('0' + digits[len(KENYA_COUNTRY_CODE):])
+    return prefixes
+
+
+def prefix_query(words):
+    """
+    Build a tsquery requiring every word, each as a prefix
+    """
+    # Quote each word so tsquery operators in user input are literal
+    raw = ' & '.join(
+        "'{}':*".format(word.replace("'", "''").replace('\\', ''))
+        for word in words
+    )
+    return SearchQuery(raw, search_type='raw', config='simple')
+
+
+def search_users(queryset, term):
+    """
+    Filter a User queryset by a free-text term and rank the matches
+    """
+    term = term.strip()
+    if not term:
+        return queryset
+
+    if PHONE_TERM.match(term):
+        condition = Q()
+        for prefix in phone_prefixes(term):
+            condition |= Q(phone_digits__startswith=prefix)
+        return queryset.filter(condition).annotate(
+            search_rank=Value(1.0)).order_by('phone_digits', '-date_joined')
+
+    words = WORD.findall(term)
+    if len(words) > 1:
+        query = prefix_query(words)
+        return queryset.filter(search_vector=query).annotate(
+            search_rank=SearchRank(F('search_vector'), query),
+        ).order_by('-search_rank', '-date_joined')
+
+    return queryset.filter(
+        Q(email__icontains=term) |
+        Q(first_name__icontains=term) |
+        Q(last_name__icontains=term)
+    ).annotate(
+        search_rank=Greatest(
+            TrigramWordSimilarity(term, 'email'),
+            TrigramWordSimilarity(term, 'first_name'),
+            TrigramWordSimilarity(term, 'last_name'),
+        ),
+    ).order_by('-search_rank', '-date_joined')
@@ -1,8 +1,14 @@
 from rest_framework import serializers
+from rest_framework_simplejwt.serializers import TokenObtainPairSerializer
 from django.contrib.auth import get_user_model
 from django.contrib.auth.password_validation import validate_password
 from django.core.exceptions import ValidationError
-from .models import UserProfile, LoginAttempt
+from django.db import models
+from .models import (
+    BulkUserJob, CitizenImportJob, UserProfile, LoginAttempt
+)
+from .phones import to_e164
+from .signals import update_last_login
 
 User = get_user_model()
 
@@ -36,10 +42,75 @@ class UserSerializer(serializers.ModelSerializer):
         read_only_fields = ['id', 'date_joined', 'last_login', 'is_verified']
 
 
+class UserSummarySerializer(serializers.ModelSerializer):
+    """
+    Slim read-only user representation for large listings. Pass
+    fields=[...] to keep only a subset of its fields.
+    """
+    full_name = serializers.ReadOnlyField()
+
+    # Model columns each serializer field reads
+    source_columns = {'full_name': ('first_name', 'last_name')}
+
+    class Meta:
+        model = User
+        fields = [
+            'id', 'email', 'first_name', 'last_name', 'full_name',
+            'phone_number', 'role', 'is_verified', 'date_joined'
+        ]
+        read_only_fields = fields
+
+    def __init__(self, *args, fields=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        if fields is not None:
+            for name in set(self.fields) - set(fields):
+                self.fields.pop(name)
+
+    @classmethod
+    def columns(cls, fields):
+        """
+        Model columns needed to serialize fields, for QuerySet.only()
+        """
+        columns = []
+        for name in fields:
+            columns.extend(cls.source_columns.get(name, (name,)))
+        return columns
+
+
+def validate_unique_phone_number(value, instance=None):
+    """
+    Reject numbers with no E.164 form and numbers registered in any format
+    """
+    e164 = to_e164(value)
+    if e164 is None:
+        raise serializers.ValidationError("Enter a valid phone number.")
+    users = User.objects.filter(phone_e164=e164)
+    if instance is not None:
+        users = users.exclude(pk=instance.pk)
+    if users.exists():
+        raise serializers.ValidationError(
+            "This phone number is already in use.")
+    return value
+
+
+class NormalizedEmailField(serializers.EmailField):
+    """
+    EmailField normalizing addresses the way they are stored, before the
+    unique check
+    """
+
+    def to_internal_value(self, data):
+        return User.objects.normalize_email(super().to_internal_value(data))
+
+
 class UserCreateSerializer(serializers.ModelSerializer):
     """
     Serializer for creating new users
     """
+    serializer_field_mapping = {
+        **serializers.ModelSerializer.serializer_field_mapping,
+        models.EmailField: NormalizedEmailField,
+    }
     password = serializers.CharField(
         write_only=True, validators=[validate_password])
     password_confirm = serializers.CharField(write_only=True)
@@ -56,6 +127,9 @@ class UserCreateSerializer(serializers.ModelSerializer):
             raise serializers.ValidationError("Passwords don't match.")
         return attrs
 
+    def validate_phone_number(self, value):
+        return validate_unique_phone_number(value)
+
     def validate_role(self, value):
         """
         Validate role assignment based on current user's permissions
@@ -100,12 +174,18 @@ class UserUpdateSerializer(serializers.ModelSerializer):
 
     def validate_phone_number(self, value):
         """
-        Ensure phone number is unique (excluding current user)
+        Ensure phone number is unique in any format (excluding current user)
         """
-        if User.objects.exclude(pk=self.instance.pk).filter(phone_number=value).exists():
-            raise serializers.ValidationError(
-                "This phone number is already in use.")
-        return value
+        return validate_unique_phone_number(value, self.instance)
+
+    def update(self, instance, validated_data):
+        # Write only the submitted columns
+        if not validated_data:
+            return instance
+        for attr, value in validated_data.items():
+            setattr(instance, attr, value)
+        instance.save(update_fields=[*validated_data, 'updated_at'])
+        return instance
 
 
 class AdminUserUpdateSerializer(UserUpdateSerializer):
@@ -138,6 +218,17 @@ class AdminUserUpdateSerializer(UserUpdateSerializer):
         return value
 
 
+class LoginSerializer(TokenObtainPairSerializer):
+    """
+    Token pair serializer whose last_login write is coalesced
+    """
+
+    def validate(self, attrs):
+        data = super().validate(attrs)
+        update_last_login(None, self.user)
+        return data
+
+
 class PasswordChangeSerializer(serializers.Serializer):
     """
     Serializer for changing user password
@@ -161,7 +252,7 @@ class PasswordChangeSerializer(serializers.Serializer):
     def save(self):
         user = self.context['request'].user
         user.set_password(self.validated_data['new_password'])
-        user.save()
+        user.save(update_fields=['password'])
         return user
 
 
@@ -178,6 +269,32 @@ class LoginAttemptSerializer(serializers.ModelSerializer):
         read_only_fields = ['id', 'timestamp']
 
 
+class BulkUserJobSerializer(serializers.ModelSerializer):
+    """
+    Serializer for bulk user action job status
+    """
+    class Meta:
+        model = BulkUserJob
+        fields = [
+            'id', 'action', 'status', 'total', 'processed', 'affected',
+            'errors', 'created_at', 'started_at', 'finished_at'
+        ]
+        read_only_fields = fields
+
+
+class CitizenImportJobSerializer(serializers.ModelSerializer):
+    """
+    Serializer for citizen import job status
+    """
+    class Meta:
+        model = CitizenImportJob
+        fields = [
+            'id', 'format', 'status', 'rows', 'created', 'error_count',
+            'errors', 'created_at', 'started_at', 'finished_at'
+        ]
+        read_only_fields = fields
+
+
 class UserStatsSerializer(serializers.Serializer):
     """
     Serializer for user statistics
@@ -1,7 +1,18 @@
-from django.db.models.signals import post_save
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import DEFERRED
+from django.db.models.signals import post_save, post_delete
 from django.dispatch import receiver
 from django.contrib.auth import get_user_model
+from django.contrib.auth.signals import user_logged_in
+from django.utils import timezone
+from .authentication import invalidate_cached_users
 from .models import UserProfile
+from .phones import invalidate_phone_numbers
+from .response_cache import invalidate_tags_on_commit
+from .stats import TRACKED_FIELDS, apply_stat_deltas, stat_deltas
 
 User = get_user_model()
 
@@ -16,11 +27,149 @@ def create_user_profile(sender, instance, created, **kwargs):
 
 
 @receiver(post_save, sender=User)
-def save_user_profile(sender, instance, **kwargs):
+def save_user_profile(sender, instance, created, update_fields=None, **kwargs):
     """
-    Save user profile when user is saved
+    Save the user's loaded profile along with the user; the profile
+    writes only its changed fields
     """
-    if hasattr(instance, 'profile'):
+    # A new user's profile was just created, and a partial save names
+    # everything it writes
+    if created or update_fields is not None:
+        return
+    if User.profile.is_cached(instance):
         instance.profile.save()
+
+
+def last_login_due(user, now):
+    interval = getattr(settings, 'LAST_LOGIN_UPDATE_INTERVAL', 0)
+    return (user.last_login is None or
+            now - user.last_login >= timedelta(seconds=interval))
+
+
+def update_last_login(sender, user, **kwargs):
+    """
+    Record a login in last_login, at most once per
+    LAST_LOGIN_UPDATE_INTERVAL seconds per user
+    """
+    now = timezone.now()
+    if last_login_due(user, now):
+        user.last_login = now
+        user.save(update_fields=['last_login'])
+
+
+async def aupdate_last_login(user):
+    now = timezone.now()
+    if last_login_due(user, now):
+        user.last_login = now
+        await user.asave(update_fields=['last_login'])
+
+
+# In place of django.contrib.auth's receiver, which writes every login
+user_logged_in.disconnect(dispatch_uid='update_last_login')
+user_logged_in.connect(update_last_login, dispatch_uid='update_last_login')
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def invalidate_cached_user(sender, instance, **kwargs):
+    """
+    Drop the cached auth entry when a user is saved or deleted
+    """
+    # After commit, so a concurrent request cannot re-cache the old row.
+    # The id is read now: delete() clears instance.pk before the commit.
+    user_id = instance.pk
+    transaction.on_commit(lambda: invalidate_cached_users([user_id]))
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def invalidate_resolved_phone(sender, instance, signal, **kwargs):
+    """
+    Drop the cached phone resolutions of the user's old and new numbers
+    """
+    loaded = getattr(instance, '_loaded_values', {})
+    old = loaded.get('phone_e164')
+    new = instance.__dict__.get('phone_e164')
+    if signal is post_save and 'phone_e164' in instance.__dict__:
+        if 'phone_e164' in loaded and old == new:
+            return
+        instance._loaded_values = {**loaded, 'phone_e164': new}
+    # A new number may have a cached miss, an old one a cached hit
+    numbers = {old, new}
+    transaction.on_commit(lambda: invalidate_phone_numbers(numbers))
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def invalidate_user_responses(sender, instance, **kwargs):
+    """
+    Expire cached API responses showing this user
+    """
+    # Registered before the stats handlers, which overwrite _loaded_values
+    roles = {instance.role, getattr(instance, '_loaded_values', {}).get('role')}
+    invalidate_tags_on_commit(
+        [f'user:{instance.pk}'] + [f'role:{role}' for role in roles if role])
+
+
+@receiver(post_save, sender=UserProfile)
+def invalidate_profile_responses(sender, instance, **kwargs):
+    """
+    Expire cached API responses embedding this profile
+    """
+    if UserProfile.user.is_cached(instance):
+        role = instance.user.role
     else:
-        UserProfile.objects.create(user=instance)
+        role = User.objects.filter(
+            pk=instance.user_id).values_list('role', flat=True).first()
+    invalidate_tags_on_commit([f'user:{instance.user_id}', f'role:{role}'])
+
+
+def tracked_values(instance):
+    return {field: getattr(instance, field) for field in TRACKED_FIELDS}
+
+
+def loaded_tracked_values(instance):
+    """
+    Return the tracked values as last read from or written to the database,
+    or None if they are not known
+    """
+    loaded = getattr(instance, '_loaded_values', {})
+    values = {field: loaded.get(field, DEFERRED) for field in TRACKED_FIELDS}
+    if any(value is DEFERRED for value in values.values()):
+        return None
+    return values
+
+
+@receiver(post_save, sender=User)
+def update_user_stats_on_save(sender, instance, created, update_fields=None, **kwargs):
+    """
+    Adjust the user statistics counters for a created or changed user
+    """
+    if update_fields is not None and not set(update_fields) & set(TRACKED_FIELDS):
+        return
+
+    old_values = None
+    if not created:
+        old_values = loaded_tracked_values(instance)
+        if old_values is None:
+            # Saved without being loaded first; reconciliation catches up
+            return
+
+    new_values = tracked_values(instance)
+    if update_fields is not None and old_values is not None:
+        new_values = {
+            field: new_values[field] if field in update_fields else old_values[field]
+            for field in TRACKED_FIELDS
+        }
+    apply_stat_deltas(stat_deltas(old_values, new_values))
+    instance._loaded_values = {
+        **getattr(instance, '_loaded_values', {}), **new_values}
+
+
+@receiver(post_delete, sender=User)
+def update_user_stats_on_delete(sender, instance, **kwargs):
+    """
+    Remove a deleted user from the user statistics counters
+    """
+    old_values = loaded_tracked_values(instance) or tracked_values(instance)
+    apply_stat_deltas(stat_deltas(old_values, None))
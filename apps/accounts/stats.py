@@ -0,0 +1,186 @@
+"""
+Incrementally maintained user statistics.
+
+Counts live in a Redis hash that is adjusted by deltas whenever a user is
+created, changed or deleted (see signals.py and bulk_user_action), so
+reading them is a single HGETALL. ``reconcile_user_stats`` recomputes the
+exact values with one conditional-aggregate query and is run periodically
+by Celery beat to correct any drift. ``aget_user_stats`` reads them from
+async views.
+"""
+
+import logging
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.models import Count, Q
+
+from .response_cache import invalidate_tags
+
+logger = logging.getLogger('smartfunds')
+
+User = get_user_model()
+
+STATS_KEY = 'accounts:user_stats'
+
+# Fields that affect the counters
+TRACKED_FIELDS = ('role', 'is_active', 'is_verified')
+
+ROLE_COUNTERS = {
+    User.UserRole.CITIZEN: 'citizens',
+    User.UserRole.FUND_OFFICER: 'fund_officers',
+    User.UserRole.FUND_ADMIN: 'fund_admins',
+    User.UserRole.SUPERADMIN: 'superadmins',
+}
+
+COUNTERS = (
+    'total_users', 'active_users', *ROLE_COUNTERS.values(), 'verified_users',
+)
+
+
+def get_stats_cache_alias():
+    return getattr(settings, 'USER_STATS_CACHE_ALIAS', 'default')
+
+
+def get_connection():
+    from django_redis import get_redis_connection
+    return get_redis_connection(get_stats_cache_alias())
+
+
+def get_async_connection():
+    from smartfunds.cache import get_async_redis_connection
+    return get_async_redis_connection(get_stats_cache_alias())
+
+
+def user_counters(values):
+    """
+    Return the counters a user with the given field values contributes to
+    """
+    if values is None:
+        return {}
+    counters = {'total_users': 1}
+    if values['is_active']:
+        counters['active_users'] = 1
+    if values['is_verified']:
+        counters['verified_users'] = 1
+    role_counter = ROLE_COUNTERS.get(values['role'])
+    if role_counter:
+        counters[role_counter] = 1
+    return counters
+
+
+def stat_deltas(old_values, new_values):
+    """
+    Return the counter deltas for a user going from old to new values
+    (None meaning the user did not / no longer exists)
+    """
+    old = user_counters(old_values)
+    new = user_counters(new_values)
+    deltas = {}
+    for counter in set(old) | set(new):
+        delta = new.get(counter, 0) - old.get(counter, 0)
+        if delta:
+            deltas[counter] = delta
+    return deltas
+
+
+def apply_stat_deltas(deltas):
+    """
+    Add deltas to the stored counters once the current transaction commits
+    """
+    deltas = {counter: delta for counter, delta in deltas.items() if delta}
+    if not deltas:
+        return
+
+    def apply():
+        try:
+            pipe = get_connection().pipeline(transaction=True)
+            for counter, delta in deltas.items():
+                pipe.hincrby(STATS_KEY, counter, delta)
+            pipe.execute()
+        except Exception:
+            # The next reconciliation corrects the counters
+            logger.warning('Failed to update user stats', exc_info=True)
+        invalidate_tags(['user-stats'])
+
+    transaction.on_commit(apply)
+
+
+def stat_aggregates():
+    aggregates = {
+        'total_users': Count('id'),
+        'active_users': Count('id', filter=Q(is_active=True)),
+        'verified_users': Count('id', filter=Q(is_verified=True)),
+    }
+    for role, counter in ROLE_COUNTERS.items():
+        aggregates[counter] = Count('id', filter=Q(role=role))
+    return aggregates
+
+
+def compute_user_stats():
+    """
+    Compute exact statistics with a single conditional-aggregate query
+    """
+    return User.objects.aggregate(**stat_aggregates())
+
+
+async def acompute_user_stats():
+    return await User.objects.aaggregate(**stat_aggregates())
+
+
+def reconcile_user_stats():
+    """
+    Overwrite the stored counters with exact values
+    """
+    stats = compute_user_stats()
+    get_connection().hset(STATS_KEY, mapping=stats)
+    return stats
+
+
+def get_user_stats():
+    """
+    Return the stored counters, rebuilding them if they are missing
+    """
+    try:
+        stored = get_connection().hgetall(STATS_KEY)
+    except Exception:
+        logger.warning('User stats unavailable, counting', exc_info=True)
+        return compute_user_stats()
+
+    stats = stored_stats(stored)
+    if stats is None:
+        try:
+            return reconcile_user_stats()
+        except Exception:
+            logger.warning('Failed to rebuild user stats', exc_info=True)
+            return compute_user_stats()
+    return stats
+
+
+async def aget_user_stats():
+    try:
+        stored = await get_async_connection().hgetall(STATS_KEY)
+    except Exception:
+        logger.warning('User stats unavailable, counting', exc_info=True)
+        return await acompute_user_stats()
+
+    stats = stored_stats(stored)
+    if stats is None:
+        try:
+            return await sync_to_async(reconcile_user_stats)()
+        except Exception:
+            logger.warning('Failed to rebuild user stats', exc_info=True)
+            return await acompute_user_stats()
+    return stats
+
+
+def stored_stats(stored):
+    """
+    The counters of an HGETALL reply, None if any is missing
+    """
+    stats = {key.decode(): int(value) for key, value in stored.items()}
+    if any(counter not in stats for counter in COUNTERS):
+        return None
+    return {counter: stats[counter] for counter in COUNTERS}
@@ -0,0 +1,48 @@
+from celery import shared_task
+
+from .audit import get_login_audit_sink
+from .imports import run_citizen_import_job
+from .jobs import run_bulk_user_job
+from .partitions import archive_partitions, ensure_partitions
+from .stats import reconcile_user_stats
+
+
+@shared_task(ignore_result=True)
+def flush_login_attempts():
+    """
+    Drain the buffered login audit queue into the database
+    """
+    return get_login_audit_sink('buffered').flush()
+
+
+@shared_task(ignore_result=True)
+def reconcile_user_stats_task():
+    """
+    Correct drift in the maintained user statistics counters
+    """
+    reconcile_user_stats()
+
+
+@shared_task(ignore_result=True)
+def maintain_login_attempt_partitions():
+    """
+    Create upcoming login attempt partitions and archive expired ones
+    """
+    ensure_partitions()
+    archive_partitions()
+
+
+@shared_task(ignore_result=True)
+def process_bulk_user_job(job_id):
+    """
+    Run a background bulk user action
+    """
+    run_bulk_user_job(job_id)
+
+
+@shared_task(ignore_result=True)
+def process_citizen_import_job(job_id):
+    """
+    Run a background citizen import
+    """
+    run_citizen_import_job(job_id)
@@ -1,3 +1,1702 @@
-from django.test import TestCase
+import csv
+import io
+import json
+import os
+import tempfile
+import time
+import uuid
+from base64 import urlsafe_b64encode
+from datetime import timedelta
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import caches
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import DatabaseError, OperationalError, connection
+from django.test import (
+    AsyncClient, TestCase, TransactionTestCase, override_settings
+)
+from django.test.utils import CaptureQueriesContext
+from django.urls import path, reverse
+from django.utils import timezone
+from django_redis import get_redis_connection
+from psycopg.errors import SerializationFailure
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework.request import Request
+from rest_framework.test import (
+    APIRequestFactory, APITestCase, APITransactionTestCase
+)
+from rest_framework_simplejwt.tokens import AccessToken
+
+from smartfunds import db as smartfunds_db
+from smartfunds.cache import MISSING
+from smartfunds.routers import (
+    ReplicaRouter, pin_key, replica_health, replica_reads_enabled
+)
+from smartfunds.transactions import (
+    TransactionConflict, retry_counters, run_in_transaction
+)
+
+from . import views
+from .async_views import (
+    AsyncCurrentUserView, AsyncTokenObtainPairView, AsyncUserProfileView,
+    AsyncUserStatsView
+)
+from .audit import BufferedLoginAuditSink
+from .authentication import (
+    CachedJWTAuthentication, CachedUser, get_cached_user,
+    invalidate_cached_users
+)
+from .hashing import (
+    PooledPBKDF2PasswordHasher, get_password_hashing_stats, password_pool
+)
+from .imports import CitizenImporter, run_citizen_import_job
+from .jobs import run_bulk_user_job
+from .lockout import LoginLocked, login_lockout
+from .models import (
+    BulkUserJob, CitizenImportJob, LoginAttempt, UserProfile
+)
+from .partitions import (
+    LEGACY_PARTITION, add_months, ensure_partitions, list_partitions
+)
+from .phones import (
+    backfill_phone_e164, invalidate_phone_numbers, resolve_user_id, to_e164
+)
+from .response_cache import get_response_cache_stats, tag_key
+from .stats import (
+    STATS_KEY, compute_user_stats, get_connection, get_user_stats,
+    reconcile_user_stats, stat_deltas
+)
+from .throttling import (
+    GCRAThrottle, LoginRateThrottle, get_throttle_cache_alias
+)
+
+User = get_user_model()
+
+
+def create_user(index, **extra_fields):
+    extra_fields.setdefault('phone_number', f'+2547000{index:05d}')
+    return User.objects.create_user(
+        email=f'user{index}@example.com',
+        username=f'user{index}',
+        password='pass-1234',
+        first_name='Test',
+        last_name=f'User{index}',
+        **extra_fields
+    )
+
+
+@override_settings(RESPONSE_CACHE={'ENABLED': False})
+class UsersByRoleTests(APITestCase):
+    """
+    users_by_role must serve a page with a single query, however many
+    users (and profiles) are on it
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.officer = create_user(0, role=User.UserRole.FUND_OFFICER)
+        for index in range(1, 26):
+            create_user(index)
+
+    def setUp(self):
+        self.client.force_authenticate(self.officer)
+        self.url = reverse('accounts:users-by-role', args=['citizen'])
+
+    def test_full_representation_has_no_n_plus_one(self):
+        with self.assertNumQueries(1):
+            response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data['results']), 20)
+        self.assertIn('profile', response.data['results'][0])
+
+        with self.assertNumQueries(1):
+            response = self.client.get(response.data['next'])
+        self.assertEqual(len(response.data['results']), 5)
+
+    def test_fields_selects_slim_representation(self):
+        with self.assertNumQueries(1):
+            response = self.client.get(
+                self.url, {'fields': 'id,full_name,phone_number'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            set(response.data['results'][0]),
+            {'id', 'full_name', 'phone_number'})
+        self.assertEqual(
+            response.data['results'][0]['full_name'], 'Test User25')
+
+    def test_unknown_fields_are_rejected(self):
+        response = self.client.get(self.url, {'fields': 'id,password'})
+        self.assertEqual(response.status_code, 400)
+
+
+@skipUnless('replica' in settings.DATABASES,
+            'set DATABASE_REPLICA_URLS to a second local database')
+@override_settings(RESPONSE_CACHE={'ENABLED': False})
+class ReplicaRouterTests(APITransactionTestCase):
+    """
+    The replica is a separate database here, so which one answered shows
+    in the rows returned
+    """
+    databases = {'default', 'replica'} & set(settings.DATABASES)
+
+    def setUp(self):
+        self.admin = create_user(0, role=User.UserRole.SUPERADMIN)
+        create_user(1)
+        # bulk_create skips the signals that would write to the primary
+        User.objects.using('replica').bulk_create([User(
+            email='replica-only@example.com',
+            username='replica-only@example.com',
+            phone_number='+254711111111')])
+        self.client.force_authenticate(self.admin)
+        self.url = reverse('accounts:user-list-create')
+        replica_health.reset()
+        caches['default'].delete(pin_key(self.admin.pk))
+
+    def list_emails(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        return {user['email'] for user in response.data['results']}
+
+    def test_list_reads_from_replica(self):
+        self.assertEqual(self.list_emails(), {'replica-only@example.com'})
+
+    def test_writer_reads_own_writes_from_primary(self):
+        response = self.client.patch(
+            reverse('accounts:current-user'), {'first_name': 'Changed'})
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('user0@example.com', self.list_emails())
+
+    def test_lagging_replica_falls_back_to_primary(self):
+        with mock.patch('smartfunds.routers.replica_lag', return_value=60):
+            self.assertIn('user0@example.com', self.list_emails())
+
+    def test_unavailable_replica_falls_back_to_primary(self):
+        with mock.patch('smartfunds.routers.replica_lag',
+                        side_effect=DatabaseError('down')):
+            self.assertIn('user0@example.com', self.list_emails())
+
+    def test_writes_go_to_primary(self):
+        response = self.client.post(self.url, {
+            'email': 'new@example.com', 'phone_number': '+254722222222',
+            'first_name': 'New', 'last_name': 'User',
+            'password': 'a-Strong-pass-1234',
+            'password_confirm': 'a-Strong-pass-1234',
+        })
+        self.assertEqual(response.status_code, 201, response.data)
+        self.assertTrue(User.objects.filter(email='new@example.com').exists())
+        self.assertFalse(User.objects.using('replica').filter(
+            email='new@example.com').exists())
+
+
+@override_settings(
+    RESPONSE_CACHE={'ENABLED': False},
+    LOGIN_AUDIT={'MODE': 'sync'},
+    LAST_LOGIN_UPDATE_INTERVAL=300,
+    PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'])
+class LoginWriteTests(APITestCase):
+    """
+    A login looks the user up once, by index, and writes the audit row
+    and, at most once per LAST_LOGIN_UPDATE_INTERVAL, last_login; the
+    profile is only written when it changed
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = create_user(0)
+
+    def login(self, address, email=None):
+        # A fresh client address per login, so the login throttle and
+        # lockout stay out of the way
+        return self.client.post(
+            reverse('accounts:token_obtain_pair'),
+            {'email': email or self.user.email, 'password': 'pass-1234'},
+            format='json', REMOTE_ADDR=f'10.21.0.{address}')
+
+    def test_login_queries(self):
+        # User lookup, last_login UPDATE and the audit INSERT
+        with self.assertNumQueries(3):
+            response = self.login(1)
+        self.assertEqual(response.status_code, 200)
+
+        # last_login is recent, so it isn't written again
+        with self.assertNumQueries(2):
+            response = self.login(2)
+        self.assertEqual(response.status_code, 200)
+
+    def test_login_email_is_case_insensitive(self):
+        response = self.login(3, email=self.user.email.upper())
+        self.assertEqual(response.status_code, 200)
+        attempt = LoginAttempt.objects.get()
+        self.assertEqual(attempt.user_id, self.user.pk)
+
+    def test_login_rejects_non_string_email(self):
+        # A number passes as text and fails to authenticate
+        cases = [(['x@example.com'], 400), (12345, 401)]
+        for address, (email, status_code) in enumerate(cases, 4):
+            response = self.client.post(
+                reverse('accounts:token_obtain_pair'),
+                {'email': email, 'password': 'pass-1234'},
+                format='json', REMOTE_ADDR=f'10.21.0.{address}')
+            self.assertEqual(response.status_code, status_code)
+        self.assertEqual(
+            list(LoginAttempt.objects.values_list('email', flat=True)),
+            ['', ''])
+
+    def test_login_lookup_uses_email_index(self):
+        with CaptureQueriesContext(connection) as queries:
+            User.objects.get_by_natural_key(self.user.email.upper())
+        with connection.cursor() as cursor:
+            # The test table is tiny; make any usable index win
+            cursor.execute('SET LOCAL enable_seqscan = off')
+            cursor.execute('EXPLAIN ' + queries[0]['sql'])
+            plan = '\n'.join(row[0] for row in cursor.fetchall())
+        # Either btree on email; UPPER(email) couldn't use them
+        self.assertRegex(plan, r'Index (Only )?Scan using accounts_user_email_')
+        self.assertNotIn('Seq Scan', plan)
+
+    def test_unchanged_profile_is_not_saved(self):
+        user = User.objects.select_related('profile').get(pk=self.user.pk)
+        with self.assertNumQueries(1):
+            user.save()
+
+        user.profile.bio = 'Changed'
+        with CaptureQueriesContext(connection) as queries:
+            user.save()
+        self.assertEqual(len(queries), 2)
+        profile_update = queries[1]['sql']
+        self.assertIn('"bio"', profile_update)
+        self.assertNotIn('"location"', profile_update)
+
+        with self.assertNumQueries(0):
+            user.profile.save()
+
+
+def random_address():
+    return '10.%d.%d.%d' % tuple(uuid.uuid4().bytes[:3])
+
+
+class LoginLockoutTests(APITestCase):
+    """
+    Failures lock a principal at its threshold, for longer on every
+    repeat; a locked login is refused before the password is checked,
+    and the client address can't be spoofed past the IP threshold
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = create_user(0)
+
+    def setUp(self):
+        self.prefix = f'test:lockout:{uuid.uuid4().hex}'
+        settings = override_settings(LOGIN_LOCKOUT={
+            'THRESHOLDS': {'email': 3, 'phone': 3, 'ip': 5},
+            'BACKOFF': 60, 'BACKOFF_FACTOR': 2, 'MAX_BACKOFF': 150,
+            'KEY_PREFIX': self.prefix})
+        settings.enable()
+        self.addCleanup(settings.disable)
+        self.connection = login_lockout.get_connection()
+        self.addCleanup(self.clear)
+        # The login throttle isn't under test
+        throttle = mock.patch.object(
+            LoginRateThrottle, 'rate', '1000/min', create=True)
+        throttle.start()
+        self.addCleanup(throttle.stop)
+
+    def clear(self):
+        keys = list(self.connection.scan_iter(f'{self.prefix}:*'))
+        if keys:
+            self.connection.delete(*keys)
+
+    def fail(self, principals, times):
+        return [login_lockout.register_failure(principals)
+                for _ in range(times)]
+
+    def unlock(self, principals):
+        # As if the lock had expired
+        self.connection.delete(*login_lockout.lock_keys(principals))
+
+    def login(self, password='pass-1234', **extra):
+        extra.setdefault('REMOTE_ADDR', random_address())
+        return self.client.post(
+            reverse('accounts:token_obtain_pair'),
+            {'email': self.user.email, 'password': password},
+            format='json', **extra)
+
+    def test_thresholds(self):
+        for kind, principals, threshold in [
+                ('email', login_lockout.principals(email='A@example.com'), 3),
+                ('phone', login_lockout.principals(
+                    phone_number='+254 712 000 001'), 3),
+                ('ip', login_lockout.principals(ip_address='10.0.0.1'), 5)]:
+            with self.subTest(kind):
+                self.assertEqual(principals[0][0], kind)
+                self.assertEqual(
+                    self.fail(principals, threshold - 1),
+                    [0] * (threshold - 1))
+                self.assertEqual(login_lockout.locked_for(principals), 0)
+                self.assertAlmostEqual(
+                    self.fail(principals, 1)[0], 60, delta=1)
+                self.assertAlmostEqual(
+                    login_lockout.locked_for(principals), 60, delta=1)
+                with self.assertRaises(LoginLocked):
+                    login_lockout.check(principals)
+
+        # Normalized the same way, so the same account
+        self.assertTrue(login_lockout.locked_for(
+            login_lockout.principals(email=' a@EXAMPLE.com ')))
+
+    def test_backoff_escalates_to_the_cap(self):
+        principals = login_lockout.principals(email='a@example.com')
+        locks = []
+        for _ in range(3):
+            locks.append(self.fail(principals, 3)[-1])
+            self.unlock(principals)
+        # 60s, doubled, then capped at MAX_BACKOFF
+        for lock, expected in zip(locks, [60, 120, 150]):
+            self.assertAlmostEqual(lock, expected, delta=1)
+
+    def test_locked_login_skips_password_check(self):
+        for _ in range(3):
+            self.assertEqual(self.login('wrong').status_code, 401)
+
+        with mock.patch.object(PooledPBKDF2PasswordHasher, 'verify',
+                               return_value=True) as verify:
+            response = self.login()
+        self.assertEqual(response.status_code, 429)
+        self.assertAlmostEqual(int(response['Retry-After']), 60, delta=1)
+        verify.assert_not_called()
+        self.assertFalse(LoginAttempt.objects.filter(successful=True).exists())
+
+    def test_success_clears_account_principals_only(self):
+        address = random_address()
+        principals = login_lockout.principals(
+            email=self.user.email, ip_address=address)
+        for _ in range(2):
+            self.assertEqual(
+                self.login('wrong', REMOTE_ADDR=address).status_code, 401)
+        self.assertEqual(
+            self.login(REMOTE_ADDR=address).status_code, 200)
+
+        email, ip = principals
+        self.assertFalse(self.connection.exists(
+            login_lockout.key('failures', email)))
+        # IP addresses are shared, so their failures still count
+        self.assertEqual(self.connection.zcard(
+            login_lockout.key('failures', ip)), 2)
+
+    def test_client_address_cannot_be_spoofed(self):
+        address = random_address()
+        for index in range(5):
+            response = self.client.post(
+                reverse('accounts:token_obtain_pair'),
+                {'email': f'nobody{index}@example.com', 'password': 'x'},
+                format='json', REMOTE_ADDR=address,
+                HTTP_X_FORWARDED_FOR=random_address())
+            self.assertEqual(response.status_code, 401)
+        # Rotating X-Forwarded-For didn't reset the IP's failures
+        self.assertEqual(self.login(REMOTE_ADDR=address,
+                                    HTTP_X_FORWARDED_FOR=random_address()
+                                    ).status_code, 429)
+        self.assertEqual(
+            set(LoginAttempt.objects.values_list('ip_address', flat=True)),
+            {address})
+
+        # Behind a trusted proxy, X-Real-IP is the client
+        client = random_address()
+        with self.settings(TRUSTED_PROXIES=[address]):
+            self.assertEqual(self.login(
+                REMOTE_ADDR=address, HTTP_X_REAL_IP=client).status_code, 200)
+        self.assertTrue(LoginAttempt.objects.filter(
+            ip_address=client, successful=True).exists())
+
+    def test_fails_open_without_redis(self):
+        principals = login_lockout.principals(email=self.user.email)
+        with mock.patch.object(login_lockout, 'get_scripts',
+                               side_effect=ConnectionError('down')), \
+                mock.patch.object(login_lockout, 'get_connection',
+                                  side_effect=ConnectionError('down')):
+            self.assertEqual(login_lockout.locked_for(principals), 0)
+            self.assertEqual(login_lockout.register_failure(principals), 0)
+            login_lockout.register_success(principals)
+            self.assertEqual(self.login().status_code, 200)
+
+
+class PhoneNumberTests(APITestCase):
+    """
+    Phone numbers in any accepted format share one canonical E.164 form,
+    which gateway lookups resolve through a cache
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = create_user(0, phone_number='0712000001')
+
+    def setUp(self):
+        invalidate_phone_numbers(['+254712000001', '+254712000002'])
+
+    def test_to_e164(self):
+        for value in ('+254712000001', '254712000001', '0712000001',
+                      '712000001', '00254712000001', '+254 712 000 001'):
+            self.assertEqual(to_e164(value), '+254712000001', value)
+        self.assertIsNone(to_e164('12345'))
+        self.assertIsNone(to_e164('+1234567890123456'))
+        self.assertEqual(self.user.phone_e164, '+254712000001')
+
+    def test_duplicate_format_is_rejected(self):
+        other = create_user(1)
+        self.client.force_authenticate(other)
+        response = self.client.patch(
+            reverse('accounts:current-user'),
+            {'phone_number': '+254712000001'}, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('phone_number', response.data)
+
+    def test_resolve_user_id_is_cached_and_invalidated(self):
+        self.assertEqual(resolve_user_id('254712000001'), self.user.pk)
+        with self.assertNumQueries(0):
+            self.assertEqual(resolve_user_id('0712000001'), self.user.pk)
+        self.assertIsNone(resolve_user_id('0712000002'))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.phone_number = '0712000002'
+            self.user.save(update_fields=['phone_number'])
+        self.assertIsNone(resolve_user_id('0712000001'))
+        self.assertEqual(resolve_user_id('0712000002'), self.user.pk)
+
+    def test_backfill_skips_duplicates(self):
+        User.objects.filter(pk=self.user.pk).update(phone_e164=None)
+        other = create_user(1)
+        User.objects.filter(pk=other.pk).update(
+            phone_number='254712000001', phone_e164=None)
+
+        chunks = list(backfill_phone_e164(chunk_size=1))
+        self.assertEqual(sum(updated for _, updated, _ in chunks), 1)
+        skipped = [row for _, _, rows in chunks for row in rows]
+        self.assertEqual(skipped, [(other.pk, '254712000001', 'duplicate')])
+        self.assertEqual(User.objects.get(pk=self.user.pk).phone_e164,
+                         '+254712000001')
+
+
+class BufferedLoginAuditTests(TransactionTestCase):
+    """
+    A buffered batch leaves Redis only once its INSERT has committed, and
+    records the database rejects don't hold up the queue
+    """
+
+    def setUp(self):
+        self.key = f'test:login_attempts:{uuid.uuid4().hex}'
+        settings = override_settings(LOGIN_AUDIT={
+            'MODE': 'buffered', 'REDIS_KEY': self.key, 'BATCH_SIZE': 2})
+        settings.enable()
+        self.addCleanup(settings.disable)
+        self.sink = BufferedLoginAuditSink()
+        self.addCleanup(self.sink.get_connection().delete, self.key,
+                        f'{self.key}:processing', f'{self.key}:dead')
+
+    def test_failed_flush_keeps_batch(self):
+        for index in range(3):
+            self.sink.record(email=f'user{index}@example.com',
+                             ip_address='10.0.0.1')
+        with mock.patch.object(LoginAttempt.objects, 'bulk_create',
+                               side_effect=DatabaseError('down')):
+            with self.assertRaises(DatabaseError):
+                self.sink.flush()
+
+        # The held batch goes first, then the rest of the queue
+        self.assertEqual(self.sink.flush(), 3)
+        self.assertEqual(
+            sorted(LoginAttempt.objects.values_list('email', flat=True)),
+            [f'user{index}@example.com' for index in range(3)])
+        self.assertEqual(self.sink.flush(), 0)
+
+    def test_one_flush_at_a_time(self):
+        self.sink.record(email='user0@example.com', ip_address='10.0.0.1')
+        lock = self.sink.get_connection().lock(
+            f'{self.key}:flush_lock', timeout=60)
+        self.assertTrue(lock.acquire(blocking=False))
+        self.addCleanup(lock.release)
+        self.assertEqual(self.sink.flush(), 0)
+        self.assertFalse(LoginAttempt.objects.exists())
+
+    def test_rejected_records_do_not_block_the_queue(self):
+        kept, deleted = create_user(1), create_user(2)
+        self.sink.record(user=kept, email=kept.email, ip_address='10.0.0.1')
+        self.sink.record(user=deleted, email=deleted.email,
+                         ip_address='10.0.0.1')
+        # Deleted before the flush, so its attempt fails the foreign key
+        # when the batch commits
+        deleted.delete()
+        connection = self.sink.get_connection()
+        connection.rpush(self.key, 'not json')
+        self.sink.record(email='user3@example.com', ip_address='10.0.0.1')
+
+        self.assertEqual(self.sink.flush(), 3)
+        self.assertEqual(dict(LoginAttempt.objects.values_list(
+            'email', 'user_id')), {
+                kept.email: kept.pk, 'user2@example.com': None,
+                'user3@example.com': None})
+        self.assertEqual(connection.lrange(f'{self.key}:dead', 0, -1),
+                         [b'not json'])
+        self.assertFalse(connection.exists(self.key, f'{self.key}:processing'))
+        self.assertEqual(self.sink.flush(), 0)
+
+    def test_queue_is_bounded(self):
+        with self.settings(LOGIN_AUDIT={**settings.LOGIN_AUDIT,
+                                        'MAX_QUEUE': 2}):
+            for index in range(3):
+                self.sink.record(email=f'user{index}@example.com',
+                                 ip_address='10.0.0.1')
+        # The newest attempt was dropped
+        self.assertEqual(self.sink.flush(), 2)
+        self.assertEqual(
+            sorted(LoginAttempt.objects.values_list('email', flat=True)),
+            ['user0@example.com', 'user1@example.com'])
+
+
+@override_settings(RESPONSE_CACHE={'ENABLED': False})
+class CachedJWTAuthenticationTests(APITestCase):
+    """
+    JWT requests resolve the user from the cache, and a deactivated or
+    deleted user is refused once the change has committed
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = create_user(0)
+
+    def setUp(self):
+        invalidate_cached_users([self.user.pk])
+        self.header = f'Bearer {AccessToken.for_user(self.user)}'
+
+    def authenticate(self):
+        request = APIRequestFactory().get(
+            '/', HTTP_AUTHORIZATION=self.header)
+        user, _ = CachedJWTAuthentication().authenticate(request)
+        return user
+
+    def assertRefused(self, code):
+        with self.assertRaises(AuthenticationFailed) as cm:
+            self.authenticate()
+        self.assertEqual(cm.exception.detail['code'], code)
+
+    def test_user_is_cached(self):
+        with self.assertNumQueries(1):
+            user = self.authenticate()
+        self.assertIsInstance(user, CachedUser)
+        with self.assertNumQueries(0):
+            self.assertEqual(self.authenticate(), self.user)
+
+    def test_deactivated_user_is_refused(self):
+        self.authenticate()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.is_active = False
+            self.user.save(update_fields=['is_active'])
+        self.assertRefused('user_inactive')
+
+        response = self.client.get(
+            reverse('accounts:current-user'), HTTP_AUTHORIZATION=self.header)
+        self.assertEqual(response.status_code, 401)
+
+    def test_bulk_update_needs_invalidation(self):
+        self.authenticate()
+        User.objects.filter(pk=self.user.pk).update(is_active=False)
+        invalidate_cached_users([self.user.pk])
+        self.assertRefused('user_inactive')
+
+    def test_deleted_user_is_refused(self):
+        self.authenticate()
+        with self.captureOnCommitCallbacks(execute=True):
+            User.objects.get(pk=self.user.pk).delete()
+        self.assertRefused('user_not_found')
+
+
+class ResponseCacheTests(APITestCase):
+    """
+    Cached responses are keyed on the user or role, go stale when a write
+    invalidates their tags, and are counted per view
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.citizen = create_user(0)
+        cls.other_citizen = create_user(1)
+        cls.officer = create_user(2, role=User.UserRole.FUND_OFFICER)
+        cls.fund_admin = create_user(3, role=User.UserRole.FUND_ADMIN)
+        cls.superadmin = create_user(4, role=User.UserRole.SUPERADMIN)
+
+    def setUp(self):
+        prefix = f'test:api:{uuid.uuid4().hex}'
+        settings = override_settings(RESPONSE_CACHE={
+            'ENABLED': True, 'KEY_PREFIX': prefix,
+            'STATS_KEY': f'{prefix}:stats', 'STATS_FLUSH_INTERVAL': 0})
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+    def get(self, user, url):
+        self.client.force_authenticate(user)
+        return self.client.get(url)
+
+    def assertCached(self, response, cached):
+        self.assertEqual(response.status_code, 200, response.data)
+        self.assertEqual(response['X-Cache'], 'HIT' if cached else 'MISS')
+
+    def test_me_is_per_user(self):
+        url = reverse('accounts:current-user')
+        for user in (self.citizen, self.other_citizen):
+            response = self.get(user, url)
+            self.assertCached(response, False)
+            self.assertEqual(response.data['email'], user.email)
+            response = self.get(user, url)
+            self.assertCached(response, True)
+            self.assertEqual(response.data['email'], user.email)
+
+    def test_stats_are_per_role(self):
+        url = reverse('accounts:user-stats')
+        self.assertCached(self.get(self.fund_admin, url), False)
+        self.assertCached(self.get(self.fund_admin, url), True)
+        # Another role has its own entry, and no role without permission
+        # is ever served one
+        self.assertCached(self.get(self.superadmin, url), False)
+        self.assertEqual(self.get(self.citizen, url).status_code, 403)
+
+    def test_users_by_role_is_per_role(self):
+        url = reverse('accounts:users-by-role', args=['citizen'])
+        self.assertCached(self.get(self.officer, url), False)
+        self.assertCached(self.get(self.officer, url), True)
+        self.assertCached(self.get(self.fund_admin, url), False)
+        self.assertEqual(self.get(self.citizen, url).status_code, 403)
+
+    def test_writes_invalidate(self):
+        me = reverse('accounts:current-user')
+        by_role = reverse('accounts:users-by-role', args=['citizen'])
+        stats = reverse('accounts:user-stats')
+        for user, url in [(self.citizen, me), (self.officer, by_role),
+                          (self.fund_admin, stats)]:
+            self.get(user, url)
+            self.assertCached(self.get(user, url), True)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.citizen.first_name = 'Renamed'
+            self.citizen.save()
+        response = self.get(self.citizen, me)
+        self.assertCached(response, False)
+        self.assertEqual(response.data['first_name'], 'Renamed')
+        self.assertCached(self.get(self.officer, by_role), False)
+        self.assertCached(self.get(self.officer, by_role), True)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            User.objects.get(pk=self.other_citizen.pk).delete()
+        response = self.get(self.officer, by_role)
+        self.assertCached(response, False)
+        self.assertNotIn(self.other_citizen.email,
+                         [user['email'] for user in response.data['results']])
+        # The deletion changed the counters
+        self.assertCached(self.get(self.fund_admin, stats), False)
+
+    def test_counters(self):
+        url = reverse('accounts:current-user')
+        for _ in range(3):
+            self.get(self.citizen, url)
+        self.get(self.other_citizen, url)
+        self.assertEqual(get_response_cache_stats()['CurrentUserView.get'], {
+            'hits': 2, 'misses': 2, 'hit_ratio': 0.5})
+
+    def test_tag_versions_expire(self):
+        self.get(self.citizen, reverse('accounts:current-user'))
+        with self.captureOnCommitCallbacks(execute=True):
+            self.other_citizen.save()
+        cache = caches['default']
+        for tag in (f'user:{self.citizen.pk}',
+                    f'user:{self.other_citizen.pk}'):
+            ttl = get_redis_connection('default').ttl(
+                cache.make_key(tag_key(tag)))
+            # Outlives any cached view (300s) but not forever
+            self.assertGreater(ttl, 300)
+            self.assertLessEqual(ttl, 3600)
+
+
+class UserStatsTests(TestCase):
+    """
+    The stored counters follow user writes by deltas and match a fresh
+    count
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = create_user(0)
+
+    def setUp(self):
+        reconcile_user_stats()
+
+    def assertStatsExact(self):
+        self.assertEqual(get_user_stats(), compute_user_stats())
+
+    def test_stat_deltas(self):
+        citizen = {'role': 'citizen', 'is_active': True, 'is_verified': False}
+        officer = {**citizen, 'role': 'fund_officer'}
+        self.assertEqual(stat_deltas(citizen, officer),
+                         {'citizens': -1, 'fund_officers': 1})
+        self.assertEqual(stat_deltas(None, citizen), {
+            'total_users': 1, 'active_users': 1, 'citizens': 1})
+        self.assertEqual(stat_deltas(citizen, {**citizen, 'is_active': False}),
+                         {'active_users': -1})
+        self.assertEqual(stat_deltas(citizen, citizen), {})
+
+    def test_counters_follow_writes(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            other = create_user(1)
+        self.assertStatsExact()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.role = User.UserRole.FUND_OFFICER
+            self.user.is_verified = True
+            self.user.save()
+        self.assertStatsExact()
+
+        # Only the listed field is written, and counted
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.is_active = False
+            self.user.role = User.UserRole.CITIZEN
+            self.user.save(update_fields=['is_active'])
+        self.assertStatsExact()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            User.objects.get(pk=other.pk).save(update_fields=['first_name'])
+        self.assertStatsExact()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            User.objects.get(pk=other.pk).delete()
+        self.assertStatsExact()
+
+    def test_missing_counters_are_rebuilt(self):
+        get_connection().delete(STATS_KEY)
+        with self.assertNumQueries(1):
+            stats = get_user_stats()
+        self.assertEqual(stats, compute_user_stats())
+        with self.assertNumQueries(0):
+            self.assertEqual(get_user_stats(), stats)
+
+
+@override_settings(RESPONSE_CACHE={'ENABLED': False})
+class KeysetPaginationTests(APITestCase):
+    """
+    Cursor pages cover every row once, in order, including rows that tie
+    on the sort key, and bad cursors are a 404
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = create_user(0, role=User.UserRole.SUPERADMIN)
+        for index in range(1, 12):
+            create_user(index)
+        # Ties on date_joined are broken by id
+        joined = timezone.now() - timedelta(days=1)
+        User.objects.filter(pk__in=User.objects.order_by('pk').values(
+            'pk')[3:8]).update(date_joined=joined)
+        cls.expected = list(User.objects.order_by(
+            '-date_joined', '-id').values_list('pk', flat=True))
+
+    def setUp(self):
+        self.client.force_authenticate(self.admin)
+        self.url = reverse('accounts:user-list-create')
+
+    def get(self, url, **params):
+        response = self.client.get(url, params)
+        self.assertEqual(response.status_code, 200, response.data)
+        return response.data
+
+    def cursor(self, payload):
+        return urlsafe_b64encode(json.dumps(payload).encode()).decode()
+
+    def test_pages_cover_rows_once_in_order(self):
+        seen = []
+        url = self.url
+        pages = []
+        params = {'page_size': 5}
+        while url:
+            with CaptureQueriesContext(connection) as queries:
+                data = self.get(url, **params)
+            # One range scan of the user table and no COUNT(*)
+            user_queries = [query['sql'] for query in queries
+                            if 'FROM "accounts_user" ' in query['sql']]
+            self.assertEqual(len(user_queries), 1)
+            self.assertNotIn('COUNT(', user_queries[0])
+            params = {}
+            pages.append(data)
+            seen += [user['id'] for user in data['results']]
+            url = data['next']
+        self.assertEqual(seen, self.expected)
+        self.assertNotIn('count', pages[0])
+
+        previous = self.get(pages[-1]['previous'])
+        self.assertEqual([user['id'] for user in previous['results']],
+                         self.expected[5:10])
+
+    def test_page_numbers_still_work(self):
+        data = self.get(self.url, page=2, page_size=5)
+        self.assertEqual(data['count'], len(self.expected))
+        self.assertEqual([user['id'] for user in data['results']],
+                         self.expected[5:10])
+
+    def test_tampered_cursor_is_not_found(self):
+        joined = timezone.now().isoformat()
+        for cursor in (
+            'not-base64!', urlsafe_b64encode(b'not json').decode(),
+            self.cursor(['not', 'a dict']),
+            self.cursor({'p': [joined], 'r': 0}),
+            self.cursor({'p': ['not a date', 1], 'r': 0}),
+            self.cursor({'p': [joined, 'not an id'], 'r': 0}),
+            self.cursor({'p': [{'a': 1}, 1], 'r': 0}),
+            self.cursor({'p': [joined, [1]], 'r': 0}),
+        ):
+            response = self.client.get(self.url, {'cursor': cursor})
+            self.assertEqual(response.status_code, 404, cursor)
+
+
+@override_settings(RESPONSE_CACHE={'ENABLED': False})
+class LoginAttemptExportTests(APITestCase):
+    """
+    The export streams the filtered attempts as NDJSON or CSV, reads its
+    rows under the view's replica routing though they are only fetched
+    once the view has returned, and stays an async stream under ASGI
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = create_user(0, role=User.UserRole.SUPERADMIN)
+        cls.user = create_user(1)
+        now = timezone.now()
+        LoginAttempt.objects.bulk_create([
+            LoginAttempt(user=cls.user, email=cls.user.email,
+                         ip_address='10.0.0.1', method='web',
+                         successful=True, timestamp=now),
+            LoginAttempt(user=cls.user, email=cls.user.email,
+                         ip_address='10.0.0.2', method='web',
+                         successful=False,
+                         timestamp=now - timedelta(hours=5)),
+            LoginAttempt(email='nobody@example.com', ip_address='10.0.0.3',
+                         method='ussd', successful=False,
+                         timestamp=now - timedelta(minutes=5)),
+        ])
+        cls.url = reverse('accounts:login-attempts-export')
+
+    def setUp(self):
+        self.client.force_authenticate(self.admin)
+
+    def export(self, **params):
+        response = self.client.get(self.url, params)
+        self.assertEqual(response.status_code, 200)
+        return response, b''.join(response.streaming_content).decode()
+
+    def addresses(self, **params):
+        response, body = self.export(**params)
+        return [json.loads(line)['ip_address'] for line in body.splitlines()]
+
+    def test_ndjson(self):
+        response, body = self.export()
+        self.assertEqual(response['Content-Type'],
+                         'application/x-ndjson; charset=utf-8')
+        self.assertRegex(response['Content-Disposition'],
+                         r'^attachment; filename="login-attempts-\d{14}'
+                         r'\.ndjson"$')
+        rows = [json.loads(line) for line in body.splitlines()]
+        self.assertEqual([row['ip_address'] for row in rows],
+                         ['10.0.0.1', '10.0.0.3', '10.0.0.2'])
+        self.assertEqual(set(rows[0]), {
+            'id', 'email', 'ip_address', 'method', 'successful',
+            'timestamp', 'user_agent'})
+        self.assertIs(rows[0]['successful'], True)
+
+    def test_filters(self):
+        self.assertEqual(self.addresses(user_id=self.user.pk),
+                         ['10.0.0.1', '10.0.0.2'])
+        self.assertEqual(self.addresses(successful='false'),
+                         ['10.0.0.3', '10.0.0.2'])
+        self.assertEqual(self.addresses(hours=1), ['10.0.0.1', '10.0.0.3'])
+        self.assertEqual(self.addresses(
+            user_id=self.user.pk, successful='false', hours=1), [])
+
+    def test_csv(self):
+        response, body = self.export(format='csv', successful='true')
+        self.assertEqual(response['Content-Type'], 'text/csv; charset=utf-8')
+        self.assertTrue(response['Content-Disposition'].endswith('.csv"'))
+        rows = list(csv.reader(io.StringIO(body)))
+        self.assertEqual(rows[0], [
+            'id', 'email', 'ip_address', 'method', 'successful',
+            'timestamp', 'user_agent'])
+        self.assertEqual(len(rows), 2)
+        self.assertEqual(rows[1][1:5],
+                         [self.user.email, '10.0.0.1', 'web', 'True'])
+
+        response = self.client.get(self.url, HTTP_ACCEPT='text/csv')
+        self.assertEqual(response['Content-Type'], 'text/csv; charset=utf-8')
+
+    def route_reads(self):
+        routed = []
+
+        def db_for_read(router, model, **hints):
+            if model is LoginAttempt:
+                routed.append(replica_reads_enabled())
+            return 'default'
+        patcher = mock.patch.object(
+            ReplicaRouter, 'db_for_read', autospec=True,
+            side_effect=db_for_read)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        return routed
+
+    def test_rows_are_read_under_replica_routing(self):
+        routed = self.route_reads()
+        response = self.client.get(self.url)
+        self.assertEqual(len(list(response.streaming_content)), 3)
+        self.assertEqual(set(routed), {True})
+
+    async def test_asgi_streams_asynchronously(self):
+        routed = self.route_reads()
+        token = AccessToken.for_user(self.admin)
+        response = await AsyncClient().get(
+            self.url, headers={'Authorization': f'Bearer {token}'})
+        self.assertEqual(response.status_code, 200)
+        # Not an iterator Django would read into memory first
+        self.assertTrue(response.is_async)
+        rows = [json.loads(chunk) async for chunk in
+                response.streaming_content]
+        self.assertEqual(len(rows), 3)
+        self.assertEqual(set(routed), {True})
+
+
+class LoginAttemptPartitionTests(TestCase):
+    """
+    Monthly partitions are created ahead without overlapping the
+    pre-partitioning table
+    """
+
+    def partitions(self):
+        with connection.cursor() as cursor:
+            return dict(list_partitions(cursor))
+
+    def test_partitions_start_at_legacy_bound(self):
+        bound = self.partitions()[LEGACY_PARTITION]
+        # Months the legacy partition covers are skipped; migration 0006
+        # made the three after it
+        created = ensure_partitions(now=add_months(bound, -2),
+                                    months_ahead=5)
+        self.assertEqual(created, [
+            f'accounts_login_attempt_p{add_months(bound, 3):%Y_%m}'])
+        self.assertEqual(ensure_partitions(now=add_months(bound, -2),
+                                           months_ahead=5), [])
+
+        LoginAttempt.objects.bulk_create([
+            LoginAttempt(email='old@example.com', ip_address='10.0.0.1',
+                         successful=False,
+                         timestamp=bound - timedelta(days=40)),
+            LoginAttempt(email='new@example.com', ip_address='10.0.0.1',
+                         successful=False,
+                         timestamp=add_months(bound, 2)),
+        ])
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'SELECT email, tableoid::regclass::text '
+                'FROM accounts_login_attempt ORDER BY email')
+            self.assertEqual(cursor.fetchall(), [
+                ('new@example.com',
+                 f'accounts_login_attempt_p{add_months(bound, 2):%Y_%m}'),
+                ('old@example.com', LEGACY_PARTITION),
+            ])
+
+
+@override_settings(RESPONSE_CACHE={'ENABLED': False})
+class BulkUserActionTests(APITestCase):
+    """
+    Bulk actions accept only a JSON list of integer ids
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = create_user(0, role=User.UserRole.SUPERADMIN)
+        cls.users = [create_user(index) for index in (1, 2, 3)]
+
+    def setUp(self):
+        self.client.force_authenticate(self.admin)
+        self.url = reverse('accounts:bulk-user-action')
+
+    def post(self, user_ids, action='deactivate'):
+        return self.client.post(
+            self.url, {'action': action, 'user_ids': user_ids},
+            format='json')
+
+    def test_malformed_user_ids_are_rejected(self):
+        for user_ids in ('123', str(self.users[0].pk), [True], [1.5],
+                         [str(self.users[0].pk)], [None], [[1]],
+                         {'1': 1}):
+            response = self.post(user_ids, action='delete')
+            self.assertEqual(response.status_code, 400, user_ids)
+        self.assertFalse(BulkUserJob.objects.exists())
+        self.assertEqual(User.objects.count(), 4)
+
+    def test_job_acts_on_listed_users(self):
+        first, second, third = (user.pk for user in self.users)
+        response = self.post([third, first, third])
+        self.assertEqual(response.status_code, 202, response.data)
+        job = BulkUserJob.objects.get()
+        self.assertEqual(job.user_ids, sorted([first, third]))
+
+        run_bulk_user_job(job.id)
+        job.refresh_from_db()
+        self.assertEqual(job.status, BulkUserJob.Status.COMPLETED)
+        self.assertEqual(job.affected, 2)
+        self.assertEqual(
+            set(User.objects.filter(is_active=False).values_list(
+                'pk', flat=True)), {first, third})
+
+
+class CitizenImportTests(TestCase):
+    """
+    NDJSON values keep their JSON types; anything but text and numbers
+    is a row error rather than a crash
+    """
+
+    def run_import(self, rows):
+        lines = [json.dumps(row) + '\n' for row in rows]
+        with CitizenImporter(chunk_size=10, workers=1) as importer:
+            return importer.run(lines, 'ndjson')
+
+    def row(self, index, **values):
+        return {
+            'email': f'import{index}@example.com',
+            'phone_number': f'07120003{index:02d}',
+            'first_name': 'Import', 'last_name': f'User{index}',
+            **values,
+        }
+
+    def test_typed_values(self):
+        summary = self.run_import([
+            self.row(0, phone_number=712000300, sms_notifications=False),
+            self.row(1, password=12345678),
+            self.row(2, first_name={'name': 'Import'}),
+            self.row(3, location=['Nairobi']),
+            self.row(4, last_name=None),
+        ])
+        self.assertEqual((summary['rows'], summary['created']), (5, 2))
+        self.assertEqual(summary['errors'], [
+            {'row': 2, 'errors': {'password': ['Must be a string.']}},
+            {'row': 3, 'errors': {
+                'first_name': ['Must be a string or number.']}},
+            {'row': 4, 'errors': {
+                'location': ['Must be a string or number.']}},
+        ])
+        user = User.objects.get(email='import0@example.com')
+        self.assertEqual(user.phone_e164, '+254712000300')
+        self.assertFalse(user.profile.sms_notifications)
+        self.assertFalse(user.has_usable_password())
+
+
+class CitizenImportJobTests(APITestCase):
+    """
+    Uploads are stored and imported by a background job, never inside
+    the request
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = create_user(0, role=User.UserRole.SUPERADMIN)
+
+    def setUp(self):
+        self.client.force_authenticate(self.admin)
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        settings = override_settings(MEDIA_ROOT=media.name)
+        settings.enable()
+        self.addCleanup(settings.disable)
+        self.media = media.name
+
+    def upload(self, name, content):
+        return self.client.post(reverse('accounts:import-citizens'), {
+            'file': SimpleUploadedFile(name, content)}, format='multipart')
+
+    def stored_files(self):
+        return [name for _, _, names in os.walk(self.media) for name in names]
+
+    def test_import_runs_in_background(self):
+        users = User.objects.count()
+        with mock.patch.object(CitizenImporter, 'run') as run:
+            response = self.upload('citizens.csv', (
+                'email,phone_number,first_name,last_name,password\n'
+                'job0@example.com,0712000400,Job,User0,Imp0rt-pass-0\n'
+                'not-an-email,0712000401,Job,User1,\n').encode())
+        self.assertEqual(response.status_code, 202, response.data)
+        run.assert_not_called()
+        self.assertEqual(User.objects.count(), users)
+        self.assertEqual(response.data['status'], 'pending')
+        self.assertEqual(len(self.stored_files()), 1)
+
+        run_citizen_import_job(response.data['id'])
+        job = self.client.get(response.data['status_url']).json()
+        self.assertEqual(job['status'], 'completed')
+        self.assertEqual(
+            (job['rows'], job['created'], job['error_count']), (2, 1, 1))
+        self.assertEqual(job['errors'][0]['row'], 2)
+        self.assertTrue(User.objects.get(
+            email='job0@example.com').check_password('Imp0rt-pass-0'))
+        # The upload is removed once imported
+        self.assertEqual(self.stored_files(), [])
+
+    def test_unreadable_file_fails_the_job(self):
+        response = self.upload('citizens.ndjson', b'{"email": "\xff"}\n')
+        self.assertEqual(response.data['format'], 'ndjson')
+        run_citizen_import_job(response.data['id'])
+        job = CitizenImportJob.objects.get(id=response.data['id'])
+        self.assertEqual(job.status, CitizenImportJob.Status.FAILED)
+        self.assertEqual(list(job.errors[-1]['errors']), ['file'])
+        self.assertEqual(self.stored_files(), [])
+
+
+class BurstThrottle(GCRAThrottle):
+    rate = '3/s'
+
+    def get_cache_key(self, request, view):
+        return self.cache_format % {
+            'scope': 'test', 'ident': request.META['HTTP_X_TEST_KEY']}
+
+
+class GCRAThrottleTests(TestCase):
+    """
+    A rate of N/period admits a burst of N, then one request per
+    period / N
+    """
+
+    def setUp(self):
+        self.request = Request(APIRequestFactory().get(
+            '/', HTTP_X_TEST_KEY=uuid.uuid4().hex))
+
+    def allow(self, throttle=None):
+        throttle = throttle or BurstThrottle()
+        return throttle.allow_request(self.request, None), throttle
+
+    def test_burst_then_steady_rate(self):
+        for _ in range(3):
+            self.assertTrue(self.allow()[0])
+        allowed, throttle = self.allow()
+        self.assertFalse(allowed)
+        # The next slot is one emission interval after the burst began
+        self.assertGreater(throttle.wait(), 0)
+        self.assertLessEqual(throttle.wait(), 0.334)
+
+        time.sleep(throttle.wait())
+        self.assertTrue(self.allow()[0])
+        self.assertFalse(self.allow()[0])
+
+    def test_key_expires_with_arrival_time(self):
+        allowed, throttle = self.allow()
+        self.assertTrue(allowed)
+        connection = get_redis_connection(get_throttle_cache_alias())
+        # One interval ahead of now; no state outlives the period
+        self.assertLessEqual(connection.pttl(throttle.key), 334)
+        self.assertGreater(connection.pttl(throttle.key), 0)
+
+    def test_redis_error_allows(self):
+        with mock.patch('apps.accounts.throttling.get_gcra_script',
+                        side_effect=ConnectionError):
+            for _ in range(5):
+                self.assertTrue(self.allow()[0])
+
+    def test_client_address_is_the_ident(self):
+        def login_allowed(**extra):
+            request = Request(APIRequestFactory().post('/', **extra))
+            return LoginRateThrottle().allow_request(request, None)
+
+        address = random_address()
+        with mock.patch.object(
+                LoginRateThrottle, 'rate', '2/min', create=True):
+            # A fresh X-Forwarded-For each time is still the same bucket
+            self.assertEqual([
+                login_allowed(REMOTE_ADDR=address,
+                              HTTP_X_FORWARDED_FOR=random_address())
+                for _ in range(3)], [True, True, False])
+
+            # Behind a trusted proxy, X-Real-IP is the client
+            with self.settings(TRUSTED_PROXIES=[address]):
+                self.assertTrue(login_allowed(
+                    REMOTE_ADDR=address, HTTP_X_REAL_IP=random_address()))
+
+
+@override_settings(RESPONSE_CACHE={'ENABLED': False})
+class ConditionalRequestTests(APITestCase):
+    """
+    304 and 412 are answered from the validator query alone, and a
+    successful write hands back the validators of the new state
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = create_user(0)
+        cls.other = create_user(1)
+
+    def setUp(self):
+        self.client.force_authenticate(self.user)
+
+    def test_not_modified(self):
+        url = reverse('accounts:current-user')
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        etag = response['ETag']
+        self.assertIn('Last-Modified', response)
+
+        with self.assertNumQueries(1):
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+        # The representation embeds the profile, so its changes count
+        UserProfile.objects.filter(user=self.user).update(
+            bio='Changed', updated_at=timezone.now())
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_if_match_chains_writes(self):
+        url = reverse('accounts:user-profile')
+        etag = self.client.get(url)['ETag']
+
+        response = self.client.patch(
+            url, {'bio': 'First'}, format='json', HTTP_IF_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        new_etag = response['ETag']
+        self.assertNotEqual(new_etag, etag)
+
+        # A client still holding the old state loses, after only the
+        # validator query (inside the write's transaction)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.patch(
+                url, {'bio': 'Stale'}, format='json', HTTP_IF_MATCH=etag)
+        self.assertEqual(response.status_code, 412)
+        self.assertEqual(len([
+            query for query in queries
+            if 'SAVEPOINT' not in query['sql']]), 1)
+        self.assertEqual(
+            UserProfile.objects.get(user=self.user).bio, 'First')
+
+        response = self.client.patch(
+            url, {'bio': 'Second'}, format='json', HTTP_IF_MATCH=new_etag)
+        self.assertEqual(response.status_code, 200)
+
+    def test_other_users_record_gets_no_validators(self):
+        etag = self.client.get(reverse('accounts:current-user'))['ETag']
+        response = self.client.get(
+            reverse('accounts:user-detail', args=[self.other.pk]),
+            HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 403)
+        self.assertNotIn('ETag', response)
+
+
+class CacheTierTests(TestCase):
+    """
+    Only the configured key prefixes use the local tier and publish
+    invalidations; sessions go straight to Redis
+    """
+
+    def setUp(self):
+        self.cache = caches['default']
+        tier = self.cache.local
+        for _ in range(100):
+            if tier.connected:
+                break
+            time.sleep(0.02)
+        self.assertTrue(tier.connected)
+        self.pubsub = tier.redis.pubsub()
+        self.pubsub.subscribe(self.cache.channel)
+        self.addCleanup(self.pubsub.close)
+        self.pubsub.get_message(timeout=1)  # subscribe confirmation
+
+    def published(self):
+        keys = []
+        while message := self.pubsub.get_message(timeout=0.2):
+            keys += json.loads(message['data'])['keys']
+        return keys
+
+    def test_only_local_keys_are_published(self):
+        suffix = uuid.uuid4().hex
+        self.cache.set(f'django.contrib.sessions.cache{suffix}', {'a': 1})
+        self.cache.delete(f'db:pin:{suffix}')
+        self.assertEqual(self.published(), [])
+
+        self.cache.set(f'api:tag:{suffix}', 'v1')
+        self.cache.delete_many([f'api:tag:{suffix}', f'db:pin:{suffix}'])
+        key = self.cache.make_key(f'api:tag:{suffix}')
+        self.assertEqual(self.published(), [key, key])
+
+    def test_only_local_keys_are_kept(self):
+        suffix = uuid.uuid4().hex
+        local, other = f'api:tag:{suffix}', f'db:pin:{suffix}'
+        self.cache.set_many({local: 'v1', other: 1})
+        self.assertEqual(
+            self.cache.get_many([local, other, 'missing']),
+            {local: 'v1', other: 1})
+        entries = self.cache.local.entries
+        self.assertIsNotNone(entries.get(self.cache.make_key(local)))
+        self.assertIsNone(entries.get(self.cache.make_key(other)))
+        self.assertEqual(self.cache.get(other), 1)
+        self.assertIsNone(entries.get(self.cache.make_key(other)))
+
+
+class ForkedConnectionTests(TransactionTestCase):
+    """
+    A forked child drops the pools and connections it inherited, leaving
+    the parent's sockets working
+    """
+
+    def run_in_child(self, check):
+        read, write = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            try:
+                ok = check()
+            except BaseException:
+                ok = False
+            os.write(write, b'1' if ok else b'0')
+            os._exit(0)
+        os.close(write)
+        result = os.read(read, 1)
+        os.close(read)
+        os.waitpid(pid, 0)
+        return result == b'1'
+
+    def test_child_drops_inherited_connections(self):
+        from django.db.backends.postgresql.base import DatabaseWrapper
+        from psycopg_pool import ConnectionPool
+
+        params = connection.get_connection_params()
+        pool = ConnectionPool(kwargs={
+            name: params[name]
+            for name in ('dbname', 'user', 'password', 'host', 'port')
+            if name in params}, min_size=1, max_size=1, open=True)
+        self.addCleanup(pool.close)
+        pool.wait()
+        pools = DatabaseWrapper._connection_pools
+        pools['forked-test'] = pool
+        self.addCleanup(pools.pop, 'forked-test', None)
+        connection.ensure_connection()
+        parent = connection.connection
+
+        def check():
+            inherited = smartfunds_db._inherited
+            dropped = (connection.connection is None and
+                       'forked-test' not in pools and
+                       parent in inherited and pool in inherited)
+            # The child opens its own connection
+            with connection.cursor() as cursor:
+                cursor.execute('SELECT 1')
+            own = connection.connection is not parent
+            connection.close()
+            return dropped and own
+
+        self.assertTrue(self.run_in_child(check))
+        # Nothing the child did closed the parent's sockets
+        self.assertIs(connection.connection, parent)
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT 1')
+        with pool.connection() as pooled:
+            self.assertEqual(pooled.execute('SELECT 1').fetchone(), (1,))
+
+
+class AuthCacheInvalidationTests(TransactionTestCase):
+    """
+    A user cached by another process is dropped there as soon as it is
+    invalidated here, not when its local copy expires
+    """
+
+    def wait_until(self, check, timeout=2):
+        deadline = time.monotonic() + timeout
+        while not check():
+            if time.monotonic() > deadline:
+                return False
+            time.sleep(0.02)
+        return True
+
+    def test_invalidation_reaches_other_processes(self):
+        user = create_user(0)
+        invalidate_cached_users([user.pk])
+        cache = caches['default']
+        key = cache.make_key(f'accounts:auth_user:{user.pk}')
+        from_parent, to_child = os.pipe()
+        from_child, to_parent = os.pipe()
+
+        pid = os.fork()
+        if pid == 0:
+            ok = False
+            try:
+                tier = cache.local
+                # The first read fills Redis, the second this process's
+                # local tier
+                ok = (self.wait_until(lambda: tier.connected) and
+                      get_cached_user(user.pk).is_active and
+                      get_cached_user(user.pk).is_active and
+                      tier.get(key) is not MISSING)
+                os.write(to_parent, b'1')
+                os.read(from_parent, 1)
+                # Well within the local tier's TIMEOUT
+                ok = ok and self.wait_until(
+                    lambda: not get_cached_user(user.pk).is_active,
+                    timeout=1)
+                connection.close()
+            except BaseException:
+                ok = False
+            os.write(to_parent, b'1' if ok else b'0')
+            os._exit(0)
+
+        try:
+            os.read(from_child, 1)
+            User.objects.filter(pk=user.pk).update(is_active=False)
+            invalidate_cached_users([user.pk])
+            os.write(to_child, b'1')
+            result = os.read(from_child, 1)
+        finally:
+            os.waitpid(pid, 0)
+            for fd in (to_child, from_parent, from_child, to_parent):
+                os.close(fd)
+        self.assertEqual(result, b'1')
+
+
+@override_settings(TRANSACTION_POLICY={'BASE_DELAY': 0})
+class TransactionRetryTests(APITransactionTestCase):
+    """
+    Retries reach the shared counters as they happen, not on some later
+    increment in the same process
+    """
+
+    def setUp(self):
+        key = f'test:transaction_retries:{uuid.uuid4().hex}'
+        patcher = mock.patch.object(retry_counters, 'key', key)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.redis = get_redis_connection('default')
+
+    def conflicts(self, count):
+        calls = []
+
+        def work():
+            calls.append(1)
+            if len(calls) <= count:
+                raise OperationalError() from SerializationFailure()
+            return len(calls)
+        return work
+
+    def stored(self):
+        return {field.decode(): int(value) for field, value in
+                self.redis.hgetall(retry_counters.key).items()}
+
+    def test_retries_are_written_through(self):
+        self.assertEqual(run_in_transaction(
+            self.conflicts(2), operation='test'), 3)
+        self.assertEqual(self.stored(), {'test:40001': 2})
+
+    def test_exhausted(self):
+        with self.assertRaises(TransactionConflict):
+            run_in_transaction(self.conflicts(10), operation='test')
+        self.assertEqual(
+            self.stored(), {'test:40001': 4, 'test:exhausted': 1})
+
+        self.client.force_authenticate(
+            create_user(0, role=User.UserRole.SUPERADMIN))
+        response = self.client.get(reverse('accounts:transaction-retry-stats'))
+        self.assertEqual(response.json(), {
+            'test': {'40001': 4, 'exhausted': 1}})
+
+
+class ParityURLs:
+    """
+    Each async view next to the DRF view it stands in for
+    """
+    urlpatterns = [
+        path(f'{prefix}/{name}/', view.as_view())
+        for name, sync_view, async_view in [
+            ('login', views.CustomTokenObtainPairView,
+             AsyncTokenObtainPairView),
+            ('me', views.CurrentUserView, AsyncCurrentUserView),
+            ('profile', views.UserProfileView, AsyncUserProfileView),
+            ('stats', views.UserStatsView, AsyncUserStatsView),
+        ]
+        for prefix, view in [('sync', sync_view), ('async', async_view)]
+    ]
+
+
+@override_settings(ROOT_URLCONF=ParityURLs,
+                   RESPONSE_CACHE={'ENABLED': False},
+                   TRUSTED_PROXIES=['127.0.0.1'])
+class AsyncViewParityTests(TestCase):
+    """
+    Through the ASGI handler, the async views answer like the DRF views
+    they replace
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = create_user(0)
+
+    def setUp(self):
+        self.client = AsyncClient()
+
+    def address(self):
+        # Fresh throttle and lockout keys
+        return '10.22.%d.%d' % tuple(uuid.uuid4().bytes[:2])
+
+    def auth(self, **headers):
+        token = AccessToken.for_user(self.user)
+        return {'headers': {'Authorization': f'Bearer {token}', **headers}}
+
+    async def both(self, method, name, **kwargs):
+        return [
+            await getattr(self.client, method)(f'/{prefix}/{name}/', **kwargs)
+            for prefix in ('sync', 'async')
+        ]
+
+    def assertSame(self, responses, status_code, headers=()):
+        sync, async_ = responses
+        self.assertEqual(sync.status_code, status_code)
+        self.assertEqual(async_.status_code, status_code)
+        if status_code in (304, 412):
+            # Django's bare conditional responses
+            self.assertEqual(sync.content, async_.content)
+        else:
+            self.assertEqual(sync.json(), async_.json())
+        for header in headers:
+            self.assertEqual(sync.get(header), async_.get(header))
+
+    async def test_not_authenticated(self):
+        self.assertSame(await self.both('get', 'me'), 401,
+                        ['WWW-Authenticate'])
+        self.assertSame(
+            await self.both('get', 'me',
+                            headers={'Authorization': 'Bearer nope'}),
+            401, ['WWW-Authenticate'])
+
+    async def test_permission_denied(self):
+        self.assertSame(await self.both('get', 'stats', **self.auth()), 403)
+
+    async def test_throttled(self):
+        with mock.patch.object(
+                LoginRateThrottle, 'rate', '1/min', create=True):
+            for prefix in ('sync', 'async'):
+                login = {
+                    'path': f'/{prefix}/login/',
+                    'data': {'email': self.user.email, 'password': 'wrong'},
+                    'content_type': 'application/json',
+                    'headers': {'X-Real-IP': self.address()},
+                }
+                response = await self.client.post(**login)
+                self.assertEqual(response.status_code, 401)
+                response = await self.client.post(**login)
+                self.assertEqual(response.status_code, 429)
+                self.assertEqual(response['Content-Type'], 'application/json')
+                self.assertGreater(int(response['Retry-After']), 0)
+                self.assertIn('throttled', response.json()['detail'])
+
+    async def test_conditional(self):
+        sync, async_ = await self.both('get', 'me', **self.auth())
+        self.assertSame([sync, async_], 200, ['ETag', 'Last-Modified'])
+        etag = sync['ETag']
+        self.assertSame(await self.both(
+            'get', 'me', **self.auth(**{'If-None-Match': etag})), 304,
+            ['ETag'])
+        self.assertSame(await self.both(
+            'get', 'profile', **self.auth(**{'If-Match': '"stale"'})), 412)
+
+    async def test_login(self):
+        responses = []
+        for prefix in ('sync', 'async'):
+            responses.append(await self.client.post(
+                f'/{prefix}/login/',
+                {'email': self.user.email, 'password': 'pass-1234'},
+                content_type='application/json',
+                headers={'X-Real-IP': self.address()}))
+        for response in responses:
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(set(response.json()), {'access', 'refresh'})
+            token = AccessToken(response.json()['access'])
+            self.assertEqual(token['user_id'], self.user.pk)
+        self.assertEqual(await LoginAttempt.objects.filter(
+            user=self.user, successful=True).acount(), 2)
+
+
+class PasswordHashingPoolTests(APITestCase):
+    """
+    With the pool on (web processes only), hashes are admitted against
+    the shared slots, rejected with a 503 when they are taken, and
+    admitted when Redis can't be asked
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = create_user(0)
+        cls.admin = create_user(1, role=User.UserRole.SUPERADMIN)
+
+    def setUp(self):
+        settings = override_settings(PASSWORD_HASHING={
+            'ENABLED': True, 'MAX_CONCURRENT': 1, 'RETRY_AFTER': 2,
+            'KEY_PREFIX': f'test:hashing:{uuid.uuid4().hex}'})
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+    def login(self):
+        return self.client.post(
+            reverse('accounts:token_obtain_pair'),
+            {'email': self.user.email, 'password': 'pass-1234'},
+            format='json', REMOTE_ADDR='10.23.%d.%d' % tuple(
+                uuid.uuid4().bytes[:2]))
+
+    def counts(self):
+        stats = get_password_hashing_stats()
+        return {name: stats[name] for name in (
+            'admitted', 'rejected', 'failed_open')}
+
+    def assertCounted(self, before, **deltas):
+        after = self.counts()
+        self.assertEqual(
+            {name: after[name] - before[name] for name in after},
+            {'admitted': 0, 'rejected': 0, 'failed_open': 0, **deltas})
+
+    def test_admitted(self):
+        before = self.counts()
+        self.assertEqual(self.login().status_code, 200)
+        self.assertCounted(before, admitted=1)
+        # The slot is given back
+        self.assertEqual(get_password_hashing_stats()['in_flight'], 0)
+
+    def test_saturated(self):
+        password_pool.get_connection().zadd(
+            password_pool.slots_key(), {'other': int(time.time() * 1000)})
+        before = self.counts()
+
+        response = self.login()
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response['Retry-After'], '2')
+        self.assertEqual(response.json()['detail'],
+                         'Too many sign-ins in progress. Please retry shortly.')
+
+        # Outside DRF too, rather than a 500
+        response = self.client.post(reverse('admin:login'), {
+            'username': self.admin.email, 'password': 'pass-1234'})
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response['Retry-After'], '2')
+        self.assertCounted(before, rejected=2)
+
+    def test_fails_open(self):
+        before = self.counts()
+        with mock.patch.object(password_pool, 'get_script',
+                               side_effect=ConnectionError):
+            self.assertEqual(self.login().status_code, 200)
+        self.assertCounted(before, failed_open=1)
+
+    def test_stats_view(self):
+        self.client.force_authenticate(self.admin)
+        response = self.client.get(reverse('accounts:password-hashing-stats'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['max_concurrent'], 1)
+        self.assertEqual(response.data['in_flight'], 0)
+
+    def test_disabled_by_default(self):
+        with override_settings(PASSWORD_HASHING={}), \
+                mock.patch.object(password_pool, 'get_executor') as executor:
+            self.assertEqual(self.login().status_code, 200)
+        executor.assert_not_called()
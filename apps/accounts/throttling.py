@@ -0,0 +1,177 @@
+"""
+GCRA throttles.
+
+DRF's ``SimpleRateThrottle`` keeps a list of request timestamps in the
+cache, so every request reads, trims and writes back the whole history.
+These throttles implement the generic cell rate algorithm as one Redis
+script instead. The only state per key is the theoretical arrival time
+(TAT) of the next request, and each request costs a single round trip.
+
+A rate of ``N/period`` allows bursts of up to N requests and then one
+request every ``period / N``. Denied requests get a ``Retry-After``
+header through DRF's ``Throttled`` handling. ``aallow_request`` runs the
+same script from async views.
+
+Clients are identified by ``smartfunds.proxies.client_address`` rather
+than DRF's ``get_ident``, which takes the whole X-Forwarded-For header
+the client sent, so a forged header would start a fresh bucket.
+"""
+
+import logging
+
+from django.conf import settings
+from rest_framework.throttling import SimpleRateThrottle
+
+from smartfunds.proxies import client_address
+
+logger = logging.getLogger('smartfunds')
+
+# KEYS: TAT key. ARGV: emission interval (ms), burst tolerance (ms).
+# Uses the Redis clock so all web processes share one time source.
+# Returns 0 when the request is allowed, else the ms until it would be.
+GCRA_SCRIPT = """
+local time = redis.call('TIME')
+local now = tonumber(time[1]) * 1000 + math.floor(tonumber(time[2]) / 1000)
+local interval = tonumber(ARGV[1])
+local tolerance = tonumber(ARGV[2])
+local tat = tonumber(redis.call('GET', KEYS[1]) or now)
+if tat < now then tat = now end
+local new_tat = tat + interval
+local allow_at = new_tat - tolerance
+if now < allow_at then
+    return allow_at - now
+end
+redis.call('SET', KEYS[1], new_tat, 'PX', new_tat - now)
+return 0
+"""
+
+_script = None
+
+
+def get_throttle_cache_alias():
+    return getattr(settings, 'THROTTLE_CACHE_ALIAS', 'default')
+
+
+def get_gcra_script():
+    global _script
+    if _script is None:
+        from django_redis import get_redis_connection
+        connection = get_redis_connection(get_throttle_cache_alias())
+        _script = connection.register_script(GCRA_SCRIPT)
+    return _script
+
+
+def get_async_gcra_script():
+    from smartfunds.cache import get_async_redis_connection
+    return get_async_redis_connection(
+        get_throttle_cache_alias()).register_script(GCRA_SCRIPT)
+
+
+class GCRAThrottle(SimpleRateThrottle):
+    """
+    SimpleRateThrottle with the request history replaced by a GCRA
+    arrival time held in Redis
+    """
+    cache_format = 'throttle:gcra:%(scope)s:%(ident)s'
+
+    def allow_request(self, request, view):
+        if self.rate is None:
+            return True
+
+        self.key = self.get_cache_key(request, view)
+        if self.key is None:
+            return True
+
+        try:
+            retry_ms = get_gcra_script()(
+                keys=[self.key], args=self.gcra_args())
+        except Exception:
+            # Availability over strictness, as with IGNORE_EXCEPTIONS
+            logger.warning('Throttle check failed, allowing request',
+                           exc_info=True)
+            return True
+
+        self.retry_after = retry_ms / 1000
+        return not retry_ms
+
+    async def aallow_request(self, request, view):
+        if self.rate is None:
+            return True
+
+        self.key = self.get_cache_key(request, view)
+        if self.key is None:
+            return True
+
+        try:
+            retry_ms = await get_async_gcra_script()(
+                keys=[self.key], args=self.gcra_args())
+        except Exception:
+            logger.warning('Throttle check failed, allowing request',
+                           exc_info=True)
+            return True
+
+        self.retry_after = retry_ms / 1000
+        return not retry_ms
+
+    def get_ident(self, request):
+        return client_address(request)
+
+    def gcra_args(self):
+        interval = self.duration * 1000 // self.num_requests
+        return [interval, self.duration * 1000]
+
+    def wait(self):
+        return self.retry_after
+
+
+class GCRAAnonRateThrottle(GCRAThrottle):
+    """
+    Limit anonymous requests per client IP (the ``anon`` rate)
+    """
+    scope = 'anon'
+
+    def get_cache_key(self, request, view):
+        if request.user and request.user.is_authenticated:
+            return None  # Only throttle unauthenticated requests.
+        return self.cache_format % {
+            'scope': self.scope, 'ident': self.get_ident(request)}
+
+
+class GCRAUserRateThrottle(GCRAThrottle):
+    """
+    Limit requests per user, or per IP for anonymous requests (the
+    ``user`` rate)
+    """
+    scope = 'user'
+
+    def get_cache_key(self, request, view):
+        if request.user and request.user.is_authenticated:
+            ident = request.user.pk
+        else:
+            ident = self.get_ident(request)
+        return self.cache_format % {'scope': self.scope, 'ident': ident}
+
+
+class LoginRateThrottle(GCRAAnonRateThrottle):
+    """
+    Limit login attempts per client IP
+    """
+    scope = 'login'
+
+    def get_cache_key(self, request, view):
+        return self.cache_format % {
+            'scope': self.scope, 'ident': self.get_ident(request)}
+
+
+class SignupRateThrottle(GCRAUserRateThrottle):
+    """
+    Limit account creation per user (or per IP)
+    """
+    scope = 'signup'
+
+
+class PasswordResetRateThrottle(GCRAUserRateThrottle):
+    """
+    Limit password changes and resets per user (or per IP)
+    """
+    scope = 'password_reset'
@@ -1,15 +1,27 @@
+from django.conf import settings
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
 from rest_framework_simplejwt.views import TokenRefreshView, TokenVerifyView
 from .views import (
     CustomTokenObtainPairView, UserListCreateView, UserDetailView,
     CurrentUserView, PasswordChangeView, UserProfileView,
-    UserStatsView, LoginAttemptsView, bulk_user_action,
-    users_by_role,
+    UserStatsView, LoginAttemptsView, LoginAttemptExportView,
+    ResponseCacheStatsView, CacheTierStatsView, DatabasePoolStatsView,
+    TransactionRetryStatsView, PasswordHashingStatsView,
+    bulk_user_action, bulk_user_job, import_citizens_view,
+    citizen_import_job, users_by_role,
 )
 
 app_name = 'accounts'
 
+if settings.ASYNC_VIEWS:
+    from .async_views import (
+        AsyncCurrentUserView as CurrentUserView,
+        AsyncTokenObtainPairView as CustomTokenObtainPairView,
+        AsyncUserProfileView as UserProfileView,
+        AsyncUserStatsView as UserStatsView,
+    )
+
 urlpatterns = [
     # Authentication endpoints
     path('auth/login/', CustomTokenObtainPairView.as_view(),
@@ -23,6 +35,11 @@ urlpatterns = [
     path('users/me/', CurrentUserView.as_view(), name='current-user'),
     path('users/stats/', UserStatsView.as_view(), name='user-stats'),
     path('users/bulk-action/', bulk_user_action, name='bulk-user-action'),
+    path('users/bulk-action/<uuid:job_id>/', bulk_user_job,
+         name='bulk-user-job'),
+    path('users/import/', import_citizens_view, name='import-citizens'),
+    path('users/import/<uuid:job_id>/', citizen_import_job,
+         name='citizen-import-job'),
     path('users/role/<str:role>/', users_by_role, name='users-by-role'),
 
     # Profile and settings
@@ -31,4 +48,16 @@ urlpatterns = [
 
     # Security and monitoring
     path('login-attempts/', LoginAttemptsView.as_view(), name='login-attempts'),
+    path('login-attempts/export/', LoginAttemptExportView.as_view(),
+         name='login-attempts-export'),
+    path('cache/stats/', ResponseCacheStatsView.as_view(),
+         name='response-cache-stats'),
+    path('cache/tiers/', CacheTierStatsView.as_view(),
+         name='cache-tier-stats'),
+    path('db/pool/', DatabasePoolStatsView.as_view(),
+         name='db-pool-stats'),
+    path('db/retries/', TransactionRetryStatsView.as_view(),
+         name='transaction-retry-stats'),
+    path('hashing/stats/', PasswordHashingStatsView.as_view(),
+         name='password-hashing-stats'),
 ]
@@ -1,23 +1,65 @@
 from rest_framework import generics, status, permissions
-from rest_framework.decorators import api_view, permission_classes
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework.decorators import (
+    api_view, parser_classes, permission_classes
+)
+from rest_framework.parsers import MultiPartParser
 from rest_framework.response import Response
 from rest_framework.views import APIView
+from rest_framework_simplejwt.exceptions import InvalidToken, TokenError
 from rest_framework_simplejwt.views import TokenObtainPairView
+from django.conf import settings
 from django.contrib.auth import get_user_model
-from django.db.models import Q, Count
+from django.core.cache import caches
+from django.core.handlers.asgi import ASGIRequest
+from django.db import transaction
+from django.http import StreamingHttpResponse
+from django.shortcuts import get_object_or_404
+from django.urls import reverse
 from django.utils import timezone
 from datetime import timedelta
 
-from .models import UserProfile, LoginAttempt
+from smartfunds.db import get_pool_stats
+from smartfunds.proxies import client_address
+from smartfunds.routers import (
+    ReplicaReadsMixin, areplica_iterator, replica_iterator,
+    replica_reads_enabled, use_replica
+)
+from smartfunds.transactions import (
+    READ_COMMITTED, SERIALIZABLE, get_transaction_retry_stats,
+    transaction_policy
+)
+
+from .audit import get_login_audit_sink
+from .authentication import resolve_user
+from .conditional import conditional, profile_validators, user_validators
+from .export import (
+    CSVRenderer, NDJSONRenderer, aexport_rows, export_rows
+)
+from .hashing import get_password_hashing_stats
+from .imports import FORMATS, detect_format
+from .jobs import get_bulk_action_setting
+from .lockout import login_lockout
+from .models import BulkUserJob, CitizenImportJob, UserProfile, LoginAttempt
 from .serializers import (
     UserSerializer, UserCreateSerializer, UserUpdateSerializer,
     AdminUserUpdateSerializer, PasswordChangeSerializer,
-    UserProfileSerializer, LoginAttemptSerializer, UserStatsSerializer
+    UserProfileSerializer, LoginAttemptSerializer, UserStatsSerializer,
+    UserSummarySerializer, BulkUserJobSerializer, CitizenImportJobSerializer,
+    LoginSerializer
 )
+from .pagination import LoginAttemptPagination, UserPagination
 from .permissions import (
     IsAdminUser, IsOwnerOrAdmin,
     IsSuperAdmin, CanReviewApplications
 )
+from .response_cache import cache_response, get_response_cache_stats
+from .search import search_users
+from .stats import compute_user_stats, get_user_stats
+from .tasks import process_bulk_user_job, process_citizen_import_job
+from .throttling import (
+    LoginRateThrottle, PasswordResetRateThrottle, SignupRateThrottle
+)
 
 User = get_user_model()
 
@@ -26,48 +68,65 @@ class CustomTokenObtainPairView(TokenObtainPairView):
     """
     Custom JWT token view with login attempt tracking
     """
+    serializer_class = LoginSerializer
+    throttle_classes = [LoginRateThrottle]
 
     def post(self, request, *args, **kwargs):
         ip_address = self.get_client_ip(request)
         email = request.data.get('email', '')
-
-        response = super().post(request, *args, **kwargs)
-
-        successful = response.status_code == 200
+        principals = login_lockout.principals(
+            email=email, ip_address=ip_address)
         user = None
 
-        if successful and email:
+        try:
+            # Before validating, so locked out attempts never reach the
+            # password check
+            login_lockout.check(principals)
+            # TokenViewBase.post, keeping hold of the authenticated user
+            serializer = self.get_serializer(data=request.data)
             try:
-                user = User.objects.get(email=email)
-            except User.DoesNotExist:
-                pass
-
-        LoginAttempt.objects.create(
-            user=user,
-            email=email,
-            ip_address=ip_address,
-            method=LoginAttempt.LoginMethod.WEB,
-            successful=successful,
-            user_agent=request.META.get('HTTP_USER_AGENT', '')
-        )
+                serializer.is_valid(raise_exception=True)
+            except AuthenticationFailed:
+                login_lockout.register_failure(principals)
+                raise
+            except TokenError as e:
+                raise InvalidToken(e.args[0])
+            user = serializer.user
+        finally:
+            get_login_audit_sink().record(
+                user=user,
+                email=email,
+                ip_address=ip_address,
+                method=LoginAttempt.LoginMethod.WEB,
+                successful=user is not None,
+                user_agent=request.META.get('HTTP_USER_AGENT', '')
+            )
 
-        return response
+        login_lockout.register_success(principals)
+        return Response(serializer.validated_data, status=status.HTTP_200_OK)
 
     def get_client_ip(self, request):
-        x_forwarded_for = request.META.get('HTTP_X_FORWARDED_FOR')
-        if x_forwarded_for:
-            ip = x_forwarded_for.split(',')[0]
-        else:
-            ip = request.META.get('REMOTE_ADDR')
-        return ip
+        # Not X-Forwarded-For: nginx appends to whatever the client sent
+        return client_address(request)
 
 
-class UserListCreateView(generics.ListCreateAPIView):
+class UserListCreateView(ReplicaReadsMixin, generics.ListCreateAPIView):
     """
     List all users or create a new user
     """
     queryset = User.objects.all()
     permission_classes = [IsAdminUser]
+    pagination_class = UserPagination
+
+    @transaction_policy(READ_COMMITTED)
+    def post(self, request, *args, **kwargs):
+        return super().post(request, *args, **kwargs)
+
+    def get_throttles(self):
+        throttles = super().get_throttles()
+        if self.request.method == 'POST':
+            throttles.append(SignupRateThrottle())
+        return throttles
 
     def get_serializer_class(self):
         if self.request.method == 'POST':
@@ -87,17 +146,12 @@ class UserListCreateView(generics.ListCreateAPIView):
         if is_active is not None:
             queryset = queryset.filter(is_active=is_active.lower() == 'true')
 
-        # Search functionality
+        # Search functionality (ranked, index backed)
         search = self.request.query_params.get('search')
         if search:
-            queryset = queryset.filter(
-                Q(email__icontains=search) |
-                Q(first_name__icontains=search) |
-                Q(last_name__icontains=search) |
-                Q(phone_number__icontains=search)
-            )
+            return search_users(queryset, search)
 
-        return queryset.order_by('-date_joined')
+        return queryset.order_by('-date_joined', '-id')
 
 
 class UserDetailView(generics.RetrieveUpdateDestroyAPIView):
@@ -114,6 +168,20 @@ class UserDetailView(generics.RetrieveUpdateDestroyAPIView):
             return UserUpdateSerializer
         return UserSerializer
 
+    @conditional(user_validators)
+    def get(self, request, *args, **kwargs):
+        return super().get(request, *args, **kwargs)
+
+    @transaction_policy(SERIALIZABLE)
+    @conditional(user_validators)
+    def put(self, request, *args, **kwargs):
+        return super().put(request, *args, **kwargs)
+
+    @transaction_policy(SERIALIZABLE)
+    @conditional(user_validators)
+    def patch(self, request, *args, **kwargs):
+        return super().patch(request, *args, **kwargs)
+
 
 class CurrentUserView(generics.RetrieveUpdateAPIView):
     """
@@ -122,8 +190,25 @@ class CurrentUserView(generics.RetrieveUpdateAPIView):
     serializer_class = UserSerializer
     permission_classes = [permissions.IsAuthenticated]
 
+    @conditional(user_validators)
+    @cache_response(
+        timeout=300, tags=lambda request, *args, **kwargs: [
+            f'user:{request.user.pk}'])
+    def get(self, request, *args, **kwargs):
+        return super().get(request, *args, **kwargs)
+
+    @transaction_policy(SERIALIZABLE)
+    @conditional(user_validators)
+    def put(self, request, *args, **kwargs):
+        return super().put(request, *args, **kwargs)
+
+    @transaction_policy(SERIALIZABLE)
+    @conditional(user_validators)
+    def patch(self, request, *args, **kwargs):
+        return super().patch(request, *args, **kwargs)
+
     def get_object(self):
-        return self.request.user
+        return resolve_user(self.request.user)
 
     def get_serializer_class(self):
         if self.request.method in ['PUT', 'PATCH']:
@@ -137,6 +222,9 @@ class PasswordChangeView(APIView):
     """
     permission_classes = [permissions.IsAuthenticated]
 
+    def get_throttles(self):
+        return super().get_throttles() + [PasswordResetRateThrottle()]
+
     def post(self, request):
         serializer = PasswordChangeSerializer(
             data=request.data,
@@ -155,39 +243,108 @@ class UserProfileView(generics.RetrieveUpdateAPIView):
     serializer_class = UserProfileSerializer
     permission_classes = [permissions.IsAuthenticated]
 
+    @conditional(profile_validators)
+    def get(self, request, *args, **kwargs):
+        return super().get(request, *args, **kwargs)
+
+    @transaction_policy(SERIALIZABLE)
+    @conditional(profile_validators)
+    def put(self, request, *args, **kwargs):
+        return super().put(request, *args, **kwargs)
+
+    @transaction_policy(SERIALIZABLE)
+    @conditional(profile_validators)
+    def patch(self, request, *args, **kwargs):
+        return super().patch(request, *args, **kwargs)
+
     def get_object(self):
         profile, created = UserProfile.objects.get_or_create(
-            user=self.request.user)
+            user_id=self.request.user.pk)
         return profile
 
 
-class UserStatsView(APIView):
+class UserStatsView(ReplicaReadsMixin, APIView):
     """
     Get user statistics (admin only)
     """
     permission_classes = [IsAdminUser]
 
+    @cache_response(timeout=60, tags=['user-stats'], vary='role')
     def get(self, request):
-        stats = {
-            'total_users': User.objects.count(),
-            'active_users': User.objects.filter(is_active=True).count(),
-            'citizens': User.objects.filter(role=User.UserRole.CITIZEN).count(),
-            'fund_officers': User.objects.filter(role=User.UserRole.FUND_OFFICER).count(),
-            'fund_admins': User.objects.filter(role=User.UserRole.FUND_ADMIN).count(),
-            'superadmins': User.objects.filter(role=User.UserRole.SUPERADMIN).count(),
-            'verified_users': User.objects.filter(is_verified=True).count(),
-        }
+        # ?exact=1 bypasses the maintained counters
+        if request.query_params.get('exact') in ('1', 'true'):
+            stats = compute_user_stats()
+        else:
+            stats = get_user_stats()
 
         serializer = UserStatsSerializer(stats)
         return Response(serializer.data)
 
 
-class LoginAttemptsView(generics.ListAPIView):
+class ResponseCacheStatsView(APIView):
+    """
+    Get API response cache hit/miss counters per view (admin only)
+    """
+    permission_classes = [IsAdminUser]
+
+    def get(self, request):
+        return Response(get_response_cache_stats())
+
+
+class CacheTierStatsView(APIView):
+    """
+    Get local/Redis hit ratios of every two-tier cache (admin only)
+    """
+    permission_classes = [IsAdminUser]
+
+    def get(self, request):
+        return Response({
+            alias: caches[alias].get_tier_stats()
+            for alias in settings.CACHES
+            if hasattr(caches[alias], 'get_tier_stats')
+        })
+
+
+class DatabasePoolStatsView(APIView):
+    """
+    Get connection pool saturation and wait times per process type
+    (admin only)
+    """
+    permission_classes = [IsAdminUser]
+
+    def get(self, request):
+        return Response(get_pool_stats())
+
+
+class TransactionRetryStatsView(APIView):
+    """
+    Get serialization failure and deadlock retries per operation (admin
+    only)
+    """
+    permission_classes = [IsAdminUser]
+
+    def get(self, request):
+        return Response(get_transaction_retry_stats())
+
+
+class PasswordHashingStatsView(APIView):
+    """
+    Get password hashing slots in flight, admissions and rejections
+    (admin only)
+    """
+    permission_classes = [IsAdminUser]
+
+    def get(self, request):
+        return Response(get_password_hashing_stats())
+
+
+class LoginAttemptsView(ReplicaReadsMixin, generics.ListAPIView):
     """
     View login attempts (admin only)
     """
     serializer_class = LoginAttemptSerializer
     permission_classes = [IsAdminUser]
+    pagination_class = LoginAttemptPagination
 
     def get_queryset(self):
         queryset = LoginAttempt.objects.all()
@@ -211,14 +368,49 @@ class LoginAttemptsView(generics.ListAPIView):
             except ValueError:
                 pass
 
-        return queryset.order_by('-timestamp')
+        return queryset.order_by('-timestamp', '-id')
+
+
+class LoginAttemptExportView(LoginAttemptsView):
+    """
+    Stream login attempts as NDJSON (default) or CSV (admin only).
+    Accepts the same filters as the login attempt list.
+    """
+    renderer_classes = [NDJSONRenderer, CSVRenderer]
+    pagination_class = None
+
+    def list(self, request, *args, **kwargs):
+        renderer = request.accepted_renderer
+        fields = self.get_serializer_class().Meta.fields
+        queryset = self.filter_queryset(self.get_queryset())
+
+        # The rows are read after ReplicaReadsMixin has left replica_reads,
+        # so the iterator sets up the routing itself
+        replica = replica_reads_enabled()
+        if isinstance(request._request, ASGIRequest):
+            # Django would read a sync iterator into memory under ASGI
+            rows = aexport_rows(queryset, fields)
+            content = renderer.astream(
+                fields, areplica_iterator(rows) if replica else rows)
+        else:
+            rows = export_rows(queryset, fields)
+            content = renderer.stream(
+                fields, replica_iterator(rows) if replica else rows)
+
+        response = StreamingHttpResponse(
+            content,
+            content_type=f'{renderer.media_type}; charset={renderer.charset}')
+        filename = f'login-attempts-{timezone.now():%Y%m%d%H%M%S}.{renderer.format}'
+        response['Content-Disposition'] = f'attachment; filename="{filename}"'
+        return response
 
 
 @api_view(['POST'])
 @permission_classes([IsSuperAdmin])
 def bulk_user_action(request):
     """
-    Perform bulk actions on users (superadmin only)
+    Queue a bulk action on users (superadmin only). The action runs in
+    the background; poll the returned status URL for progress.
     """
     action = request.data.get('action')
     user_ids = request.data.get('user_ids', [])
@@ -229,35 +421,104 @@ def bulk_user_action(request):
             status=status.HTTP_400_BAD_REQUEST
         )
 
-    users = User.objects.filter(id__in=user_ids)
-
-    if action == 'activate':
-        users.update(is_active=True)
-        message = f'{users.count()} users activated'
-    elif action == 'deactivate':
-        users.update(is_active=False)
-        message = f'{users.count()} users deactivated'
-    elif action == 'verify':
-        users.update(is_verified=True)
-        message = f'{users.count()} users verified'
-    elif action == 'delete':
-        count = users.count()
-        users.delete()
-        message = f'{count} users deleted'
-    else:
+    if action not in BulkUserJob.Action.values:
         return Response(
             {'error': 'Invalid action'},
             status=status.HTTP_400_BAD_REQUEST
         )
 
-    return Response({'message': message})
+    # Only a JSON list of integers: int() would read "123" as [1, 2, 3],
+    # true as 1 and 2.9 as 2, and act on the wrong users
+    if not isinstance(user_ids, list) or not all(
+            isinstance(user_id, int) and not isinstance(user_id, bool)
+            for user_id in user_ids):
+        return Response(
+            {'error': 'user_ids must be a list of integers'},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    user_ids = sorted(set(user_ids))
+
+    max_user_ids = get_bulk_action_setting('MAX_USER_IDS')
+    if len(user_ids) > max_user_ids:
+        return Response(
+            {'error': f'At most {max_user_ids} user_ids per job'},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+
+    job = BulkUserJob.objects.create(
+        action=action, user_ids=user_ids, total=len(user_ids),
+        created_by_id=request.user.pk)
+    transaction.on_commit(lambda: process_bulk_user_job.delay(str(job.id)))
+
+    data = BulkUserJobSerializer(job).data
+    data['status_url'] = request.build_absolute_uri(
+        reverse('accounts:bulk-user-job', args=[job.id]))
+    return Response(data, status=status.HTTP_202_ACCEPTED)
+
+
+@api_view(['GET'])
+@permission_classes([IsSuperAdmin])
+def bulk_user_job(request, job_id):
+    """
+    Get the progress of a bulk user action (superadmin only)
+    """
+    job = get_object_or_404(BulkUserJob, id=job_id)
+    return Response(BulkUserJobSerializer(job).data)
+
+
+@api_view(['POST'])
+@permission_classes([IsAdminUser])
+@parser_classes([MultiPartParser])
+def import_citizens_view(request):
+    """
+    Queue an import of citizens from an uploaded CSV or NDJSON file (admin
+    only). The import runs in the background; poll the returned status
+    URL for counts and per-row errors.
+    """
+    upload = request.FILES.get('file')
+    if upload is None:
+        return Response(
+            {'error': 'A CSV or NDJSON file is required'},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+
+    format = request.data.get('format') or detect_format(upload.name)
+    if format not in FORMATS:
+        return Response(
+            {'error': f'format must be one of: {", ".join(FORMATS)}'},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+
+    job = CitizenImportJob.objects.create(
+        file=upload, format=format, created_by_id=request.user.pk)
+    transaction.on_commit(
+        lambda: process_citizen_import_job.delay(str(job.id)))
+
+    data = CitizenImportJobSerializer(job).data
+    data['status_url'] = request.build_absolute_uri(
+        reverse('accounts:citizen-import-job', args=[job.id]))
+    return Response(data, status=status.HTTP_202_ACCEPTED)
+
+
+@api_view(['GET'])
+@permission_classes([IsAdminUser])
+def citizen_import_job(request, job_id):
+    """
+    Get the progress of a citizen import (admin only)
+    """
+    job = get_object_or_404(CitizenImportJob, id=job_id)
+    return Response(CitizenImportJobSerializer(job).data)
 
 
 @api_view(['GET'])
 @permission_classes([CanReviewApplications])
+@cache_response(
+    timeout=300, tags=lambda request, role: [f'role:{role}'], vary='role')
+@use_replica
 def users_by_role(request, role):
     """
-    Get users filtered by role
+    Get active users of a role, paginated. ``?fields=id,email,...``
+    returns only those fields of the slim summary representation.
     """
     if role not in [choice[0] for choice in User.UserRole.choices]:
         return Response(
@@ -265,6 +526,28 @@ def users_by_role(request, role):
             status=status.HTTP_400_BAD_REQUEST
         )
 
-    users = User.objects.filter(role=role, is_active=True)
-    serializer = UserSerializer(users, many=True)
-    return Response(serializer.data)
+    users = User.objects.filter(
+        role=role, is_active=True).order_by('-date_joined', '-id')
+
+    fields = request.query_params.get('fields')
+    if fields:
+        fields = [name.strip() for name in fields.split(',') if name.strip()]
+        unknown = set(fields) - set(UserSummarySerializer.Meta.fields)
+        if unknown:
+            return Response(
+                {'error': f'Unknown fields: {", ".join(sorted(unknown))}'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        # The pagination ordering columns are needed for the cursor
+        users = users.only(
+            'date_joined', *UserSummarySerializer.columns(fields))
+    else:
+        users = users.select_related('profile')
+
+    paginator = UserPagination()
+    page = paginator.paginate_queryset(users, request)
+    if fields:
+        serializer = UserSummarySerializer(page, many=True, fields=fields)
+    else:
+        serializer = UserSerializer(page, many=True)
+    return paginator.get_paginated_response(serializer.data)
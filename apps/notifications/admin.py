@@ -0,0 +1,33 @@
+from django.contrib import admin
+
+from .models import SmsBatch, SmsMessage
+
+
+@admin.register(SmsBatch)
+class SmsBatchAdmin(admin.ModelAdmin):
+    """
+    Read-only view of SMS batches
+    """
+    list_display = ['template', 'language', 'recipients', 'status',
+                    'attempts', 'created_at', 'finished_at']
+    list_filter = ['status', 'template', 'language']
+    readonly_fields = [field.name for field in SmsBatch._meta.fields]
+
+    def has_add_permission(self, request):
+        return False
+
+
+@admin.register(SmsMessage)
+class SmsMessageAdmin(admin.ModelAdmin):
+    """
+    Read-only view of SMS recipients
+    """
+    list_display = ['phone', 'batch', 'status', 'delivery_status',
+                    'updated_at']
+    list_filter = ['status', 'delivery_status']
+    search_fields = ['phone', 'provider_message_id']
+    raw_id_fields = ['batch', 'user']
+    readonly_fields = [field.name for field in SmsMessage._meta.fields]
+
+    def has_add_permission(self, request):
+        return False
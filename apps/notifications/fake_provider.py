@@ -0,0 +1,109 @@
+"""
+Local stand-in for the Africa's Talking bulk SMS API.
+
+``FakeSmsProvider`` serves the messaging endpoint over HTTP on a free
+local port and records every request. It answers like the real API, and
+can be told to fail the next requests (``fail_requests``) or to give
+chosen numbers a status code (``number_codes``).
+"""
+
+import json
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+
+STATUSES = {
+    101: 'Success',
+    403: 'InvalidPhoneNumber',
+    405: 'InsufficientBalance',
+    406: 'UserInBlacklist',
+    500: 'InternalServerError',
+}
+
+
+class FakeSmsProvider:
+    def __init__(self):
+        self.requests = []
+        # HTTP statuses to answer the next requests with, in order
+        self.fail_requests = []
+        # {number: [status code, ...]}, one per request naming the number
+        self.number_codes = {}
+        self.lock = threading.Lock()
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), self.handler())
+        self.thread = None
+
+    @property
+    def url(self):
+        host, port = self.server.server_address
+        return f'http://{host}:{port}/version1/messaging'
+
+    def start(self):
+        self.thread = threading.Thread(
+            target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def respond(self, form, api_key):
+        """
+        Return the (HTTP status, body) answering a messaging request
+        """
+        with self.lock:
+            self.requests.append({
+                'time': time.monotonic(),
+                'api_key': api_key,
+                'username': form.get('username', [''])[0],
+                'from': form.get('from', [''])[0],
+                'message': form.get('message', [''])[0],
+                'to': form.get('to', [''])[0].split(','),
+            })
+            if self.fail_requests:
+                return self.fail_requests.pop(0), b'{}'
+
+            recipients = []
+            for number in self.requests[-1]['to']:
+                codes = self.number_codes.get(number)
+                code = codes.pop(0) if codes else 101
+                recipients.append({
+                    'statusCode': code,
+                    'number': number,
+                    'status': STATUSES.get(code, 'Failed'),
+                    'cost': 'KES 0.8000' if code == 101 else '0',
+                    'messageId': (f'ATXid_{uuid.uuid4().hex}'
+                                  if code == 101 else 'None'),
+                })
+        return 201, json.dumps({'SMSMessageData': {
+            'Message': f'Sent to {len(recipients)}',
+            'Recipients': recipients,
+        }}).encode()
+
+    def handler(self):
+        provider = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                length = int(self.headers.get('Content-Length') or 0)
+                form = parse_qs(self.rfile.read(length).decode())
+                status, body = provider.respond(
+                    form, self.headers.get('apiKey'))
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
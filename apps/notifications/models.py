@@ -0,0 +1,75 @@
+from django.conf import settings
+from django.db import models
+
+
+class SmsBatch(models.Model):
+    """
+    One provider bulk send: a rendered template in one language and its
+    recipients (see apps.notifications.sms)
+    """
+    class Status(models.TextChoices):
+        PENDING = 'pending', 'Pending'
+        SENT = 'sent', 'Sent'
+        PARTIAL = 'partial', 'Partially sent'
+        FAILED = 'failed', 'Failed'
+
+    template = models.CharField(max_length=50)
+    language = models.CharField(max_length=10)
+    body = models.TextField()
+    status = models.CharField(
+        max_length=20, choices=Status.choices, default=Status.PENDING)
+    recipients = models.PositiveIntegerField(default=0)
+    # Provider requests made, including failed ones
+    attempts = models.PositiveIntegerField(default=0)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        db_table = 'notifications_sms_batch'
+        ordering = ['-created_at']
+        verbose_name_plural = 'SMS batches'
+
+    def __str__(self):
+        return f"{self.template} ({self.language}) to {self.recipients} ({self.status})"
+
+
+class SmsMessage(models.Model):
+    """
+    One recipient of an SmsBatch, with its send and delivery status
+    """
+    class Status(models.TextChoices):
+        QUEUED = 'queued', 'Queued'
+        SENT = 'sent', 'Sent'
+        FAILED = 'failed', 'Failed'
+
+    batch = models.ForeignKey(
+        SmsBatch, on_delete=models.CASCADE, related_name='messages')
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL, on_delete=models.SET_NULL, null=True,
+        blank=True, related_name='+')
+    phone = models.CharField(max_length=16)
+    status = models.CharField(
+        max_length=20, choices=Status.choices, default=Status.QUEUED)
+    provider_message_id = models.CharField(
+        max_length=64, null=True, blank=True)
+    status_code = models.PositiveSmallIntegerField(null=True, blank=True)
+    cost = models.CharField(max_length=20, blank=True)
+    error = models.CharField(max_length=255, blank=True)
+    # From the provider's delivery reports
+    delivery_status = models.CharField(max_length=20, blank=True)
+    failure_reason = models.CharField(max_length=64, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        db_table = 'notifications_sms_message'
+        indexes = [
+            models.Index(fields=['batch', 'status'],
+                         name='notifications_sms_batch_st'),
+            # Delivery reports look messages up by provider id
+            models.Index(fields=['provider_message_id'],
+                         name='notifications_sms_provider_id'),
+        ]
+
+    def __str__(self):
+        return f"{self.phone} ({self.status})"
@@ -0,0 +1,89 @@
+"""
+Africa's Talking bulk SMS client.
+
+One request sends a message to many recipients, and the response carries
+a status per recipient. Transport errors, 429 and 5xx responses raise
+``TransientSmsError``, and the batch is retried. Other error responses
+raise ``SmsProviderError``.
+"""
+
+import json
+from typing import NamedTuple
+
+import urllib3
+
+# Per-recipient status codes
+SUCCESS_CODES = {100, 101, 102}  # processed, sent, queued
+# Insufficient balance, could not route, provider errors
+RETRYABLE_CODES = {405, 407, 500, 501}
+
+
+class SmsProviderError(Exception):
+    pass
+
+
+class TransientSmsError(SmsProviderError):
+    pass
+
+
+class SmsResult(NamedTuple):
+    number: str
+    status_code: int
+    status: str
+    message_id: str
+    cost: str
+
+
+class AfricasTalkingClient:
+    def __init__(self, url, username, api_key, sender_id='', timeout=10):
+        self.url = url
+        self.username = username
+        self.api_key = api_key
+        self.sender_id = sender_id
+        self.pool = urllib3.PoolManager(
+            retries=False, timeout=urllib3.Timeout(total=timeout))
+
+    def send(self, message, recipients):
+        """
+        Send message to the recipients' E.164 numbers, returning an
+        SmsResult per recipient the provider reported on
+        """
+        fields = {
+            'username': self.username,
+            'to': ','.join(recipients),
+            'message': message,
+        }
+        if self.sender_id:
+            fields['from'] = self.sender_id
+        try:
+            response = self.pool.request(
+                'POST', self.url, fields=fields, encode_multipart=False,
+                headers={'apiKey': self.api_key,
+                         'Accept': 'application/json'})
+        except urllib3.exceptions.HTTPError as exc:
+            raise TransientSmsError(f'{type(exc).__name__}: {exc}') from exc
+
+        if response.status == 429 or response.status >= 500:
+            raise TransientSmsError(f'HTTP {response.status}')
+        if response.status >= 400:
+            raise SmsProviderError(
+                f'HTTP {response.status}: {response.data[:200]!r}')
+        try:
+            recipients = json.loads(response.data)[
+                'SMSMessageData']['Recipients']
+            results = []
+            for recipient in recipients:
+                message_id = recipient.get('messageId') or ''
+                results.append(SmsResult(
+                    number=recipient['number'],
+                    status_code=int(recipient['statusCode']),
+                    status=recipient.get('status', ''),
+                    # 'None' for recipients it did not send to
+                    message_id='' if message_id == 'None' else message_id,
+                    cost=recipient.get('cost') or '',
+                ))
+        except (ValueError, KeyError, TypeError) as exc:
+            # Not retried: the messages may well have gone out
+            raise SmsProviderError(
+                f'Unexpected response: {response.data[:200]!r}') from exc
+        return results
@@ -0,0 +1,400 @@
+"""
+Batched SMS notifications.
+
+``queue_sms`` selects the recipients of a template in one streamed query.
+The query joins ``UserProfile`` and keeps only active users with
+``sms_notifications`` on and a canonical phone number. Recipients are
+grouped by the language they get the template in (their
+``preferred_language``, see ``apps.notifications.templates``) into
+``SmsBatch`` rows of at most ``BATCH_SIZE``, each with one ``SmsMessage``
+per recipient. A recipient already sent the same template and parameters
+(or ``dedupe_key``) within ``DEDUPE_WINDOW`` seconds is skipped; the
+window is a Redis key per recipient.
+
+Every batch is sent by the ``send_sms_batch`` task on the
+``notifications`` queue as one provider bulk request. Requests are paced
+to the provider's ``TPS`` (messages per second) across all workers by a
+GCRA limit in Redis that charges a batch its recipient count. The
+per-recipient statuses in the response are written with one
+``bulk_update``. Transient failures, of the whole request or of single
+recipients, are retried with exponential backoff and jitter up to
+``MAX_ATTEMPTS`` provider requests; then the recipients still queued are
+marked failed.
+
+Delivery reports the provider posts later are queued in Redis and applied
+by ``flush_delivery_reports`` with one UPDATE per distinct status.
+"""
+
+import hashlib
+import json
+import logging
+import math
+import time
+
+from celery.utils.time import get_exponential_backoff_interval
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from apps.accounts.models import UserProfile
+from apps.accounts.throttling import get_gcra_script
+
+from .models import SmsBatch, SmsMessage
+from .providers import (
+    RETRYABLE_CODES, SUCCESS_CODES, AfricasTalkingClient, SmsProviderError,
+    TransientSmsError
+)
+from .templates import SMS_TEMPLATES, render, template_language
+
+logger = logging.getLogger('smartfunds')
+
+DEFAULTS = {
+    'PROVIDER_URL': 'https://api.sandbox.africastalking.com/version1/messaging',
+    'USERNAME': 'sandbox',
+    'API_KEY': '',
+    'SENDER_ID': '',
+    'TIMEOUT': 10,  # seconds per provider request
+    'BATCH_SIZE': 500,  # recipients per provider request
+    'TPS': 10,  # messages per second the provider accepts
+    'BURST': 1,  # seconds of TPS that may be sent at once
+    'MAX_RATE_WAIT': 5,  # seconds a worker sleeps for the rate limit
+    'DEDUPE_WINDOW': 3600,  # seconds
+    'MAX_ATTEMPTS': 6,  # provider requests per batch
+    'RETRY_BACKOFF': 10,  # seconds, doubled per attempt
+    'RETRY_BACKOFF_MAX': 600,  # seconds
+    'DELIVERY_BATCH_SIZE': 500,  # delivery reports per flush
+    'KEY_PREFIX': 'notifications:sms',
+    'CACHE_ALIAS': 'default',
+    'ALLOWED_IPS': [],  # delivery report senders, addresses or networks
+    'CALLBACK_TOKEN': '',  # shared secret, as ?token= on the report URL
+    'TRUSTED_PROXIES': [],  # whose X-Real-IP is the sender's address
+}
+
+
+def get_sms_setting(name):
+    return getattr(settings, 'SMS_NOTIFICATIONS', {}).get(
+        name, DEFAULTS[name])
+
+
+def get_connection():
+    from django_redis import get_redis_connection
+    return get_redis_connection(get_sms_setting('CACHE_ALIAS'))
+
+
+_client = None
+
+
+def get_sms_client():
+    global _client
+    if _client is None:
+        _client = AfricasTalkingClient(
+            get_sms_setting('PROVIDER_URL'),
+            get_sms_setting('USERNAME'),
+            get_sms_setting('API_KEY'),
+            get_sms_setting('SENDER_ID'),
+            get_sms_setting('TIMEOUT'),
+        )
+    return _client
+
+
+def dedupe(template, key, window, recipients):
+    """
+    Return the (user_id, phone) recipients not sent this template and key
+    within the window, and claim them for it
+    """
+    if not window:
+        return recipients
+    prefix = f"{get_sms_setting('KEY_PREFIX')}:dedupe:{template}:{key}"
+    try:
+        pipe = get_connection().pipeline(transaction=False)
+        for user_id, _ in recipients:
+            pipe.set(f'{prefix}:{user_id}', 1, nx=True, ex=window)
+        claimed = pipe.execute()
+    except Exception:
+        # Better a repeated SMS than a missing one
+        logger.warning('SMS dedupe unavailable, sending to all',
+                       exc_info=True)
+        return recipients
+    return [recipient for recipient, new in zip(recipients, claimed) if new]
+
+
+def create_batch(template, language, body, recipients):
+    with transaction.atomic():
+        batch = SmsBatch.objects.create(
+            template=template, language=language, body=body,
+            recipients=len(recipients))
+        SmsMessage.objects.bulk_create([
+            SmsMessage(batch=batch, user_id=user_id, phone=phone)
+            for user_id, phone in recipients
+        ])
+
+        from .tasks import send_sms_batch
+        transaction.on_commit(lambda: send_sms_batch.delay(batch.pk))
+    return batch
+
+
+def queue_sms(template, users, params=None, dedupe_key=None,
+              dedupe_window=None):
+    """
+    Queue template to the users (a User queryset or ids) that accept SMS
+    notifications, returning the batches created
+    """
+    if template not in SMS_TEMPLATES:
+        raise ValueError(f'Unknown SMS template: {template}')
+    params = params or {}
+    if dedupe_key is None:
+        dedupe_key = hashlib.sha1(json.dumps(
+            params, sort_keys=True, default=str).encode()).hexdigest()[:16]
+    if dedupe_window is None:
+        dedupe_window = get_sms_setting('DEDUPE_WINDOW')
+    batch_size = get_sms_setting('BATCH_SIZE')
+
+    # Opted-out, inactive and phoneless users never leave the database
+    recipients = UserProfile.objects.filter(
+        user__in=users, sms_notifications=True, user__is_active=True,
+        user__phone_e164__isnull=False,
+    ).order_by('user_id').values_list(
+        'user_id', 'user__phone_e164', 'preferred_language')
+
+    bodies = {}
+    pending = {}
+    batches = []
+
+    def flush(language):
+        chosen = dedupe(template, dedupe_key, dedupe_window,
+                        pending.pop(language))
+        if chosen:
+            batches.append(create_batch(
+                template, language, bodies[language], chosen))
+
+    for user_id, phone, preferred in recipients.iterator(
+            chunk_size=batch_size):
+        language = template_language(template, preferred)
+        if language not in bodies:
+            bodies[language] = render(template, language, params)
+        group = pending.setdefault(language, [])
+        group.append((user_id, phone))
+        if len(group) >= batch_size:
+            flush(language)
+    for language in list(pending):
+        flush(language)
+    return batches
+
+
+class SmsRateLimited(Exception):
+    def __init__(self, wait):
+        super().__init__(f'Retry in {wait:.1f}s')
+        self.wait = wait
+
+
+def acquire_send_rate(count):
+    """
+    Wait until the provider's TPS allows count more messages, raising
+    SmsRateLimited if that is longer than MAX_RATE_WAIT
+    """
+    # GCRA charging the batch its size: allowed once its share of the
+    # rate is within the burst tolerance
+    interval = math.ceil(1000 * count / get_sms_setting('TPS'))
+    tolerance = max(get_sms_setting('BURST') * 1000, interval)
+    key = f"{get_sms_setting('KEY_PREFIX')}:rate"
+    while True:
+        try:
+            wait_ms = get_gcra_script()(
+                keys=[key], args=[interval, tolerance])
+        except Exception:
+            logger.warning('SMS rate limit unavailable, sending',
+                           exc_info=True)
+            return
+        if not wait_ms:
+            return
+        wait = wait_ms / 1000
+        if wait > get_sms_setting('MAX_RATE_WAIT'):
+            raise SmsRateLimited(wait)
+        time.sleep(wait)
+
+
+def finish_batch(batch_id, error=''):
+    """
+    Set a batch's final status from its messages'
+    """
+    sent = SmsMessage.objects.filter(
+        batch_id=batch_id, status=SmsMessage.Status.SENT).exists()
+    failed = SmsMessage.objects.filter(
+        batch_id=batch_id, status=SmsMessage.Status.FAILED).exists()
+    if sent and failed:
+        status = SmsBatch.Status.PARTIAL
+    elif sent:
+        status = SmsBatch.Status.SENT
+    else:
+        status = SmsBatch.Status.FAILED
+    fields = {'status': status, 'finished_at': timezone.now()}
+    if error:
+        fields['last_error'] = error
+    SmsBatch.objects.filter(pk=batch_id).update(**fields)
+
+
+def fail_queued(batch_id, error):
+    SmsMessage.objects.filter(
+        batch_id=batch_id, status=SmsMessage.Status.QUEUED,
+    ).update(status=SmsMessage.Status.FAILED, error=error[:255],
+             updated_at=timezone.now())
+    finish_batch(batch_id, error)
+
+
+def record_results(messages, results):
+    """
+    Apply per-recipient results to the messages with one bulk update,
+    returning how many stay queued for a retry
+    """
+    by_number = {result.number: result for result in results}
+    now = timezone.now()
+    queued = 0
+    for message in messages:
+        result = by_number.get(message.phone)
+        if result is None:
+            message.error = 'Not in provider response'
+        else:
+            message.status_code = result.status_code
+            message.provider_message_id = result.message_id or None
+            message.cost = result.cost
+            message.error = '' if result.status_code in SUCCESS_CODES else (
+                result.status[:255])
+            if result.status_code in SUCCESS_CODES:
+                message.status = SmsMessage.Status.SENT
+            elif result.status_code not in RETRYABLE_CODES:
+                message.status = SmsMessage.Status.FAILED
+        if message.status == SmsMessage.Status.QUEUED:
+            queued += 1
+        message.updated_at = now
+    SmsMessage.objects.bulk_update(messages, [
+        'status', 'status_code', 'provider_message_id', 'cost', 'error',
+        'updated_at',
+    ], batch_size=get_sms_setting('BATCH_SIZE'))
+    return queued
+
+
+def retry_delay(attempts):
+    return max(1, get_exponential_backoff_interval(
+        get_sms_setting('RETRY_BACKOFF'), attempts - 1,
+        get_sms_setting('RETRY_BACKOFF_MAX'), full_jitter=True))
+
+
+def send_batch(batch_id):
+    """
+    Send a batch's queued messages in one provider request, returning the
+    seconds after which to try again, or None when the batch is done
+    """
+    messages = list(SmsMessage.objects.filter(
+        batch_id=batch_id, status=SmsMessage.Status.QUEUED,
+    ).only('id', 'phone', 'status').order_by('id'))
+    if not messages:
+        finish_batch(batch_id)
+        return None
+
+    try:
+        acquire_send_rate(len(messages))
+    except SmsRateLimited as exc:
+        return exc.wait
+
+    SmsBatch.objects.filter(pk=batch_id).update(attempts=F('attempts') + 1)
+    batch = SmsBatch.objects.only('body', 'attempts').get(pk=batch_id)
+    try:
+        results = get_sms_client().send(
+            batch.body, [message.phone for message in messages])
+    except TransientSmsError as exc:
+        error = str(exc)
+        queued = len(messages)
+    except SmsProviderError as exc:
+        logger.warning('SMS batch %s failed: %s', batch_id, exc)
+        fail_queued(batch_id, str(exc))
+        return None
+    else:
+        error = ''
+        queued = record_results(messages, results)
+
+    if not queued:
+        finish_batch(batch_id)
+        return None
+    if batch.attempts >= get_sms_setting('MAX_ATTEMPTS'):
+        logger.warning('SMS batch %s gave up after %s attempts: %s',
+                       batch_id, batch.attempts, error or 'recipients failed')
+        fail_queued(batch_id, error or 'Retries exhausted')
+        return None
+    if error:
+        SmsBatch.objects.filter(pk=batch_id).update(last_error=error)
+    return retry_delay(batch.attempts)
+
+
+def delivery_reports_key():
+    return f"{get_sms_setting('KEY_PREFIX')}:delivery_reports"
+
+
+def apply_delivery_reports(reports):
+    """
+    Record delivery reports, one UPDATE per distinct status and reason,
+    returning the number of messages updated
+    """
+    # The latest report for a message wins
+    latest = {}
+    for report in reports:
+        latest[report['id']] = report
+    groups = {}
+    for message_id, report in latest.items():
+        groups.setdefault(
+            (report['status'][:20], report.get('failureReason', '')[:64]),
+            []).append(message_id)
+
+    now = timezone.now()
+    updated = 0
+    for (status, reason), message_ids in groups.items():
+        updated += SmsMessage.objects.filter(
+            provider_message_id__in=message_ids,
+        ).update(delivery_status=status, failure_reason=reason,
+                 updated_at=now)
+    return updated
+
+
+def record_delivery_report(report):
+    """
+    Queue a delivery report ({'id', 'status', 'failureReason'}) for the
+    next flush
+    """
+    try:
+        length = get_connection().rpush(
+            delivery_reports_key(), json.dumps(report))
+    except Exception:
+        logger.warning('SMS delivery report queue unavailable, '
+                       'writing synchronously', exc_info=True)
+        apply_delivery_reports([report])
+        return
+
+    if length % get_sms_setting('DELIVERY_BATCH_SIZE') == 0:
+        from .tasks import flush_sms_delivery_reports
+        flush_sms_delivery_reports.delay()
+
+
+def flush_delivery_reports():
+    """
+    Apply queued delivery reports, returning the number of reports
+    """
+    key = delivery_reports_key()
+    size = get_sms_setting('DELIVERY_BATCH_SIZE')
+    connection = get_connection()
+    flushed = 0
+    while True:
+        pipe = connection.pipeline(transaction=True)
+        pipe.lrange(key, 0, size - 1)
+        pipe.ltrim(key, size, -1)
+        records, _ = pipe.execute()
+        if not records:
+            break
+        try:
+            apply_delivery_reports([json.loads(record) for record in records])
+        except Exception:
+            connection.lpush(key, *reversed(records))
+            raise
+        flushed += len(records)
+        if len(records) < size:
+            break
+    return flushed
@@ -0,0 +1,40 @@
+from celery import shared_task
+from django.contrib.auth import get_user_model
+
+from .sms import flush_delivery_reports, queue_sms, send_batch
+
+User = get_user_model()
+
+
+@shared_task(ignore_result=True)
+def queue_sms_notification(template, user_ids=None, roles=None, params=None,
+                           dedupe_key=None):
+    """
+    Queue an SMS template to the given users and/or roles
+    """
+    users = User.objects.all()
+    if user_ids is not None:
+        users = users.filter(id__in=user_ids)
+    if roles is not None:
+        users = users.filter(role__in=roles)
+    queue_sms(template, users.values('id'), params=params,
+              dedupe_key=dedupe_key)
+
+
+@shared_task(bind=True, ignore_result=True, max_retries=None)
+def send_sms_batch(self, batch_id):
+    """
+    Send an SMS batch, retrying with backoff while recipients are left
+    """
+    # The batch counts its own attempts (see MAX_ATTEMPTS)
+    countdown = send_batch(batch_id)
+    if countdown is not None:
+        raise self.retry(countdown=countdown)
+
+
+@shared_task(ignore_result=True)
+def flush_sms_delivery_reports():
+    """
+    Apply the queued SMS delivery reports
+    """
+    return flush_delivery_reports()
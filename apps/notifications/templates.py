@@ -0,0 +1,36 @@
+"""
+SMS templates.
+
+A batch shares one body, so templates take only parameters common to all
+recipients (a fund name, a deadline), never per-user fields. Each template
+has a text per language; other languages fall back to the first.
+"""
+
+SMS_TEMPLATES = {
+    'announcement': {
+        'en': 'SmartFunds: {message}',
+        'sw': 'SmartFunds: {message}',
+    },
+    'fund_open': {
+        'en': 'SmartFunds: applications for {fund} are open until '
+              '{deadline}. Dial *384*1# or visit smartfunds to apply.',
+        'sw': 'SmartFunds: maombi ya {fund} yamefunguliwa hadi '
+              '{deadline}. Piga *384*1# au tembelea smartfunds kuomba.',
+    },
+    'account_verified': {
+        'en': 'SmartFunds: your account has been verified.',
+        'sw': 'SmartFunds: akaunti yako imethibitishwa.',
+    },
+}
+
+
+def template_language(template, language):
+    """
+    Return the language template is sent in to a user preferring language
+    """
+    texts = SMS_TEMPLATES[template]
+    return language if language in texts else next(iter(texts))
+
+
+def render(template, language, params):
+    return SMS_TEMPLATES[template][language].format(**params)
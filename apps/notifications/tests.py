@@ -0,0 +1,255 @@
+import uuid
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+from apps.accounts.models import UserProfile
+
+from .fake_provider import FakeSmsProvider
+from .models import SmsBatch, SmsMessage
+from .sms import (
+    flush_delivery_reports, get_sms_client, queue_sms, send_batch
+)
+from .tasks import send_sms_batch
+from . import sms
+
+User = get_user_model()
+
+
+def create_user(index, language='en', sms_notifications=True):
+    user = User.objects.create_user(
+        email=f'sms{index}@example.com', username=f'sms{index}',
+        password='pass-1234', phone_number=f'07120002{index:02d}',
+        first_name='Sms', last_name=f'User{index}')
+    UserProfile.objects.filter(user=user).update(
+        preferred_language=language, sms_notifications=sms_notifications)
+    return user
+
+
+def send_until_done(batch):
+    """
+    Send a batch as send_sms_batch and its retries would, without
+    Celery's eager retry handling (which raises Retry when eager tasks
+    propagate exceptions)
+    """
+    while send_batch(batch.pk) is not None:
+        pass
+
+
+class SmsNotificationTests(TestCase):
+    """
+    Batches per template and language, sent to a local stand-in for the
+    provider's bulk SMS API
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.provider = FakeSmsProvider().start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.provider.stop()
+        super().tearDownClass()
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.users = [
+            create_user(0), create_user(1),
+            create_user(2, language='sw'),
+            # No Kiswahili-only fallback: French speakers get English
+            create_user(3, language='fr'),
+            create_user(4, sms_notifications=False),
+        ]
+
+    def setUp(self):
+        self.provider.requests.clear()
+        self.provider.fail_requests.clear()
+        self.provider.number_codes.clear()
+        sms_settings = override_settings(SMS_NOTIFICATIONS={
+            'PROVIDER_URL': self.provider.url,
+            'API_KEY': 'test-key',
+            'TPS': 1000,
+            'RETRY_BACKOFF': 1,
+            # Fresh Redis keys (dedupe, rate) per test
+            'KEY_PREFIX': f'test:sms:{uuid.uuid4().hex}',
+            'ALLOWED_IPS': ['127.0.0.1'],
+        })
+        sms_settings.enable()
+        self.addCleanup(sms_settings.disable)
+        sms._client = None
+        self.addCleanup(setattr, sms, '_client', None)
+
+    def queue(self, **kwargs):
+        return queue_sms('fund_open', User.objects.filter(
+            pk__in=[user.pk for user in self.users]),
+            params={'fund': 'Bursary', 'deadline': '1 March'}, **kwargs)
+
+    def test_batches_per_language_skip_opted_out(self):
+        # One streamed recipient query, then per language a savepoint
+        # around inserting the batch and its messages
+        with self.assertNumQueries(1 + 2 * 4):
+            batches = self.queue()
+        by_language = {batch.language: batch for batch in batches}
+        self.assertEqual(set(by_language), {'en', 'sw'})
+        self.assertEqual(by_language['en'].recipients, 3)
+        self.assertTrue(by_language['sw'].body.startswith(
+            'SmartFunds: maombi ya Bursary'))
+        self.assertFalse(SmsMessage.objects.filter(
+            user=self.users[4]).exists())
+
+        for batch in batches:
+            send_sms_batch.apply(args=[batch.pk])
+        self.assertEqual(len(self.provider.requests), 2)
+        request = next(r for r in self.provider.requests
+                       if r['message'] == by_language['en'].body)
+        self.assertEqual(sorted(request['to']), [
+            '+254712000200', '+254712000201', '+254712000203'])
+        self.assertEqual(request['api_key'], 'test-key')
+        self.assertFalse(SmsMessage.objects.exclude(
+            status=SmsMessage.Status.SENT).exists())
+        self.assertFalse(SmsMessage.objects.filter(
+            provider_message_id=None).exists())
+
+    def test_dedupe_window(self):
+        self.assertEqual(len(self.queue()), 2)
+        self.assertEqual(self.queue(), [])
+        # A different key is a different message
+        self.assertEqual(len(self.queue(dedupe_key='reminder')), 2)
+
+    def test_transient_failures_are_retried(self):
+        batch = queue_sms('account_verified', [self.users[0].pk,
+                                               self.users[1].pk])[0]
+        self.provider.fail_requests = [503, 429]
+        # The first number is out of credit once, the second is invalid
+        self.provider.number_codes = {
+            '+254712000200': [405], '+254712000201': [403]}
+
+        send_until_done(batch)
+        batch.refresh_from_db()
+        self.assertEqual(batch.attempts, 4)
+        self.assertEqual(batch.status, SmsBatch.Status.PARTIAL)
+        statuses = dict(batch.messages.values_list('phone', 'status'))
+        self.assertEqual(statuses, {
+            '+254712000200': SmsMessage.Status.SENT,
+            '+254712000201': SmsMessage.Status.FAILED,
+        })
+        # Only the recipient left queued was sent again
+        self.assertEqual(self.provider.requests[-1]['to'], ['+254712000200'])
+
+    def test_retries_are_bounded(self):
+        batch = queue_sms('account_verified', [self.users[0].pk])[0]
+        self.provider.fail_requests = [500] * 10
+        with self.settings(SMS_NOTIFICATIONS={
+                **sms.settings.SMS_NOTIFICATIONS, 'MAX_ATTEMPTS': 3}):
+            send_until_done(batch)
+        batch.refresh_from_db()
+        self.assertEqual(batch.attempts, 3)
+        self.assertEqual(batch.status, SmsBatch.Status.FAILED)
+        self.assertEqual(batch.last_error, 'HTTP 500')
+
+    def test_task_retries(self):
+        batch = queue_sms('account_verified', [self.users[0].pk])[0]
+        self.provider.fail_requests = [503]
+        # The retry runs eagerly too, and sends the batch
+        result = send_sms_batch.apply(args=[batch.pk], throw=False)
+        self.assertEqual(result.state, 'SUCCESS')
+        batch.refresh_from_db()
+        self.assertEqual(batch.attempts, 2)
+        self.assertEqual(batch.status, SmsBatch.Status.SENT)
+
+    def test_rate_limit(self):
+        batches = [queue_sms('account_verified', [user.pk])[0]
+                   for user in self.users[:4]]
+        batches += queue_sms('announcement', [self.users[0].pk],
+                             params={'message': 'Hi'})
+        with self.settings(SMS_NOTIFICATIONS={
+                **sms.settings.SMS_NOTIFICATIONS, 'TPS': 4, 'BURST': 1}):
+            for batch in batches:
+                send_sms_batch.apply(args=[batch.pk])
+        # A second's burst of 4 goes at once, the fifth waits its turn
+        times = [request['time'] for request in self.provider.requests]
+        self.assertLess(times[3] - times[0], 0.2)
+        self.assertGreaterEqual(times[4] - times[0], 0.2)
+
+    def test_delivery_reports_are_applied_in_bulk(self):
+        batch = self.queue()[0]
+        send_sms_batch.apply(args=[batch.pk])
+        ids = list(batch.messages.values_list(
+            'provider_message_id', flat=True))
+
+        for message_id in ids[:-1]:
+            response = self.client.post(
+                reverse('notifications:sms-delivery-report'),
+                {'id': message_id, 'status': 'Success'})
+            self.assertEqual(response.status_code, 200)
+        self.client.post(reverse('notifications:sms-delivery-report'), {
+            'id': ids[-1], 'status': 'Failed',
+            'failureReason': 'AbsentSubscriber'})
+
+        # One UPDATE per status
+        with self.assertNumQueries(2):
+            self.assertEqual(flush_delivery_reports(), len(ids))
+        self.assertEqual(
+            batch.messages.filter(delivery_status='Success').count(),
+            len(ids) - 1)
+        failed = batch.messages.get(provider_message_id=ids[-1])
+        self.assertEqual(failed.failure_reason, 'AbsentSubscriber')
+
+    def test_client_is_built_from_settings(self):
+        self.assertEqual(get_sms_client().url, self.provider.url)
+
+
+class DeliveryReportSenderTests(TestCase):
+    """
+    Delivery reports are refused unless the sender's address or token
+    checks out, and X-Real-IP only counts from a trusted proxy
+    """
+
+    def setUp(self):
+        self.path = reverse('notifications:sms-delivery-report')
+
+    def post(self, path=None, **extra):
+        return self.client.post(path or self.path, {
+            'id': f'ATXid_{uuid.uuid4().hex}', 'status': 'Success',
+        }, **extra)
+
+    def sms(self, **values):
+        return override_settings(SMS_NOTIFICATIONS={
+            **settings.SMS_NOTIFICATIONS, 'ALLOWED_IPS': [],
+            'CALLBACK_TOKEN': '', 'TRUSTED_PROXIES': [],
+            'KEY_PREFIX': f'test:sms:{uuid.uuid4().hex}', **values})
+
+    def test_refused_unless_configured(self):
+        with self.sms():
+            self.assertEqual(self.post().status_code, 403)
+            with self.settings(DEBUG=True):
+                self.assertEqual(self.post().status_code, 200)
+
+    def test_allowed_ips(self):
+        provider = '196.201.214.10'
+        with self.sms(ALLOWED_IPS=['196.201.214.0/24']):
+            self.assertEqual(
+                self.post(REMOTE_ADDR=provider).status_code, 200)
+            self.assertEqual(self.post().status_code, 403)
+            # Not through a trusted proxy, so X-Real-IP is ignored
+            self.assertEqual(self.post(
+                REMOTE_ADDR='203.0.113.5',
+                HTTP_X_REAL_IP=provider).status_code, 403)
+
+        with self.sms(ALLOWED_IPS=['196.201.214.0/24'],
+                      TRUSTED_PROXIES=['127.0.0.1']):
+            self.assertEqual(
+                self.post(HTTP_X_REAL_IP=provider).status_code, 200)
+            self.assertEqual(
+                self.post(HTTP_X_REAL_IP='203.0.113.5').status_code, 403)
+
+    def test_callback_token(self):
+        with self.sms(CALLBACK_TOKEN='s3cret'):
+            self.assertEqual(
+                self.post(f'{self.path}?token=s3cret').status_code, 200)
+            self.assertEqual(
+                self.post(f'{self.path}?token=guess').status_code, 403)
+            self.assertEqual(self.post().status_code, 403)
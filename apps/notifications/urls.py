@@ -0,0 +1,10 @@
+from django.urls import path
+
+from .views import delivery_report
+
+app_name = 'notifications'
+
+urlpatterns = [
+    path('sms/delivery-reports/', delivery_report,
+         name='sms-delivery-report'),
+]
@@ -0,0 +1,59 @@
+import hmac
+import logging
+
+from django.conf import settings
+from django.http import (
+    HttpResponse, HttpResponseBadRequest, HttpResponseForbidden
+)
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_POST
+
+from smartfunds.proxies import client_address, in_networks
+
+from .sms import get_sms_setting, record_delivery_report
+
+logger = logging.getLogger('smartfunds')
+
+
+def provider_allowed(request):
+    """
+    Whether the request passes every configured provider check. With none
+    configured, only DEBUG lets it through.
+    """
+    allowed = get_sms_setting('ALLOWED_IPS')
+    token = get_sms_setting('CALLBACK_TOKEN')
+    if not allowed and not token:
+        if not settings.DEBUG:
+            logger.error('SMS delivery report refused: set SMS_ALLOWED_IPS '
+                         'or SMS_CALLBACK_TOKEN')
+        return settings.DEBUG
+    if allowed and not in_networks(
+            client_address(request, get_sms_setting('TRUSTED_PROXIES')),
+            allowed):
+        return False
+    if token and not hmac.compare_digest(
+            request.GET.get('token', '').encode(), token.encode()):
+        return False
+    return True
+
+
+@csrf_exempt
+@require_POST
+def delivery_report(request):
+    """
+    Provider callback with the delivery status of one message
+    """
+    if not provider_allowed(request):
+        return HttpResponseForbidden()
+
+    message_id = request.POST.get('id')
+    status = request.POST.get('status')
+    if not message_id or not status:
+        return HttpResponseBadRequest('id and status are required',
+                                      content_type='text/plain')
+    record_delivery_report({
+        'id': message_id,
+        'status': status,
+        'failureReason': request.POST.get('failureReason', ''),
+    })
+    return HttpResponse(status=200)
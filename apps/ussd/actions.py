@@ -0,0 +1,55 @@
+"""
+Caller lookup and menu actions.
+
+Each of these issues a single query, the most any hop may spend on
+Postgres (see ``apps.ussd.engine``).
+"""
+
+from django.contrib.auth import get_user_model
+from django.db.models import F
+from django.utils import timezone
+
+from apps.accounts.models import UserProfile
+from apps.accounts.phones import to_e164
+from apps.accounts.response_cache import invalidate_tags_on_commit
+
+User = get_user_model()
+
+
+def lookup_caller(msisdn):
+    """
+    Return the active user with this phone number, with the profile
+    settings a session needs, as a dict, or None
+    """
+    e164 = to_e164(msisdn)
+    if e164 is None:
+        return None
+    return User.objects.filter(phone_e164=e164, is_active=True).values(
+        'id', 'first_name', 'last_name', 'role',
+        timeout=F('profile__ussd_session_timeout'),
+        language=F('profile__preferred_language'),
+    ).first()
+
+
+def update_profile(session, **values):
+    # update() rather than save(): one query, and no profile read first
+    UserProfile.objects.filter(user_id=session['user_id']).update(
+        **values, updated_at=timezone.now())
+    # update() skips the post_save response cache invalidation
+    invalidate_tags_on_commit([f"user:{session['user_id']}",
+                               f"role:{session['role']}"])
+
+
+def set_language(session, value):
+    update_profile(session, preferred_language=value)
+    session['language'] = value
+
+
+def set_sms_notifications(session, value):
+    update_profile(session, sms_notifications=value)
+
+
+ACTIONS = {
+    'set_language': set_language,
+    'set_sms_notifications': set_sms_notifications,
+}
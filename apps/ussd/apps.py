@@ -0,0 +1,16 @@
+from django.apps import AppConfig
+
+
+class UssdConfig(AppConfig):
+    default_auto_field = 'django.db.models.BigAutoField'
+    name = 'apps.ussd'
+    verbose_name = 'USSD'
+    label = 'ussd'
+
+    def ready(self):
+        """
+        Compile the menu once, so that a bad menu fails at startup and
+        hops only fill in prepared templates
+        """
+        from .engine import load_menu
+        load_menu()
@@ -0,0 +1,304 @@
+"""
+USSD session engine.
+
+The gateway (Africa's Talking style) POSTs every hop of a session to the
+callback with the session id, the caller's MSISDN and ``text``: the
+session's inputs so far, joined by ``*``. The reply is plain text
+starting with ``CON`` (show a screen and wait for input) or ``END``
+(show a screen and close the session), and has to arrive within a
+couple of seconds.
+
+The menu is declared as data in ``apps.ussd.menu`` and compiled once at
+startup (``UssdConfig.ready``). Compiling checks every target, action and
+placeholder, and renders each screen with its numbered options into one
+template per language, so a hop only looks up the input and fills in the
+caller's details.
+
+Session state is one JSON value per session in Redis, expiring after the
+caller's ``UserProfile.ussd_session_timeout`` seconds. The first hop
+resolves the caller through ``accounts.User`` with one query that also
+reads their profile, and later hops use Redis only, except for actions,
+which issue a single write. No hop touches Postgres more than once. A
+retried hop (same ``text``) gets the stored reply again without running
+its action twice.
+
+A session belongs to the number that started it: a later hop with the
+same session id from another number is ended without touching the
+session.
+"""
+
+import json
+import logging
+from string import Formatter
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+
+from apps.accounts.phones import to_e164
+
+from .actions import ACTIONS, lookup_caller
+
+logger = logging.getLogger('smartfunds')
+
+DEFAULTS = {
+    'CACHE_ALIAS': 'default',
+    'KEY_PREFIX': 'ussd:session',
+    'DEFAULT_TIMEOUT': 180,  # seconds, for unregistered callers
+    'ALLOWED_IPS': [],  # gateway addresses or networks
+    'CALLBACK_TOKEN': '',  # shared secret, as ?token= on the callback URL
+    'TRUSTED_PROXIES': [],  # whose X-Real-IP is the gateway's address
+}
+
+# Caller fields screen texts may use
+CONTEXT_FIELDS = ('first_name', 'full_name', 'phone', 'role')
+
+# Set by load_menu() at startup
+menu = None
+
+
+def get_ussd_setting(name):
+    return getattr(settings, 'USSD', {}).get(name, DEFAULTS[name])
+
+
+class Option:
+    def __init__(self, next, action=None, value=None):
+        self.next = next
+        self.action = action
+        self.value = value
+
+
+class Screen:
+    """
+    A compiled screen: its reply template per language and its options
+    by input
+    """
+
+    def __init__(self, name, templates, options, end):
+        self.name = name
+        self.templates = templates
+        self.options = options
+        self.end = end
+
+    def render(self, language, context, prefix=''):
+        return self.templates[language].format(prefix=prefix, **context)
+
+
+class Menu:
+    def __init__(self, screens, start, unregistered, languages, invalid,
+                 expired):
+        self.screens = screens
+        self.start = start
+        self.unregistered = unregistered
+        self.languages = languages
+        self.invalid = invalid
+        self.expired = expired
+
+    def language(self, language):
+        return language if language in self.languages else self.languages[0]
+
+
+def localize(value, languages, where):
+    """
+    Return {language: text} for a string or a dict of translations
+    """
+    if isinstance(value, str):
+        return {language: value for language in languages}
+    missing = set(languages) - set(value)
+    if missing:
+        raise ImproperlyConfigured(
+            f'USSD menu {where} lacks {", ".join(sorted(missing))}')
+    return {language: value[language] for language in languages}
+
+
+def escape(text):
+    return text.replace('{', '{{').replace('}', '}}')
+
+
+def check_placeholders(text, where):
+    for _, field, _, _ in Formatter().parse(text):
+        if field is not None and field not in CONTEXT_FIELDS:
+            raise ImproperlyConfigured(
+                f'USSD menu {where} uses unknown field {{{field}}}')
+
+
+def compile_menu(spec, actions=ACTIONS):
+    """
+    Check a menu declaration and compile it into a Menu
+    """
+    languages = tuple(spec['languages'])
+    declared = spec['screens']
+    for name in (spec['start'], spec['unregistered']):
+        if name not in declared:
+            raise ImproperlyConfigured(f'USSD menu has no screen {name!r}')
+
+    screens = {}
+    for name, screen in declared.items():
+        texts = localize(screen['text'], languages, f'screen {name!r}')
+        option_specs = screen.get('options', [])
+        end = screen.get('end', False)
+        if end == bool(option_specs):
+            raise ImproperlyConfigured(
+                f'USSD menu screen {name!r} needs either options or end')
+
+        options = {}
+        lines = {language: [] for language in languages}
+        for option in option_specs:
+            where = f'screen {name!r} option {option["key"]!r}'
+            if option['key'] in options:
+                raise ImproperlyConfigured(f'USSD menu {where} is repeated')
+            if option['next'] not in declared:
+                raise ImproperlyConfigured(
+                    f'USSD menu {where} leads to unknown screen '
+                    f'{option["next"]!r}')
+            action = option.get('action')
+            if action is not None and action not in actions:
+                raise ImproperlyConfigured(
+                    f'USSD menu {where} has unknown action {action!r}')
+            options[option['key']] = Option(
+                option['next'], actions.get(action), option.get('value'))
+            for language, label in localize(
+                    option['label'], languages, where).items():
+                lines[language].append(f'{option["key"]}. {escape(label)}')
+
+        templates = {}
+        for language in languages:
+            check_placeholders(texts[language], f'screen {name!r}')
+            body = '\n'.join([texts[language], *lines[language]])
+            templates[language] = (
+                ('END ' if end else 'CON ') + '{prefix}' + body)
+        screens[name] = Screen(name, templates, options, end)
+
+    return Menu(
+        screens, spec['start'], spec['unregistered'], languages,
+        localize(spec['invalid'], languages, 'invalid text'),
+        localize(spec['expired'], languages, 'expired text'))
+
+
+def load_menu():
+    """
+    Compile the menu into the module's ``menu``
+    """
+    global menu
+    from .menu import MENU
+    menu = compile_menu(MENU)
+    return menu
+
+
+class SessionStore:
+    """
+    Session state as a JSON value per session in Redis
+    """
+
+    def get_connection(self):
+        from django_redis import get_redis_connection
+        return get_redis_connection(get_ussd_setting('CACHE_ALIAS'))
+
+    def key(self, session_id):
+        return f"{get_ussd_setting('KEY_PREFIX')}:{session_id}"
+
+    def load(self, session_id):
+        raw = self.get_connection().get(self.key(session_id))
+        return json.loads(raw) if raw is not None else None
+
+    def save(self, session_id, session):
+        self.get_connection().set(
+            self.key(session_id), json.dumps(session), ex=session['timeout'])
+
+    def end(self, session_id):
+        self.get_connection().delete(self.key(session_id))
+
+
+sessions = SessionStore()
+
+
+def caller_number(msisdn):
+    return to_e164(msisdn) or msisdn
+
+
+def start_session(msisdn):
+    """
+    Return the state of a new session for the caller
+    """
+    caller = lookup_caller(msisdn)
+    if caller is None:
+        return {
+            'msisdn': caller_number(msisdn),
+            'screen': menu.unregistered,
+            'user_id': None,
+            'role': None,
+            'language': menu.language(None),
+            'timeout': get_ussd_setting('DEFAULT_TIMEOUT'),
+            'context': dict.fromkeys(CONTEXT_FIELDS, ''),
+        }
+    from apps.accounts.models import User
+    return {
+        'msisdn': caller_number(msisdn),
+        'screen': menu.start,
+        'user_id': caller['id'],
+        'role': caller['role'],
+        'language': menu.language(caller['language']),
+        # No profile, or a nonsensical timeout, gets the default
+        'timeout': (caller['timeout'] if caller['timeout'] and
+                    caller['timeout'] > 0
+                    else get_ussd_setting('DEFAULT_TIMEOUT')),
+        'context': {
+            'first_name': caller['first_name'],
+            'full_name': f"{caller['first_name']} "
+                         f"{caller['last_name']}".strip(),
+            'phone': msisdn,
+            'role': User.UserRole(caller['role']).label,
+        },
+    }
+
+
+def latest_input(text, previous):
+    """
+    Return what the caller entered since the previous hop's text
+    """
+    if not previous:
+        return text
+    if text.startswith(previous + '*'):
+        return text[len(previous) + 1:]
+    return text.rsplit('*', 1)[-1]
+
+
+def handle_hop(session_id, msisdn, text):
+    """
+    Advance a session by one hop and return the reply
+    """
+    session = sessions.load(session_id)
+    if session is None:
+        if text:
+            # Inputs for a session we no longer have: it timed out
+            return 'END ' + menu.expired[menu.language(None)]
+        session = start_session(msisdn)
+        screen = menu.screens[session['screen']]
+        reply = screen.render(session['language'], session['context'])
+    elif session.get('msisdn') != caller_number(msisdn):
+        logger.warning('USSD session %s continued from another number',
+                       session_id)
+        return 'END ' + menu.expired[menu.language(None)]
+    elif text == session['text']:
+        # The gateway retried a hop
+        return session['reply']
+    else:
+        screen = menu.screens[session['screen']]
+        option = screen.options.get(latest_input(text, session['text']))
+        if option is None:
+            prefix = menu.invalid[session['language']] + '\n'
+        else:
+            if option.action is not None:
+                option.action(session, option.value)
+            screen = menu.screens[option.next]
+            prefix = ''
+        session['screen'] = screen.name
+        reply = screen.render(session['language'], session['context'],
+                              prefix)
+
+    if screen.end:
+        sessions.end(session_id)
+    else:
+        session['text'] = text
+        session['reply'] = reply
+        sessions.save(session_id, session)
+    return reply
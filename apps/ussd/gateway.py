@@ -0,0 +1,99 @@
+"""
+Local stand-in for a USSD gateway.
+
+``FakeGateway`` drives sessions against the callback the way Africa's
+Talking does: a new ``sessionId`` per dial, and on every hop ``text``
+carrying all of the session's inputs joined by ``*``. It posts through a
+transport, either the Django test client (``client_transport``) or HTTP
+to a running server (``http_transport``).
+"""
+
+import http.client
+import threading
+import uuid
+from urllib.parse import urlencode, urlsplit
+
+CALLBACK_PATH = '/api/v1/ussd/callback/'
+
+
+def client_transport(client, path=CALLBACK_PATH):
+    """
+    Post hops through a django.test.Client
+    """
+    def send(form):
+        response = client.post(path, form)
+        return response.status_code, response.content.decode()
+    return send
+
+
+def http_transport(url, timeout=10):
+    """
+    Post hops over HTTP, keeping one connection per thread. A query
+    string (the gateway's ?token=) is kept.
+    """
+    parts = urlsplit(url)
+    target = f'{parts.path}?{parts.query}' if parts.query else parts.path
+    local = threading.local()
+
+    def send(form):
+        connection = getattr(local, 'connection', None)
+        if connection is None:
+            connection = local.connection = http.client.HTTPConnection(
+                parts.hostname, parts.port or 80, timeout=timeout)
+        try:
+            connection.request('POST', target, urlencode(form), {
+                'Content-Type': 'application/x-www-form-urlencoded'})
+            response = connection.getresponse()
+            body = response.read().decode()
+        except (http.client.HTTPException, OSError):
+            connection.close()
+            local.connection = None
+            raise
+        if response.will_close:
+            connection.close()
+            local.connection = None
+        return response.status, body
+    return send
+
+
+class FakeSession:
+    def __init__(self, gateway, phone_number):
+        self.gateway = gateway
+        self.phone_number = phone_number
+        self.session_id = f'ATUid_{uuid.uuid4().hex}'
+        self.inputs = []
+        self.ended = False
+
+    def hop(self):
+        status, body = self.gateway.send({
+            'sessionId': self.session_id,
+            'serviceCode': self.gateway.service_code,
+            'phoneNumber': self.phone_number,
+            'networkCode': '63902',
+            'text': '*'.join(self.inputs),
+        })
+        if status != 200:
+            raise RuntimeError(f'USSD callback returned {status}: {body}')
+        self.ended = not body.startswith('CON ')
+        return body
+
+    def start(self):
+        return self.hop()
+
+    def reply(self, value):
+        if self.ended:
+            raise RuntimeError('USSD session has ended')
+        self.inputs.append(value)
+        return self.hop()
+
+
+class FakeGateway:
+    def __init__(self, send, service_code='*384*1#'):
+        self.send = send
+        self.service_code = service_code
+
+    def dial(self, phone_number):
+        """
+        Start a session, returning it; its first screen is session.start()
+        """
+        return FakeSession(self, phone_number)
@@ -0,0 +1,172 @@
+import multiprocessing
+import os
+import signal
+import time
+
+from django.conf import settings
+from django.db import connection
+from django.test import Client
+from django.test.utils import CaptureQueriesContext, override_settings
+from django_redis import get_redis_connection
+
+from apps.accounts.benchmark import run_concurrently, summarize
+from apps.accounts.management.commands import bench_asgi
+from apps.ussd.engine import get_ussd_setting
+from apps.ussd.gateway import (
+    CALLBACK_PATH, FakeGateway, client_transport, http_transport
+)
+from apps.ussd.views import UNAVAILABLE
+
+# Replies after the first screen; each ends its session
+SCRIPTS = {
+    'account': ['1'],
+    'language': ['2', '1'],
+    'sms': ['3', '1'],
+    'back': ['2', '0', '0'],
+}
+
+
+def run_sessions(port, phones, scripts, count, concurrency, results):
+    """
+    Run count sessions over concurrency threads, putting the latencies
+    by hop, the failures and the wall time on results
+    """
+    gateway = FakeGateway(http_transport(
+        f'http://127.0.0.1:{port}{CALLBACK_PATH}', timeout=30))
+
+    def session(i):
+        script = scripts[i % len(scripts)]
+        current = gateway.dial(phones[i % len(phones)])
+        hops = []
+        try:
+            for value in [None, *SCRIPTS[script]]:
+                start = time.perf_counter()
+                reply = (current.start() if value is None
+                         else current.reply(value))
+                hops.append((time.perf_counter() - start) * 1000)
+        except Exception:
+            # Including a reply after an early END
+            return hops, True
+        return hops, not current.ended or reply == UNAVAILABLE
+
+    _, outcomes, wall = run_concurrently(session, count, concurrency)
+    results.put(([hops for hops, _ in outcomes],
+                 sum(1 for _, failed in outcomes if failed), wall))
+
+
+class Command(bench_asgi.Command):
+    help = (
+        'Measure per-hop latency of multi-hop USSD sessions driven through '
+        'the fake gateway against gunicorn, after checking in-process that '
+        'no hop runs more than one query'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=3,
+                            help='gunicorn --workers')
+        parser.add_argument('--sessions', type=int, default=1000)
+        parser.add_argument('--concurrency', type=int, default=16)
+        parser.add_argument('--clients', type=int, default=2,
+                            help='Load generator processes')
+        parser.add_argument('--users', type=int, default=50)
+        parser.add_argument('--scripts', default=','.join(SCRIPTS))
+        parser.add_argument('--latency-ms', type=float, default=0.0,
+                            help='Delay added to every Postgres and Redis '
+                                 'request')
+        parser.add_argument('--server', default='wsgi',
+                            choices=list(bench_asgi.SERVERS))
+        parser.add_argument('--port', type=int, default=8765)
+
+    def handle(self, *args, **options):
+        users = self.get_bench_users(options['users'])
+        phones = [user.phone_number for user in users]
+        scripts = options['scripts'].split(',')
+        context = multiprocessing.get_context('fork')
+        # The load comes from this host, to the server and in process
+        env = {**os.environ, 'PROCESS_TYPE': 'web',
+               'USSD_ALLOWED_IPS': '127.0.0.1', 'USSD_CALLBACK_TOKEN': ''}
+
+        proxy = None
+        try:
+            with override_settings(USSD={
+                    **settings.USSD, 'ALLOWED_IPS': ['127.0.0.1'],
+                    'CALLBACK_TOKEN': ''}):
+                self.check_queries(phones[0], scripts)
+            if options['latency_ms']:
+                proxy, proxied = self.start_proxy(
+                    context, options['latency_ms'] / 1000)
+                env.update(proxied)
+            server = self.start_server(options['server'], options['workers'],
+                                       options['port'], env)
+            try:
+                # Warm up every worker's connections
+                self.load_sessions(phones, scripts, len(phones) * 2,
+                                   context, options)
+                self.report(*self.load_sessions(
+                    phones, scripts, options['sessions'], context, options))
+            finally:
+                server.send_signal(signal.SIGTERM)
+                server.wait(timeout=30)
+        finally:
+            if proxy is not None:
+                proxy.terminate()
+            self.clear_sessions()
+            bench_asgi.User.objects.filter(
+                pk__in=[user.pk for user in users]).delete()
+
+    def check_queries(self, phone, scripts):
+        """
+        Run each script in this process, reporting the most queries a
+        hop ran
+        """
+        gateway = FakeGateway(
+            client_transport(Client(SERVER_NAME='localhost')))
+        most = 0
+        for script in scripts:
+            current = gateway.dial(phone)
+            for value in [None, *SCRIPTS[script]]:
+                with CaptureQueriesContext(connection) as queries:
+                    if value is None:
+                        current.start()
+                    else:
+                        current.reply(value)
+                most = max(most, len(queries))
+        self.stdout.write(f'most queries in a hop: {most}')
+
+    def load_sessions(self, phones, scripts, count, context, options):
+        results = context.Queue()
+        clients = options['clients']
+        processes = [
+            context.Process(target=run_sessions, args=(
+                options['port'], phones, scripts, count // clients,
+                max(1, options['concurrency'] // clients), results))
+            for _ in range(clients)
+        ]
+        for process in processes:
+            process.start()
+        outcomes = [results.get() for _ in processes]
+        for process in processes:
+            process.join()
+        sessions = [hops for outcome in outcomes for hops in outcome[0]]
+        failed = sum(outcome[1] for outcome in outcomes)
+        return sessions, failed, max(outcome[2] for outcome in outcomes)
+
+    def report(self, sessions, failed, wall):
+        by_hop = {}
+        for hops in sessions:
+            for n, latency in enumerate(hops):
+                by_hop.setdefault(n, []).append(latency)
+        self.stdout.write(summarize(
+            'all hops', [ms for hops in sessions for ms in hops], wall))
+        for n, latencies in sorted(by_hop.items()):
+            self.stdout.write(summarize(f'hop {n + 1}', latencies))
+        self.stdout.write(
+            summarize('session', [sum(hops) for hops in sessions]))
+        self.stdout.write(f'sessions={len(sessions)} failed={failed}')
+
+    def clear_sessions(self):
+        redis = get_redis_connection(get_ussd_setting('CACHE_ALIAS'))
+        keys = list(redis.scan_iter(
+            f"{get_ussd_setting('KEY_PREFIX')}:*", count=1000))
+        if keys:
+            redis.delete(*keys)
@@ -0,0 +1,59 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+
+from apps.ussd.gateway import FakeGateway, client_transport, http_transport
+
+
+class Command(BaseCommand):
+    help = (
+        'Dial a USSD session through the fake gateway, replying with '
+        '--inputs or interactively, and show each screen with its latency'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('phone_number')
+        parser.add_argument('--inputs',
+                            help='Comma-separated replies, e.g. 2,1')
+        parser.add_argument('--url',
+                            help='Callback URL of a running server; by '
+                                 'default hops run in this process and '
+                                 'their queries are counted')
+
+    def handle(self, *args, **options):
+        if options['url']:
+            send = http_transport(options['url'])
+        else:
+            # localhost, which the development settings allow
+            send = client_transport(Client(SERVER_NAME='localhost'))
+        session = FakeGateway(send).dial(options['phone_number'])
+        inputs = (options['inputs'].split(',')
+                  if options['inputs'] is not None else None)
+
+        self.hop(session.start, options['url'])
+        while not session.ended:
+            if inputs is not None:
+                if not inputs:
+                    break
+                value = inputs.pop(0)
+                self.stdout.write(f'> {value}')
+            else:
+                value = input('> ')
+            self.hop(lambda: session.reply(value), options['url'])
+
+    def hop(self, func, remote):
+        if remote:
+            start = time.perf_counter()
+            reply = func()
+            detail = ''
+        else:
+            with CaptureQueriesContext(connection) as queries:
+                start = time.perf_counter()
+                reply = func()
+            detail = f', {len(queries)} queries'
+        elapsed = (time.perf_counter() - start) * 1000
+        self.stdout.write(reply)
+        self.stdout.write(self.style.HTTP_INFO(f'[{elapsed:.1f} ms{detail}]'))
@@ -0,0 +1,92 @@
+"""
+The USSD menu tree.
+
+Each screen has a ``text`` and either ``options`` or ``end``. Texts and
+labels are strings or {language: string} dicts; a string serves every
+language. Texts may use the caller fields in ``engine.CONTEXT_FIELDS``.
+An option leads to ``next`` and may first run an ``action`` from
+``apps.ussd.actions.ACTIONS`` with its ``value``.
+
+The tree is compiled and checked at startup (see ``engine.compile_menu``).
+"""
+
+MENU = {
+    'languages': ('en', 'sw'),
+    'start': 'main',
+    # Shown to numbers that belong to no active user
+    'unregistered': 'unregistered',
+    'invalid': {
+        'en': 'Invalid choice.',
+        'sw': 'Chaguo si sahihi.',
+    },
+    'expired': {
+        'en': 'Your session has expired. Please dial again.',
+        'sw': 'Muda wa kikao umeisha. Tafadhali piga tena.',
+    },
+    'screens': {
+        'main': {
+            'text': {
+                'en': 'Welcome to SmartFunds, {first_name}',
+                'sw': 'Karibu SmartFunds, {first_name}',
+            },
+            'options': [
+                {'key': '1', 'next': 'account',
+                 'label': {'en': 'My account', 'sw': 'Akaunti yangu'}},
+                {'key': '2', 'next': 'language',
+                 'label': {'en': 'Language', 'sw': 'Lugha'}},
+                {'key': '3', 'next': 'sms',
+                 'label': {'en': 'SMS notifications', 'sw': 'Arifa za SMS'}},
+                {'key': '0', 'next': 'goodbye',
+                 'label': {'en': 'Exit', 'sw': 'Ondoka'}},
+            ],
+        },
+        'account': {
+            'text': {
+                'en': 'Name: {full_name}\nPhone: {phone}\nRole: {role}',
+                'sw': 'Jina: {full_name}\nSimu: {phone}\nWadhifa: {role}',
+            },
+            'end': True,
+        },
+        'language': {
+            'text': {'en': 'Choose a language', 'sw': 'Chagua lugha'},
+            'options': [
+                {'key': '1', 'label': 'English', 'next': 'saved',
+                 'action': 'set_language', 'value': 'en'},
+                {'key': '2', 'label': 'Kiswahili', 'next': 'saved',
+                 'action': 'set_language', 'value': 'sw'},
+                {'key': '0', 'next': 'main',
+                 'label': {'en': 'Back', 'sw': 'Rudi'}},
+            ],
+        },
+        'sms': {
+            'text': {'en': 'SMS notifications', 'sw': 'Arifa za SMS'},
+            'options': [
+                {'key': '1', 'next': 'saved',
+                 'label': {'en': 'On', 'sw': 'Washa'},
+                 'action': 'set_sms_notifications', 'value': True},
+                {'key': '2', 'next': 'saved',
+                 'label': {'en': 'Off', 'sw': 'Zima'},
+                 'action': 'set_sms_notifications', 'value': False},
+                {'key': '0', 'next': 'main',
+                 'label': {'en': 'Back', 'sw': 'Rudi'}},
+            ],
+        },
+        'saved': {
+            'text': {
+                'en': 'Your settings have been saved.',
+                'sw': 'Mipangilio yako imehifadhiwa.',
+            },
+            'end': True,
+        },
+        'goodbye': {
+            'text': {'en': 'Thank you for using SmartFunds.',
+                     'sw': 'Asante kwa kutumia SmartFunds.'},
+            'end': True,
+        },
+        'unregistered': {
+            'text': 'This number is not registered with SmartFunds. '
+                    'Please register online or at a fund office.',
+            'end': True,
+        },
+    },
+}
@@ -0,0 +1,173 @@
+import uuid
+from copy import deepcopy
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.exceptions import ImproperlyConfigured
+from django.test import TestCase, override_settings
+
+from apps.accounts.models import UserProfile
+
+from .engine import compile_menu, sessions
+from .gateway import CALLBACK_PATH, FakeGateway, client_transport
+from .menu import MENU
+
+User = get_user_model()
+
+
+# The test client connects from 127.0.0.1
+@override_settings(USSD={**settings.USSD, 'ALLOWED_IPS': ['127.0.0.1']})
+class UssdSessionTests(TestCase):
+    """
+    Sessions driven through the fake gateway: state lives in Redis and
+    no hop runs more than one query
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
+            email='caller@example.com', username='caller',
+            password='pass-1234', phone_number='0712000100',
+            first_name='Amina', last_name='Otieno')
+        UserProfile.objects.filter(user=cls.user).update(
+            ussd_session_timeout=120)
+
+    def setUp(self):
+        self.gateway = FakeGateway(client_transport(self.client))
+
+    def test_change_language(self):
+        session = self.gateway.dial('+254712000100')
+        with self.assertNumQueries(1):
+            reply = session.start()
+        self.assertTrue(reply.startswith('CON Welcome to SmartFunds, Amina'))
+        ttl = sessions.get_connection().ttl(sessions.key(session.session_id))
+        self.assertTrue(0 < ttl <= 120)
+
+        with self.assertNumQueries(0):
+            reply = session.reply('2')
+        self.assertIn('1. English\n2. Kiswahili', reply)
+
+        with self.assertNumQueries(1):
+            reply = session.reply('2')
+        self.assertEqual(reply, 'END Mipangilio yako imehifadhiwa.')
+        self.assertTrue(session.ended)
+        self.assertEqual(UserProfile.objects.get(user=self.user)
+                         .preferred_language, 'sw')
+        self.assertIsNone(sessions.load(session.session_id))
+
+    def test_invalid_choice_and_retried_hop(self):
+        session = self.gateway.dial('0712000100')
+        session.start()
+        reply = session.reply('9')
+        self.assertTrue(reply.startswith('CON Invalid choice.\nWelcome'))
+
+        # text is now 9*3; only the latest input counts
+        reply = session.reply('3')
+        self.assertTrue(reply.startswith('CON SMS notifications'))
+        # The gateway resends the hop: the same reply, from Redis alone
+        with self.assertNumQueries(0):
+            self.assertEqual(session.hop(), reply)
+
+    def test_unregistered_number(self):
+        session = self.gateway.dial('+254799999999')
+        reply = session.start()
+        self.assertTrue(reply.startswith('END This number is not registered'))
+        self.assertIsNone(sessions.load(session.session_id))
+
+    def test_expired_session(self):
+        session = self.gateway.dial('0712000100')
+        session.start()
+        sessions.end(session.session_id)
+        self.assertEqual(session.reply('1'), 'END Your session has expired. '
+                                             'Please dial again.')
+
+    def test_session_is_bound_to_its_number(self):
+        session = self.gateway.dial('0712000100')
+        session.start()
+        reply = session.reply('2')
+
+        # Guessing the session id from another number gets nothing, not
+        # even the stored reply of a retried hop
+        intruder = self.gateway.dial('+254799999998')
+        intruder.session_id = session.session_id
+        intruder.inputs = list(session.inputs)
+        expired = 'END Your session has expired. Please dial again.'
+        self.assertEqual(intruder.hop(), expired)
+        intruder.inputs.append('2')
+        self.assertEqual(intruder.hop(), expired)
+
+        # The same number in another form is the caller
+        caller = self.gateway.dial('+254712000100')
+        caller.session_id = session.session_id
+        caller.inputs = list(session.inputs)
+        self.assertEqual(caller.hop(), reply)
+
+        self.assertEqual(session.reply('2'), 'END Mipangilio yako imehifadhiwa.')
+        self.assertEqual(UserProfile.objects.get(user=self.user)
+                         .preferred_language, 'sw')
+
+    def test_menu_is_checked_when_compiled(self):
+        menu = deepcopy(MENU)
+        menu['screens']['main']['options'][0]['next'] = 'missing'
+        with self.assertRaises(ImproperlyConfigured):
+            compile_menu(menu)
+
+        menu = deepcopy(MENU)
+        menu['screens']['account']['text']['en'] = 'Hi {password}'
+        with self.assertRaises(ImproperlyConfigured):
+            compile_menu(menu)
+
+
+class UssdGatewayTests(TestCase):
+    """
+    Callbacks are refused unless the gateway's address or token checks
+    out, and X-Real-IP only counts from a trusted proxy
+    """
+
+    def post(self, path=CALLBACK_PATH, **extra):
+        return self.client.post(path, {
+            'sessionId': f'ATUid_{uuid.uuid4().hex}',
+            'phoneNumber': '+254799999999', 'text': '',
+        }, **extra)
+
+    def ussd(self, **values):
+        return override_settings(USSD={
+            **settings.USSD, 'ALLOWED_IPS': [], 'CALLBACK_TOKEN': '',
+            'TRUSTED_PROXIES': [], **values})
+
+    def test_refused_unless_configured(self):
+        with self.ussd():
+            self.assertEqual(self.post().status_code, 403)
+            with self.settings(DEBUG=True):
+                self.assertEqual(self.post().status_code, 200)
+
+    def test_allowed_ips(self):
+        gateway = '196.201.214.10'
+        with self.ussd(ALLOWED_IPS=['196.201.214.0/24']):
+            self.assertEqual(
+                self.post(REMOTE_ADDR=gateway).status_code, 200)
+            self.assertEqual(self.post().status_code, 403)
+            # Not through a trusted proxy, so X-Real-IP is ignored
+            self.assertEqual(self.post(
+                REMOTE_ADDR='203.0.113.5',
+                HTTP_X_REAL_IP=gateway).status_code, 403)
+
+        with self.ussd(ALLOWED_IPS=['196.201.214.0/24'],
+                       TRUSTED_PROXIES=['127.0.0.1']):
+            self.assertEqual(
+                self.post(HTTP_X_REAL_IP=gateway).status_code, 200)
+            self.assertEqual(
+                self.post(HTTP_X_REAL_IP='203.0.113.5').status_code, 403)
+
+    def test_callback_token(self):
+        with self.ussd(CALLBACK_TOKEN='s3cret'):
+            self.assertEqual(
+                self.post(f'{CALLBACK_PATH}?token=s3cret').status_code, 200)
+            self.assertEqual(
+                self.post(f'{CALLBACK_PATH}?token=guess').status_code, 403)
+            self.assertEqual(self.post().status_code, 403)
+
+        # Both configured: both must pass
+        with self.ussd(CALLBACK_TOKEN='s3cret', ALLOWED_IPS=['10.0.0.1']):
+            self.assertEqual(
+                self.post(f'{CALLBACK_PATH}?token=s3cret').status_code, 403)
@@ -0,0 +1,68 @@
+import hmac
+import logging
+
+from django.conf import settings
+from django.http import (
+    HttpResponse, HttpResponseBadRequest, HttpResponseForbidden
+)
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_POST
+
+from smartfunds.proxies import client_address, in_networks
+
+from . import engine
+
+logger = logging.getLogger('smartfunds')
+
+UNAVAILABLE = 'END Service temporarily unavailable. Please try again later.'
+
+
+def gateway_address(request):
+    return client_address(
+        request, engine.get_ussd_setting('TRUSTED_PROXIES'))
+
+
+def gateway_allowed(request):
+    """
+    Whether the request passes every configured gateway check. With none
+    configured, only DEBUG lets it through.
+    """
+    allowed = engine.get_ussd_setting('ALLOWED_IPS')
+    token = engine.get_ussd_setting('CALLBACK_TOKEN')
+    if not allowed and not token:
+        if not settings.DEBUG:
+            logger.error('USSD callback refused: set USSD_ALLOWED_IPS or '
+                         'USSD_CALLBACK_TOKEN')
+        return settings.DEBUG
+    if allowed and not in_networks(gateway_address(request), allowed):
+        return False
+    if token and not hmac.compare_digest(
+            request.GET.get('token', '').encode(), token.encode()):
+        return False
+    return True
+
+
+@csrf_exempt
+@require_POST
+def ussd_callback(request):
+    """
+    Gateway callback for every hop of a USSD session
+    """
+    if not gateway_allowed(request):
+        return HttpResponseForbidden()
+
+    session_id = request.POST.get('sessionId')
+    phone_number = request.POST.get('phoneNumber')
+    if not session_id or not phone_number:
+        return HttpResponseBadRequest('sessionId and phoneNumber are required',
+                                      content_type='text/plain')
+
+    try:
+        reply = engine.handle_hop(
+            session_id, phone_number, request.POST.get('text', ''))
+    except Exception:
+        # The gateway shows whatever we answer; never leave it waiting
+        logger.warning('USSD hop failed for session %s', session_id,
+                       exc_info=True)
+        reply = UNAVAILABLE
+    return HttpResponse(reply, content_type='text/plain; charset=utf-8')
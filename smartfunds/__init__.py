@@ -0,0 +1,5 @@
+from .celery import app as celery_app
+# Connection pool metrics and fork handling for web and Celery processes
+from . import db  # noqa: F401
+
+__all__ = ('celery_app',)
@@ -2,6 +2,11 @@
 ASGI config for smartfunds project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
+The hot accounts endpoints are served by native async views here (see
+``apps.accounts.async_views``); run it with
+``gunicorn smartfunds.asgi:application -k uvicorn.workers.UvicornWorker``.
+Web processes hash passwords in the bounded pool (see
+``apps.accounts.hashing``).
 
 For more information on this file, see
 https://docs.djangoproject.com/en/5.2/howto/deployment/asgi/
@@ -12,5 +17,7 @@ import os
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'smartfunds.settings')
+os.environ.setdefault('ASYNC_VIEWS', 'True')
+os.environ.setdefault('PASSWORD_HASHING_POOL', 'True')
 
 application = get_asgi_application()
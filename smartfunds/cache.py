@@ -0,0 +1,562 @@
+"""
+Two-tier cache backend.
+
+``TwoTierRedisCache`` is django-redis' ``RedisCache`` with a bounded
+per-process LRU in front of it. Reads try the local tier first and fall
+back to Redis, keeping what they find for ``TIMEOUT`` seconds. Writes go
+to Redis and then publish the affected keys on a pub/sub channel; a
+subscriber thread in every process drops them from its local tier, so
+other gunicorn workers and nodes stop serving the old value about one
+round trip later.
+
+The local tier is only used while the subscriber is connected, and it is
+emptied on every (re)subscribe, so invalidations missed during a Redis
+outage never leave stale values behind. TTL-only changes (``touch``,
+``expire``) are broadcast like writes.
+
+Only keys starting with one of ``KEY_PREFIXES`` use the local tier. The
+rest (sessions, pins) are read from and written to Redis directly, and
+writing them publishes nothing, so per-request session saves don't make
+every process handle an invalidation.
+
+Django creates a backend instance per thread; the local tier and its
+subscriber are shared by all of them and rebuilt after a fork, so entries
+cached in a ``--preload`` master never reach the workers.
+
+Hits and misses per tier are counted in process and added to a Redis hash
+at most every ``STATS_FLUSH_INTERVAL`` seconds (see ``get_tier_stats``).
+
+Configured in ``OPTIONS['LOCAL_CACHE']``; the rest of the ``CACHES`` entry
+is passed to django-redis unchanged.
+
+``aget``/``aget_many`` read Redis through a ``redis.asyncio`` client (one
+per event loop, see ``get_async_redis_connection``) instead of Django's
+default of running the sync method in a thread. Async writes still go
+through the sync methods, so they publish invalidations as usual.
+"""
+
+import asyncio
+import json
+import logging
+import os
+import pickle
+import threading
+import time
+import uuid
+import weakref
+from collections import Counter, OrderedDict
+
+from asgiref.sync import sync_to_async
+from django.core.cache import caches
+from django.core.cache.backends.base import DEFAULT_TIMEOUT
+from django_redis.cache import RedisCache
+from redis import asyncio as aioredis
+
+logger = logging.getLogger('smartfunds')
+
+DEFAULTS = {
+    'MAXSIZE': 5000,
+    'TIMEOUT': 5,  # seconds
+    'CHANNEL': 'cache:invalidate',
+    'STATS_KEY': 'cache:tier_stats',
+    'STATS_FLUSH_INTERVAL': 10,  # seconds
+    'RECONNECT_DELAY': 1,  # seconds, doubled up to 30 while Redis is down
+    'KEY_PREFIXES': (),  # keys kept in the local tier
+}
+
+MISSING = object()
+
+
+class LocalLRUCache:
+    """
+    Small thread-safe, per-process LRU cache with a TTL per entry
+    """
+
+    def __init__(self, maxsize, timeout):
+        self.maxsize = maxsize
+        self.timeout = timeout
+        self.data = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            item = self.data.get(key)
+            if item is None:
+                return None
+            expires, value = item
+            if expires < time.monotonic():
+                del self.data[key]
+                return None
+            self.data.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self.lock:
+            self.data[key] = (time.monotonic() + self.timeout, value)
+            self.data.move_to_end(key)
+            while len(self.data) > self.maxsize:
+                self.data.popitem(last=False)
+
+    def delete(self, key):
+        with self.lock:
+            self.data.pop(key, None)
+
+    def clear(self):
+        with self.lock:
+            self.data.clear()
+
+    def __len__(self):
+        return len(self.data)
+
+
+class LocalTier:
+    """
+    A process's local entries, invalidation subscriber and tier counters
+    """
+
+    def __init__(self, options, channel, stats_key):
+        self.pid = os.getpid()
+        self.options = options
+        self.channel = channel
+        self.stats_key = stats_key
+        self.sender = uuid.uuid4().hex
+        self.entries = LocalLRUCache(options['MAXSIZE'], options['TIMEOUT'])
+        # Bumped by every invalidation, so a read that raced one doesn't
+        # store the value it fetched before it
+        self.generation = 0
+        self.lock = threading.Lock()
+        self.connected = False
+        self.thread = None
+        self.redis = None
+        self.counts = Counter()
+        self.flushed_at = time.monotonic()
+
+    def start(self, redis):
+        with self.lock:
+            if self.thread is not None and self.thread.is_alive():
+                return
+            self.redis = redis
+            self.thread = threading.Thread(
+                target=self.listen, name='cache-invalidation', daemon=True)
+            self.thread.start()
+
+    def listen(self):
+        delay = self.options['RECONNECT_DELAY']
+        while True:
+            pubsub = self.redis.pubsub()
+            try:
+                pubsub.subscribe(self.channel)
+                for message in pubsub.listen():
+                    if message['type'] == 'subscribe':
+                        self.drop(None)
+                        self.connected = True
+                        delay = self.options['RECONNECT_DELAY']
+                    elif message['type'] == 'message':
+                        self.receive(message['data'])
+            except Exception:
+                logger.warning('Cache invalidation subscriber disconnected',
+                               exc_info=True)
+            finally:
+                self.connected = False
+                self.drop(None)
+                try:
+                    pubsub.close()
+                except Exception:
+                    pass
+            time.sleep(delay)
+            delay = min(delay * 2, 30)
+
+    def receive(self, data):
+        message = json.loads(data)
+        if message['sender'] != self.sender:
+            self.drop(message['keys'])
+
+    def drop(self, keys):
+        """
+        Remove keys from the local tier; None removes everything
+        """
+        with self.lock:
+            self.generation += 1
+            if keys is None:
+                self.entries.clear()
+            else:
+                for key in keys:
+                    self.entries.delete(key)
+
+    def get(self, key):
+        data = self.entries.get(key)
+        if data is None:
+            return MISSING
+        # Stored pickled so callers never share (and mutate) one object
+        return pickle.loads(data)
+
+    def set(self, key, value, generation):
+        data = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        with self.lock:
+            if generation == self.generation:
+                self.entries.set(key, data)
+
+    def count(self, tier, outcome, count=1):
+        """
+        Count in memory, returning True when the counters are due a flush
+        """
+        with self.lock:
+            self.counts[f'{tier}:{outcome}'] += count
+        return self.due()
+
+    def due(self):
+        return (time.monotonic() - self.flushed_at >=
+                self.options['STATS_FLUSH_INTERVAL'])
+
+    def record(self, tier, outcome, count=1):
+        if self.count(tier, outcome, count):
+            self.flush()
+
+    async def arecord(self, tier, outcome, count=1):
+        if self.count(tier, outcome, count):
+            await sync_to_async(self.flush)()
+
+    def flush_due(self):
+        if self.due():
+            self.flush()
+
+    async def aflush_due(self):
+        if self.due():
+            await sync_to_async(self.flush)()
+
+    def flush(self):
+        with self.lock:
+            counts, self.counts = self.counts, Counter()
+            self.flushed_at = time.monotonic()
+        if not counts or self.redis is None:
+            return
+        try:
+            pipe = self.redis.pipeline(transaction=False)
+            for field, count in counts.items():
+                pipe.hincrby(self.stats_key, field, count)
+            pipe.execute()
+        except Exception:
+            logger.warning('Failed to flush cache tier stats', exc_info=True)
+            with self.lock:
+                self.counts.update(counts)
+
+
+_tiers = {}
+_tiers_lock = threading.Lock()
+
+
+def get_local_tier(backend):
+    """
+    Return this process's tier for the backend's server and channel,
+    replacing one inherited through fork()
+    """
+    ident = (backend._server, backend.channel)
+    tier = _tiers.get(ident)
+    if tier is None or tier.pid != os.getpid():
+        with _tiers_lock:
+            tier = _tiers.get(ident)
+            if tier is None or tier.pid != os.getpid():
+                tier = _tiers[ident] = LocalTier(
+                    backend.local_options, backend.channel,
+                    backend.stats_key)
+    if tier.thread is None:
+        tier.start(backend.client.get_client(write=True))
+    return tier
+
+
+# {event loop: {server: client}}; redis.asyncio connections can only be
+# used from the loop that opened them
+_async_clients = weakref.WeakKeyDictionary()
+
+
+def get_async_redis_client(backend):
+    """
+    Return a redis.asyncio client for a django-redis backend's primary
+    server, shared by the running event loop
+    """
+    clients = _async_clients.setdefault(asyncio.get_running_loop(), {})
+    server = backend.client._server[0]
+    client = clients.get(server)
+    if client is None:
+        options = backend.client._options
+        client = clients[server] = aioredis.Redis.from_url(
+            server,
+            socket_timeout=options.get('SOCKET_TIMEOUT'),
+            socket_connect_timeout=options.get('SOCKET_CONNECT_TIMEOUT'),
+            **options.get('CONNECTION_POOL_KWARGS', {}))
+    return client
+
+
+def get_async_redis_connection(alias='default'):
+    """
+    ``django_redis.get_redis_connection`` for async code
+    """
+    return get_async_redis_client(caches[alias])
+
+
+class TwoTierRedisCache(RedisCache):
+    """
+    django-redis backend with a process-local LRU tier kept coherent
+    over Redis pub/sub
+    """
+
+    def __init__(self, server, params):
+        options = dict(params.get('OPTIONS', {}))
+        self.local_options = {**DEFAULTS, **options.pop('LOCAL_CACHE', {})}
+        super().__init__(server, {**params, 'OPTIONS': options})
+        self.channel = f"{self.key_prefix}:{self.local_options['CHANNEL']}"
+        self.stats_key = (
+            f"{self.key_prefix}:{self.local_options['STATS_KEY']}")
+        self.local_prefixes = tuple(self.local_options['KEY_PREFIXES'])
+
+    @property
+    def local(self):
+        return get_local_tier(self)
+
+    def is_local(self, key):
+        """
+        Whether a key is kept in the local tier
+        """
+        return str(key).startswith(self.local_prefixes)
+
+    def invalidate_keys(self, keys, version=None):
+        """
+        Invalidate the locally kept keys among those written
+        """
+        keys = [self.make_key(key, version)
+                for key in keys if self.is_local(key)]
+        if keys:
+            self.invalidate(keys)
+
+    def invalidate(self, keys):
+        """
+        Drop keys (None for all) here and in every other process
+        """
+        tier = self.local
+        tier.drop(keys)
+        try:
+            tier.redis.publish(self.channel, json.dumps(
+                {'sender': tier.sender, 'keys': keys}))
+        except Exception:
+            logger.warning('Failed to publish cache invalidation',
+                           exc_info=True)
+
+    # Reads
+
+    def get(self, key, default=None, version=None, client=None):
+        if not self.is_local(key):
+            return super().get(key, default, version, client)
+        local_key = self.make_key(key, version)
+        tier = self.local
+        if tier.connected:
+            value = tier.get(local_key)
+            if value is not MISSING:
+                tier.record('local', 'hits')
+                return value
+            tier.record('local', 'misses')
+
+        generation = tier.generation
+        value = super().get(key, MISSING, version, client)
+        if value is MISSING:
+            tier.record('redis', 'misses')
+            return default
+        tier.record('redis', 'hits')
+        if tier.connected:
+            tier.set(local_key, value, generation)
+        return value
+
+    def get_many(self, keys, version=None, client=None):
+        tier = self.local
+        found, remaining = self.get_many_local(tier, keys, version)
+        if not remaining:
+            tier.flush_due()
+            return found
+
+        generation = tier.generation
+        fetched = super().get_many(remaining, version=version, client=client)
+        self.keep_fetched(tier, remaining, fetched, version, generation)
+        tier.flush_due()
+        found.update(fetched)
+        return found
+
+    def has_key(self, key, version=None, client=None):
+        tier = self.local
+        if (self.is_local(key) and tier.connected and
+                tier.get(self.make_key(key, version)) is not MISSING):
+            return True
+        return super().has_key(key, version=version, client=client)
+
+    async def aget(self, key, default=None, version=None):
+        local_key = self.make_key(key, version)
+        tier = self.local
+        local = self.is_local(key)
+        if local and tier.connected:
+            value = tier.get(local_key)
+            if value is not MISSING:
+                await tier.arecord('local', 'hits')
+                return value
+            await tier.arecord('local', 'misses')
+
+        generation = tier.generation
+        try:
+            raw = await get_async_redis_client(self).get(local_key)
+        except Exception:
+            if not self._ignore_exceptions:
+                raise
+            logger.warning('Cache read failed', exc_info=True)
+            return default
+        if raw is None:
+            if local:
+                await tier.arecord('redis', 'misses')
+            return default
+        value = self.client.decode(raw)
+        if local:
+            await tier.arecord('redis', 'hits')
+            if tier.connected:
+                tier.set(local_key, value, generation)
+        return value
+
+    async def aget_many(self, keys, version=None):
+        tier = self.local
+        found, remaining = self.get_many_local(tier, keys, version)
+        if not remaining:
+            await tier.aflush_due()
+            return found
+
+        generation = tier.generation
+        try:
+            values = await get_async_redis_client(self).mget(
+                [self.make_key(key, version) for key in remaining])
+        except Exception:
+            if not self._ignore_exceptions:
+                raise
+            logger.warning('Cache read failed', exc_info=True)
+            return found
+        fetched = {key: self.client.decode(raw)
+                   for key, raw in zip(remaining, values) if raw is not None}
+        self.keep_fetched(tier, remaining, fetched, version, generation)
+        await tier.aflush_due()
+        found.update(fetched)
+        return found
+
+    def get_many_local(self, tier, keys, version):
+        """
+        Return (found, remaining): the local tier's hits and the keys left
+        to fetch from Redis
+        """
+        found = {}
+        remaining = []
+        misses = 0
+        for key in keys:
+            if self.is_local(key) and tier.connected:
+                value = tier.get(self.make_key(key, version))
+                if value is not MISSING:
+                    found[key] = value
+                    continue
+                misses += 1
+            remaining.append(key)
+        if tier.connected:
+            tier.count('local', 'hits', len(found))
+            tier.count('local', 'misses', misses)
+        return found, remaining
+
+    def keep_fetched(self, tier, keys, fetched, version, generation):
+        """
+        Count the Redis outcome of the local keys fetched and keep them
+        """
+        keys = [key for key in keys if self.is_local(key)]
+        hits = [key for key in keys if key in fetched]
+        tier.count('redis', 'hits', len(hits))
+        tier.count('redis', 'misses', len(keys) - len(hits))
+        if tier.connected:
+            for key in hits:
+                tier.set(self.make_key(key, version), fetched[key], generation)
+
+    # Writes
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None,
+            **kwargs):
+        result = super().set(key, value, timeout, version=version, **kwargs)
+        self.invalidate_keys([key], version)
+        return result
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None,
+            **kwargs):
+        result = super().add(key, value, timeout, version=version, **kwargs)
+        if result:
+            self.invalidate_keys([key], version)
+        return result
+
+    def set_many(self, data, timeout=DEFAULT_TIMEOUT, version=None,
+                 **kwargs):
+        result = super().set_many(data, timeout, version=version, **kwargs)
+        self.invalidate_keys(data, version)
+        return result
+
+    def delete(self, key, version=None, **kwargs):
+        result = super().delete(key, version=version, **kwargs)
+        self.invalidate_keys([key], version)
+        return result
+
+    def delete_many(self, keys, version=None, **kwargs):
+        keys = list(keys)
+        result = super().delete_many(keys, version=version, **kwargs)
+        self.invalidate_keys(keys, version)
+        return result
+
+    def delete_pattern(self, *args, **kwargs):
+        result = super().delete_pattern(*args, **kwargs)
+        self.invalidate(None)
+        return result
+
+    def clear(self):
+        result = super().clear()
+        self.invalidate(None)
+        return result
+
+    def incr(self, key, delta=1, version=None, **kwargs):
+        result = super().incr(key, delta, version=version, **kwargs)
+        self.invalidate_keys([key], version)
+        return result
+
+    def decr(self, key, delta=1, version=None, **kwargs):
+        result = super().decr(key, delta, version=version, **kwargs)
+        self.invalidate_keys([key], version)
+        return result
+
+    def incr_version(self, key, delta=1, version=None, **kwargs):
+        result = super().incr_version(key, delta, version=version, **kwargs)
+        self.invalidate_keys([key], version)
+        return result
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None, **kwargs):
+        result = super().touch(key, timeout, version=version, **kwargs)
+        self.invalidate_keys([key], version)
+        return result
+
+    def expire(self, key, timeout, version=None, **kwargs):
+        result = super().expire(key, timeout, version=version, **kwargs)
+        self.invalidate_keys([key], version)
+        return result
+
+    # Stats
+
+    def get_tier_stats(self):
+        """
+        Return {'local': {...}, 'redis': {...}} hits, misses and hit ratio
+        across processes, plus this process's local tier size
+        """
+        tier = self.local
+        tier.flush()
+        stored = tier.redis.hgetall(self.stats_key)
+        stats = {name: {'hits': 0, 'misses': 0} for name in ('local', 'redis')}
+        for field, count in stored.items():
+            name, outcome = field.decode().split(':', 1)
+            stats.setdefault(name, {'hits': 0, 'misses': 0})[outcome] = (
+                int(count))
+        for counts in stats.values():
+            total = counts['hits'] + counts['misses']
+            counts['hit_ratio'] = counts['hits'] / total if total else 0.0
+        stats['local']['size'] = len(tier.entries)
+        stats['local']['connected'] = tier.connected
+        return stats
@@ -0,0 +1,17 @@
+"""
+Celery application for smartfunds project.
+
+Workers and beat are started with ``celery -A smartfunds``; tasks are
+discovered from the ``tasks`` module of every installed app.
+"""
+
+import os
+
+from celery import Celery
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE',
+                      'smartfunds.settings.development')
+
+app = Celery('smartfunds')
+app.config_from_object('django.conf:settings', namespace='CELERY')
+app.autodiscover_tasks()
@@ -0,0 +1,179 @@
+"""
+Postgres connection pool metrics and fork handling.
+
+Production runs Django's psycopg 3 pool (``DATABASES[...]['OPTIONS']
+['pool']``), sized per process type (see ``DB_POOL_SIZES``). Every pool
+belongs to one process. After each request or Celery task, the process
+writes a snapshot of its pool's counters to a Redis hash, at most every
+``STATS_INTERVAL`` seconds. ``get_pool_stats`` sums the snapshots per
+process type and reports saturation and wait time.
+
+Pools and connections inherited through fork() (``gunicorn --preload``,
+Celery prefork) are dropped in the child without being closed, because
+the parent still owns their sockets.
+"""
+
+import json
+import logging
+import os
+import socket
+import sys
+import threading
+import time
+
+from celery.signals import task_postrun
+from django.conf import settings
+from django.core.signals import request_finished
+from django.db import connections
+from django.dispatch import receiver
+
+logger = logging.getLogger('smartfunds')
+
+DEFAULTS = {
+    'CACHE_ALIAS': 'default',
+    'STATS_KEY': 'db_pool:stats',
+    'STATS_INTERVAL': 15,  # seconds
+}
+
+# Counters summed across processes; the gauges are handled separately
+COUNTERS = (
+    'requests_num', 'requests_queued', 'requests_wait_ms',
+    'requests_errors', 'connections_num', 'connections_errors',
+    'connections_lost',
+)
+
+
+def get_db_pool_setting(name):
+    return getattr(settings, 'DB_POOL_METRICS', {}).get(name, DEFAULTS[name])
+
+
+def get_process_type():
+    return getattr(settings, 'PROCESS_TYPE', 'web')
+
+
+def pool_snapshot(alias='default'):
+    """
+    Return this process's pool counters for alias, or None when the
+    database isn't pooled or the pool hasn't been opened yet
+    """
+    pool = getattr(connections[alias], 'pool', None)
+    if pool is None or pool.closed:
+        return None
+    stats = pool.get_stats()
+    return {name: stats.get(name, 0) for name in (
+        'pool_min', 'pool_max', 'pool_size', 'pool_available',
+        'requests_waiting', *COUNTERS)}
+
+
+class PoolReporter:
+    """
+    Writes the process's pool snapshot to Redis when due
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reported_at = 0.0
+
+    def get_connection(self):
+        from django_redis import get_redis_connection
+        return get_redis_connection(get_db_pool_setting('CACHE_ALIAS'))
+
+    def maybe_report(self):
+        with self.lock:
+            now = time.monotonic()
+            if now - self.reported_at < get_db_pool_setting('STATS_INTERVAL'):
+                return
+            self.reported_at = now
+        self.report()
+
+    def report(self):
+        snapshot = pool_snapshot()
+        if snapshot is None:
+            return
+        key = get_db_pool_setting('STATS_KEY')
+        field = f'{socket.gethostname()}:{os.getpid()}'
+        try:
+            pipe = self.get_connection().pipeline(transaction=False)
+            pipe.hset(key, field, json.dumps({
+                'process_type': get_process_type(),
+                'reported_at': time.time(),
+                'stats': snapshot,
+            }))
+            pipe.expire(key, get_db_pool_setting('STATS_INTERVAL') * 10)
+            pipe.execute()
+        except Exception:
+            logger.warning('Failed to report connection pool stats',
+                           exc_info=True)
+
+
+pool_reporter = PoolReporter()
+
+
+@receiver(request_finished)
+def report_after_request(sender, **kwargs):
+    pool_reporter.maybe_report()
+
+
+@task_postrun.connect
+def report_after_task(sender=None, **kwargs):
+    pool_reporter.maybe_report()
+
+
+def get_pool_stats():
+    """
+    Return {process_type: {...}} pool totals over the processes that
+    reported within the last three intervals
+    """
+    stored = pool_reporter.get_connection().hgetall(
+        get_db_pool_setting('STATS_KEY'))
+    cutoff = time.time() - 3 * get_db_pool_setting('STATS_INTERVAL')
+    totals = {}
+    for value in stored.values():
+        entry = json.loads(value)
+        if entry['reported_at'] < cutoff:
+            continue
+        stats = entry['stats']
+        total = totals.setdefault(entry['process_type'], {
+            'processes': 0, 'connections': 0, 'in_use': 0, 'capacity': 0,
+            'waiting': 0, **{name: 0 for name in COUNTERS}})
+        total['processes'] += 1
+        total['connections'] += stats['pool_size']
+        total['in_use'] += stats['pool_size'] - stats['pool_available']
+        total['capacity'] += stats['pool_max']
+        total['waiting'] += stats['requests_waiting']
+        for name in COUNTERS:
+            total[name] += stats[name]
+
+    for total in totals.values():
+        total['saturation'] = (
+            total['in_use'] / total['capacity'] if total['capacity'] else 0.0)
+        # Share of connection requests that had to wait, and for how long
+        total['queued_ratio'] = (
+            total['requests_queued'] / total['requests_num']
+            if total['requests_num'] else 0.0)
+        total['avg_wait_ms'] = (
+            total['requests_wait_ms'] / total['requests_queued']
+            if total['requests_queued'] else 0.0)
+    return totals
+
+
+# Inherited pools and connections, referenced so they are never finalized
+# (which would close the parent's sockets) in the child
+_inherited = []
+
+
+def forget_inherited_connections():
+    backend = sys.modules.get('django.db.backends.postgresql.base')
+    if backend is None:
+        return
+    pools = backend.DatabaseWrapper._connection_pools
+    _inherited.extend(pools.values())
+    pools.clear()
+    for connection in connections.all(initialized_only=True):
+        if connection.connection is not None:
+            _inherited.append(connection.connection)
+            connection.connection = None
+    pool_reporter.reported_at = 0.0
+
+
+os.register_at_fork(after_in_child=forget_inherited_connections)
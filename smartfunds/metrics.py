@@ -0,0 +1,61 @@
+"""
+Process-local counters shared across processes through a Redis hash.
+
+``increment`` only touches memory; the counts are added to the hash at
+most every ``flush_interval`` seconds, and ``read`` returns the totals of
+every process. With a ``flush_interval`` of 0 each increment is written
+straight to the hash, for rare events that should show up at once.
+"""
+
+import logging
+import threading
+import time
+from collections import Counter
+
+logger = logging.getLogger('smartfunds')
+
+
+class RedisCounters:
+    def __init__(self, key, flush_interval=10, cache_alias='default'):
+        self.key = key
+        self.flush_interval = flush_interval
+        self.cache_alias = cache_alias
+        self.counts = Counter()
+        self.lock = threading.Lock()
+        self.flushed_at = time.monotonic()
+
+    def get_connection(self):
+        from django_redis import get_redis_connection
+        return get_redis_connection(self.cache_alias)
+
+    def increment(self, field, count=1):
+        with self.lock:
+            self.counts[field] += count
+            due = time.monotonic() - self.flushed_at >= self.flush_interval
+        if due:
+            self.flush()
+
+    def flush(self):
+        with self.lock:
+            counts, self.counts = self.counts, Counter()
+            self.flushed_at = time.monotonic()
+        if not counts:
+            return
+        try:
+            pipe = self.get_connection().pipeline(transaction=False)
+            for field, count in counts.items():
+                pipe.hincrby(self.key, field, count)
+            pipe.execute()
+        except Exception:
+            logger.warning('Failed to flush counters to %s', self.key,
+                           exc_info=True)
+            with self.lock:
+                self.counts.update(counts)
+
+    def read(self):
+        """
+        Return {field: total} across processes
+        """
+        self.flush()
+        return {field.decode(): int(count) for field, count in
+                self.get_connection().hgetall(self.key).items()}
@@ -0,0 +1,37 @@
+"""
+Client addresses behind the nginx proxy.
+
+nginx sets X-Real-IP to the address that connected to it and appends that
+address to X-Forwarded-For, whose earlier entries are whatever the client
+sent. So only X-Real-IP is believed, and only from a proxy in
+``TRUSTED_PROXIES``; otherwise the client is the connecting address.
+"""
+
+import ipaddress
+
+from django.conf import settings
+
+
+def in_networks(address, networks):
+    """
+    Whether address is one of, or in one of, the addresses or networks
+    """
+    try:
+        address = ipaddress.ip_address(address)
+    except ValueError:
+        return False
+    return any(address in ipaddress.ip_network(network, strict=False)
+               for network in networks)
+
+
+def client_address(request, trusted_proxies=None):
+    """
+    Return the address of the client that made the request
+    """
+    if trusted_proxies is None:
+        trusted_proxies = getattr(settings, 'TRUSTED_PROXIES', [])
+    address = request.META.get('REMOTE_ADDR')
+    real_ip = request.META.get('HTTP_X_REAL_IP')
+    if real_ip and in_networks(address, trusted_proxies):
+        return real_ip
+    return address
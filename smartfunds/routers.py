@@ -0,0 +1,349 @@
+"""
+Read-replica routing.
+
+Replicas are configured from ``DATABASE_REPLICA_URLS`` (see settings) as
+the ``replica``, ``replica_2``, ... aliases. ``ReplicaRouter`` sends every
+write to ``default``, and reads to a replica only inside
+``replica_reads()``, which read-heavy views and admin changelists opt into
+(``ReplicaReadsMixin``, ``use_replica``, ``ReplicaChangeListMixin``).
+Everything else, including Celery tasks, keeps reading from the primary.
+
+Inside ``replica_reads()`` the primary is still used:
+
+- for a user who wrote within the last ``PIN_SECONDS`` seconds
+  (``ReplicaPinningMiddleware`` pins a user whose request wrote), so they
+  read their own writes;
+- after the current request has written, or inside a transaction;
+- when every replica is unreachable or more than ``MAX_LAG`` seconds
+  behind. Replicas are checked at most every ``HEALTH_INTERVAL`` seconds
+  per process.
+
+Async views use ``areplica_reads``; the ORM's async methods run the
+queries in a thread that inherits the context. A streamed response is
+consumed after the view has returned, so its rows are fetched through
+``replica_iterator``/``areplica_iterator`` instead.
+"""
+
+import logging
+import random
+import threading
+import time
+from contextlib import asynccontextmanager, contextmanager
+from contextvars import ContextVar
+from functools import wraps
+
+from asgiref.sync import (
+    iscoroutinefunction, markcoroutinefunction, sync_to_async
+)
+from django.conf import settings
+from django.core.cache import caches
+from django.db import DEFAULT_DB_ALIAS, DatabaseError, connections
+
+logger = logging.getLogger('smartfunds')
+
+DEFAULTS = {
+    'PIN_SECONDS': 5,
+    'MAX_LAG': 5,  # seconds
+    'HEALTH_INTERVAL': 5,  # seconds
+    'CACHE_ALIAS': 'default',
+}
+
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+# Seconds the replica's replayed WAL is behind; 0 when caught up or when
+# the database is not a standby at all
+REPLICA_LAG_SQL = """
+    SELECT CASE
+        WHEN NOT pg_is_in_recovery() THEN 0
+        WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+        ELSE COALESCE(EXTRACT(EPOCH FROM
+            now() - pg_last_xact_replay_timestamp()), 0)
+    END
+"""
+
+_replica_reads = ContextVar('replica_reads', default=False)
+# {'wrote': bool} for the request being handled, set by the middleware
+_request_state = ContextVar('replica_request_state', default=None)
+
+
+def get_replica_setting(name):
+    return getattr(settings, 'DATABASE_REPLICAS', {}).get(
+        name, DEFAULTS[name])
+
+
+def get_replica_aliases():
+    return [alias for alias in settings.DATABASES
+            if alias == 'replica' or alias.startswith('replica_')]
+
+
+def pin_key(user_id):
+    return f'db:pin:{user_id}'
+
+
+def pin_user(user_id):
+    try:
+        caches[get_replica_setting('CACHE_ALIAS')].set(
+            pin_key(user_id), 1, get_replica_setting('PIN_SECONDS'))
+    except Exception:
+        logger.warning('Failed to pin user %s to the primary', user_id,
+                       exc_info=True)
+
+
+def is_pinned(user):
+    if not user or not user.is_authenticated:
+        return False
+    try:
+        return caches[get_replica_setting('CACHE_ALIAS')].get(
+            pin_key(user.pk)) is not None
+    except Exception:
+        # Without the pin we can't promise read-your-writes
+        logger.warning('Failed to read primary pin', exc_info=True)
+        return True
+
+
+async def ais_pinned(user):
+    if not user or not user.is_authenticated:
+        return False
+    try:
+        return await caches[get_replica_setting('CACHE_ALIAS')].aget(
+            pin_key(user.pk)) is not None
+    except Exception:
+        logger.warning('Failed to read primary pin', exc_info=True)
+        return True
+
+
+def replica_lag(alias):
+    with connections[alias].cursor() as cursor:
+        cursor.execute(REPLICA_LAG_SQL)
+        return float(cursor.fetchone()[0])
+
+
+class ReplicaHealth:
+    """
+    Per-process record of which replicas are reachable and caught up
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.checked = {}  # alias -> (monotonic time, usable)
+
+    def is_usable(self, alias):
+        with self.lock:
+            checked_at, usable = self.checked.get(alias, (None, None))
+            if (checked_at is not None and time.monotonic() - checked_at <
+                    get_replica_setting('HEALTH_INTERVAL')):
+                return usable
+            # Other threads keep the last answer while this one checks
+            self.checked[alias] = (time.monotonic(), bool(usable))
+
+        try:
+            lag = replica_lag(alias)
+            usable = lag <= get_replica_setting('MAX_LAG')
+            if not usable:
+                logger.warning('Replica %s is %.1fs behind, reading from '
+                               'the primary', alias, lag)
+        except DatabaseError:
+            logger.warning('Replica %s is unavailable, reading from the '
+                           'primary', alias, exc_info=True)
+            connections[alias].close()
+            usable = False
+        with self.lock:
+            self.checked[alias] = (time.monotonic(), usable)
+        return usable
+
+    def reset(self):
+        with self.lock:
+            self.checked.clear()
+
+
+replica_health = ReplicaHealth()
+
+
+@contextmanager
+def replica_reads(request=None):
+    """
+    Let reads in the block go to a replica; with a request, only for
+    safe methods and users who aren't pinned to the primary
+    """
+    if request is not None and (request.method not in SAFE_METHODS or
+                                is_pinned(request.user)):
+        yield
+        return
+    token = _replica_reads.set(True)
+    try:
+        yield
+    finally:
+        _replica_reads.reset(token)
+
+
+@asynccontextmanager
+async def areplica_reads(request=None):
+    """
+    ``replica_reads`` for async views
+    """
+    if request is not None and (request.method not in SAFE_METHODS or
+                                await ais_pinned(request.user)):
+        yield
+        return
+    token = _replica_reads.set(True)
+    try:
+        yield
+    finally:
+        _replica_reads.reset(token)
+
+
+def replica_reads_enabled():
+    """
+    Whether reads in the current context may go to a replica
+    """
+    return _replica_reads.get()
+
+
+def replica_iterator(iterable):
+    """
+    Iterate with replica reads enabled around each step, for iterators
+    consumed after the ``replica_reads()`` block that created them
+    """
+    iterator = iter(iterable)
+    while True:
+        # Set and reset within one step, as the steps may run in
+        # different contexts
+        with replica_reads():
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+        yield item
+
+
+async def areplica_iterator(aiterable):
+    """
+    ``replica_iterator`` for async iterators
+    """
+    iterator = aiter(aiterable)
+    while True:
+        async with areplica_reads():
+            try:
+                item = await anext(iterator)
+            except StopAsyncIteration:
+                return
+        yield item
+
+
+class ReplicaRouter:
+    """
+    Writes to the primary; opted-in reads to a healthy replica
+    """
+
+    def db_for_read(self, model, **hints):
+        if not _replica_reads.get():
+            return DEFAULT_DB_ALIAS
+        state = _request_state.get()
+        if state and state['wrote']:
+            return DEFAULT_DB_ALIAS
+        if connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return DEFAULT_DB_ALIAS
+        replicas = [alias for alias in get_replica_aliases()
+                    if replica_health.is_usable(alias)]
+        return random.choice(replicas) if replicas else DEFAULT_DB_ALIAS
+
+    def db_for_write(self, model, **hints):
+        state = _request_state.get()
+        if state is not None:
+            state['wrote'] = True
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas hold the primary's rows
+        aliases = {DEFAULT_DB_ALIAS, *get_replica_aliases()}
+        if obj1._state.db in aliases and obj2._state.db in aliases:
+            return True
+        return None
+
+
+class ReplicaPinningMiddleware:
+    """
+    Pin users to the primary for PIN_SECONDS after a request that wrote
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        state = {'wrote': False}
+        token = _request_state.set(state)
+        try:
+            response = self.get_response(request)
+        finally:
+            _request_state.reset(token)
+        if state['wrote']:
+            self.pin(request)
+        return response
+
+    async def __acall__(self, request):
+        state = {'wrote': False}
+        token = _request_state.set(state)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _request_state.reset(token)
+        if state['wrote']:
+            await sync_to_async(self.pin)(request)
+        return response
+
+    def pin(self, request):
+        # DRF copies the user it authenticated onto the Django request
+        user = getattr(request, 'user', None)
+        if user is not None and user.is_authenticated:
+            pin_user(user.pk)
+
+
+class ReplicaReadsMixin:
+    """
+    APIView mixin reading from a replica for safe requests
+    """
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        # After authentication, so the pin can be checked
+        self._replica_reads = replica_reads(request)
+        self._replica_reads.__enter__()
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        replica_context = getattr(self, '_replica_reads', None)
+        if replica_context is not None:
+            self._replica_reads = None
+            replica_context.__exit__(None, None, None)
+        return super().finalize_response(request, response, *args, **kwargs)
+
+
+def use_replica(view_func):
+    """
+    ``replica_reads`` for ``@api_view`` functions (place it below the DRF
+    decorators)
+    """
+    @wraps(view_func)
+    def wrapper(request, *args, **kwargs):
+        with replica_reads(request):
+            return view_func(request, *args, **kwargs)
+    return wrapper
+
+
+class ReplicaChangeListMixin:
+    """
+    ModelAdmin mixin reading changelists from a replica
+    """
+
+    def changelist_view(self, request, extra_context=None):
+        with replica_reads(request):
+            response = super().changelist_view(request, extra_context)
+            # The results are only fetched while rendering
+            if hasattr(response, 'render'):
+                response.render()
+            return response
@@ -38,6 +38,7 @@ DJANGO_APPS = [
     'django.contrib.staticfiles',
     'django.contrib.sites',
     'django.contrib.humanize',
+    'django.contrib.postgres',
 ]
 
 THIRD_PARTY_APPS = [
@@ -53,10 +54,11 @@ THIRD_PARTY_APPS = [
 
 LOCAL_APPS = [
     'apps.accounts',
+    'apps.ussd',
     # 'apps.funds',
     # 'apps.contracts',
     # 'apps.analytics',
-    # 'apps.notifications',
+    'apps.notifications',
     # 'apps.core',
 ]
 
@@ -70,8 +72,10 @@ MIDDLEWARE = [
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'smartfunds.routers.ReplicaPinningMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'apps.accounts.hashing.PasswordHashingSaturatedMiddleware',
     # 'apps.core.middleware.RequestLoggingMiddleware',
     # 'apps.core.middleware.HealthCheckMiddleware',
 ]
@@ -96,6 +100,10 @@ TEMPLATES = [
 
 WSGI_APPLICATION = 'smartfunds.wsgi.application'
 
+# Serve the hot accounts endpoints from native async views (see
+# apps.accounts.async_views); smartfunds.asgi turns this on
+ASYNC_VIEWS = get_env_variable('ASYNC_VIEWS', 'False').lower() == 'true'
+
 # Database
 DATABASES = {
     'default': dj_database_url.config(
@@ -109,9 +117,54 @@ DATABASES = {
     )
 }
 
+# Read replicas: comma-separated database URLs, added as the 'replica',
+# 'replica_2', ... aliases. Only views that opt in read from them (see
+# smartfunds.routers).
+DATABASE_REPLICA_URLS = [
+    url.strip() for url in get_env_variable(
+        'DATABASE_REPLICA_URLS', '').split(',') if url.strip()
+]
+for index, url in enumerate(DATABASE_REPLICA_URLS):
+    DATABASES['replica' if index == 0 else f'replica_{index + 1}'] = (
+        dj_database_url.parse(url, conn_max_age=600, conn_health_checks=True))
+
+# Under ASGI every request runs its queries in its own thread, so
+# persistent (per-thread) connections would pile up; production pools
+# them instead (see production.py)
+if ASYNC_VIEWS:
+    for database in DATABASES.values():
+        database['CONN_MAX_AGE'] = 0
+
+DATABASE_ROUTERS = ['smartfunds.routers.ReplicaRouter']
+
+DATABASE_REPLICAS = {
+    'PIN_SECONDS': int(get_env_variable('DATABASE_REPLICA_PIN_SECONDS', '5')),
+    'MAX_LAG': float(get_env_variable('DATABASE_REPLICA_MAX_LAG', '5')),
+    'HEALTH_INTERVAL': 5,  # seconds
+}
+
+# Transaction isolation and conflict retries (see smartfunds.transactions)
+TRANSACTION_POLICY = {
+    'MAX_RETRIES': 3,
+    'BASE_DELAY': 0.02,  # seconds, doubled per retry with full jitter
+    'MAX_DELAY': 0.5,  # seconds
+}
+
 # Custom User Model
 AUTH_USER_MODEL = 'accounts.User'
 
+AUTHENTICATION_BACKENDS = ['apps.accounts.backends.ModelBackend']
+
+# Hashes run in a bounded process pool (see apps.accounts.hashing); the
+# remaining hashers only verify passwords stored with them
+PASSWORD_HASHERS = [
+    'apps.accounts.hashing.PooledPBKDF2PasswordHasher',
+    'django.contrib.auth.hashers.PBKDF2SHA1PasswordHasher',
+    'django.contrib.auth.hashers.Argon2PasswordHasher',
+    'django.contrib.auth.hashers.BCryptSHA256PasswordHasher',
+    'django.contrib.auth.hashers.ScryptPasswordHasher',
+]
+
 # Password validation
 AUTH_PASSWORD_VALIDATORS = [
     {
@@ -159,8 +212,7 @@ SITE_ID = 1
 # REST Framework configuration
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
-
+        'apps.accounts.authentication.CachedJWTAuthentication',
     ],
     'DEFAULT_PERMISSION_CLASSES': [
         'rest_framework.permissions.IsAuthenticated',
@@ -177,14 +229,15 @@ REST_FRAMEWORK = {
     ],
     'DEFAULT_SCHEMA_CLASS': 'drf_spectacular.openapi.AutoSchema',
     'DEFAULT_THROTTLE_CLASSES': [
-        'rest_framework.throttling.AnonRateThrottle',
-        'rest_framework.throttling.UserRateThrottle'
+        'apps.accounts.throttling.GCRAAnonRateThrottle',
+        'apps.accounts.throttling.GCRAUserRateThrottle'
     ],
     'DEFAULT_THROTTLE_RATES': {
         'anon': '100/hour',
         'user': '1000/hour',
         'login': '5/min',
         'signup': '3/min',
+        'password_reset': '3/hour',
     }
 }
 
@@ -195,7 +248,8 @@ SIMPLE_JWT = {
     'REFRESH_TOKEN_LIFETIME': timedelta(days=7),
     'ROTATE_REFRESH_TOKENS': True,
     'BLACKLIST_AFTER_ROTATION': True,
-    'UPDATE_LAST_LOGIN': True,
+    # The login views coalesce it (see LAST_LOGIN_UPDATE_INTERVAL)
+    'UPDATE_LAST_LOGIN': False,
     'ALGORITHM': 'HS256',
     'SIGNING_KEY': SECRET_KEY,
     'VERIFYING_KEY': None,
@@ -217,6 +271,10 @@ SIMPLE_JWT = {
     'SLIDING_TOKEN_REFRESH_LIFETIME': timedelta(days=1),
 }
 
+# last_login is written at most this often per user (see
+# apps.accounts.signals.update_last_login)
+LAST_LOGIN_UPDATE_INTERVAL = 300  # seconds
+
 # API Documentation
 SPECTACULAR_SETTINGS = {
     'TITLE': 'SmartFunds KE API',
@@ -231,20 +289,113 @@ SPECTACULAR_SETTINGS = {
 # Redis Configuration
 REDIS_URL = get_env_variable('REDIS_URL', 'redis://localhost:6379/0')
 
+# Proxies (nginx), addresses or networks, whose X-Real-IP header is the
+# client's address (see smartfunds.proxies)
+TRUSTED_PROXIES = [
+    ip.strip() for ip in
+    get_env_variable('TRUSTED_PROXIES', '').split(',') if ip.strip()
+]
+
 # Cache Configuration
 CACHES = {
     'default': {
-        'BACKEND': 'django_redis.cache.RedisCache',
+        'BACKEND': 'smartfunds.cache.TwoTierRedisCache',
         'LOCATION': REDIS_URL,
         'OPTIONS': {
             'CLIENT_CLASS': 'django_redis.client.DefaultClient',
             'IGNORE_EXCEPTIONS': True,
+            # Process-local tier in front of Redis (see smartfunds.cache)
+            'LOCAL_CACHE': {
+                'MAXSIZE': 5000,
+                'TIMEOUT': 5,  # seconds
+                # Auth users, phone lookups and response-cache tags.
+                # Other keys (sessions, pins) bypass the local tier and
+                # publish no invalidations
+                'KEY_PREFIXES': (
+                    'accounts:auth_user:', 'accounts:phone:', 'api:tag:'),
+            },
         },
         'KEY_PREFIX': 'smartfunds',
         'TIMEOUT': 300,
     }
 }
 
+# Authenticated user cache (see apps.accounts.authentication)
+AUTH_USER_CACHE = {
+    'CACHE_ALIAS': 'default',
+    # Seconds in Redis; the backend's local tier keeps users for its own
+    # TIMEOUT and drops them on invalidation
+    'TIMEOUT': 300,
+}
+
+# Canonical phone numbers and MSISDN lookups (see apps.accounts.phones)
+PHONE_NUMBERS = {
+    'DEFAULT_COUNTRY_CODE': '254',  # for national numbers such as 07...
+    'NATIONAL_NUMBER_LENGTH': 9,
+    'CACHE_ALIAS': 'default',
+    'CACHE_TIMEOUT': 3600,  # resolved numbers, seconds
+    'NEGATIVE_TIMEOUT': 60,  # unknown numbers, seconds
+    'BACKFILL_CHUNK_SIZE': 1000,  # users per transaction
+}
+
+# USSD sessions (see apps.ussd.engine); a session's TTL is the caller's
+# UserProfile.ussd_session_timeout
+USSD = {
+    'CACHE_ALIAS': 'default',
+    'KEY_PREFIX': 'ussd:session',
+    'DEFAULT_TIMEOUT': 180,  # seconds, for unregistered callers
+    # Gateway addresses (or networks) allowed to call back, and/or a
+    # secret the callback URL carries as ?token=. With neither, callbacks
+    # are refused unless DEBUG
+    'ALLOWED_IPS': [
+        ip.strip() for ip in
+        get_env_variable('USSD_ALLOWED_IPS', '').split(',') if ip.strip()
+    ],
+    'CALLBACK_TOKEN': get_env_variable('USSD_CALLBACK_TOKEN', ''),
+    # Proxies (nginx) whose X-Real-IP header is believed
+    'TRUSTED_PROXIES': [
+        ip.strip() for ip in
+        get_env_variable('USSD_TRUSTED_PROXIES', '').split(',') if ip.strip()
+    ],
+}
+
+# Batched SMS notifications (see apps.notifications.sms)
+SMS_NOTIFICATIONS = {
+    'PROVIDER_URL': get_env_variable(
+        'AFRICASTALKING_SMS_URL',
+        'https://api.sandbox.africastalking.com/version1/messaging'),
+    'USERNAME': get_env_variable('AFRICASTALKING_USERNAME', 'sandbox'),
+    'API_KEY': get_env_variable('AFRICASTALKING_API_KEY', ''),
+    'SENDER_ID': get_env_variable('AFRICASTALKING_SENDER_ID', ''),
+    'BATCH_SIZE': 500,  # recipients per provider request
+    # Messages per second the provider account accepts, across workers
+    'TPS': int(get_env_variable('SMS_PROVIDER_TPS', '10')),
+    'DEDUPE_WINDOW': 3600,  # seconds a template won't repeat per user
+    'MAX_ATTEMPTS': 6,  # provider requests per batch
+    'RETRY_BACKOFF': 10,  # seconds, doubled per attempt, with jitter
+    'RETRY_BACKOFF_MAX': 600,  # seconds
+    # Delivery report senders (addresses or networks) and/or a secret the
+    # report URL carries as ?token=. With neither, reports are refused
+    # unless DEBUG
+    'ALLOWED_IPS': [
+        ip.strip() for ip in
+        get_env_variable('SMS_ALLOWED_IPS', '').split(',') if ip.strip()
+    ],
+    'CALLBACK_TOKEN': get_env_variable('SMS_CALLBACK_TOKEN', ''),
+    'TRUSTED_PROXIES': TRUSTED_PROXIES,
+}
+
+# Per-user API response cache (see apps.accounts.response_cache)
+RESPONSE_CACHE = {
+    'ENABLED': get_env_variable('RESPONSE_CACHE_ENABLED', 'True').lower() == 'true',
+    'CACHE_ALIAS': 'default',
+    'KEY_PREFIX': 'api',
+    # Tag versions expire after this many seconds; keep it above the
+    # longest cache_response timeout (300)
+    'TAG_TIMEOUT': 3600,
+    'STATS_FLUSH_INTERVAL': 10,  # seconds
+}
+
 # Session Configuration
 SESSION_ENGINE = 'django.contrib.sessions.backends.cache'
 SESSION_CACHE_ALIAS = 'default'
@@ -270,6 +421,20 @@ CELERY_WORKER_MAX_TASKS_PER_CHILD = 1000
 
 # Celery Beat Configuration
 CELERY_BEAT_SCHEDULER = 'django_celery_beat.schedulers:DatabaseScheduler'
+CELERY_BEAT_SCHEDULE = {
+    'reconcile-user-stats': {
+        'task': 'apps.accounts.tasks.reconcile_user_stats_task',
+        'schedule': 900.0,  # 15 minutes
+    },
+    'maintain-login-attempt-partitions': {
+        'task': 'apps.accounts.tasks.maintain_login_attempt_partitions',
+        'schedule': 86400.0,  # daily
+    },
+    'flush-sms-delivery-reports': {
+        'task': 'apps.notifications.tasks.flush_sms_delivery_reports',
+        'schedule': 10.0,  # seconds
+    },
+}
 
 # Email Configuration
 EMAIL_BACKEND = get_env_variable(
@@ -354,6 +519,72 @@ HEALTH_CHECK = {
 RATELIMIT_ENABLE = True
 RATELIMIT_USE_CACHE = 'default'
 
+# Login audit trail (see apps.accounts.audit)
+LOGIN_AUDIT = {
+    'MODE': get_env_variable('LOGIN_AUDIT_MODE', 'sync'),
+    'BATCH_SIZE': int(get_env_variable('LOGIN_AUDIT_BATCH_SIZE', '500')),
+    'FLUSH_INTERVAL': 5,  # seconds, also the beat schedule below
+    'FLUSH_LOCK_TIMEOUT': 60,  # seconds a flush may hold a batch
+    'MAX_BUFFER': 10000,  # fire_and_forget only
+    'MAX_QUEUE': 100000,  # buffered only, attempts waiting in Redis
+    'REDIS_KEY': 'accounts:login_attempts',
+    'CACHE_ALIAS': 'default',
+}
+# Drains the buffered sink
+CELERY_BEAT_SCHEDULE['flush-login-attempts'] = {
+    'task': 'apps.accounts.tasks.flush_login_attempts',
+    'schedule': float(LOGIN_AUDIT['FLUSH_INTERVAL']),
+}
+
+# Monthly login attempt partitions (see apps.accounts.partitions)
+LOGIN_ATTEMPT_PARTITIONS = {
+    'PARTITIONS_AHEAD': 3,  # months created in advance
+    'RETENTION_MONTHS': int(get_env_variable(
+        'LOGIN_ATTEMPT_RETENTION_MONTHS', '12')),
+    'ARCHIVE_DIR': get_env_variable(
+        'LOGIN_ATTEMPT_ARCHIVE_DIR',
+        str(BASE_DIR / 'archives' / 'login_attempts')),
+}
+
+# Brute-force login lockout (see apps.accounts.lockout)
+LOGIN_LOCKOUT = {
+    'ENABLED': get_env_variable('LOGIN_LOCKOUT_ENABLED', 'True').lower() == 'true',
+    'WINDOW': 900,  # seconds of failures counted
+    'THRESHOLDS': {'email': 5, 'phone': 5, 'ip': 50},  # failures per window
+    'BACKOFF': 60,  # first lockout, seconds
+    'BACKOFF_FACTOR': 2,  # each repeat lockout within STRIKE_TTL
+    'MAX_BACKOFF': 3600,  # seconds
+    'STRIKE_TTL': 86400,  # seconds
+    'CACHE_ALIAS': 'default',
+}
+
+# Password hashing pool (see apps.accounts.hashing)
+PASSWORD_HASHING = {
+    # Set by smartfunds.wsgi and smartfunds.asgi; tests, management
+    # commands and Celery hash inline
+    'ENABLED': get_env_variable('PASSWORD_HASHING_POOL', 'False').lower() == 'true',
+    # Hashes at once across all web processes; more fail fast with a 503
+    'MAX_CONCURRENT': int(get_env_variable('PASSWORD_HASHING_MAX_CONCURRENT', '2')),
+    'WORKERS': 1,  # hashing processes per web process
+    'NICENESS': 0,  # raise to hash at a lower CPU priority than requests
+    'SLOT_TTL': 30,  # seconds before a crashed process's slot is reclaimed
+    'RETRY_AFTER': 1,  # seconds
+}
+
+# Background bulk user actions (see apps.accounts.jobs)
+BULK_USER_ACTIONS = {
+    'CHUNK_SIZE': 500,  # users per transaction
+    'DELETE_BATCH_SIZE': 5000,  # login attempts deleted per transaction
+    'MAX_USER_IDS': 100000,  # per job
+}
+
+# Bulk citizen import (see apps.accounts.imports)
+USER_IMPORT = {
+    'CHUNK_SIZE': 1000,  # rows per bulk_create transaction
+    'WORKERS': None,  # password hashing processes, defaults to CPU count
+    'MAX_ERRORS': 1000,  # per-row errors included in the result
+}
+
 # Pagination
 REST_FRAMEWORK_PAGE_SIZE = 20
 MAX_PAGE_SIZE = 100
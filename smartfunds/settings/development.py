@@ -97,10 +97,20 @@ CSRF_TRUSTED_ORIGINS = [
 # Cache Configuration - Redis
 CACHES = {
     'default': {
-        'BACKEND': 'django_redis.cache.RedisCache',
+        'BACKEND': 'smartfunds.cache.TwoTierRedisCache',
         'LOCATION': REDIS_URL,
         'OPTIONS': {
             'CLIENT_CLASS': 'django_redis.client.DefaultClient',
+            # Process-local tier in front of Redis (see smartfunds.cache)
+            'LOCAL_CACHE': {
+                'MAXSIZE': 5000,
+                'TIMEOUT': 5,  # seconds
+                # Auth users, phone lookups and response-cache tags.
+                # Other keys (sessions, pins) bypass the local tier and
+                # publish no invalidations
+                'KEY_PREFIXES': (
+                    'accounts:auth_user:', 'accounts:phone:', 'api:tag:'),
+            },
         },
         'KEY_PREFIX': 'smartfunds_dev',
     }
@@ -134,6 +144,7 @@ REST_FRAMEWORK.update({
         'user': '10000/hour',
         'login': '50/min',
         'signup': '30/min',
+        'password_reset': '30/hour',
     }
 })
 
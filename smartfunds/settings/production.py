@@ -54,7 +54,8 @@ DATABASES['default'].update({
     'OPTIONS': {
         'sslmode': 'require',
         'connect_timeout': 10,
-        'options': '-c default_transaction_isolation=serializable'
+        # READ COMMITTED by default; writes that need more declare it
+        # (see smartfunds.transactions)
     },
 })
 
@@ -98,7 +99,7 @@ WHITENOISE_SKIP_COMPRESS_EXTENSIONS = [
 # Cache Configuration with Redis
 CACHES = {
     'default': {
-        'BACKEND': 'django_redis.cache.RedisCache',
+        'BACKEND': 'smartfunds.cache.TwoTierRedisCache',
         'LOCATION': REDIS_URL,
         'OPTIONS': {
             'CLIENT_CLASS': 'django_redis.client.DefaultClient',
@@ -107,6 +108,16 @@ CACHES = {
                 'retry_on_timeout': True,
             },
             'IGNORE_EXCEPTIONS': True,
+            # Process-local tier in front of Redis (see smartfunds.cache)
+            'LOCAL_CACHE': {
+                'MAXSIZE': 5000,
+                'TIMEOUT': 5,  # seconds
+                # Auth users, phone lookups and response-cache tags.
+                # Other keys (sessions, pins) bypass the local tier and
+                # publish no invalidations
+                'KEY_PREFIXES': (
+                    'accounts:auth_user:', 'accounts:phone:', 'api:tag:'),
+            },
         },
         'KEY_PREFIX': 'smartfunds_prod',
         'TIMEOUT': 300,
@@ -152,7 +163,7 @@ CELERY_TASK_DEFAULT_QUEUE = 'default'
 CELERY_TASK_CREATE_MISSING_QUEUES = True
 
 # Celery Beat Configuration
-CELERY_BEAT_SCHEDULE = {
+CELERY_BEAT_SCHEDULE.update({
     'health-check': {
         'task': 'apps.core.tasks.health_check',
         'schedule': 300.0,  # 5 minutes
@@ -161,7 +172,7 @@ CELERY_BEAT_SCHEDULE = {
         'task': 'apps.core.tasks.cleanup_expired_sessions',
         'schedule': 3600.0,  # 1 hour
     },
-}
+})
 
 # REST Framework Configuration for Production
 REST_FRAMEWORK.update({
@@ -304,15 +315,46 @@ PROMETHEUS_METRICS_EXPORT_ADDRESS = get_env_variable(
     'PROMETHEUS_METRICS_EXPORT_ADDRESS', '')
 
 # Performance Optimizations
-# Database connection pooling
-DATABASES['default']['OPTIONS'].update({
-    'MAX_CONNS': 20,
-    'MIN_CONNS': 5,
-})
+# Database connection pooling (psycopg 3). Every process has its own pool,
+# sized for the threads that can query at once in that kind of process:
+# gunicorn workers (up to 4 threads), Celery prefork children, and beat.
+# PROCESS_TYPE is set per service in docker-compose.prod.yml.
+PROCESS_TYPE = get_env_variable('PROCESS_TYPE', 'web')
+DB_POOL_SIZES = {
+    'web': {'min_size': 1, 'max_size': 4, 'timeout': 5, 'max_waiting': 32},
+    'celery': {'min_size': 1, 'max_size': 2, 'timeout': 30},
+    'beat': {'min_size': 0, 'max_size': 1, 'timeout': 30},
+}
+# The pool keeps connections; CONN_HEALTH_CHECKS makes it check them
+# before handing them out
+DATABASES['default']['CONN_MAX_AGE'] = 0
+DATABASES['default']['OPTIONS']['pool'] = {
+    **DB_POOL_SIZES[PROCESS_TYPE],
+    'name': PROCESS_TYPE,
+    'max_idle': 300,
+    'max_lifetime': 1800,
+}
+for option in ('min_size', 'max_size'):
+    value = get_env_variable(f'DB_POOL_{option.upper()}', '')
+    if value:
+        DATABASES['default']['OPTIONS']['pool'][option] = int(value)
+
+# Read replicas use the same connection settings
+for alias in DATABASES:
+    if alias != 'default':
+        DATABASES[alias].update({
+            'CONN_MAX_AGE': 0,
+            'OPTIONS': {
+                **DATABASES['default']['OPTIONS'],
+                'pool': {**DATABASES['default']['OPTIONS']['pool'],
+                         'name': f'{PROCESS_TYPE}-{alias}'},
+            },
+        })
 
-# Cache optimizations
-CACHE_MIDDLEWARE_SECONDS = 300
-CACHE_MIDDLEWARE_KEY_PREFIX = 'smartfunds_prod'
+# Pool metrics (see smartfunds.db)
+DB_POOL_METRICS = {
+    'STATS_INTERVAL': 15,  # seconds
+}
 
 # API Documentation - Disable in production for security
 SPECTACULAR_SETTINGS.update({
@@ -361,14 +403,16 @@ USE_TZ = True
 RATELIMIT_ENABLE = True
 RATELIMIT_USE_CACHE = 'default'
 
+# Keep login audit INSERTs off the login hot path
+LOGIN_AUDIT['MODE'] = get_env_variable('LOGIN_AUDIT_MODE', 'buffered')
+
 # Disable browsable API in production
 if 'rest_framework.renderers.BrowsableAPIRenderer' in REST_FRAMEWORK.get('DEFAULT_RENDERER_CLASSES', []):
     REST_FRAMEWORK['DEFAULT_RENDERER_CLASSES'].remove(
         'rest_framework.renderers.BrowsableAPIRenderer')
 
-# Additional middleware for production
-MIDDLEWARE.insert(1, 'django.middleware.cache.UpdateCacheMiddleware')
-MIDDLEWARE.append('django.middleware.cache.FetchFromCacheMiddleware')
+# API responses are cached per user by apps.accounts.response_cache; the
+# site-wide cache middleware ignored Authorization and is not used
 
 # Create logs directory on container startup
 os.makedirs('/app/logs', exist_ok=True)
@@ -0,0 +1,150 @@
+"""
+Transaction policies.
+
+Connections run at Postgres' default READ COMMITTED isolation, and reads
+stay in autocommit. Writes declare the isolation they need:
+``run_in_transaction`` (or the ``transaction_policy`` decorator for view
+methods and functions) runs the work in one transaction at that level.
+Serialization failures (SQLSTATE 40001) and deadlocks (40P01) are retried
+up to ``MAX_RETRIES`` times after a full-jitter exponential backoff.
+Once retries are exhausted, the caller gets ``TransactionConflict`` (409).
+
+SERIALIZABLE is meant for read-check-write operations that must not
+interleave, such as conditional updates and money movements. Anything
+whose correctness comes from row locks or unique constraints should use
+READ COMMITTED.
+
+Inside an existing transaction the work only gets a savepoint. The outer
+transaction's isolation applies, and so does its retry policy, since a
+failed transaction can't be retried from a savepoint.
+
+Retries are counted per operation and SQLSTATE and written to Redis as
+they happen (see ``get_transaction_retry_stats``).
+"""
+
+import logging
+import random
+import time
+from functools import wraps
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, OperationalError, connections, transaction
+from rest_framework import status
+from rest_framework.exceptions import APIException
+from rest_framework.request import Request
+
+from .metrics import RedisCounters
+
+logger = logging.getLogger('smartfunds')
+
+DEFAULTS = {
+    'MAX_RETRIES': 3,
+    'BASE_DELAY': 0.02,  # seconds
+    'MAX_DELAY': 0.5,  # seconds
+    'STATS_KEY': 'db:transaction_retries',
+}
+
+READ_COMMITTED = 'READ COMMITTED'
+REPEATABLE_READ = 'REPEATABLE READ'
+SERIALIZABLE = 'SERIALIZABLE'
+
+SERIALIZATION_FAILURE = '40001'
+DEADLOCK_DETECTED = '40P01'
+RETRYABLE_SQLSTATES = (SERIALIZATION_FAILURE, DEADLOCK_DETECTED)
+
+
+def get_transaction_setting(name):
+    return getattr(settings, 'TRANSACTION_POLICY', {}).get(
+        name, DEFAULTS[name])
+
+
+# Retries are rare, so each is written through rather than buffered until
+# the process happens to count another one
+retry_counters = RedisCounters(
+    get_transaction_setting('STATS_KEY'), flush_interval=0)
+
+
+class TransactionConflict(APIException):
+    status_code = status.HTTP_409_CONFLICT
+    default_detail = ('The request conflicted with concurrent changes. '
+                      'Please retry.')
+    default_code = 'transaction_conflict'
+
+
+def sqlstate(exc):
+    # psycopg 3 exposes .sqlstate, psycopg2 .pgcode
+    cause = exc.__cause__
+    return getattr(cause, 'sqlstate', None) or getattr(cause, 'pgcode', None)
+
+
+def backoff(attempt):
+    ceiling = min(get_transaction_setting('MAX_DELAY'),
+                  get_transaction_setting('BASE_DELAY') * 2 ** attempt)
+    return random.uniform(0, ceiling)
+
+
+def run_in_transaction(func, isolation=READ_COMMITTED, using=DEFAULT_DB_ALIAS,
+                       operation=None):
+    """
+    Call func() in a transaction at the isolation level, retrying it on
+    serialization failures and deadlocks
+    """
+    if connections[using].in_atomic_block:
+        with transaction.atomic(using=using):
+            return func()
+
+    operation = operation or getattr(func, '__qualname__', 'transaction')
+    max_retries = get_transaction_setting('MAX_RETRIES')
+    attempt = 0
+    while True:
+        try:
+            with transaction.atomic(using=using):
+                with connections[using].cursor() as cursor:
+                    cursor.execute(
+                        f'SET TRANSACTION ISOLATION LEVEL {isolation}')
+                return func()
+        except OperationalError as exc:
+            code = sqlstate(exc)
+            if code not in RETRYABLE_SQLSTATES:
+                raise
+            retry_counters.increment(f'{operation}:{code}')
+            if attempt >= max_retries:
+                retry_counters.increment(f'{operation}:exhausted')
+                logger.warning('%s failed after %s retries (%s)',
+                               operation, attempt, code)
+                raise TransactionConflict() from exc
+            time.sleep(backoff(attempt))
+            attempt += 1
+
+
+def transaction_policy(isolation=READ_COMMITTED, using=DEFAULT_DB_ALIAS):
+    """
+    Run a view method or function through ``run_in_transaction``; safe
+    requests to DRF handlers are left in autocommit
+    """
+    def decorator(func):
+        operation = func.__qualname__
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            request = next(
+                (arg for arg in args[:2] if isinstance(arg, Request)), None)
+            if request is not None and request.method in (
+                    'GET', 'HEAD', 'OPTIONS'):
+                return func(*args, **kwargs)
+            return run_in_transaction(
+                lambda: func(*args, **kwargs), isolation, using, operation)
+
+        return wrapper
+    return decorator
+
+
+def get_transaction_retry_stats():
+    """
+    Return {operation: {sqlstate or 'exhausted': count}} across processes
+    """
+    stats = {}
+    for field, count in retry_counters.read().items():
+        operation, outcome = field.rsplit(':', 1)
+        stats.setdefault(operation, {})[outcome] = count
+    return stats
@@ -2,6 +2,8 @@
 WSGI config for smartfunds project.
 
 It exposes the WSGI callable as a module-level variable named ``application``.
+Web processes hash passwords in the bounded pool (see
+``apps.accounts.hashing``).
 
 For more information on this file, see
 https://docs.djangoproject.com/en/5.2/howto/deployment/wsgi/
@@ -13,5 +15,6 @@ from django.core.wsgi import get_wsgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE',
                       'smartfunds.settings.development')
+os.environ.setdefault('PASSWORD_HASHING_POOL', 'True')
 
 application = get_wsgi_application()